@@ -14,12 +14,15 @@ import pandas as pd
 import h5py
 import datetime
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_executor import lakes_dict
 
 # ---------------------------------------------------------------------------
 # Global Variables
 # ---------------------------------------------------------------------------
 variables = ['clt', 'hurs', 'tas', 'rsds', 'ps', 'pr', 'sfcWind']
-lakes_dict = {"Bromont": "Bromont"}
 
 rawdata_directory = r"../Raw_data/Data"
 observation_directory = r"../obs"
@@ -267,13 +270,16 @@ class Simulation_informations:
         self.climate_file = os.path.join(observation_folder, "climate_data.csv")
         self.enable_river_inflow = enable_river_inflow
 
-    def mylakeinput(self, outpath: str, inflows_filename: str):
+    def mylakeinput(self, outpath: str, inflows_filename: str, climate_file: str = None, enable_river_inflow=None):
         """
         create a file containing the informations relatively to Mylake
         :param pA: dictionary of paths to HDF5 files
         :param pB: dictionary of paths to HDF5 files
         :param inflowfile: filename of the inflowfile
         :param outpath: filename where a file of Mylake input will be written
+        :param climate_file: file of the climate data (default: the climate file of the simulation, shared by all lakes)
+        :param enable_river_inflow: switch to use the inflows of inflows_filename
+                                    (default: the switch of the simulation)
         :type pA: dict
         :type pB: dict
         :type inflowfile: str
@@ -281,8 +287,13 @@ class Simulation_informations:
         :return: string to be written to a file
         """
 
+        if climate_file is None:
+            climate_file = self.climate_file
+        if enable_river_inflow is None:
+            enable_river_inflow = self.enable_river_inflow
+
         all_days = pd.date_range(pd.datetime(self.start_year, 1, 1), pd.datetime(self.end_year, 12, 31), freq='D')
-        meteo = pd.read_csv(self.climate_file)
+        meteo = pd.read_csv(climate_file)
 
 
         meteo["Date"] = pd.to_datetime(meteo['Date'])
@@ -325,12 +336,15 @@ class Simulation_informations:
         meteo = meteo.interpolate('pad').ffill()
         meteo = meteo.interpolate('pad').bfill()
 
-        meteo.to_csv(self.climate_file.replace('.csv','_filled_interpolate.csv'), index=False)
+        # written in a temporary file first since several lakes can share the same climate file
+        filled_climate_file = climate_file.replace('.csv', '_filled_interpolate.csv')
+        meteo.to_csv('%s.%s.temp' % (filled_climate_file, os.getpid()), index=False)
+        os.replace('%s.%s.temp' % (filled_climate_file, os.getpid()), filled_climate_file)
 
         'Year	Month	Day	GlobalRadiation	CloudCover	AirTemperature	RelativeHumidity	AirPressure	WindSpeed	Precipitation	InflowQ	InflowT	InflowC	POC	InflowTP'
         '	InflowDOP	InflowChla	DOC	DIC	O	NO3	NH4	SO4	Fe2	Ca2	pH	CH4	Fe3	Al3	SiO4	SiO2	diatom	POP'
 
-        if self.enable_river_inflow:
+        if enable_river_inflow:
             inflows_data = pd.read_csv(inflows_filename)
             inflows_data = inflows_data.interpolate()
 
@@ -522,9 +536,11 @@ class Simulation_informations:
                               'InflowQ	InflowT	InflowC	POC	InflowTP'
                               '	InflowDOP	InflowChla	DOC	DIC	O	NO3	NH4	SO4	Fe2	Ca2	pH	CH4	Fe3	Al3	SiO4	SiO2	diatom	POP')
 
+        # the input file is replaced, not overwritten, since it can be linked to the archive (see run_archive.py)
         with open(temporarypath) as f:
-            with open("%s.txt" % outpath, 'w') as g:
+            with open("%s.txt.%s.temp" % (outpath, os.getpid()), 'w') as g:
                 g.write(f.read().replace('-99999999', 'NaN'))
+        os.replace("%s.txt.%s.temp" % (outpath, os.getpid()), "%s.txt" % outpath)
         os.unlink(temporarypath)
 
         return True
@@ -535,9 +551,11 @@ class Lake:
     Create object Lake with all information relative to the lake analysed.
     """
 
-    def __init__(self, lake_name, simulation_information):
+    def __init__(self, lake_name, simulation_information, enable_river_inflow=None):
         self.name = lake_name
         self.sim_info = simulation_information
+        # switch for the inflows of this lake (None: use the switch of simulation_information)
+        self.enable_river_inflow = enable_river_inflow
         self.input_folder = os.path.join(simulation_information.input_folder, self.name)
         if not os.path.exists(self.input_folder):
             os.makedirs(self.input_folder)
@@ -562,7 +580,7 @@ class Lake:
         observation_concentration = pd.read_csv(
             os.path.join(self.observation_folder, "%s_observation_data.csv" % self.name))
         depth_levels, area_levels = get_bathymetry_formatted(list(bathy['Depth']), list(bathy['Area']),
-                                                             depth_resolution)
+                                                             self.sim_info.depth_resolution)
 
         # get initial concentration and temperature
         Tz,  O2z = get_initial_concentration(depth_levels,
@@ -579,8 +597,9 @@ class Lake:
      Z (m)	  Az (m2)	 Tz (deg C)	  Cz(mg/m3)	  POCz (mg/m3)	  TPz (mg/m3)	 DOPz (mg/m3)	    Chlaz (mg/m3)	   DOCz (mg/m3)	    TPz_sed (mg/m3)	 Chlaz_sed (mg/m3)	   Fvol_IM (m3/m3, dry w.)	 Hice (m)	 Hsnow (m)	 O2z (mg/m3)	 DICz (mg/m3)	 NO3z (mg/m3)	 NH4z (mg/m3)	 SO4z (mg/m3)	 HSz (mg/m3)	 H2Sz (mg/m3)	 Fe2z (mg/m3)	 Ca2z (mg/m3)	 pHz (mg/m3)	 CH4aqz (mg/m3)	 Fe3z (mg/m3)	 Al3z (mg/m3)	 FeSz (mg/m3)	 CaCO3z (mg/m3)	 CH4gz (mg/m3)	 POPz (mg/m3)
     '''
         lines = [firstlines] + lines
-        with open(outpath, 'w') as f:
+        with open('%s.%s.temp' % (outpath, os.getpid()), 'w') as f:
             f.write('\n'.join(lines))
+        os.replace('%s.%s.temp' % (outpath, os.getpid()), outpath)
 
         return True
 
@@ -608,17 +627,19 @@ class Lake:
             print("%s was not created" % initp)
 
         inflows = os.path.join(self.observation_folder, "%s_inflow_data.csv" % self.name)
-        if self.sim_info.mylakeinput(inputp, inflows):
+        # climate data specific to the lake if the file exists, otherwise the climate file shared by all lakes
+        climate_file = os.path.join(self.observation_folder, "climate_data.csv")
+        if not os.path.exists(climate_file):
+            climate_file = None
+        if self.sim_info.mylakeinput(inputp, inflows, climate_file, self.enable_river_inflow):
             print("%s created!" % inputp)
         else:
             print("%s was not created" % inputp)
 
 
 if __name__ == "__main__":
-    import sys
-
     # default sys.argv : "Bromont"
-    lakes = sys.argv[1:]
+    lakes = sys.argv[1:] or list(lakes_dict.keys())
     print("****Default information for simulation: ***** \n"
           "bathymetry resolution: 1.0\n"
           "relative input path: \IO \n"
@@ -11,6 +11,7 @@
 # ---------------------------------------------------------------------------
 
 import os
+import sys
 import pandas as pd
 import csv
 import numpy as np
@@ -18,6 +19,9 @@ from itertools import *
 import xlrd
 import numbers
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_executor import lakes_dict
+
 # ---------------------------------------------------------------------------
 # Global Variables
 # ---------------------------------------------------------------------------
@@ -29,8 +33,10 @@ raw_geo_data_directory = "../Raw_data/geo_data"
 observation_directory = r"../obs"
 input_directory = r"../IO"
 
-# Information Dict
-lakes_dict = {"Bromont": "Bromont"}
+# Information Dict (lakes_dict: see run_executor.py)
+# Raw data specific to each lake (folder of the observations and file of the bathymetry)
+raw_obs_directories = {"Bromont": raw_obs_directory}
+raw_bathymetry_files = {"Bromont": "Bromont_Bathymetry.csv"}
 variables_dict = {"Date": "Date",
                   "Date de mesure": "Date",
                   "Total precip": "Precipitation",
@@ -154,7 +160,7 @@ def get_information_from_file_as_dataframe(file_path: str, skipuntil=None):
         return None
 
 def extract_bathymetry(lakes: dict, rawdata_path: str = raw_geo_data_directory,
-                       rawnamefile: str = "area_export_corrected.csv", observation_path: str = observation_directory):
+                       rawnamefile: str = None, observation_path: str = observation_directory):
     """
     Generate bathymetry files for each lake. This function takes the information from the raw data to create formatted
     files in the observation folder.
@@ -167,7 +173,8 @@ def extract_bathymetry(lakes: dict, rawdata_path: str = raw_geo_data_directory,
     :param rawdata_path:        Relative path where the raw data are.
     :type rawdata_path          str
 
-    :param rawnamefile:         Name of the file with the area at each depth.
+    :param rawnamefile:         Name of the file with the area at each depth. By default, the file of the lake in
+                                raw_bathymetry_files, or "area_export_corrected.csv" (all lakes) if not given.
     :type rawnamefile:          str
 
     :param observation_path:    Relative path where the formatted files of the observations are.
@@ -180,7 +187,11 @@ def extract_bathymetry(lakes: dict, rawdata_path: str = raw_geo_data_directory,
     for lake in lakes.keys():
         try:
             # Extract data from Raw file
-            raw_data = pd.read_csv(os.path.join(rawdata_path, rawnamefile))
+            if rawnamefile is None:
+                raw_data = pd.read_csv(os.path.join(rawdata_path,
+                                                    raw_bathymetry_files.get(lake, "area_export_corrected.csv")))
+            else:
+                raw_data = pd.read_csv(os.path.join(rawdata_path, rawnamefile))
             data_for_lake = raw_data[raw_data["lake_name"] == lakes[lake]]
 
             # Generate bathymetry file
@@ -205,7 +216,7 @@ def extract_bathymetry(lakes: dict, rawdata_path: str = raw_geo_data_directory,
         print("bathymetry files generated")
         return 1
 
-def extract_observations(lakes: dict, rawdata_path: str = raw_obs_directory,
+def extract_observations(lakes: dict, rawdata_path: str = None,
                          observation_path: str = observation_directory):
     """
     Extract and merge observations from the lakes. This function takes the information from the raw data to create
@@ -216,7 +227,8 @@ def extract_observations(lakes: dict, rawdata_path: str = raw_obs_directory,
                                 the raw files.
     :type lakes:                dict
 
-    :param rawdata_path:        Relative path where the raw data are.
+    :param rawdata_path:        Relative path where the raw data are. By default, the folder of the lake in
+                                raw_obs_directories.
     :type rawdata_path:         str
 
     :param observation_path:    Relative path where the formatted files of the observations are.
@@ -226,9 +238,11 @@ def extract_observations(lakes: dict, rawdata_path: str = raw_obs_directory,
 
     """
 
-    files_with_information = get_all_files_in_directory(raw_obs_directory)
-
     for lake in lakes.keys():
+        if rawdata_path is None:
+            files_with_information = get_all_files_in_directory(raw_obs_directories[lake])
+        else:
+            files_with_information = get_all_files_in_directory(rawdata_path)
         # Create file with all years
         observation_data = pd.DataFrame(
             columns=["Lake", "Full_Name", "Date", "Depth", 'Date_Depth', "Temp", "DO"])
@@ -584,6 +598,6 @@ def extract_climate(climat_directory: str = raw_weather_directory, observation_p
 
 if __name__ == "__main__":
     print("Hello")
-    print(extract_bathymetry(lakes=lakes_dict, rawnamefile="Bromont_Bathymetry.csv"))
+    print(extract_bathymetry(lakes=lakes_dict))
     print(extract_climate())
     extract_observations(lakes=lakes_dict)
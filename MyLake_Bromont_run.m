@@ -4,11 +4,12 @@
 % Code checked by TSA, xx.03.2005
 % Last modified by TSA, 15.08.2006 (Az replaced by In_Az 10.03.06; Possibility to have NaN in Global rad. series, 15.08.06)
 
-function [MyLake_results]= MyLake_Bromont_run(M_start,M_stop,lake_name,kz_N0,c_shelter, i_scv, i_sct, swa_b0, swa_b1, I_scDOC,I_scO,I_scChl, k_Chl,k_BOD, k_POP,k_POC,k_DOP,k_DOC,k_pdesorb_a,k_pdesorb_b, enable_sediment,enable_river_inflow,save_initial_conditions)
+function [MyLake_results]= MyLake_Bromont_run(M_start,M_stop,lake_name,kz_N0,c_shelter, i_scv, i_sct, swa_b0, swa_b1, I_scDOC,I_scO,I_scChl, k_Chl,k_BOD, k_POP,k_POC,k_DOP,k_DOC,k_pdesorb_a,k_pdesorb_b, enable_sediment,enable_river_inflow,save_initial_conditions,dz)
 addpath(genpath("MyLake_v2_Vansjo"));
 % Inputs:
-%       M_start : Model start date [year, month, day]
-%       M_stop : Model stop date [year, month, day]
+%       M_start : Model start year, or start date [year, month, day] (restart windows of the data assimilation)
+%       M_stop : Model stop year, or stop date [year, month, day]
+%       dz : depth resolution of the layers (m), optional (0.5 m by default)
 %    
 % Outputs:
 %		
@@ -17,8 +18,16 @@ tic
 disp('Started at:')
 disp(datetime('now'));
 
-m_start=[M_start, 1, 1]; %
-m_stop=[M_stop, 12, 31];
+if numel(M_start) == 3
+    m_start = M_start;
+else
+    m_start=[M_start, 1, 1]; %
+end
+if numel(M_stop) == 3
+    m_stop = M_stop;
+else
+    m_stop=[M_stop, 12, 31];
+end
 
 if save_initial_conditions == 0
 save_initial_conditions = false; % save final concentrations as initial for the next run
@@ -64,6 +73,9 @@ sediment_params{52} = 100; % 65.1237e+000   %    accel
 % Value giving during simulation
 
 % ============ Water Column parameters ====================================
+if nargin > 23
+    lake_params{1} = dz;    %0.5,         % 1     grid step size (m)
+end
 lake_params{4} = kz_N0;     %7.0e-05,     % 4     min. stability frequency (s-2)
 if c_shelter == 'NaN'
     lake_params{5} = nan; %0.5,         % 5     wind shelter parameter (-)
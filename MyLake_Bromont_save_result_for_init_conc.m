@@ -1,9 +1,13 @@
-function [file_name] = MyLake_Bromont_save_result_for_init_conc(MyLake_results, n)
+function [file_name] = MyLake_Bromont_save_result_for_init_conc(MyLake_results, n, lake_name)
+
+if nargin < 3
+    lake_name = 'Bromont';
+end
 
 if n == 1
-    file_name = './IO/Bromont/mylake_initial_concentrations.txt';
+    file_name = sprintf('./IO/%s/mylake_initial_concentrations.txt', lake_name);
 else
-    file_name = './IO/Bromont/mylake_initial_concentrations_2.txt';
+    file_name = sprintf('./IO/%s/mylake_initial_concentrations_2.txt', lake_name);
 end
 
 fid = fopen(file_name,'wt');
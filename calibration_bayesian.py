@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Bayesian optimiser of the automatic calibration
+
+Gaussian process (Matern 5/2 kernel with one length scale by parameter) fitted on the runs of the current calibration
+and, if asked, on the previous results of the lake: the iterations of the manual calibration reports
+(Postproc_code/<lake>/manual_calibration_<lake>_*.csv) and the evaluations of the previous Bayesian optimisations
+(final_calibration_<lake>_bayesian_*.csv) whose run is still valid for the current input files, options and fixed
+parameters (the run key includes the hash of the input files, and the performances are recalculated if the
+observations have changed). The points known can also be all the runs still valid (warm start, see
+calibration_warm_start.py).
+
+Each round proposes a batch of q points with the local penalisation of the expected improvement (Gonzalez et al.,
+Batch Bayesian Optimization via Local Penalization, 2016), so that the q runs of a round are executed in parallel.
+Above max_points results, the surrogate is a set of local Gaussian processes (one by cluster of the results, each
+point being predicted by the process of its cluster), sharing the hyperparameters fitted on a subset of the results.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.vq import kmeans2
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import minimize
+from scipy.stats import norm
+
+from calibration_local import calibration_result
+from calibration_objective import failure_value, inside_bounds, latin_hypercube, same_fixed_parameters
+from calibration_reports import find_calibration_reports, read_calibration_report, report_parameters
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Bounds of the hyperparameters (logarithm of the length scales, of the variance and of the noise, for objectives
+# normalised to a mean of 0 and a standard deviation of 1)
+length_scale_bounds = (np.log(1e-2), np.log(1e1))
+variance_bounds = (np.log(1e-2), np.log(1e2))
+noise_bounds = (np.log(1e-6), np.log(1.0))
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def matern52(x1, x2, length_scales, variance: float):
+    """ Matern 5/2 covariance between the points x1 (n x d) and x2 (m x d) """
+    distance = np.sqrt(np.sum(((x1[:, None, :] - x2[None, :, :]) / length_scales) ** 2, axis=-1))
+    return variance * (1 + np.sqrt(5) * distance + 5 / 3 * distance ** 2) * np.exp(-np.sqrt(5) * distance)
+
+
+def expected_improvement(mean, std, best: float):
+    """ Expected improvement (minimisation) of points with the predicted mean and standard deviation """
+    std = np.maximum(std, 1e-12)
+    z = (best - mean) / std
+    return (best - mean) * norm.cdf(z) + std * norm.pdf(z)
+
+
+def previous_results_files(lake_name: str, root: str):
+    """ Manual calibration reports and histories of the previous Bayesian optimisations of a lake """
+    return find_calibration_reports(lake_name, root) + sorted(glob.glob(os.path.join(
+        root, "Postproc_code", lake_name, "final_calibration_%s_bayesian_*.csv" % lake_name)))
+
+
+def previous_results(evaluator, paths: list):
+    """
+    Results of previous calibrations still valid for the calibration: the iterations of the reports and the
+    evaluations of the histories whose run is in the run archive of RunExecutor with the current input files and the
+    options of the calibration (same run key), done with the fixed parameters of the space and with the calibrated
+    parameters inside its bounds. Their performances are those of the run, recalculated if the observations have
+    changed (see RunExecutor.cached_result()); the performances written in the files are not used.
+
+    :param evaluator:   CalibrationEvaluator of the calibration
+    :param paths:       Manual calibration reports or histories of Bayesian optimisations (see previous_results_files())
+    :return: points (n x d), objectives (n) and keys of the runs
+    """
+    executor, space = evaluator.executor, evaluator.space
+    results = {}
+    for path in paths:
+        try:
+            table = read_calibration_report(path)
+        except (pd.errors.EmptyDataError, ValueError, SyntaxError) as error:
+            print("%s not used: %s" % (path, error))
+            continue
+        for _, line in table.iterrows():
+            if "Run_key" in line.index:
+                # evaluation of a history: the parameters not calibrated are those of its run
+                archived = os.path.join(executor.runs_folder, str(line["Run_key"]), "metrics.json")
+                if not os.path.exists(archived):
+                    continue
+                with open(archived) as f:
+                    parameters = json.load(f)["parameters"]
+            else:
+                parameters = report_parameters(line)
+            specification = executor.specification(parameters, **evaluator.options)
+            if specification["key"] in results or ("Run_key" in line.index and specification["key"] != line["Run_key"]):
+                continue
+            result = executor.cached_result(specification)
+            if result is not None and same_fixed_parameters(result["parameters"], space) and \
+                    inside_bounds(result["parameters"], space):
+                results[result["key"]] = result
+    points = [space.unit_of(result["parameters"]) for result in results.values()]
+    values = [evaluator.objective(result) for result in results.values()]
+    return np.array(points, dtype=float).reshape(-1, space.dimension), np.array(values, dtype=float), \
+        list(results.keys())
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class GaussianProcess:
+    """
+    Gaussian process regression of the objective in the unit cube. With more than max_points points, the points are
+    divided in clusters and each cluster has its own process (local Gaussian processes), the hyperparameters being
+    fitted once on a subset of max_points points.
+
+    Example:
+        mean, std = GaussianProcess().fit(points, values).predict(candidates)
+    """
+
+    def __init__(self, max_points: int = 400, restarts: int = 3, seed: int = None):
+        """
+        :param max_points:  Maximum number of points of a process (size of the Cholesky factorisations)
+        :param restarts:    Number of starting points of the fit of the hyperparameters
+        """
+        self.max_points = max_points
+        self.restarts = restarts
+        self.random = np.random.default_rng(seed)
+
+    def unpack(self, hyperparameters):
+        """ Length scales, variance and noise from the vector of their logarithms """
+        return np.exp(hyperparameters[:-2]), np.exp(hyperparameters[-2]), np.exp(hyperparameters[-1])
+
+    def negative_log_likelihood(self, hyperparameters, x, y):
+        length_scales, variance, noise = self.unpack(hyperparameters)
+        covariance = matern52(x, x, length_scales, variance) + (noise + 1e-8) * np.eye(len(x))
+        try:
+            factor = cho_factor(covariance, lower=True)
+        except np.linalg.LinAlgError:
+            return 1e10
+        alpha = cho_solve(factor, y)
+        return 0.5 * y @ alpha + np.sum(np.log(np.diag(factor[0]))) + 0.5 * len(x) * np.log(2 * np.pi)
+
+    def fit_hyperparameters(self, x, y):
+        """ Maximum likelihood of the hyperparameters (L-BFGS-B from several starting points) """
+        dimension = x.shape[1]
+        bounds = [length_scale_bounds] * dimension + [variance_bounds, noise_bounds]
+        starts = [np.array([np.log(0.3)] * dimension + [0.0, np.log(1e-3)])]
+        for _ in range(self.restarts - 1):
+            starts.append(np.array([self.random.uniform(low, high) for low, high in bounds]))
+        best = None
+        for start in starts:
+            fitted = minimize(self.negative_log_likelihood, start, args=(x, y), method="L-BFGS-B", bounds=bounds)
+            if best is None or fitted.fun < best.fun:
+                best = fitted
+        return best.x
+
+    def expert(self, x, y):
+        """ Cholesky factor and weights of a process on the points x """
+        length_scales, variance, noise = self.unpack(self.hyperparameters)
+        covariance = matern52(x, x, length_scales, variance) + (noise + 1e-8) * np.eye(len(x))
+        factor = np.linalg.cholesky(covariance)
+        return {"x": x, "factor": factor, "alpha": cho_solve((factor, True), y)}
+
+    def fit(self, x, y, hyperparameters=None):
+        """
+        :param x:               Points of the unit cube (n x d)
+        :param y:               Objective of the points (n)
+        :param hyperparameters: Hyperparameters of a previous fit (logarithms), None to fit them
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        self.offset, self.scale = y.mean(), y.std() if y.std() > 0 else 1.0
+        normalised = (y - self.offset) / self.scale
+
+        subset = np.arange(len(x))
+        if len(x) > self.max_points:
+            # the best points and a random selection of the others
+            order = np.argsort(normalised)
+            subset = np.concatenate([order[:self.max_points // 4], self.random.choice(
+                order[self.max_points // 4:], self.max_points - self.max_points // 4, replace=False)])
+        self.hyperparameters = self.fit_hyperparameters(x[subset], normalised[subset]) if hyperparameters is None \
+            else np.asarray(hyperparameters, dtype=float)
+
+        if len(x) <= self.max_points:
+            self.centres = x.mean(axis=0, keepdims=True)
+            self.experts = [self.expert(x, normalised)]
+            return self
+        clusters = int(np.ceil(2 * len(x) / self.max_points))
+        self.centres, labels = kmeans2(x, clusters, minit="++", seed=self.random)
+        self.experts = []
+        for cluster in range(len(self.centres)):
+            members = np.flatnonzero(labels == cluster)
+            if len(members) > self.max_points:
+                distances = np.linalg.norm(x[members] - self.centres[cluster], axis=1)
+                members = members[np.argsort(distances)[:self.max_points]]
+            self.experts.append(self.expert(x[members], normalised[members]) if len(members) else None)
+        return self
+
+    def predict(self, points):
+        """
+        :param points:  Points of the unit cube (m x d)
+        :return: mean and standard deviation of the objective at the points
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        length_scales, variance, _ = self.unpack(self.hyperparameters)
+        distances = np.linalg.norm(points[:, None, :] - self.centres[None, :, :], axis=-1)
+        distances[:, [index for index, expert in enumerate(self.experts) if expert is None]] = np.inf
+        labels = np.argmin(distances, axis=1)
+        mean, std = np.zeros(len(points)), np.zeros(len(points))
+        for cluster in np.unique(labels):
+            expert = self.experts[cluster]
+            selected = labels == cluster
+            cross = matern52(points[selected], expert["x"], length_scales, variance)
+            mean[selected] = cross @ expert["alpha"]
+            v = solve_triangular(expert["factor"], cross.T, lower=True)
+            std[selected] = np.sqrt(np.maximum(variance - np.sum(v ** 2, axis=0), 1e-12))
+        return self.offset + self.scale * mean, self.scale * std
+
+
+class BayesianOptimisation:
+    """
+    Bayesian optimisation with batches of q points chosen by local penalisation of the expected improvement.
+
+    Example:
+        result = BayesianOptimisation(evaluator, batch_size=8, previous=previous_results_files("Bromont", root)) \
+            .minimise(x0)
+    """
+
+    def __init__(self, evaluator, batch_size: int = None, initial_points: int = None, previous: list = None,
+                 max_points: int = 400, candidates: int = None, ei_tol: float = 1e-6, seed: int = None,
+                 warm_start: dict = None):
+        """
+        :param evaluator:       CalibrationEvaluator
+        :param batch_size:      Number of runs of each round (default: number of processors)
+        :param initial_points:  Number of points known before the first round; the missing points are evaluated in
+                                the first batch, with x0 (default: 2d + 1)
+        :param previous:        Files of previous results whose runs still valid are added to the data of the surrogate
+                                (see previous_results()), default: none
+        :param max_points:      Maximum number of points of a Gaussian process (see GaussianProcess)
+        :param candidates:      Number of random points where the acquisition is calculated (default: 1000 d)
+        :param ei_tol:          Stop when the expected improvement is lower than ei_tol times the standard deviation
+                                of the objectives
+        :param warm_start:      Points known (see calibration_warm_start.warm_start_data()) added to the data of the
+                                surrogate, with the previous results
+        """
+        self.evaluator = evaluator
+        dimension = evaluator.space.dimension
+        self.batch_size = batch_size or os.cpu_count() or 1
+        self.initial_points = initial_points or 2 * dimension + 1
+        self.previous = previous or []
+        self.max_points = max_points
+        self.candidates = candidates or 1000 * dimension
+        self.ei_tol = ei_tol
+        self.seed = seed
+        self.random = np.random.default_rng(seed)
+        self.warm_start = warm_start
+
+    def surrogate_values(self, y):
+        """
+        Objectives given to the surrogate: the failed runs are given the worst objective of the successful runs, so
+        they do not flatten the surrogate.
+        """
+        successful = y < failure_value
+        return np.where(successful, y, y[successful].max() if successful.any() else failure_value)
+
+    def candidate_points(self, x, y):
+        """ Random points of the unit cube, and points around the best points found """
+        best = x[np.argsort(y)[:5]]
+        local = best[self.random.integers(len(best), size=self.candidates // 4)] + \
+            self.random.normal(0, 0.05, (self.candidates // 4, x.shape[1]))
+        return np.clip(np.vstack([self.random.random((self.candidates, x.shape[1])), local]), 0, 1)
+
+    def lipschitz_constant(self, surrogate, candidates):
+        """ Largest norm of the gradient of the mean of the surrogate (finite differences on candidates) """
+        sample = candidates[self.random.choice(len(candidates), min(len(candidates), 200), replace=False)]
+        step = 1e-4
+        mean = surrogate.predict(sample)[0]
+        gradient = np.stack([(surrogate.predict(sample + step * axis)[0] - mean) / step
+                             for axis in np.eye(sample.shape[1])], axis=1)
+        return max(float(np.max(np.linalg.norm(gradient, axis=1))), 1e-7)
+
+    def propose(self, x, y, number: int):
+        """
+        Points of the next batch: the maximum of the expected improvement, then the maxima of the expected improvement
+        multiplied by the penalisation of the balls around the points already chosen.
+
+        :return: points (number x d), or an empty array when the expected improvement is negligible
+        """
+        surrogate = GaussianProcess(self.max_points, seed=self.seed).fit(x, y)
+        candidates = self.candidate_points(x, y)
+        mean, std = surrogate.predict(candidates)
+        best = y.min()
+        acquisition = expected_improvement(mean, std, best)
+        if acquisition.max() < self.ei_tol * max(y.std(), 1e-12):
+            return np.empty((0, x.shape[1]))
+        lipschitz = self.lipschitz_constant(surrogate, candidates)
+        chosen = []
+        for _ in range(number):
+            index = int(np.argmax(acquisition))
+            chosen.append(candidates[index])
+            distance = np.linalg.norm(candidates - candidates[index], axis=1)
+            acquisition = acquisition * norm.cdf((lipschitz * distance - (mean[index] - best)) / std[index])
+            acquisition[index] = 0
+        return np.array(chosen)
+
+    def minimise(self, x0):
+        """
+        :param x0:  Initial point (unit cube), evaluated in the first batch
+        :return: best point found by the runs of this calibration (see calibration_local.calibration_result())
+        """
+        space = self.evaluator.space
+        x, y, keys = previous_results(self.evaluator, self.previous)
+        if self.warm_start is not None:
+            # the runs of the warm start are not added twice
+            new = np.array([key not in self.warm_start["keys"] for key in keys], dtype=bool)
+            x, y = np.vstack([x[new], self.warm_start["unit"]]), np.concatenate([y[new], self.warm_start["values"]])
+        if len(x):
+            print("%s previous results used by the surrogate" % len(x))
+        if self.warm_start is not None and np.sum(self.warm_start["values"] < failure_value) >= self.initial_points:
+            # the best point known (its run is in the cache) and the points proposed with the points known
+            batch = np.vstack([self.warm_start["unit"][:1],
+                               self.propose(x, self.surrogate_values(y), max(self.batch_size - 1, 1))])
+        else:
+            first = max(self.batch_size - 1, self.initial_points - len(x) - 1)
+            batch = np.vstack([np.array(x0, dtype=float)[None, :],
+                               latin_hypercube(first, space.dimension, self.random)])
+        rounds = 0
+        while len(batch) and not self.evaluator.exhausted():
+            if self.evaluator.remaining() is not None:
+                batch = batch[:self.evaluator.remaining()]
+            values = self.evaluator.evaluate(batch)
+            x, y = np.vstack([x, batch]), np.concatenate([y, values])
+            rounds += 1
+            print("Bayesian optimisation round %s: best of the batch %.4f, best %.4f" % (
+                rounds, values.min(), self.evaluator.best()["Objective"]))
+            if self.evaluator.exhausted():
+                break
+            batch = self.propose(x, self.surrogate_values(y), self.batch_size)
+        return calibration_result(self.evaluator, "bayesian")
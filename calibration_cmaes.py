@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" CMA-ES optimiser of the automatic calibration
+
+Covariance matrix adaptation evolution strategy (Hansen, The CMA Evolution Strategy: A Tutorial, 2016) working in the
+unit cube of a ParameterSpace (the logarithmic or linear transformation of each parameter comes from the registry,
+see calibration_objective.py). The population of each generation is evaluated in one batch by the
+CalibrationEvaluator, so all its runs are executed in parallel. The points outside the bounds are evaluated on the
+bounds, with a penalty proportional to the squared distance to the bounds.
+
+The state of the algorithm is saved after each generation (checkpoint file), and a calibration stopped (or
+crashed) is continued from its last generation by giving the same checkpoint file. Without checkpoint, the first
+generation can be centred on the best runs already done (warm start, see calibration_warm_start.py): mean, step size
+and covariance of the best points known, weighted like the parents of a generation.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import json
+import os
+
+import numpy as np
+
+from calibration_local import calibration_result
+from calibration_objective import failure_value
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Weight of the penalty of the points outside the unit cube
+bounds_penalty = 1.0
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class CMAES:
+    """
+    CMA-ES with a population evaluated in parallel and a checkpoint after each generation.
+
+    Example:
+        result = CMAES(evaluator, population_size=16, checkpoint="cmaes_Bromont.json").minimise(x0)
+    """
+
+    def __init__(self, evaluator, population_size: int = None, sigma: float = 0.3, checkpoint: str = None,
+                 seed: int = None, ftol: float = 1e-6, sigma_tol: float = 1e-4, max_generations: int = None,
+                 warm_start: dict = None):
+        """
+        :param evaluator:       CalibrationEvaluator
+        :param population_size: Number of runs of each generation (default: 4 + 3 ln(d))
+        :param sigma:           Initial step size (unit cube)
+        :param checkpoint:      JSON file of the state of the algorithm, read at the start if it exists
+        :param seed:            Seed of the random generator
+        :param ftol:            Stop when the best objectives of the last 10 generations differ less than ftol
+        :param sigma_tol:       Stop when the step size (times the largest standard deviation) is lower
+        :param warm_start:      Points known (see calibration_warm_start.warm_start_data()), used for the first
+                                generation when there is no checkpoint (see warm_distribution())
+        """
+        self.evaluator = evaluator
+        self.dimension = evaluator.space.dimension
+        self.population_size = population_size or 4 + int(3 * np.log(self.dimension))
+        self.initial_sigma = sigma
+        self.checkpoint = checkpoint
+        self.seed = seed
+        self.ftol = ftol
+        self.sigma_tol = sigma_tol
+        self.max_generations = max_generations
+        self.warm_start = warm_start
+
+        # strategy parameters (default values of the tutorial)
+        n = self.dimension
+        self.parents = self.population_size // 2
+        weights = np.log((self.population_size + 1) / 2) - np.log(np.arange(1, self.parents + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / np.sum(self.weights ** 2)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+    def initial_state(self, x0, covariance=None, sigma: float = None):
+        """
+        State of the first generation, centred on x0 (with the covariance given, identity by default, and the initial
+        step size by default)
+        """
+        covariance = np.eye(self.dimension) if covariance is None else np.array(covariance, dtype=float)
+        return {"names": self.evaluator.space.names, "objective": str(self.evaluator.objective), "generation": 0,
+                "mean": np.array(x0, dtype=float), "sigma": sigma or self.initial_sigma, "covariance": covariance,
+                "pc": np.zeros(self.dimension), "ps": np.zeros(self.dimension), "best_values": [], "best_unit": None,
+                "best_value": None, "random_state": np.random.default_rng(self.seed).bit_generator.state}
+
+    def warm_distribution(self):
+        """
+        Distribution of the first generation from the points known: weighted mean of the best points (the weights of
+        the parents), their weighted covariance scaled to a trace of d, and a step size equal to their spread (at
+        most the initial step size). With one point (or identical points), only the mean is used.
+
+        :return: mean, covariance and step size (None for the defaults)
+        """
+        successful = self.warm_start["values"] < failure_value
+        best = self.warm_start["unit"][successful][:self.parents]
+        if len(best) < 2:
+            return best[0], None, None
+        weights = self.weights[:len(best)] / self.weights[:len(best)].sum()
+        mean = weights @ best
+        covariance = ((best - mean).T * weights) @ (best - mean)
+        spread = np.sqrt(np.trace(covariance) / self.dimension)
+        if spread < 1e-12:
+            return mean, None, None
+        # a part of identity keeps the directions not explored by the points known
+        covariance = 0.8 * covariance / spread ** 2 + 0.2 * np.eye(self.dimension)
+        return mean, covariance, float(min(self.initial_sigma, max(spread, 10 * self.sigma_tol)))
+
+    def save_state(self, state: dict):
+        """ Write the checkpoint (written in a temporary file first, so that a crash does not corrupt it) """
+        if self.checkpoint is None:
+            return
+        serialised = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in state.items()}
+        temporary = "%s.%s.temp" % (self.checkpoint, os.getpid())
+        with open(temporary, "w") as f:
+            json.dump(serialised, f, default=float)
+        os.replace(temporary, self.checkpoint)
+
+    def load_state(self):
+        """ State saved in the checkpoint, or None (no checkpoint, or checkpoint of other parameters) """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state["names"] != self.evaluator.space.names or state["objective"] != str(self.evaluator.objective):
+            print("Checkpoint %s is for other parameters or another objective (%s; %s), not used" % (
+                self.checkpoint, ", ".join(state["names"]), state["objective"]))
+            return None
+        for name in ["mean", "covariance", "pc", "ps", "best_unit"]:
+            if state[name] is not None:
+                state[name] = np.array(state[name], dtype=float)
+        return state
+
+    def ask(self, state: dict, random):
+        """ Points of a generation (population x d), before the projection on the bounds """
+        eigenvalues, eigenvectors = np.linalg.eigh(state["covariance"])
+        deviations = np.sqrt(np.maximum(eigenvalues, 1e-20))
+        normal = random.standard_normal((self.population_size, self.dimension))
+        return state["mean"] + state["sigma"] * (normal * deviations) @ eigenvectors.T
+
+    def tell(self, state: dict, points, values):
+        """ Update the mean, the step size, the evolution paths and the covariance with the evaluated generation """
+        order = np.argsort(values)
+        selected = points[order[:self.parents]]
+        old_mean = state["mean"]
+        mean = self.weights @ selected
+        sigma = state["sigma"]
+        covariance = state["covariance"]
+
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        inverse_sqrt = eigenvectors @ np.diag(1 / np.sqrt(np.maximum(eigenvalues, 1e-20))) @ eigenvectors.T
+        ps = (1 - self.cs) * state["ps"] + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * \
+            inverse_sqrt @ (mean - old_mean) / sigma
+        generation = state["generation"] + 1
+        hsig = np.linalg.norm(ps) / np.sqrt(1 - (1 - self.cs) ** (2 * generation)) / self.chi_n < \
+            1.4 + 2 / (self.dimension + 1)
+        pc = (1 - self.cc) * state["pc"] + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * \
+            (mean - old_mean) / sigma
+
+        steps = (selected - old_mean) / sigma
+        covariance = (1 - self.c1 - self.cmu) * covariance + \
+            self.c1 * (np.outer(pc, pc) + (1 - hsig) * self.cc * (2 - self.cc) * covariance) + \
+            self.cmu * (steps.T * self.weights) @ steps
+        covariance = (covariance + covariance.T) / 2
+        sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(ps) / self.chi_n - 1))
+
+        state.update({"generation": generation, "mean": mean, "sigma": float(sigma), "covariance": covariance,
+                      "pc": pc, "ps": ps})
+        best = int(order[0])
+        if state["best_value"] is None or values[best] < state["best_value"]:
+            state["best_value"], state["best_unit"] = float(values[best]), np.clip(points[best], 0, 1)
+        state["best_values"] = (state["best_values"] + [float(values[best])])[-10:]
+        return state
+
+    def converged(self, state: dict):
+        if self.max_generations is not None and state["generation"] >= self.max_generations:
+            return True
+        if len(state["best_values"]) == 10 and max(state["best_values"]) - min(state["best_values"]) < self.ftol:
+            return True
+        return state["sigma"] * np.sqrt(np.max(np.diag(state["covariance"]))) < self.sigma_tol
+
+    def minimise(self, x0, covariance=None):
+        """
+        :param x0:          Initial mean (unit cube), not used if the calibration continues from the checkpoint
+        :param covariance:  Initial covariance (unit cube), identity by default
+        :return: best point found (see calibration_local.calibration_result())
+        """
+        state = self.load_state()
+        if state is None and self.warm_start is not None and np.any(self.warm_start["values"] < failure_value):
+            mean, warm_covariance, sigma = self.warm_distribution()
+            state = self.initial_state(mean, warm_covariance if covariance is None else covariance, sigma)
+            print("CMA-ES: first generation centred on the best of %s points known, step size %.4f" % (
+                len(self.warm_start["values"]), state["sigma"]))
+        elif state is None:
+            state = self.initial_state(x0, covariance)
+        else:
+            print("Continue CMA-ES from generation %s (checkpoint %s)" % (state["generation"], self.checkpoint))
+        random = np.random.default_rng()
+        random.bit_generator.state = state["random_state"]
+
+        while not self.converged(state):
+            remaining = self.evaluator.remaining()
+            if remaining is not None and remaining < self.population_size:
+                break
+            points = self.ask(state, random)
+            inside = np.clip(points, 0, 1)
+            values = self.evaluator.evaluate(inside) + bounds_penalty * np.sum((points - inside) ** 2, axis=1)
+            state = self.tell(state, points, values)
+            state["random_state"] = random.bit_generator.state
+            self.save_state(state)
+            print("CMA-ES generation %s: best %.4f, step size %.4f" % (state["generation"], values.min(),
+                                                                      state["sigma"]))
+
+        return self.result(state)
+
+    def result(self, state: dict):
+        """
+        Best point of the calibration, with the same content whether points were run or the checkpoint was already
+        converged: the best point of the history, or the best point of the checkpoint if it is better (found before a
+        restart, its run is in the cache of RunExecutor). If no point is known, the mean of the distribution is run.
+
+        :return: see calibration_local.calibration_result()
+        """
+        if not self.evaluator.history and state["best_value"] is None:
+            self.evaluator.evaluate(np.clip(state["mean"], 0, 1)[None, :])
+        if self.evaluator.history:
+            result = calibration_result(self.evaluator, "cmaes")
+        else:
+            result = {"method": "cmaes", "objective": None, "evaluations": self.evaluator.evaluations,
+                      "history": self.evaluator.log_path}
+        if state["best_value"] is not None and (result["objective"] is None or
+                                                state["best_value"] < result["objective"]):
+            result.update({"parameters": self.evaluator.space.parameters(state["best_unit"]),
+                           "objective": state["best_value"], "unit": state["best_unit"], "run_key": None})
+        return result
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Emulator of the runs trained on the run archive
+
+Every run of Postproc_code/<lake>/runs gives a pair (parameters -> performances and daily series). The emulator is a
+regression of these pairs in the unit cube of the calibrated parameters, one model by output:
+    - gp: Gaussian process (see calibration_bayesian.GaussianProcess);
+    - rbf: thin plate spline radial basis functions, with an uncertainty growing with the distance to the nearest
+      run (cross-validated error of the interpolation times the distance relative to the usual spacing of the runs).
+The daily series at the surface and deepwater levels (variables x levels x days values by run) are first reduced by
+principal component analysis, and only the scores of the components are emulated.
+
+Only the runs done with the input files of the lake, the options of the executor and the values of the fixed
+parameters are used. The predictions are used as a pre-filter:
+    - EmulatedEvaluator runs only the points of an optimiser whose lower confidence bound (mean - kappa std) of the
+      objective is better than a quantile of the objectives known, the other points being given the prediction;
+    - screen_points() keeps the most promising points of a sweep or a design (see design_of_experiments.py).
+
+    $ python calibration_emulator.py Bromont --group T --model gp --folds 5
+    $ python calibration_emulator.py Bromont --group T --model rbf --series --components 0.99
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RBFInterpolator
+from scipy.spatial import cKDTree
+
+from calibration_bayesian import GaussianProcess
+from calibration_objective import CalibrationEvaluator, Objective, ParameterSpace, calibrated_parameters, \
+    default_objective, same_fixed_parameters
+from run_executor import RunExecutor, read_parameter_file
+from sensitivity_indices import run_series
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+emulator_models = ["gp", "rbf"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def training_data(results: list, space: ParameterSpace, objective: Objective):
+    """
+    Points of the unit cube and values of the terms of the objective of the runs done with the fixed parameters of
+    the space.
+
+    :param results: Results of the runs (see run_executor.execute_run()), ex: RunExecutor.archived_results()
+    :return: points (n x d) and values of the terms (n x terms, nan when a term can not be calculated)
+    """
+    x, y = [], []
+    for result in results:
+        if result["status"] != "done" or result["metrics"] is None:
+            continue
+        if not same_fixed_parameters(result["parameters"], space):
+            continue
+        x.append(space.unit_of(result["parameters"]))
+        y.append(objective.terms_values(result["metrics"]))
+    return np.array(x, dtype=float).reshape(-1, space.dimension), \
+        np.array(y, dtype=float).reshape(-1, len(objective.terms))
+
+
+def series_training_data(results: list, space: ParameterSpace):
+    """
+    Points of the unit cube and daily series of the runs whose outputs are still saved.
+
+    :return: points (n x d) and series (n x variables x levels x days)
+    """
+    x, y = [], []
+    for result in results:
+        if result["status"] != "done" or not same_fixed_parameters(result["parameters"], space):
+            continue
+        try:
+            y.append(run_series(result))
+        except (OSError, TypeError, ValueError, KeyError):
+            # outputs removed by the retention of the runs
+            continue
+        x.append(space.unit_of(result["parameters"]))
+    return np.array(x, dtype=float).reshape(-1, space.dimension), np.array(y)
+
+
+def cross_validation(emulator, x, y, folds: int = 5, seed: int = None):
+    """
+    K-fold cross-validation of an emulator.
+
+    :param emulator:    Emulator (refitted on each fold)
+    :param y:           Outputs of the points (n x outputs)
+    :return: DataFrame with the RMSE of the predictions, the standard deviation of the outputs and the fraction of
+             the outputs inside mean +/- 2 std, by output
+    """
+    random = np.random.default_rng(seed)
+    groups = random.permutation(len(x)) % folds
+    mean, std = np.full(y.shape, np.nan), np.full(y.shape, np.nan)
+    for fold in range(folds):
+        test = groups == fold
+        emulator.fit(x[~test], y[~test])
+        mean[test], std[test] = emulator.predict(x[test])
+    with np.errstate(invalid="ignore"):
+        error = mean - y
+        inside = np.abs(error) <= 2 * std
+        return pd.DataFrame({"RMSE": np.sqrt(np.nanmean(error ** 2, axis=0)), "Std": np.nanstd(y, axis=0),
+                             "Coverage_2std": np.nanmean(np.where(np.isfinite(error), inside, np.nan), axis=0)})
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class RadialBasis:
+    """
+    Thin plate spline interpolation of one output. The standard deviation of a prediction is the cross-validated
+    error of the interpolation times the distance to the nearest point divided by the median distance between
+    neighbouring points (zero at the points, growing away from them).
+    """
+
+    def __init__(self, smoothing: float = 1e-6, folds: int = 5, seed: int = None):
+        self.smoothing = smoothing
+        self.folds = folds
+        self.random = np.random.default_rng(seed)
+
+    def interpolator(self, x, y):
+        return RBFInterpolator(x, y, kernel="thin_plate_spline", smoothing=self.smoothing)
+
+    def fit(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        self.offset, self.scale = y.mean(), y.std() if y.std() > 0 else 1.0
+        normalised = (y - self.offset) / self.scale
+        self.model = self.interpolator(x, normalised)
+        self.tree = cKDTree(x)
+        self.spacing = max(float(np.median(self.tree.query(x, k=2)[0][:, 1])), 1e-12)
+
+        groups = self.random.permutation(len(x)) % self.folds
+        errors = []
+        for fold in range(self.folds):
+            test = groups == fold
+            if test.all() or (~test).sum() <= x.shape[1] + 1:
+                continue
+            errors.append(self.interpolator(x[~test], normalised[~test])(x[test]) - normalised[test])
+        self.error = float(np.sqrt(np.mean(np.concatenate(errors) ** 2))) if errors else 1.0
+        return self
+
+    def predict(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        distance = self.tree.query(points)[0]
+        return self.offset + self.scale * self.model(points), self.scale * self.error * distance / self.spacing
+
+
+class Emulator:
+    """
+    Regression of several outputs of the runs (one model by output, or by principal component of the outputs).
+
+    Example:
+        emulator = Emulator("gp").fit(points, values)
+        mean, std = emulator.predict(candidates)
+    """
+
+    def __init__(self, model: str = "gp", components=None, max_points: int = 400, seed: int = None):
+        """
+        :param model:       gp or rbf
+        :param components:  Number of principal components of the outputs emulated (integer) or fraction of the
+                            variance of the outputs explained (between 0 and 1), None to emulate each output
+        :param max_points:  Maximum number of points of a Gaussian process (see GaussianProcess)
+        """
+        if model not in emulator_models:
+            raise ValueError("Emulator '%s' is not an option, choose between %s" % (model, ", ".join(emulator_models)))
+        self.model = model
+        self.components = components
+        self.max_points = max_points
+        self.seed = seed
+
+    def regression(self):
+        if self.model == "gp":
+            return GaussianProcess(self.max_points, seed=self.seed)
+        return RadialBasis(seed=self.seed)
+
+    def fit(self, x, y, refit: bool = True):
+        """
+        :param x:       Points of the unit cube (n x d)
+        :param y:       Outputs of the points (n x outputs, or n x ... for series), nan for the missing values
+        :param refit:   False to keep the hyperparameters of the Gaussian processes of the previous fit (same
+                        outputs), much faster when a few points are added
+        """
+        previous = getattr(self, "models", None) if not refit and self.model == "gp" and self.components is None \
+            else None
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.shape = y.shape[1:]
+        y = y.reshape(len(y), -1)
+        self.basis = None
+        if self.components is not None:
+            # principal components of the runs with all outputs (the outputs without values are left out)
+            columns = np.isfinite(y).all(axis=0) if np.isfinite(y).all(axis=0).any() else np.ones(y.shape[1], bool)
+            rows = np.isfinite(y[:, columns]).all(axis=1)
+            x, y = x[rows], y[rows]
+            self.columns = columns
+            self.centre = y[:, columns].mean(axis=0)
+            _, singular, basis = np.linalg.svd(y[:, columns] - self.centre, full_matrices=False)
+            explained = np.cumsum(singular ** 2) / max(np.sum(singular ** 2), 1e-30)
+            number = int(self.components) if self.components >= 1 else \
+                int(np.searchsorted(explained, self.components) + 1)
+            number = max(1, min(number, len(singular)))
+            self.basis = basis[:number]
+            targets = (y[:, columns] - self.centre) @ self.basis.T
+            # variance of the outputs not explained by the components kept
+            self.truncation = np.var(y[:, columns] - self.centre - targets @ self.basis, axis=0)
+            y = targets
+
+        models = []
+        for index, column in enumerate(y.T):
+            valid = np.isfinite(column)
+            if valid.sum() < x.shape[1] + 2:
+                models.append(None)
+            elif previous is not None and previous[index] is not None:
+                models.append(self.regression().fit(x[valid], column[valid], previous[index].hyperparameters))
+            else:
+                models.append(self.regression().fit(x[valid], column[valid]))
+        self.models = models
+        return self
+
+    def predict(self, points):
+        """
+        :param points:  Points of the unit cube (m x d)
+        :return: mean and standard deviation of the outputs at the points (m x outputs), nan for the outputs
+                 without model
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        mean = np.full((len(points), len(self.models)), np.nan)
+        std = np.full((len(points), len(self.models)), np.nan)
+        for index, model in enumerate(self.models):
+            if model is not None:
+                mean[:, index], std[:, index] = model.predict(points)
+        if self.basis is not None:
+            outputs = np.full((len(points), len(self.columns)), np.nan)
+            deviations = np.full((len(points), len(self.columns)), np.nan)
+            outputs[:, self.columns] = self.centre + mean @ self.basis
+            deviations[:, self.columns] = np.sqrt(std ** 2 @ self.basis ** 2 + self.truncation)
+            mean, std = outputs, deviations
+        return mean.reshape((len(points),) + self.shape), std.reshape((len(points),) + self.shape)
+
+
+class EmulatedEvaluator(CalibrationEvaluator):
+    """
+    CalibrationEvaluator running only the points whose objective could be competitive according to an emulator
+    trained on the run archive and on the runs of the calibration. A point is run if the lower confidence bound of
+    its objective (mean - kappa std) is lower than the quantile of the objectives known; the other points are given
+    the predicted objective without running the model (at least the most promising point of each batch is run).
+    The algorithms using the outputs of the runs (DREAM(ZS), NSGA-II) call results() and always run the model.
+    """
+
+    def __init__(self, executor, space: ParameterSpace, objective: Objective, method: str = "calibration",
+                 max_evaluations: int = None, save: bool = True, model: str = "gp", kappa: float = 2.0,
+                 quantile: float = 0.25, min_points: int = None, refit_growth: float = 0.25, seed: int = None,
+                 **options):
+        """
+        :param model:       Emulator of the terms of the objective (gp or rbf)
+        :param kappa:       Number of standard deviations of the lower confidence bound
+        :param quantile:    Quantile of the objectives known that a point must be able to beat to be run
+        :param min_points:  Number of runs needed before screening (default: 2d + 2)
+        :param refit_growth:    The hyperparameters of the emulator are fitted again when the number of runs has
+                                grown by this fraction since their last fit
+        """
+        super().__init__(executor, space, objective, method, max_evaluations, save, **options)
+        self.emulator = Emulator(model, seed=seed)
+        self.kappa = kappa
+        self.quantile = quantile
+        self.min_points = min_points or 2 * space.dimension + 2
+        self.refit_growth = refit_growth
+        self.fitted_points = 0
+        self.weights = np.array([term[3] for term in objective.terms])
+        self.x, self.y = training_data(executor.archived_results(**options), space, objective)
+        print("Emulator: %s archived runs with the same inputs and fixed parameters" % len(self.x))
+        self.trained = False
+        self.stale = True
+        self.screened = 0
+
+    def results(self, points):
+        results = super().results(points)
+        x, y = training_data(results, self.space, self.objective)
+        self.x, self.y = np.vstack([self.x, x]), np.vstack([self.y, y])
+        self.stale = True
+        return results
+
+    def train(self):
+        """ Fit the emulator on the runs with all the terms of the objective """
+        valid = np.isfinite(self.y).all(axis=1)
+        self.trained = valid.sum() >= self.min_points
+        if self.trained:
+            refit = valid.sum() >= (1 + self.refit_growth) * self.fitted_points
+            self.emulator.fit(self.x[valid], self.y[valid], refit)
+            if refit:
+                self.fitted_points = valid.sum()
+            self.threshold = float(np.quantile(self.y[valid] @ self.weights, self.quantile))
+        self.stale = False
+
+    def predict(self, points):
+        """ Mean and standard deviation of the objective of points of the unit cube """
+        mean, std = self.emulator.predict(points)
+        return mean @ self.weights, np.sqrt((std ** 2) @ (self.weights ** 2))
+
+    def evaluate(self, points):
+        points = np.atleast_2d(np.clip(np.asarray(points, dtype=float), 0, 1))
+        if self.stale:
+            self.train()
+        if not self.trained:
+            return super().evaluate(points)
+        mean, std = self.predict(points)
+        bound = mean - self.kappa * std
+        run = bound <= self.threshold
+        run[np.argmin(bound)] = True
+        values = mean.copy()
+        values[run] = super().evaluate(points[run])
+        self.screened += int((~run).sum())
+        if not run.all():
+            print("Emulator: %s of %s points run, %s points screened out since the start" % (
+                run.sum(), len(points), self.screened))
+        return values
+
+
+def screen_points(executor, space: ParameterSpace, objective: Objective, points, keep: int, model: str = "gp",
+                  kappa: float = 2.0, seed: int = None, **options):
+    """
+    Most promising points of a sweep or a design according to an emulator trained on the run archive: the keep
+    points with the lowest lower confidence bound (mean - kappa std) of the objective.
+
+    :param points:  Points of the unit cube (n x d)
+    :return: indices of the points kept (best first), mean and standard deviation of the objective of all points,
+             or all the points if the archive does not have enough runs
+    """
+    x, y = training_data(executor.archived_results(**options), space, objective)
+    valid = np.isfinite(y).all(axis=1)
+    if valid.sum() < space.dimension + 2:
+        print("Emulator: %s archived runs, not enough to screen the points" % valid.sum())
+        return np.arange(len(points)), None, None
+    weights = np.array([term[3] for term in objective.terms])
+    term_mean, term_std = Emulator(model, seed=seed).fit(x[valid], y[valid]).predict(points)
+    mean, std = term_mean @ weights, np.sqrt((term_std ** 2) @ (weights ** 2))
+    print("Emulator: %s archived runs, %s of %s points kept" % (valid.sum(), min(keep, len(points)), len(points)))
+    return np.argsort(mean - kappa * std)[:keep], mean, std
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validation of an emulator trained on the run archive.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Parameters of the emulator, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--objective", default=default_objective, help="Terms of the objective emulated")
+    parser.add_argument("--model", default="gp", choices=emulator_models, help="Regression of the outputs")
+    parser.add_argument("--series", action="store_true",
+                        help="Emulate the daily series at the surface and deepwater levels instead of the objective")
+    parser.add_argument("--components", type=float, default=0.99,
+                        help="Series: number of principal components, or fraction of the variance explained")
+    parser.add_argument("--folds", type=int, default=5, help="Number of folds of the cross-validation")
+    parser.add_argument("--solver", default="matlab", help="Solver of the archived runs ('matlab' or 'stand-in')")
+    parser.add_argument("--sediment", type=int, default=0, help="Sediment module of the archived runs")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    space = ParameterSpace(names, fixed=read_parameter_file(args.lake))
+    objective = Objective.from_text(args.objective)
+    with RunExecutor(args.lake, max_workers=1, solver=args.solver, enable_sediment=args.sediment) as executor:
+        archived = executor.archived_results()
+    if args.series:
+        x, y = series_training_data(archived, space)
+        emulator = Emulator(args.model, components=args.components)
+        labels = None
+    else:
+        x, y = training_data(archived, space, objective)
+        emulator = Emulator(args.model)
+        labels = [":".join(term[:3]) for term in objective.terms]
+    print("%s archived runs of %s with the fixed parameters of %s" % (len(x), len(archived), args.lake))
+    if len(x) < args.folds * (len(names) + 2):
+        raise SystemExit("Not enough runs for the cross-validation")
+    validation = cross_validation(emulator, x, y.reshape(len(y), -1), args.folds)
+    if labels is not None:
+        validation.index = labels
+        print(validation.to_string())
+    else:
+        print("Series: mean RMSE %.4g, mean standard deviation %.4g, coverage of 2 std %.2f" % (
+            validation["RMSE"].mean(), validation["Std"].mean(), validation["Coverage_2std"].mean()))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Finite-difference Jacobian and Levenberg-Marquardt calibration
+
+Near an optimum, a least squares method using the derivatives of the residuals converges in a few iterations where
+the derivative-free methods need many. The residuals are the differences between the simulations and the
+observations of the variables and depth levels of the objective (see run_executor.compare_with_observations()),
+each block (variable, level) being divided by the standard deviation of its observations and by the square root of
+its number of observations, and multiplied by the square root of the weight of its terms: the sum of squares is the
+weighted sum of the squared normalised RMSE of the blocks.
+
+The Jacobian (residuals x d, in the unit cube of the ParameterSpace) is calculated by central differences: the 2d
+runs x +- h e_i are executed in one batch, so an iteration costs the time of one run instead of d runs. The
+Levenberg-Marquardt steps of 3 damping values are then evaluated in a second batch, the best one being accepted if
+it decreases the sum of squares. The residuals of the observations that a perturbed run does not simulate (ex: a
+depth below the bottom) are given the residual of the centre (derivative 0).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import os
+
+import numpy as np
+
+from calibration_local import calibration_result
+from run_executor import compare_with_observations, depth_levels, load_results, read_observations, \
+    simulated_variable, simulation_start
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Factors of the damping of the steps evaluated in the same batch
+damping_factors = [0.1, 1.0, 10.0]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def objective_blocks(objective):
+    """ Weight of each block (variable, level) of the objective, the weights of the terms of a block being added """
+    blocks = {}
+    for _, variable, level, weight in objective.terms:
+        blocks[(variable, level)] = blocks.get((variable, level), 0.0) + weight
+    return blocks
+
+
+def block_residuals(result: dict, observations: dict, blocks: list):
+    """
+    Simulations minus observations of a run at the variables and levels given.
+
+    :param result:          Result of a run (see run_executor.execute_run())
+    :param observations:    Observations by variable (see run_executor.read_observations())
+    :param blocks:          List of (variable, level), level being surface, deepwater or all
+    :return: list of Series indexed by (Datetime, Depth), one by block, or None if the outputs of the run are not
+             available (failed run, outputs removed)
+    """
+    if result is None or result["status"] != "done" or result["result_file"] is None or \
+            not os.path.exists(result["result_file"]):
+        return None
+    water = load_results(result["result_file"])
+    options = result["options"]
+    comparisons = {}
+    residuals = []
+    for variable, level in blocks:
+        if variable not in comparisons:
+            comparison = compare_with_observations(simulated_variable(water, variable), observations[variable],
+                                                   simulation_start(options), options.get("dz", 0.5))
+            comparisons[variable] = comparison.set_index(["Datetime", "Depth"])
+        comparison = comparisons[variable]
+        if level != "all":
+            comparison = comparison[comparison.index.get_level_values("Depth") == depth_levels[level]]
+        residuals.append(comparison["Simulations"] - comparison["Observations"])
+    return residuals
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ResidualJacobian:
+    """
+    Normalised residuals of runs at the observations of the blocks of an objective, and their Jacobian by central
+    differences in one batch. The observations and the normalisation of the residuals are those of the first centre
+    (see reference()), so that the sums of squares of all runs are comparable.
+
+    Example:
+        engine = ResidualJacobian(evaluator, step=0.01)
+        residuals, jacobian, result = engine.jacobian(point)
+    """
+
+    def __init__(self, evaluator, step: float = 0.01):
+        """
+        :param evaluator:   CalibrationEvaluator running the points (its objective gives the blocks and weights)
+        :param step:        Step of the differences in the unit cube (one-sided next to the bounds)
+        """
+        self.evaluator = evaluator
+        self.step = step
+        weights = objective_blocks(evaluator.objective)
+        self.blocks = list(weights)
+        self.weights = np.array([weights[block] for block in self.blocks])
+        folder = evaluator.executor.observation_folder
+        self.observations = {variable: read_observations(folder, variable)
+                             for variable in dict.fromkeys(variable for variable, _ in self.blocks)}
+        self.index = None
+        self.scales = None
+
+    def reference(self, residuals: list):
+        """ Observations of each block and normalisation of its residuals, from the residuals of a run """
+        self.index = [block.index[np.isfinite(block.values)] for block in residuals]
+        self.scales = []
+        for (variable, level), index, weight in zip(self.blocks, self.index, self.weights):
+            observed = self.observations[variable].stack()
+            observed = observed[observed.index.isin(index)]
+            spread = observed.std() if len(observed) > 1 and observed.std() > 0 else 1.0
+            self.scales.append(np.sqrt(weight / max(len(index), 1)) / spread)
+        empty = [block for block, index in zip(self.blocks, self.index) if not len(index)]
+        if empty:
+            print("No observations matched for %s" % ", ".join("%s:%s" % block for block in empty))
+
+    @property
+    def size(self):
+        return sum(len(index) for index in self.index)
+
+    def residual_vector(self, result: dict):
+        """ Normalised residuals of a run (nan where the run does not simulate an observation, all nan if failed) """
+        residuals = block_residuals(result, self.observations, self.blocks)
+        if residuals is not None and self.index is None:
+            self.reference(residuals)
+        if self.index is None:
+            return None
+        if residuals is None:
+            return np.full(self.size, np.nan)
+        return np.concatenate([block.reindex(index).values * scale
+                               for block, index, scale in zip(residuals, self.index, self.scales)])
+
+    def difference_points(self, point):
+        """ Points x + h e_i and x - h e_i (2d x d), shifted inside the unit cube next to the bounds """
+        point = np.asarray(point, dtype=float)
+        identity = np.eye(len(point))
+        upper = np.clip(point + self.step * identity, 0, 1)
+        lower = np.clip(point - self.step * identity, 0, 1)
+        # next to a bound, the pair of points is shifted so that its difference is still 2 h
+        at_upper = upper[np.arange(len(point)), np.arange(len(point))] - point < self.step
+        at_lower = point - lower[np.arange(len(point)), np.arange(len(point))] < self.step
+        lower[at_upper] = np.clip(point - 2 * self.step * identity, 0, 1)[at_upper]
+        upper[at_lower] = np.clip(point + 2 * self.step * identity, 0, 1)[at_lower]
+        return np.vstack([upper, lower])
+
+    def jacobian(self, point, centre_result: dict = None):
+        """
+        Residuals at a point and their Jacobian, the 2d perturbed runs (and the centre if its result is not given) in
+        one batch.
+
+        :return: residuals (m), Jacobian (m x d) and the result of the centre; the residuals are None if the centre
+                 failed
+        """
+        point = np.asarray(point, dtype=float)
+        perturbed = self.difference_points(point)
+        if centre_result is None:
+            results = self.evaluator.results(np.vstack([point[None, :], perturbed]))
+            centre_result, results = results[0], results[1:]
+        else:
+            results = self.evaluator.results(perturbed)
+        centre = self.residual_vector(centre_result)
+        if centre is None or not np.all(np.isfinite(centre)):
+            return None, None, centre_result
+        dimension = len(point)
+        upper = np.array([self.residual_vector(result) for result in results[:dimension]])
+        lower = np.array([self.residual_vector(result) for result in results[dimension:]])
+        upper = np.where(np.isfinite(upper), upper, centre)
+        lower = np.where(np.isfinite(lower), lower, centre)
+        steps = np.diag(perturbed[:dimension]) - np.diag(perturbed[dimension:])
+        return centre, ((upper - lower) / steps[:, None]).T, centre_result
+
+
+class LevenbergMarquardt:
+    """
+    Levenberg-Marquardt least squares with the Jacobian of the residuals calculated by finite differences in one
+    batch, and the steps of several damping values evaluated in a second batch.
+
+    Example:
+        result = LevenbergMarquardt(evaluator, step=0.01).minimise(x0)
+    """
+
+    def __init__(self, evaluator, step: float = 0.01, damping: float = 1e-2, max_damping: float = 1e8,
+                 xtol: float = 1e-3, ftol: float = 1e-4, warm_start: dict = None):
+        """
+        :param evaluator:   CalibrationEvaluator
+        :param step:        Step of the finite differences in the unit cube
+        :param damping:     Initial damping (relative to the diagonal of J'J)
+        :param max_damping: Stop when no step decreases the sum of squares with this damping
+        :param xtol:        Stop when the accepted step is smaller than xtol (unit cube)
+        :param ftol:        Stop when the relative decrease of the sum of squares is lower than ftol
+        :param warm_start:  Points known (see calibration_warm_start.warm_start_data()), the search starts from the
+                            best one
+        """
+        self.evaluator = evaluator
+        self.engine = ResidualJacobian(evaluator, step)
+        self.damping = damping
+        self.max_damping = max_damping
+        self.xtol = xtol
+        self.ftol = ftol
+        self.warm_start = warm_start
+
+    def damped_steps(self, residuals, jacobian, point):
+        """ Steps of the damping values damping x damping_factors, limited by the unit cube """
+        hessian = jacobian.T @ jacobian
+        gradient = jacobian.T @ residuals
+        # the diagonal of a parameter without effect on the residuals is not 0
+        diagonal = np.maximum(np.diag(hessian), 1e-12 * max(np.max(np.diag(hessian)), 1e-12))
+        steps = [np.linalg.solve(hessian + self.damping * factor * np.diag(diagonal), -gradient)
+                 for factor in damping_factors]
+        return np.clip(point + np.array(steps), 0, 1) - point
+
+    def minimise(self, x0):
+        """
+        :param x0:  Initial point (unit cube)
+        :return: best point found (see calibration_local.calibration_result())
+        """
+        x = np.array(x0, dtype=float)
+        if self.warm_start is not None and len(self.warm_start["unit"]):
+            x = self.warm_start["unit"][0].copy()
+        dimension = len(x)
+        centre_result = None
+        iteration = 0
+        while not self.evaluator.exhausted():
+            remaining = self.evaluator.remaining()
+            if remaining is not None and remaining < 2 * dimension + (centre_result is None) + len(damping_factors):
+                break
+            residuals, jacobian, centre_result = self.engine.jacobian(x, centre_result)
+            if residuals is None:
+                print("Levenberg-Marquardt: the run of the centre failed or its outputs are not available")
+                break
+            cost = float(residuals @ residuals)
+            accepted = False
+            while not accepted and self.damping <= self.max_damping and \
+                    (self.evaluator.remaining() is None or self.evaluator.remaining() >= len(damping_factors)):
+                steps = self.damped_steps(residuals, jacobian, x)
+                results = self.evaluator.results(x + steps)
+                costs = []
+                for result in results:
+                    trial = self.engine.residual_vector(result)
+                    costs.append(float(trial @ trial) if np.all(np.isfinite(trial)) else np.inf)
+                best = int(np.argmin(costs))
+                if costs[best] < cost:
+                    accepted = True
+                    self.damping *= damping_factors[best]
+                    x, centre_result = x + steps[best], results[best]
+                    decrease, size = cost - costs[best], np.max(np.abs(steps[best]))
+                    iteration += 1
+                    print("Levenberg-Marquardt iteration %s: sum of squares %.4f, damping %.3g, objective %.4f" % (
+                        iteration, costs[best], self.damping, self.evaluator.objective(results[best])))
+                else:
+                    self.damping *= 10 * damping_factors[-1]
+            if not accepted or decrease < self.ftol * cost or size < self.xtol:
+                break
+        return calibration_result(self.evaluator, "levenberg-marquardt")
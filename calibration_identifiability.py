@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Identifiability of the calibrated parameters from the Jacobian of the residuals
+
+Parameters that compensate each other (ex: swa_b0 and swa_b1, I_scDOC and k_BOD) can not be calibrated together: the
+optimisers waste runs along the directions where the residuals do not change. The Jacobian of the normalised residuals
+at the observations (see calibration_gradient.ResidualJacobian, 2d runs in one batch) gives:
+    - the sensitivity of each parameter: root mean square of its column (unit cube of the parameters);
+    - the correlation of the parameters: from the inverse of the Fisher information J'J / s2, s2 being the variance
+      of the residuals;
+    - the collinearity index of subsets of parameters (Brun et al., Practical identifiability analysis of large
+      environmental simulation models, 2001): 1 / sqrt(smallest eigenvalue of S'S), S being the columns of J scaled
+      to a unit norm. Above 10 to 15, a change of a parameter of the subset can be compensated by the others;
+    - the eigen-decomposition of the Fisher information: the eigenvectors of the small eigenvalues are the
+      combinations of parameters that the observations do not constrain.
+The recommended parameters to fix are chosen by adding the parameters by decreasing sensitivity, a parameter being
+fixed when it has no effect or when it makes the collinearity index of the selected parameters exceed the threshold.
+
+    $ python calibration_identifiability.py Bromont --group T,O2 --workers 8
+    $ python calibration_identifiability.py Bromont --parameters swa_b0,swa_b1,I_scDOC,k_BOD --best --threshold 10
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import itertools
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calibration_gradient import ResidualJacobian
+from calibration_objective import CalibrationEvaluator, Objective, ParameterSpace, calibrated_parameters, \
+    default_objective
+from run_executor import RunExecutor, read_parameter_file
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Collinearity index above which a subset of parameters is not identifiable
+collinearity_threshold = 10.0
+# Sensitivity (relative to the largest one) below which a parameter has no effect
+min_relative_sensitivity = 1e-3
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def scaled_columns(jacobian):
+    """ Columns of the Jacobian scaled to a unit norm (a column of zeros stays 0) """
+    norms = np.linalg.norm(jacobian, axis=0)
+    return jacobian / np.where(norms > 0, norms, 1.0)
+
+
+def collinearity_index(jacobian, subset):
+    """ Collinearity index of the parameters of a subset (indices of the columns), infinite if they are dependent """
+    scaled = scaled_columns(jacobian)[:, list(subset)]
+    smallest = np.linalg.eigvalsh(scaled.T @ scaled)[0]
+    return float(1 / np.sqrt(smallest)) if smallest > 1e-300 else np.inf
+
+
+def collinearity_table(jacobian, names: list, max_size: int = 4):
+    """
+    Collinearity index of all subsets of 2 to max_size parameters.
+
+    :return: DataFrame with the parameters, the size and the index of each subset, the largest indices first
+    """
+    lines = []
+    for size in range(2, min(max_size, len(names)) + 1):
+        for subset in itertools.combinations(range(len(names)), size):
+            lines.append({"Parameters": ",".join(names[index] for index in subset), "Size": size,
+                          "Collinearity": collinearity_index(jacobian, subset)})
+    table = pd.DataFrame(lines, columns=["Parameters", "Size", "Collinearity"])
+    return table.sort_values(["Collinearity", "Size"], ascending=[False, True], kind="stable").reset_index(drop=True)
+
+
+def fisher_information(jacobian, residuals):
+    """
+    Fisher information of the parameters (unit cube) for errors of constant variance, estimated by the variance of
+    the residuals.
+
+    :return: information matrix (d x d) and the variance of the errors
+    """
+    variance = float(residuals @ residuals) / max(len(residuals) - jacobian.shape[1], 1)
+    return jacobian.T @ jacobian / max(variance, 1e-300), variance
+
+
+def identifiability(jacobian, residuals, names: list, threshold: float = collinearity_threshold,
+                    max_size: int = 4):
+    """
+    Identifiability diagnostics of the parameters (see the description of the module).
+
+    :param jacobian:    Jacobian of the normalised residuals (m x d, unit cube)
+    :param residuals:   Normalised residuals at the point (m)
+    :param threshold:   Collinearity index above which a subset is not identifiable
+    :param max_size:    Largest subsets of the collinearity table
+    :return: dictionary of DataFrames: parameters (sensitivity, standard error, recommendation), correlation,
+             collinearity (subsets) and eigen (eigenvalues and eigenvectors of the Fisher information)
+    """
+    jacobian = np.asarray(jacobian, dtype=float)
+    sensitivity = np.sqrt(np.mean(jacobian ** 2, axis=0))
+    information, variance = fisher_information(jacobian, residuals)
+    covariance = np.linalg.pinv(information)
+    deviation = np.sqrt(np.maximum(np.diag(covariance), 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = covariance / np.outer(deviation, deviation)
+    correlation = pd.DataFrame(np.clip(correlation, -1, 1), index=names, columns=names)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(information)
+    eigen = pd.DataFrame(eigenvectors.T, columns=names)
+    eigen.insert(0, "Relative", eigenvalues / max(eigenvalues.max(), 1e-300))
+    eigen.insert(0, "Eigenvalue", eigenvalues)
+
+    # parameters added by decreasing sensitivity while the selected parameters stay identifiable
+    selected = []
+    recommendation, reason = {}, {}
+    for index in np.argsort(-sensitivity, kind="stable"):
+        if sensitivity[index] <= min_relative_sensitivity * max(sensitivity.max(), 1e-300):
+            recommendation[index], reason[index] = "fix", "no effect on the residuals"
+            continue
+        index_with = collinearity_index(jacobian, selected + [index])
+        if index_with > threshold:
+            # parameter of the selection compensating it the most
+            partner = max(selected, key=lambda other: collinearity_index(jacobian, [other, index]))
+            recommendation[index] = "fix"
+            reason[index] = "collinearity index %.1f with the parameters selected (%.1f with %s)" % (
+                index_with, collinearity_index(jacobian, [partner, index]), names[partner])
+            continue
+        selected.append(index)
+        recommendation[index], reason[index] = "calibrate", ""
+
+    parameters = pd.DataFrame({"Parameter": names, "Sensitivity": sensitivity, "Standard_error": deviation,
+                               "Recommendation": [recommendation[index] for index in range(len(names))],
+                               "Reason": [reason[index] for index in range(len(names))]})
+    parameters = parameters.sort_values("Sensitivity", ascending=False, kind="stable").reset_index(drop=True)
+    return {"parameters": parameters, "correlation": correlation,
+            "collinearity": collinearity_table(jacobian, names, max_size), "eigen": eigen, "variance": variance}
+
+
+def identifiability_at(executor, space: ParameterSpace, objective: Objective, point=None, step: float = 0.01,
+                       threshold: float = collinearity_threshold, max_size: int = 4, **options):
+    """
+    Identifiability diagnostics at a point, the 2d + 1 runs of the Jacobian being executed in one batch.
+
+    :param point:   Point of the unit cube (default: the values of space.fixed)
+    :param step:    Step of the finite differences (unit cube)
+    :param options: Options of the runs replacing those of the executor (ex: enable_sediment=1)
+    :return: see identifiability(), None if the run of the point failed
+    """
+    evaluator = CalibrationEvaluator(executor, space, objective, "identifiability", save=False, **options)
+    point = space.unit_of(space.fixed) if point is None else np.asarray(point, dtype=float)
+    residuals, jacobian, result = ResidualJacobian(evaluator, step).jacobian(point)
+    if residuals is None:
+        print("Run %s failed or its outputs are not available: %s" % (result["key"], result.get("error")))
+        return None
+    print("Jacobian of %s residuals for %s (%s runs, objective %.4f at the point)" % (
+        len(residuals), ", ".join(space.names), evaluator.evaluations, objective(result)))
+    return identifiability(jacobian, residuals, space.names, threshold, max_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Identifiability of the calibrated parameters of a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Parameters, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--objective", default=default_objective,
+                        help="Variables, levels and weights of the residuals, as the objective of the calibration")
+    parser.add_argument("--best", action="store_true",
+                        help="Jacobian at the best run of the archive instead of the parameter file")
+    parser.add_argument("--step", type=float, default=0.01, help="Step of the finite differences (fraction of bounds)")
+    parser.add_argument("--threshold", type=float, default=collinearity_threshold,
+                        help="Collinearity index above which the parameters are not identifiable")
+    parser.add_argument("--max-size", type=int, default=4, help="Largest subsets of the collinearity table")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    space = ParameterSpace(names, fixed=read_parameter_file(args.lake))
+    objective = Objective.from_text(args.objective)
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        point = None
+        if args.best:
+            from calibration_warm_start import warm_start_data
+
+            known = warm_start_data(executor, space, objective)
+            point = known["unit"][0] if len(known["unit"]) else None
+        diagnostics = identifiability_at(executor, space, objective, point, args.step, args.threshold,
+                                         args.max_size)
+        output_folder = executor.output_folder
+    if diagnostics is None:
+        raise SystemExit(1)
+
+    pd.set_option("display.width", 200)
+    print("\nSensitivity and recommendation:\n%s" % diagnostics["parameters"].to_string(index=False))
+    print("\nCorrelation:\n%s" % diagnostics["correlation"].round(2).to_string())
+    print("\nLargest collinearity indices:\n%s" % diagnostics["collinearity"].head(10).to_string(index=False))
+    print("\nEigenvalues of the Fisher information:\n%s" % diagnostics["eigen"].round(3).to_string(index=False))
+    fixed = diagnostics["parameters"]
+    fixed = list(fixed.loc[fixed["Recommendation"] == "fix", "Parameter"])
+    print("\nParameters to fix: %s" % (", ".join(fixed) if fixed else "none"))
+
+    prefix = os.path.join(output_folder, "identifiability_%s_%s" % (args.lake,
+                                                                     datetime.now().strftime('%Y%m%d_%H%M%S')))
+    for name in ["parameters", "correlation", "collinearity", "eigen"]:
+        diagnostics[name].to_csv("%s_%s.csv" % (prefix, name), index=name == "correlation")
+    print("Diagnostics saved: %s_*.csv" % prefix)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Derivative-free local optimisers of the automatic calibration
+
+The optimisers work in the unit cube of a ParameterSpace (see calibration_objective.py) and evaluate the objective
+by batches with a CalibrationEvaluator, so that the runs of each step are executed in parallel:
+    - NelderMead: the reflection, expansion and both contractions of a step are evaluated in the same batch
+      (speculative evaluation), the shrink of the simplex in a second batch;
+    - Powell: the line searches evaluate a grid of points along the direction in one batch, then refine the grid
+      around the best point;
+    - QuadraticTrustRegion (BOBYQA-like): quadratic model (gradient and diagonal Hessian) fitted on the 2d+1 points
+      around the centre, evaluated in one batch, and minimised in the intersection of the trust region with the bounds.
+Each optimiser can start from the runs already done (warm_start, see calibration_warm_start.py): the runs of the
+points known are in the cache of RunExecutor, so evaluating them again does not run the model.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import numpy as np
+
+from calibration_objective import failure_value
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def calibration_result(evaluator, method: str):
+    """
+    Best point found by an optimiser.
+
+    :return: dictionary with the method, the parameters of the best run, its objective and unit point, the number
+             of evaluations and the path of the history file
+    """
+    best = evaluator.best()
+    return {"method": method, "parameters": evaluator.space.parameters(best["unit"]), "objective": best["Objective"],
+            "unit": best["unit"], "run_key": best["Run_key"], "evaluations": evaluator.evaluations,
+            "history": evaluator.log_path}
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class NelderMead:
+    """
+    Nelder-Mead simplex with speculative evaluation of the candidate points of each step in one batch.
+    """
+
+    def __init__(self, evaluator, initial_step: float = 0.1, xtol: float = 1e-3, ftol: float = 1e-4,
+                 reflection: float = 1.0, expansion: float = 2.0, contraction: float = 0.5, shrink: float = 0.5,
+                 warm_start: dict = None):
+        """
+        :param evaluator:       CalibrationEvaluator
+        :param initial_step:    Size of the initial simplex in the unit cube
+        :param xtol:            Stop when the simplex is smaller than xtol (unit cube)
+        :param ftol:            Stop when the objective of the points of the simplex differ less than ftol
+        :param warm_start:      Points known (see calibration_warm_start.warm_start_data()), the initial simplex is
+                                made of the best ones
+        """
+        self.evaluator = evaluator
+        self.initial_step = initial_step
+        self.xtol = xtol
+        self.ftol = ftol
+        self.coefficients = (reflection, expansion, contraction, shrink)
+        self.warm_start = warm_start
+
+    def initial_simplex(self, x0):
+        dimension = len(x0)
+        simplex = [np.array(x0, dtype=float)]
+        for index in range(dimension):
+            vertex = np.array(x0, dtype=float)
+            # step toward the inside of the unit cube
+            vertex[index] += self.initial_step if vertex[index] + self.initial_step <= 1 else -self.initial_step
+            simplex.append(vertex)
+        return np.array(simplex)
+
+    def warm_simplex(self, x0):
+        """
+        Initial simplex made of the points known: the best point, then the best points at most 2 initial steps away
+        from it adding a direction to the simplex (distance to the span of the previous edges larger than a quarter of
+        the initial step). The missing vertices are steps along the axes the least covered by the edges.
+        """
+        unit, values = self.warm_start["unit"], self.warm_start["values"]
+        if not len(unit):
+            return self.initial_simplex(x0)
+        best = unit[0]
+        edges = np.empty((0, len(best)))
+        for point in unit[1:]:
+            if len(edges) == len(best):
+                break
+            edge = point - best
+            if np.max(np.abs(edge)) > 2 * self.initial_step:
+                continue
+            residual = edge - edges.T @ np.linalg.lstsq(edges.T, edge, rcond=None)[0] if len(edges) else edge
+            if np.linalg.norm(residual) >= self.initial_step / 4:
+                edges = np.vstack([edges, edge])
+        known = len(edges)
+        while len(edges) < len(best):
+            # axis with the smallest component in the span of the edges
+            projector = edges.T @ np.linalg.pinv(edges.T) if len(edges) else np.zeros((len(best), len(best)))
+            axis = int(np.argmin(np.diag(projector)))
+            step = self.initial_step if best[axis] + self.initial_step <= 1 else -self.initial_step
+            edges = np.vstack([edges, step * np.eye(len(best))[axis]])
+        print("Nelder-Mead: initial simplex of %s points known (best %.4f) and %s steps along the axes" % (
+            known + 1, values[0], len(best) - known))
+        return np.clip(np.vstack([best, best + edges]), 0, 1)
+
+    def minimise(self, x0, simplex=None):
+        """
+        :param x0:      Initial point (unit cube)
+        :param simplex: Initial simplex (d+1 points), replacing the simplex built around x0 (or from the warm start)
+        :return: best point found (see calibration_result())
+        """
+        reflection, expansion, contraction, shrink = self.coefficients
+        if simplex is not None:
+            simplex = np.clip(np.array(simplex, dtype=float), 0, 1)
+        elif self.warm_start is not None:
+            simplex = self.warm_simplex(x0)
+        else:
+            simplex = self.initial_simplex(x0)
+        # the vertices beyond the maximum number of evaluations are not run (and the calibration stops)
+        simplex = simplex[:self.evaluator.budget(len(simplex))]
+        values = self.evaluator.evaluate(simplex)
+        while not self.evaluator.exhausted():
+            order = np.argsort(values)
+            simplex, values = simplex[order], values[order]
+            size = np.max(np.abs(simplex[1:] - simplex[0]))
+            if size < self.xtol or values[-1] - values[0] < self.ftol:
+                break
+            centroid = simplex[:-1].mean(axis=0)
+            worst = simplex[-1]
+            candidates = np.clip(np.array([
+                centroid + reflection * (centroid - worst),
+                centroid + expansion * (centroid - worst),
+                centroid + contraction * reflection * (centroid - worst),
+                centroid + contraction * (worst - centroid)]), 0, 1)
+            # candidates beyond the maximum number of evaluations are not run, and never accepted
+            candidates_values = np.full(len(candidates), np.inf)
+            count = self.evaluator.budget(len(candidates))
+            candidates_values[:count] = self.evaluator.evaluate(candidates[:count])
+            reflected, expanded, outside, inside = candidates_values
+
+            accepted = None
+            if reflected < values[0]:
+                accepted = 1 if expanded < reflected else 0
+            elif reflected < values[-2]:
+                accepted = 0
+            elif reflected < values[-1]:
+                if outside <= reflected:
+                    accepted = 2
+            elif inside < values[-1]:
+                accepted = 3
+            if accepted is not None:
+                simplex[-1] = candidates[accepted]
+                values[-1] = [reflected, expanded, outside, inside][accepted]
+            else:
+                # shrink toward the best point (only the vertices that can still be evaluated)
+                count = self.evaluator.budget(len(simplex) - 1)
+                if count == 0:
+                    break
+                simplex[1:count + 1] = simplex[0] + shrink * (simplex[1:count + 1] - simplex[0])
+                values[1:count + 1] = self.evaluator.evaluate(simplex[1:count + 1])
+        return calibration_result(self.evaluator, "nelder-mead")
+
+
+class Powell:
+    """
+    Powell's conjugate directions, each line search evaluating a grid of points along the direction in one batch.
+    """
+
+    def __init__(self, evaluator, points_per_line: int = 8, refinements: int = 2, initial_step: float = 0.5,
+                 xtol: float = 1e-3, ftol: float = 1e-4, warm_start: dict = None):
+        """
+        :param points_per_line: Number of points of the grid of a line search (runs of a batch)
+        :param refinements:     Number of grids evaluated around the best point after the first one
+        :param initial_step:    Half-width of the line searches (unit cube), halved when a cycle does not improve
+        :param warm_start:      Points known (see calibration_warm_start.warm_start_data()), the search starts from
+                                the best one along the principal axes of the best 2d + 1 ones
+        """
+        self.evaluator = evaluator
+        self.points_per_line = points_per_line
+        self.refinements = refinements
+        self.step = initial_step
+        self.xtol = xtol
+        self.ftol = ftol
+        self.warm_start = warm_start
+
+    def line_search(self, x, value: float, direction):
+        """
+        Minimise along x + t * direction, t in [-step, step] limited by the unit cube.
+
+        :return: best point and its objective
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            limits = np.stack([(0 - x) / direction, (1 - x) / direction])
+        limits = np.where(np.isfinite(limits), limits, np.nan)
+        low = max(np.nanmax(np.min(limits, axis=0)), -self.step)
+        high = min(np.nanmin(np.max(limits, axis=0)), self.step)
+        best_t, best_value = 0.0, value
+        for _ in range(self.refinements + 1):
+            if self.evaluator.exhausted() or high - low < self.xtol:
+                break
+            steps = np.linspace(low, high, self.points_per_line)
+            steps = steps[np.abs(steps - best_t) > 1e-12]
+            if self.evaluator.remaining() is not None:
+                steps = steps[:self.evaluator.remaining()]
+            values = self.evaluator.evaluate(x + steps[:, None] * direction)
+            if values.min() < best_value:
+                best_t, best_value = steps[np.argmin(values)], values.min()
+            spacing = (high - low) / (self.points_per_line - 1)
+            low, high = max(best_t - spacing, low), min(best_t + spacing, high)
+        return np.clip(x + best_t * direction, 0, 1), best_value
+
+    def minimise(self, x0, directions=None):
+        """
+        :param x0:          Initial point (unit cube)
+        :param directions:  Initial directions (rows), the axes of the unit cube by default
+        :return: best point found (see calibration_result())
+        """
+        x = np.array(x0, dtype=float)
+        if self.warm_start is not None and len(self.warm_start["unit"]):
+            x = self.warm_start["unit"][0].copy()
+            best = self.warm_start["unit"][:2 * len(x) + 1]
+            if directions is None and len(best) > len(x):
+                # principal axes of the best points, the directions along which they are spread first
+                directions = np.linalg.svd(best - best.mean(axis=0), full_matrices=False)[2]
+        directions = np.eye(len(x)) if directions is None else np.array(directions, dtype=float)
+        value = self.evaluator.evaluate([x])[0]
+        while not self.evaluator.exhausted() and self.step >= self.xtol:
+            start, start_value = x.copy(), value
+            decreases = []
+            for direction in directions:
+                previous = value
+                x, value = self.line_search(x, value, direction)
+                decreases.append(previous - value)
+            new_direction = x - start
+            norm = np.linalg.norm(new_direction)
+            if norm > 0:
+                directions[int(np.argmax(decreases))] = new_direction / norm
+                x, value = self.line_search(x, value, new_direction / norm)
+            if start_value - value < self.ftol:
+                self.step /= 2
+        return calibration_result(self.evaluator, "powell")
+
+
+class QuadraticTrustRegion:
+    """
+    BOBYQA-like trust region method: a quadratic model with a diagonal Hessian is fitted on the points evaluated
+    around the centre (the 2d points centre +- radius along each axis are evaluated in one batch), and minimised in
+    the trust region (infinity norm) limited by the unit cube. The trial step, half and double of it are evaluated
+    in one batch.
+    """
+
+    def __init__(self, evaluator, initial_radius: float = 0.2, final_radius: float = 1e-3,
+                 maximum_radius: float = 0.5, warm_start: dict = None):
+        """
+        :param warm_start:  Points known (see calibration_warm_start.warm_start_data()), the search starts from the
+                            best one and the points known are used by the quadratic models
+        """
+        self.evaluator = evaluator
+        self.radius = initial_radius
+        self.final_radius = final_radius
+        self.maximum_radius = maximum_radius
+        self.warm_start = warm_start
+
+    def fit_model(self, centre, points, values):
+        """
+        Least squares fit of f(centre + s) = c + g.s + 0.5 * sum(h * s^2) on the points.
+
+        :return: c, g and h
+        """
+        steps = points - centre
+        design = np.hstack([np.ones((len(steps), 1)), steps, 0.5 * steps ** 2])
+        coefficients = np.linalg.lstsq(design, values, rcond=None)[0]
+        dimension = len(centre)
+        return coefficients[0], coefficients[1:dimension + 1], coefficients[dimension + 1:]
+
+    def model_step(self, centre, gradient, hessian):
+        """ Minimum of the separable model in the trust region limited by the unit cube, coordinate by coordinate """
+        low = np.maximum(-self.radius, -centre)
+        high = np.minimum(self.radius, 1 - centre)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            interior = np.clip(-gradient / hessian, low, high)
+        candidates = np.stack([low, high, np.where(hessian > 0, interior, low)])
+        model = gradient * candidates + 0.5 * hessian * candidates ** 2
+        return candidates[np.argmin(model, axis=0), np.arange(len(centre))]
+
+    def minimise(self, x0):
+        """
+        :param x0:  Initial point (unit cube)
+        :return: best point found (see calibration_result())
+        """
+        centre = np.array(x0, dtype=float)
+        points, values = [], []
+        if self.warm_start is not None and len(self.warm_start["unit"]):
+            centre = self.warm_start["unit"][0].copy()
+            successful = self.warm_start["values"][1:] < failure_value
+            points = list(self.warm_start["unit"][1:][successful])
+            values = list(self.warm_start["values"][1:][successful])
+        value = self.evaluator.evaluate([centre])[0]
+        points, values = [centre] + points, [value] + values
+        dimension = len(centre)
+        while not self.evaluator.exhausted() and self.radius >= self.final_radius:
+            stencil = []
+            for index in range(dimension):
+                for sign in (1, -1):
+                    point = centre.copy()
+                    point[index] = np.clip(point[index] + sign * self.radius, 0, 1)
+                    stencil.append(point)
+            stencil = np.array(stencil)[:self.evaluator.budget(len(stencil))]
+            stencil_values = self.evaluator.evaluate(stencil)
+            points.extend(stencil)
+            values.extend(stencil_values)
+
+            near = np.max(np.abs(np.array(points) - centre), axis=1) <= 2 * self.radius + 1e-12
+            constant, gradient, hessian = self.fit_model(centre, np.array(points)[near], np.array(values)[near])
+            step = self.model_step(centre, gradient, hessian)
+            if np.max(np.abs(step)) < 1e-12 or self.evaluator.exhausted():
+                self.radius /= 2
+                continue
+            trials = np.clip(centre + np.array([step, 0.5 * step, 2 * step]), 0, 1)
+            trials = trials[:self.evaluator.budget(len(trials))]
+            trial_values = self.evaluator.evaluate(trials)
+            points.extend(trials)
+            values.extend(trial_values)
+
+            predicted = -(gradient @ step + 0.5 * hessian @ step ** 2)
+            ratio = (value - trial_values[0]) / predicted if predicted > 0 else -1
+            best = int(np.argmin(trial_values))
+            if trial_values[best] < value:
+                centre, value = trials[best], trial_values[best]
+                if ratio > 0.75 and np.max(np.abs(step)) >= 0.99 * self.radius:
+                    self.radius = min(2 * self.radius, self.maximum_radius)
+                elif ratio < 0.25:
+                    self.radius /= 2
+            else:
+                self.radius /= 2
+        return calibration_result(self.evaluator, "bobyqa")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" DREAM(ZS) sampler of the posterior distribution of the parameters
+
+Markov chain Monte Carlo with parallel chains (Vrugt, Markov chain Monte Carlo simulation using the DREAM software
+package, 2016; ter Braak and Vrugt, 2008): each chain proposes a jump made of differences of past states (archive Z),
+on a random subset of the parameters (crossover), and the proposals of all chains are evaluated in one batch by the
+CalibrationEvaluator, so the runs of a generation are executed in parallel. The snooker update is not used.
+
+The prior is uniform in the unit cube of the ParameterSpace (uniform between the bounds of the registry, on a
+logarithmic scale for the rate constants). The likelihood is calculated from the residuals of the simulations at the
+observations of the variables and depth levels of the objective (see run_executor.compare_with_observations()), the
+standard deviation of the errors of each variable and level being integrated out:
+    - gaussian: errors of constant standard deviation, log L = -n/2 log(sum(residuals^2));
+    - heteroscedastic: standard deviation of the errors increasing linearly with the observed value,
+      log L = -n/2 log(sum((residuals / w)^2)), w = |observation| + mean(|observations|).
+
+The states of the chains are appended to a CSV file after each generation and the state of the sampler is saved in a
+checkpoint file, so a sampling stopped (or crashed) is continued from its last generation. The Gelman-Rubin statistic
+of each parameter is given during the sampling.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from calibration_local import calibration_result
+from calibration_objective import latin_hypercube
+from run_executor import compare_with_observations, depth_levels, load_results, read_observations, \
+    simulated_variable, simulation_start, variables_list
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+likelihoods = ["gaussian", "heteroscedastic"]
+# Probabilities of the crossover values (fraction of the parameters updated by a jump)
+crossover_values = [1 / 3, 2 / 3, 1.0]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def residual_blocks(result: dict, observations: dict, blocks: list):
+    """
+    Observations and simulations of a run at the variables and levels given.
+
+    :param result:          Result of a run (see run_executor.execute_run())
+    :param observations:    Observations by variable (see run_executor.read_observations())
+    :param blocks:          List of (variable, level), level being surface, deepwater or all
+    :return: list of (observations, simulations) arrays, one by block
+    """
+    water = load_results(result["result_file"])
+    options = result["options"]
+    comparisons = {}
+    matched = []
+    for variable, level in blocks:
+        if variable not in comparisons:
+            comparisons[variable] = compare_with_observations(simulated_variable(water, variable),
+                                                              observations[variable],
+                                                              simulation_start(options),
+                                                              options.get("dz", 0.5))
+        comparison = comparisons[variable]
+        if level != "all":
+            comparison = comparison[comparison["Depth"] == depth_levels[level]]
+        matched.append((comparison["Observations"].values, comparison["Simulations"].values))
+    return matched
+
+
+def log_likelihood(matched: list, likelihood: str = "gaussian"):
+    """
+    Log-likelihood of the residuals of a run, the standard deviation of the errors of each block being integrated
+    out (Jeffreys prior). The constant terms are not included.
+
+    :param matched:     List of (observations, simulations) arrays (see residual_blocks())
+    :param likelihood:  gaussian or heteroscedastic
+    """
+    total = 0.0
+    for observed, simulated in matched:
+        valid = np.isfinite(observed) & np.isfinite(simulated)
+        if not valid.any():
+            continue
+        residuals = observed[valid] - simulated[valid]
+        if likelihood == "heteroscedastic":
+            residuals = residuals / (np.abs(observed[valid]) + np.mean(np.abs(observed[valid])))
+        total += -0.5 * valid.sum() * np.log(max(np.sum(residuals ** 2), 1e-300))
+    return float(total)
+
+
+def gelman_rubin(chains):
+    """
+    Gelman-Rubin statistic of each parameter, on the second half of the chains.
+
+    :param chains:  Array (generations x chains x d)
+    :return: array (d), nan with less than 4 generations or one chain
+    """
+    chains = np.asarray(chains, dtype=float)
+    if chains.ndim != 3 or chains.shape[0] < 4 or chains.shape[1] < 2:
+        return np.full(chains.shape[-1], np.nan)
+    half = chains[chains.shape[0] // 2:]
+    length = half.shape[0]
+    within = half.var(axis=0, ddof=1).mean(axis=0)
+    between = length * half.mean(axis=0).var(axis=0, ddof=1)
+    pooled = (length - 1) / length * within + between / length
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(pooled / within)
+
+
+def posterior_summary(chains_path: str, names: list, burn_in: float = 0.5):
+    """
+    Mean, standard deviation and 95 % interval of each parameter after the burn-in.
+
+    :param chains_path: CSV file of the chains (see DreamZS)
+    :param burn_in:     Fraction of the generations removed
+    :return: DataFrame with one line by parameter
+    """
+    chains = pd.read_csv(chains_path)
+    chains = chains[chains["Generation"] > burn_in * chains["Generation"].max()]
+    return pd.DataFrame({"mean": chains[names].mean(), "std": chains[names].std(),
+                         "2.5%": chains[names].quantile(0.025), "97.5%": chains[names].quantile(0.975)})
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class DreamZS:
+    """
+    DREAM(ZS) with the proposals of the chains evaluated in parallel, the chains saved after each generation.
+
+    Example:
+        result = DreamZS(evaluator, chains=8, checkpoint="dream_Bromont.json").minimise(x0)
+    """
+
+    def __init__(self, evaluator, chains: int = None, likelihood: str = "gaussian", checkpoint: str = None,
+                 archive_size: int = None, thinning: int = 10, pairs: int = 1, jump_rate: float = 0.2,
+                 rhat_threshold: float = 1.2, report_every: int = 5, max_generations: int = None, seed: int = None):
+        """
+        :param evaluator:       CalibrationEvaluator, the likelihood uses the variables and levels of its objective
+        :param chains:          Number of chains, runs of each generation (default: number of processors, at least 3)
+        :param likelihood:      gaussian or heteroscedastic
+        :param checkpoint:      JSON file of the state of the sampler; the chains are saved in the CSV file of the
+                                same name (<checkpoint>_chains.csv)
+        :param archive_size:    Number of prior samples of the initial archive Z (default: 10 d)
+        :param thinning:        The states of the chains are added to Z every thinning generations
+        :param pairs:           Number of pairs of past states of a jump
+        :param jump_rate:       Probability of a jump of size 1 (jump between modes)
+        :param rhat_threshold:  Gelman-Rubin statistic below which the chains are considered converged
+        :param report_every:    The Gelman-Rubin statistics are printed every report_every generations
+        """
+        if likelihood not in likelihoods:
+            raise ValueError("Likelihood '%s' is not an option, choose between %s" % (likelihood,
+                                                                                     ", ".join(likelihoods)))
+        self.evaluator = evaluator
+        self.dimension = evaluator.space.dimension
+        self.chains = chains or max(os.cpu_count() or 1, 3)
+        self.likelihood = likelihood
+        self.checkpoint = checkpoint
+        self.chains_path = None if checkpoint is None else "%s_chains.csv" % os.path.splitext(checkpoint)[0]
+        self.archive_size = archive_size or 10 * self.dimension
+        self.thinning = thinning
+        self.pairs = pairs
+        self.jump_rate = jump_rate
+        self.rhat_threshold = rhat_threshold
+        self.report_every = report_every
+        self.max_generations = max_generations
+        self.seed = seed
+        self.blocks = list(dict.fromkeys((variable, level) for _, variable, level, _ in evaluator.objective.terms))
+        self.observations = {variable: read_observations(evaluator.executor.observation_folder, variable)
+                             for variable in variables_list if variable in [block[0] for block in self.blocks]}
+
+    def chain_log_likelihoods(self, results: list):
+        """ Log-likelihood of each run result (-inf for a failed run or a result file removed) """
+        values = []
+        for result in results:
+            if result["status"] != "done" or result["result_file"] is None or \
+                    not os.path.exists(result["result_file"]):
+                values.append(-np.inf)
+                continue
+            values.append(log_likelihood(residual_blocks(result, self.observations, self.blocks), self.likelihood))
+        return np.array(values)
+
+    def evaluate(self, points):
+        """ Run a batch of points; returns their log-likelihood and the keys of the runs """
+        results = self.evaluator.results(points)
+        return self.chain_log_likelihoods(results), [result["key"] for result in results]
+
+    def save_state(self, state: dict):
+        """ Write the checkpoint (written in a temporary file first, so that a crash does not corrupt it) """
+        if self.checkpoint is None:
+            return
+        serialised = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in state.items()}
+        temporary = "%s.%s.temp" % (self.checkpoint, os.getpid())
+        with open(temporary, "w") as f:
+            json.dump(serialised, f, default=float)
+        os.replace(temporary, self.checkpoint)
+
+    def load_state(self):
+        """
+        State saved in the checkpoint with the chains of the CSV file, or None. The generations of the CSV file
+        written after the checkpoint (crash between both) are removed.
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state["names"] != self.evaluator.space.names or state["likelihood"] != self.likelihood or \
+                state["blocks"] != [list(block) for block in self.blocks] or state["chains"] != self.chains:
+            print("Checkpoint %s is for other parameters, likelihood or chains, not used" % self.checkpoint)
+            return None
+        for name in ["archive", "current", "current_log_likelihood"]:
+            state[name] = np.array(state[name], dtype=float)
+        table = pd.read_csv(self.chains_path)
+        table = table[table["Generation"] <= state["generation"]]
+        table.to_csv(self.chains_path, index=False)
+        units = self.evaluator.space.to_unit(table[self.evaluator.space.names].values)
+        state["history"] = units.reshape(-1, self.chains, self.dimension)
+        return state
+
+    def append_chains(self, generation: int, points, values, keys: list, accepted):
+        """ Append the states of the chains of a generation to the CSV file (written to disk before continuing) """
+        if self.chains_path is None:
+            return
+        table = pd.DataFrame(self.evaluator.space.from_unit(points), columns=self.evaluator.space.names)
+        table.insert(0, "Run_key", keys)
+        table.insert(0, "Log_likelihood", values)
+        table.insert(0, "Accepted", np.asarray(accepted, dtype=int))
+        table.insert(0, "Chain", np.arange(len(points)))
+        table.insert(0, "Generation", generation)
+        exists = os.path.exists(self.chains_path)
+        with open(self.chains_path, "a", newline="") as f:
+            table.to_csv(f, header=not exists, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def propose(self, state: dict, random):
+        """ Jumps of all chains from differences of states of the archive, reflected into the unit cube """
+        current, archive = state["current"], state["archive"]
+        proposals = current.copy()
+        for chain in range(self.chains):
+            crossover = crossover_values[random.integers(len(crossover_values))]
+            updated = random.random(self.dimension) < crossover
+            if not updated.any():
+                updated[random.integers(self.dimension)] = True
+            selected = random.choice(len(archive), 2 * self.pairs, replace=False)
+            difference = archive[selected[:self.pairs]].sum(axis=0) - archive[selected[self.pairs:]].sum(axis=0)
+            gamma = 1.0 if random.random() < self.jump_rate else 2.38 / np.sqrt(2 * self.pairs * updated.sum())
+            jump = (1 + random.uniform(-0.05, 0.05, self.dimension)) * gamma * difference + \
+                random.normal(0, 1e-6, self.dimension)
+            proposals[chain, updated] += jump[updated]
+        # reflection on the bounds of the unit cube
+        proposals = np.abs(proposals) % 2
+        return np.where(proposals > 1, 2 - proposals, proposals)
+
+    def minimise(self, x0):
+        """
+        Sample the posterior distribution (the name of the method is the same as the optimisers, see
+        script_final_calibration.py). The first chain starts from x0, the others from points of a latin hypercube.
+
+        :return: best run (see calibration_local.calibration_result()) with the path of the chains and the last
+                 Gelman-Rubin statistics
+        """
+        state = self.load_state()
+        if state is None:
+            random = np.random.default_rng(self.seed)
+            archive = latin_hypercube(self.archive_size, self.dimension, random)
+            current = np.vstack([np.array(x0, dtype=float)[None, :],
+                                 latin_hypercube(self.chains - 1, self.dimension, random)])
+            values, keys = self.evaluate(current)
+            state = {"names": self.evaluator.space.names, "likelihood": self.likelihood,
+                     "blocks": [list(block) for block in self.blocks], "chains": self.chains, "generation": 1,
+                     "archive": archive, "current": current, "current_log_likelihood": values, "keys": keys,
+                     "converged_generation": None, "history": current[None, :, :]}
+            if self.chains_path is not None and os.path.exists(self.chains_path):
+                os.remove(self.chains_path)
+            self.append_chains(1, current, values, keys, np.ones(self.chains))
+            state["random_state"] = random.bit_generator.state
+            self.save_state({name: value for name, value in state.items() if name != "history"})
+        else:
+            print("Continue DREAM(ZS) from generation %s (checkpoint %s)" % (state["generation"], self.checkpoint))
+        random = np.random.default_rng()
+        random.bit_generator.state = state["random_state"]
+        history = list(state.pop("history"))
+        rhat = gelman_rubin(history)
+
+        while self.max_generations is None or state["generation"] < self.max_generations:
+            remaining = self.evaluator.remaining()
+            if remaining is not None and remaining < self.chains:
+                break
+            proposals = self.propose(state, random)
+            values, keys = self.evaluate(proposals)
+            with np.errstate(invalid="ignore"):
+                accepted = np.log(random.random(self.chains)) < values - state["current_log_likelihood"]
+            state["current"][accepted] = proposals[accepted]
+            state["current_log_likelihood"][accepted] = values[accepted]
+            state["generation"] += 1
+            history.append(state["current"].copy())
+            if state["generation"] % self.thinning == 0:
+                state["archive"] = np.vstack([state["archive"], state["current"]])
+            # the chains keep the key of the run of their current state
+            for chain in np.flatnonzero(accepted):
+                state["keys"][chain] = keys[chain]
+            self.append_chains(state["generation"], state["current"], state["current_log_likelihood"], state["keys"],
+                               accepted)
+            rhat = gelman_rubin(history)
+            if state["converged_generation"] is None and np.all(rhat < self.rhat_threshold):
+                state["converged_generation"] = state["generation"]
+                print("DREAM(ZS) converged at generation %s (Gelman-Rubin < %s)" % (state["generation"],
+                                                                                   self.rhat_threshold))
+            state["random_state"] = random.bit_generator.state
+            self.save_state(state)
+            if state["generation"] % self.report_every == 0:
+                print("DREAM(ZS) generation %s: acceptance %.2f, best log-likelihood %.2f, Gelman-Rubin %s" % (
+                    state["generation"], accepted.mean(), state["current_log_likelihood"].max(),
+                    ", ".join("%s %.3f" % (name, value) for name, value in zip(self.evaluator.space.names, rhat))))
+
+        result = calibration_result(self.evaluator, "dream") if self.evaluator.history else \
+            {"method": "dream", "evaluations": 0, "history": self.evaluator.log_path, "run_key": None}
+        best = int(np.argmax(state["current_log_likelihood"]))
+        result.update({"chains": self.chains_path, "converged_generation": state["converged_generation"],
+                       "gelman_rubin": dict(zip(self.evaluator.space.names, rhat.tolist()))})
+        if "parameters" not in result:
+            result.update({"parameters": self.evaluator.space.parameters(state["current"][best]),
+                           "objective": np.nan, "unit": state["current"][best]})
+        return result
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Multi-fidelity evaluations of the automatic calibration
+
+MyLake at a coarse depth resolution (dz = 1 or 2 m instead of 0.5 m) is several times cheaper and is usually good
+enough to rank the parameter sets. Each batch of points of an optimiser is first run at the coarse resolution; the
+terms of the objective of the coarse runs are corrected by a linear regression (fine = a + b coarse, by term) learnt
+on the points run at both resolutions, and only the best points according to the corrected objective are promoted to
+the full resolution. The other points are given their corrected objective.
+
+The correction is learnt again after each batch, all points being promoted until min_pairs points have been run at
+both resolutions. The runs of both resolutions are kept in the cache of RunExecutor (dz is an option of the runs).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import numpy as np
+
+from calibration_objective import CalibrationEvaluator, Objective, ParameterSpace, failure_value
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+fine_dz = 0.5
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def fidelity_correction(coarse, fine):
+    """
+    Linear correction of each term of the objective from the coarse to the fine resolution.
+
+    :param coarse:  Terms of the objective of the points at the coarse resolution (n x terms)
+    :param fine:    Terms of the same points at the fine resolution (n x terms)
+    :return: intercept, slope and standard deviation of the residuals of each term (identity for the terms with less
+             than 3 pairs)
+    """
+    coarse, fine = np.atleast_2d(coarse), np.atleast_2d(fine)
+    terms = coarse.shape[1]
+    intercept, slope, residual = np.zeros(terms), np.ones(terms), np.zeros(terms)
+    for term in range(terms):
+        valid = np.isfinite(coarse[:, term]) & np.isfinite(fine[:, term])
+        if valid.sum() < 3:
+            continue
+        design = np.column_stack([np.ones(valid.sum()), coarse[valid, term]])
+        (intercept[term], slope[term]), *_ = np.linalg.lstsq(design, fine[valid, term], rcond=None)
+        residuals = fine[valid, term] - design @ [intercept[term], slope[term]]
+        residual[term] = np.sqrt(np.sum(residuals ** 2) / max(valid.sum() - 2, 1))
+    return intercept, slope, residual
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class MultiFidelityEvaluator(CalibrationEvaluator):
+    """
+    CalibrationEvaluator running the points at a coarse depth resolution and promoting the best ones to the full
+    resolution. The history (and the maximum number of evaluations) only counts the runs at the full resolution. The
+    algorithms using the outputs of the runs (DREAM(ZS), NSGA-II) call results() and always run the full resolution.
+    """
+
+    def __init__(self, executor, space: ParameterSpace, objective: Objective, method: str = "calibration",
+                 max_evaluations: int = None, save: bool = True, coarse_dz: float = 2.0, promote: float = 0.25,
+                 min_pairs: int = None, **options):
+        """
+        :param coarse_dz:   Depth resolution of the cheap runs (m)
+        :param promote:     Fraction of the points of a batch promoted to the full resolution (at least one)
+        :param min_pairs:   Number of points run at both resolutions before the promotion is selective
+                            (default: d + 2)
+        """
+        super().__init__(executor, space, objective, method, max_evaluations, save, **options)
+        self.coarse_dz = coarse_dz
+        self.promote = promote
+        self.min_pairs = min_pairs or space.dimension + 2
+        self.weights = np.array([term[3] for term in objective.terms])
+        self.pairs_coarse = np.empty((0, len(objective.terms)))
+        self.pairs_fine = np.empty((0, len(objective.terms)))
+        self.coarse_evaluations = 0
+
+    def coarse_terms(self, points):
+        """ Terms of the objective of points run at the coarse resolution (nan for the failed runs) """
+        options = dict(self.options, dz=self.coarse_dz)
+        results = self.executor.run_batch([self.space.parameters(point) for point in points], **options)
+        self.coarse_evaluations += len(points)
+        terms = np.full((len(points), len(self.objective.terms)), np.nan)
+        for index, result in enumerate(results):
+            if result["status"] == "done" and result["metrics"] is not None:
+                terms[index] = self.objective.terms_values(result["metrics"])
+        return terms
+
+    def corrected_objective(self, terms):
+        """ Objective predicted at the full resolution from the terms at the coarse resolution """
+        intercept, slope, _ = fidelity_correction(self.pairs_coarse, self.pairs_fine)
+        values = (intercept + slope * terms) @ self.weights
+        return np.where(np.isfinite(values), values, failure_value)
+
+    def evaluate(self, points):
+        points = np.atleast_2d(np.clip(np.asarray(points, dtype=float), 0, 1))
+        number = max(1, int(np.ceil(self.promote * len(points))))
+        if len(self.pairs_fine) >= self.min_pairs and number >= len(points):
+            # all points would be promoted (ex: one point), the coarse runs are useless
+            return super().evaluate(points)
+        terms = self.coarse_terms(points)
+        predicted = self.corrected_objective(terms)
+        promoted = np.ones(len(points), dtype=bool)
+        if len(self.pairs_fine) >= self.min_pairs:
+            promoted[:] = False
+            promoted[np.argsort(predicted)[:number]] = True
+
+        values = predicted.copy()
+        results = self.results(points[promoted])
+        values[promoted] = [self.objective(result) for result in results]
+        for coarse, result in zip(terms[promoted], results):
+            if result["status"] == "done" and result["metrics"] is not None:
+                self.pairs_coarse = np.vstack([self.pairs_coarse, coarse])
+                self.pairs_fine = np.vstack([self.pairs_fine, self.objective.terms_values(result["metrics"])])
+        print("Multi-fidelity: %s of %s points promoted to dz = %s m (%s runs at dz = %s m, %s pairs)" % (
+            promoted.sum(), len(points), self.options.get("dz", fine_dz), self.coarse_evaluations, self.coarse_dz,
+            len(self.pairs_fine)))
+        return values
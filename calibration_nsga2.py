@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" NSGA-II multi-objective calibration
+
+Non-dominated sorting genetic algorithm (Deb et al., A fast and elitist multiobjective genetic algorithm: NSGA-II,
+2002) in the unit cube of a ParameterSpace: each term of the objective (ex: nrmse:T:surface, RMSE:O2:all) is a
+separate objective instead of being added to the others, so the calibration gives the trade-off between the variables
+and the depth levels (Pareto front) instead of one best run. The offspring of each generation are evaluated in one
+batch by the CalibrationEvaluator (in parallel).
+
+The non-dominated runs found are kept in a Pareto archive (CSV file) updated after each generation; a calibration
+called again with the same parameters and objectives starts from the runs of the archive still valid for the current
+input files and observations (see NSGA2.load_archive()). The archive can be queried
+and plotted with script_pareto.py. The initial population can also include the best fronts of the runs already done
+(warm start, see calibration_warm_start.py).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import json
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from calibration_local import calibration_result
+from calibration_objective import failure_value, latin_hypercube, same_fixed_parameters
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Columns of the Pareto archive besides the parameters and the objectives
+archive_columns = ["Run_key", "Generation"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def objective_labels(objective):
+    """ Name of each objective of the calibration (metric:variable:level of each term) """
+    return ["%s:%s:%s" % (metric, variable, level) for metric, variable, level, _ in objective.terms]
+
+
+def objective_vectors(objective, results: list):
+    """ Value of each term of the objective (before weighting) for the run results, failure_value if not available """
+    vectors = []
+    for result in results:
+        if result is None or result["status"] != "done" or result["metrics"] is None:
+            vectors.append(np.full(len(objective.terms), failure_value))
+            continue
+        values = objective.terms_values(result["metrics"])
+        vectors.append(np.where(np.isfinite(values), values, failure_value))
+    return np.array(vectors, dtype=float).reshape(-1, len(objective.terms))
+
+
+def dominance(values):
+    """ Matrix (n x n) of the dominance relation: element (i, j) is True if i dominates j """
+    values = np.asarray(values, dtype=float)
+    return np.all(values[:, None, :] <= values[None, :, :], axis=-1) & \
+        np.any(values[:, None, :] < values[None, :, :], axis=-1)
+
+
+def non_dominated_sort(values):
+    """ Rank of the front of each point (0 for the non-dominated points) """
+    dominates = dominance(values)
+    rank = np.zeros(len(values), dtype=int)
+    remaining = np.ones(len(values), dtype=bool)
+    front = 0
+    while remaining.any():
+        indices = np.flatnonzero(remaining)
+        dominated = dominates[np.ix_(indices, indices)].any(axis=0)
+        rank[indices[~dominated]] = front
+        remaining[indices[~dominated]] = False
+        front += 1
+    return rank
+
+
+def crowding_distance(values, rank):
+    """ Crowding distance of each point in its front (infinite for the extreme points) """
+    values = np.asarray(values, dtype=float)
+    distance = np.zeros(len(values))
+    for front in np.unique(rank):
+        members = np.flatnonzero(rank == front)
+        if len(members) <= 2:
+            distance[members] = np.inf
+            continue
+        for objective in range(values.shape[1]):
+            order = members[np.argsort(values[members, objective])]
+            spread = values[order[-1], objective] - values[order[0], objective]
+            distance[order[[0, -1]]] = np.inf
+            if spread > 0:
+                distance[order[1:-1]] += (values[order[2:], objective] - values[order[:-2], objective]) / spread
+    return distance
+
+
+def read_pareto_archive(path: str):
+    """ Pareto archive saved by NSGA2 (DataFrame), None if it does not exist """
+    if path is None or not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
+
+
+def query_pareto(archive: pd.DataFrame, conditions: str):
+    """
+    Runs of the Pareto archive meeting conditions on the objectives.
+
+    :param conditions:  Conditions "objective<value" or "objective>value" separated by commas
+                        (ex: "nrmse:T:surface<0.2,nrmse:O2:deepwater<0.4")
+    """
+    selected = np.ones(len(archive), dtype=bool)
+    for condition in conditions.split(","):
+        condition = condition.strip()
+        operator = "<" if "<" in condition else ">"
+        label, value = condition.split(operator)
+        if label not in archive.columns:
+            raise ValueError("Objective '%s' is not in the archive" % label)
+        column = archive[label].values
+        selected &= column < float(value) if operator == "<" else column > float(value)
+    return archive[selected]
+
+
+def figure_pareto(archive: pd.DataFrame, labels: list, outpath: str, title: str = ""):
+    """
+    Figure of the Pareto archive: one subplot by pair of objectives, the runs coloured by their generation.
+    """
+    if len(labels) < 2:
+        raise ValueError("The figure of a Pareto archive needs at least two objectives, not %s" % len(labels))
+    pairs = [(first, second) for position, first in enumerate(labels) for second in labels[position + 1:]]
+    columns = min(len(pairs), 3)
+    rows = int(np.ceil(len(pairs) / columns))
+    fig, axes = plt.subplots(rows, columns, figsize=(4.5 * columns, 4 * rows), squeeze=False)
+    for axis, (first, second) in zip(axes.ravel(), pairs):
+        points = axis.scatter(archive[first], archive[second], c=archive["Generation"], cmap="viridis", s=15)
+        axis.set_xlabel(first)
+        axis.set_ylabel(second)
+    for axis in axes.ravel()[len(pairs):]:
+        axis.set_visible(False)
+    fig.subplots_adjust(wspace=0.4, hspace=0.3)
+    fig.colorbar(points, ax=axes.ravel().tolist(), label="Generation")
+    fig.suptitle(title)
+    fig.savefig(outpath)
+    plt.close(fig)
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class NSGA2:
+    """
+    NSGA-II with the offspring of each generation evaluated in parallel and a Pareto archive saved after each
+    generation.
+
+    Example:
+        result = NSGA2(evaluator, population_size=16, archive="pareto_Bromont.csv").minimise(x0)
+    """
+
+    def __init__(self, evaluator, population_size: int = None, archive: str = None, crossover_eta: float = 15.0,
+                 mutation_eta: float = 20.0, crossover_probability: float = 0.9, max_generations: int = None,
+                 seed: int = None, warm_start: dict = None):
+        """
+        :param evaluator:       CalibrationEvaluator, each term of its objective being an objective of the algorithm
+        :param population_size: Number of runs of each generation (default: number of processors, at least 2d and 8)
+        :param archive:         CSV file of the Pareto archive, read at the start if it exists
+        :param crossover_eta:   Distribution index of the simulated binary crossover
+        :param mutation_eta:    Distribution index of the polynomial mutation
+        :param warm_start:      Points known (see calibration_warm_start.warm_start_data()), the best fronts of their
+                                terms of the objective completing the initial population after the Pareto archive
+        """
+        if len(evaluator.objective.terms) < 2:
+            raise ValueError("NSGA-II needs at least two terms in the objective (one objective by term), use another "
+                             "method for a single objective")
+        self.evaluator = evaluator
+        self.dimension = evaluator.space.dimension
+        size = population_size or max(os.cpu_count() or 1, 2 * self.dimension, 8)
+        self.population_size = size + size % 2
+        self.archive_path = archive
+        self.crossover_eta = crossover_eta
+        self.mutation_eta = mutation_eta
+        self.crossover_probability = crossover_probability
+        self.max_generations = max_generations
+        self.random = np.random.default_rng(seed)
+        self.labels = objective_labels(evaluator.objective)
+        self.warm_start = warm_start
+        self.archive = {"unit": np.empty((0, self.dimension)), "values": np.empty((0, len(self.labels))),
+                        "keys": [], "generations": []}
+
+    def evaluate(self, points):
+        """ Run a batch of points; returns their objective vectors and the keys of the runs """
+        results = self.evaluator.results(points)
+        return objective_vectors(self.evaluator.objective, results), [result["key"] for result in results]
+
+    def load_archive(self):
+        """
+        Read the saved Pareto archive, if it is for the same parameters and objectives. Only the runs still valid are
+        kept: runs in the run archive of RunExecutor with the current input files, options and fixed parameters (same
+        run key), whose objectives are calculated again from their performances (recalculated if the observations
+        have changed, see RunExecutor.cached_result()).
+
+        :return: points of the archive (unit cube)
+        """
+        table = read_pareto_archive(self.archive_path)
+        if table is None:
+            return np.empty((0, self.dimension))
+        if set(table.columns) != set(archive_columns + self.evaluator.space.names + self.labels):
+            print("Pareto archive %s is for other parameters or objectives, not used" % self.archive_path)
+            return np.empty((0, self.dimension))
+        executor, space = self.evaluator.executor, self.evaluator.space
+        results, generations = [], []
+        for key, generation in zip(table["Run_key"], table["Generation"]):
+            path = os.path.join(executor.runs_folder, str(key), "metrics.json")
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                parameters = json.load(f)["parameters"]
+            specification = executor.specification(parameters, **self.evaluator.options)
+            result = executor.cached_result(specification) if specification["key"] == key else None
+            if result is not None and same_fixed_parameters(result["parameters"], space):
+                results.append(result)
+                generations.append(generation)
+        if len(results) < len(table):
+            print("%s runs of the Pareto archive %s no longer valid for the input files, options or fixed parameters"
+                  % (len(table) - len(results), self.archive_path))
+        print("%s runs of the Pareto archive %s used in the initial population" % (len(results), self.archive_path))
+        self.archive = {"unit": np.array([space.unit_of(result["parameters"]) for result in results],
+                                         dtype=float).reshape(-1, self.dimension),
+                        "values": objective_vectors(self.evaluator.objective, results),
+                        "keys": [result["key"] for result in results], "generations": generations}
+        # the values recalculated can make runs of the archive dominated
+        self.update_archive(np.empty((0, self.dimension)), np.empty((0, len(self.labels))), [], 0)
+        return self.archive["unit"]
+
+    def warm_population(self, number: int):
+        """
+        Points known not in the Pareto archive, by front of their terms of the objective then by crowding distance.
+
+        :return: at most number points (unit cube)
+        """
+        if self.warm_start is None or number <= 0:
+            return np.empty((0, self.dimension))
+        known = set(self.archive["keys"])
+        new = np.array([key not in known for key in self.warm_start["keys"]], dtype=bool)
+        # the dominance matrix grows as the square of the number of points: the best 1000 by weighted objective
+        new[np.cumsum(new) > 1000] = False
+        if not new.any():
+            return np.empty((0, self.dimension))
+        values = self.warm_start["terms"][new]
+        values = np.where(np.isfinite(values), values, failure_value)
+        rank = non_dominated_sort(values)
+        order = np.lexsort((-crowding_distance(values, rank), rank))[:number]
+        print("%s runs known used in the initial population (fronts 0 to %s)" % (len(order), rank[order].max()))
+        return self.warm_start["unit"][new][order]
+
+    def update_archive(self, points, values, keys: list, generation: int):
+        """
+        Keep the non-dominated runs of the archive and of a generation, and save the archive. The runs of the archive
+        evaluated again in the generation take their new values.
+        """
+        positions = {key: position for position, key in enumerate(self.archive["keys"])}
+        archive_values = self.archive["values"].copy()
+        new = []
+        for index, key in enumerate(keys):
+            if key in positions:
+                archive_values[positions[key]] = values[index]
+            elif key not in keys[:index]:
+                new.append(index)
+        unit = np.vstack([self.archive["unit"], points[new]])
+        all_values = np.vstack([archive_values, values[new]])
+        all_keys = self.archive["keys"] + [keys[index] for index in new]
+        generations = self.archive["generations"] + [generation] * len(new)
+        kept = np.flatnonzero((non_dominated_sort(all_values) == 0) & np.all(all_values < failure_value, axis=1))
+        self.archive = {"unit": unit[kept], "values": all_values[kept], "keys": [all_keys[index] for index in kept],
+                        "generations": [generations[index] for index in kept]}
+        if self.archive_path is None:
+            return
+        table = pd.DataFrame(self.evaluator.space.from_unit(self.archive["unit"]).reshape(-1, self.dimension),
+                             columns=self.evaluator.space.names)
+        for position, label in enumerate(self.labels):
+            table[label] = self.archive["values"][:, position]
+        table.insert(0, "Generation", self.archive["generations"])
+        table.insert(0, "Run_key", self.archive["keys"])
+        temporary = "%s.%s.temp" % (self.archive_path, os.getpid())
+        table.to_csv(temporary, index=False)
+        os.replace(temporary, self.archive_path)
+
+    def select_parents(self, rank, distance):
+        """ Binary tournament on the rank, then on the crowding distance """
+        first = self.random.integers(len(rank), size=self.population_size)
+        second = self.random.integers(len(rank), size=self.population_size)
+        better = (rank[first] < rank[second]) | ((rank[first] == rank[second]) & (distance[first] >= distance[second]))
+        return np.where(better, first, second)
+
+    def offspring(self, population, rank, distance):
+        """ Simulated binary crossover and polynomial mutation of the selected parents """
+        parents = population[self.select_parents(rank, distance)]
+        first, second = parents[0::2], parents[1::2]
+        u = self.random.random(first.shape)
+        beta = np.where(u <= 0.5, (2 * u) ** (1 / (self.crossover_eta + 1)),
+                        (1 / (2 * (1 - u))) ** (1 / (self.crossover_eta + 1)))
+        crossed = (self.random.random(first.shape) < 0.5) & \
+            (self.random.random((len(first), 1)) < self.crossover_probability)
+        beta = np.where(crossed, beta, 1.0)
+        children = np.vstack([0.5 * ((1 + beta) * first + (1 - beta) * second),
+                              0.5 * ((1 - beta) * first + (1 + beta) * second)])
+
+        mutated = self.random.random(children.shape) < 1 / self.dimension
+        u = self.random.random(children.shape)
+        delta = np.where(u < 0.5, (2 * u) ** (1 / (self.mutation_eta + 1)) - 1,
+                         1 - (2 * (1 - u)) ** (1 / (self.mutation_eta + 1)))
+        return np.clip(children + mutated * delta, 0, 1)
+
+    def minimise(self, x0):
+        """
+        :param x0:  Point of the initial population (unit cube), with the runs of the Pareto archive, the best runs
+                    known (warm start) and points of a latin hypercube
+        :return: run of the best weighted objective (see calibration_local.calibration_result()) with the path of the
+                 Pareto archive and the number of runs of the front
+        """
+        archived = self.load_archive()
+        population = np.vstack([np.array(x0, dtype=float)[None, :],
+                                archived[self.random.permutation(len(archived))]])[:self.population_size]
+        population = np.vstack([population, self.warm_population(self.population_size - len(population))])
+        if len(population) < self.population_size:
+            population = np.vstack([population, latin_hypercube(self.population_size - len(population),
+                                                                self.dimension, self.random)])
+        values, keys = self.evaluate(population)
+        # the generations continue those of the archive
+        generation = int(max(self.archive["generations"], default=0)) + 1
+        self.update_archive(population, values, keys, generation)
+
+        first_generation = generation
+        while self.max_generations is None or generation - first_generation + 1 < self.max_generations:
+            remaining = self.evaluator.remaining()
+            if remaining is not None and remaining < self.population_size:
+                break
+            rank = non_dominated_sort(values)
+            children = self.offspring(population, rank, crowding_distance(values, rank))
+            children_values, children_keys = self.evaluate(children)
+            generation += 1
+            self.update_archive(children, children_values, children_keys, generation)
+
+            combined, combined_values = np.vstack([population, children]), np.vstack([values, children_values])
+            rank = non_dominated_sort(combined_values)
+            distance = crowding_distance(combined_values, rank)
+            selected = np.lexsort((-distance, rank))[:self.population_size]
+            population, values = combined[selected], combined_values[selected]
+            print("NSGA-II generation %s: %s runs in the Pareto archive, best %s" % (
+                generation, len(self.archive["keys"]), ", ".join(
+                    "%s %.4f" % (label, value) for label, value in zip(self.labels, self.archive["values"].min(
+                        axis=0) if len(self.archive["keys"]) else values.min(axis=0)))))
+
+        result = calibration_result(self.evaluator, "nsga2")
+        result.update({"pareto": self.archive_path, "front_size": len(self.archive["keys"])})
+        return result
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Objective of the automatic calibration
+
+Classes and functions shared by the calibration algorithms (see script_final_calibration.py):
+    - ParameterSpace: the calibrated parameters and their transformation between their value and the unit cube
+      [0, 1]^d (logarithmic or linear, from the bounds and the scale of run_executor.parameters_registry);
+    - Objective: weighted sum of the performances of Lake.stats_lake (RMSE, NSE, RSR, Pbias, R2, SOS, nrmse) for the
+      variables and the depth levels chosen;
+    - CalibrationEvaluator: evaluation of batches of points with RunExecutor (in parallel), with the history of all
+      evaluations saved in Postproc_code/<lake>/final_calibration_<lake>_<method>_<date>.csv;
+    - calibrated_parameters: names of the calibrated parameters, by name or by group of the registry;
+    - latin_hypercube: latin hypercube sample of the unit cube (initial points of the algorithms and designs).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from run_executor import complete_parameters, parameters_registry, performance_indices_names, variables_list
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+levels_list = ["surface", "deepwater"]
+
+# Conversion of each performance into a value to minimise
+metric_losses = {"RMSE": lambda value: value, "RSR": lambda value: value, "SOS": lambda value: value,
+                 "nrmse": lambda value: value, "NSE": lambda value: 1 - value, "R2": lambda value: 1 - value,
+                 "Pbias": lambda value: abs(value) / 100}
+
+# Default objective: normalised RMSE of the temperature and the oxygen at the surface and deepwater levels
+default_objective = "nrmse:T:surface:1,nrmse:T:deepwater:1,nrmse:O2:surface:1,nrmse:O2:deepwater:1"
+
+# Value of the objective for a failed run or a performance that can not be calculated
+failure_value = 1e3
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def calibrated_parameters(names: str = None, groups: str = None):
+    """
+    Names of the calibrated parameters, given by name ("kz_N0,swa_b0") or by group of the registry ("T,O2").
+    """
+    if names:
+        return [name.strip() for name in names.split(",")]
+    groups = [group.strip() for group in (groups or "T").split(",")]
+    return [name for name, description in parameters_registry.items() if description["group"] in groups]
+
+
+def latin_hypercube(number: int, dimension: int, random):
+    """ Latin hypercube sample of the unit cube (number x dimension) """
+    strata = np.array([random.permutation(number) for _ in range(dimension)]).T
+    return (strata + random.random((number, dimension))) / number
+
+
+def metric_value(metrics: dict, metric: str, variable: str, level: str):
+    """
+    Get a performance from the metrics of a run (see run_executor.score_results()).
+
+    :param metric:      RMSE, NSE, RSR, Pbias, R2, SOS or nrmse
+    :param variable:    T, O2 or Chl
+    :param level:       surface, deepwater or all (all depths, only for RMSE and R2)
+    """
+    position = variables_list.index(variable)
+    if level == "all":
+        if metric not in ["RMSE", "R2"]:
+            raise ValueError("Only RMSE and R2 are calculated for all depths, not %s" % metric)
+        value = metrics["%s_all" % metric][position]
+        # R2_all of the report is the correlation coefficient
+        return value ** 2 if metric == "R2" and value is not None else value
+    return metrics[metric][position][levels_list.index(level)]
+
+
+def same_fixed_parameters(parameters: dict, space: "ParameterSpace"):
+    """ True if the parameters not calibrated have the values of the space """
+    for name, value in space.fixed.items():
+        if name in space.names:
+            continue
+        if isinstance(value, str) or isinstance(parameters.get(name), str):
+            if str(parameters.get(name)) != str(value):
+                return False
+        elif not np.isclose(float(parameters.get(name, np.nan)), value, rtol=1e-9, atol=0):
+            return False
+    return True
+
+
+def inside_bounds(parameters: dict, space: "ParameterSpace"):
+    """ True if the calibrated parameters are numbers inside the bounds of the space (a point outside is clipped) """
+    try:
+        unit = space.to_unit([float(parameters[name]) for name in space.names])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return bool(np.all(np.isfinite(unit)) and np.all(unit >= -1e-9) and np.all(unit <= 1 + 1e-9))
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ParameterSpace:
+    """
+    Calibrated parameters, with the transformation of their values into the unit cube (the optimisers work in the
+    unit cube). The other parameters keep the value given in fixed.
+    """
+
+    def __init__(self, names: list, fixed: dict = None, bounds: dict = None):
+        """
+        :param names:   Names of the calibrated parameters (from run_executor.parameters_registry)
+        :param fixed:   Value of the other parameters (default value of the registry if not given)
+        :param bounds:  Bounds replacing those of the registry, by parameter name
+        """
+        unknown = [name for name in names if name not in parameters_registry]
+        if unknown:
+            raise ValueError("Unknown parameters: %s" % ", ".join(unknown))
+        self.names = list(names)
+        self.fixed = complete_parameters(fixed or {})
+        bounds = bounds or {}
+        self.bounds = np.array([bounds.get(name, parameters_registry[name]["bounds"]) for name in self.names],
+                               dtype=float)
+        # logarithmic scale only for positive bounds
+        self.log_scale = np.array([parameters_registry[name]["scale"] == "log" and lower > 0
+                                   for name, (lower, _) in zip(self.names, self.bounds)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.lower = np.where(self.log_scale, np.log10(self.bounds[:, 0]), self.bounds[:, 0])
+            self.upper = np.where(self.log_scale, np.log10(self.bounds[:, 1]), self.bounds[:, 1])
+
+    @property
+    def dimension(self):
+        return len(self.names)
+
+    def from_unit(self, unit):
+        """ Values of the parameters (array (..., d)) of points of the unit cube """
+        unit = np.clip(np.asarray(unit, dtype=float), 0, 1)
+        transformed = self.lower + unit * (self.upper - self.lower)
+        return np.where(self.log_scale, 10 ** transformed, transformed)
+
+    def to_unit(self, values):
+        """ Points of the unit cube (array (..., d)) of values of the parameters """
+        values = np.asarray(values, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            transformed = np.where(self.log_scale, np.log10(values), values)
+        return (transformed - self.lower) / (self.upper - self.lower)
+
+    def parameters(self, unit):
+        """ All parameters of a run (dictionary) for a point of the unit cube """
+        parameters = dict(self.fixed)
+        parameters.update({name: float(value) for name, value in zip(self.names, self.from_unit(unit))})
+        return parameters
+
+    def unit_of(self, parameters: dict):
+        """
+        Point of the unit cube of a set of parameters. The values that are not numbers (ex: c_shelter "NaN") are
+        replaced by the middle of the bounds.
+        """
+        values = []
+        for name in self.names:
+            try:
+                values.append(float(parameters.get(name, self.fixed[name])))
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        unit = self.to_unit(values)
+        return np.clip(np.where(np.isfinite(unit), unit, 0.5), 0, 1)
+
+
+class Objective:
+    """
+    Weighted sum of performances of the run, each converted into a value to minimise (see metric_losses).
+
+    Example:
+        objective = Objective.from_text("nrmse:T:surface:1,NSE:O2:deepwater:2")
+        value = objective(result)
+    """
+
+    def __init__(self, terms: list):
+        """
+        :param terms:   List of (metric, variable, level, weight), level being surface, deepwater or all
+        """
+        for metric, variable, level, _ in terms:
+            if metric not in metric_losses or variable not in variables_list or level not in levels_list + ["all"]:
+                raise ValueError("Term %s:%s:%s is not an option (metrics: %s, variables: %s, levels: %s)" % (
+                    metric, variable, level, ", ".join(performance_indices_names), ", ".join(variables_list),
+                    ", ".join(levels_list + ["all"])))
+        self.terms = [(metric, variable, level, float(weight)) for metric, variable, level, weight in terms]
+
+    @classmethod
+    def from_text(cls, text: str = default_objective):
+        """ Objective given as "metric:variable:level:weight" separated by commas (the weight is optional) """
+        terms = []
+        for term in text.split(","):
+            fields = term.strip().split(":")
+            terms.append(tuple(fields[:3]) + (float(fields[3]) if len(fields) > 3 else 1.0,))
+        return cls(terms)
+
+    def __str__(self):
+        return ",".join("%s:%s:%s:%g" % term for term in self.terms)
+
+    def terms_values(self, metrics: dict):
+        """ Value (to minimise, before weighting) of each term, nan if it can not be calculated """
+        values = []
+        for metric, variable, level, _ in self.terms:
+            value = metric_value(metrics, metric, variable, level)
+            values.append(np.nan if value is None else metric_losses[metric](float(value)))
+        return np.array(values, dtype=float)
+
+    def __call__(self, result: dict):
+        """ Value of the objective for a run result (see run_executor.execute_run()) """
+        if result is None or result["status"] != "done" or result["metrics"] is None:
+            return failure_value
+        values = self.terms_values(result["metrics"])
+        if not np.all(np.isfinite(values)):
+            return failure_value
+        return float(np.dot([term[3] for term in self.terms], values))
+
+
+class CalibrationEvaluator:
+    """
+    Evaluation of the objective for batches of points of the unit cube, the runs of a batch being executed in
+    parallel by RunExecutor. All evaluations are kept (history) and saved after each batch.
+    """
+
+    def __init__(self, executor, space: ParameterSpace, objective: Objective, method: str = "calibration",
+                 max_evaluations: int = None, save: bool = True, **options):
+        """
+        :param executor:        RunExecutor of the lake
+        :param method:          Name of the algorithm, used in the name of the history file
+        :param max_evaluations: Maximum number of evaluations (None: no limit)
+        :param options:         Options of the runs replacing those of the executor (ex: enable_sediment=1)
+        """
+        self.executor = executor
+        self.space = space
+        self.objective = objective
+        self.method = method
+        self.max_evaluations = max_evaluations
+        self.options = options
+        self.history = []
+        self.batches = 0
+        self.log_path = None
+        if save:
+            self.log_path = os.path.join(executor.output_folder, "final_calibration_%s_%s_%s.csv" % (
+                executor.name, method, datetime.now().strftime('%Y%m%d_%H%M%S')))
+
+    @property
+    def evaluations(self):
+        return len(self.history)
+
+    def remaining(self):
+        """ Number of evaluations left (None: no limit) """
+        if self.max_evaluations is None:
+            return None
+        return max(self.max_evaluations - self.evaluations, 0)
+
+    def budget(self, number: int):
+        """ Number of the points of a batch of number points that can still be evaluated """
+        remaining = self.remaining()
+        return number if remaining is None else min(number, remaining)
+
+    def exhausted(self):
+        return self.max_evaluations is not None and self.evaluations >= self.max_evaluations
+
+    def results(self, points):
+        """
+        Run a batch of points of the unit cube.
+
+        :return: list of results of the runs (see run_executor.execute_run())
+        """
+        points = np.atleast_2d(np.clip(np.asarray(points, dtype=float), 0, 1))
+        parameter_sets = [self.space.parameters(point) for point in points]
+        results = self.executor.run_batch(parameter_sets, **self.options)
+        self.batches += 1
+        for point, result in zip(points, results):
+            self.record(point, result, self.objective(result))
+        self.save()
+        return results
+
+    def evaluate(self, points):
+        """
+        Objective of a batch of points of the unit cube.
+
+        :return: array of the value of the objective of each point
+        """
+        return np.array([self.objective(result) for result in self.results(points)])
+
+    def record(self, point, result: dict, value: float):
+        entry = {"Evaluation": self.evaluations + 1, "Batch": self.batches, "Run_key": result["key"],
+                 "Status": result["status"], "Objective": value}
+        entry.update({name: result["parameters"][name] for name in self.space.names})
+        entry["unit"] = np.array(point, dtype=float)
+        if result["metrics"] is not None:
+            entry.update(result["metrics"])
+        self.history.append(entry)
+
+    def best(self):
+        """ Best evaluation of the history (dictionary, see record()) """
+        return min(self.history, key=lambda entry: entry["Objective"])
+
+    def table(self):
+        """ History of the evaluations (DataFrame) """
+        return pd.DataFrame([{name: value for name, value in entry.items() if name != "unit"}
+                             for entry in self.history])
+
+    def save(self):
+        if self.log_path is not None:
+            self.table().to_csv(self.log_path, index=False)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Reading of the manual calibration reports
+
+The reports of the manual calibration (Postproc_code/<lake>/manual_calibration_<lake>_<var>_<stamp>.csv) have one line
+by iteration, with the value of the parameters and the performances by variable written as lists. They are read by
+the replay of the reports (script_replay_calibration.py), the warm start of the automatic calibration
+(calibration_warm_start.py) and the Bayesian optimiser (calibration_bayesian.py).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import ast
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from run_executor import complete_parameters, parameters_registry, report_columns, root_directory
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+list_columns = ["RMSE_all", "R2_all", "RMSE", "NSE", "RSR", "Pbias", "R2", "SOS", "nrmse"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def parse_list_value(value):
+    """
+    Convert a list written in the report (ex: "[[4.194, 3.339], [nan, nan]]") into a list of float.
+    """
+    if not isinstance(value, str):
+        return value
+    parsed = ast.literal_eval(value.replace("nan", "None"))
+
+    def to_float(item):
+        if isinstance(item, (list, tuple)):
+            return [to_float(element) for element in item]
+        return np.nan if item is None else float(item)
+
+    return to_float(parsed)
+
+
+def read_calibration_report(path: str):
+    """
+    Read a manual calibration report, converting the columns with lists of performances.
+
+    :param path:    Path of the report
+    :return: DataFrame with one line by iteration, and the column "Report" with the name of the file
+    """
+    report = pd.read_csv(path)
+    report = report.drop(columns=[column for column in report.columns if column.startswith("Unnamed")])
+    for column in list_columns:
+        if column in report.columns:
+            report[column] = report[column].apply(parse_list_value)
+    report["Report"] = os.path.basename(path)
+    return report
+
+
+def report_parameters(iteration: pd.Series):
+    """
+    Get the value of the parameters used for an iteration of a report (the parameters absent of older reports, like
+    K_BOD, take their default value).
+    """
+    parameters = {}
+    for name in parameters_registry:
+        column = report_columns.get(name, name)
+        if column in iteration.index and not pd.isna(iteration[column]):
+            value = iteration[column]
+            try:
+                parameters[name] = float(value)
+            except ValueError:
+                parameters[name] = value
+    return complete_parameters(parameters)
+
+
+def find_calibration_reports(lake_name: str, root: str = root_directory):
+    """ List the manual calibration reports of a lake """
+    return sorted(glob.glob(os.path.join(root, "Postproc_code", lake_name, "manual_calibration_%s_*.csv" % lake_name)))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Warm start of the automatic calibration from the runs already done
+
+The runs of the earlier sweeps, designs and calibrations of a lake (run archive of RunExecutor) and the iterations of
+the manual calibration reports are the starting data of a new calibration, instead of starting from one point:
+    - nelder-mead: initial simplex made of the best points known (completed by steps along the axes);
+    - powell: best point known, directions of the principal axes of the best points;
+    - bobyqa: best point known, the points known near the centre being used by the quadratic model;
+    - cmaes: mean, step size and covariance of the best points known;
+    - bayesian: all the points known are data of the Gaussian process;
+    - nsga2: initial population made of the best fronts of the points known.
+DREAM(ZS) starts from its own checkpoint only (its chains must be samples of the posterior distribution).
+
+Only the runs that are still valid are used: runs done with the current input files of the lake, the options of the
+runs of the calibration and the values of the fixed parameters, with calibrated parameters inside the bounds of the
+space. Their performances are recalculated if the observations have changed (see RunExecutor.cached_result()). An
+iteration of a report is used only if its parameter set has a run in the archive (the performances written in the
+report were calculated with input files and observations that are not known), or if the reports are replayed.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+
+from calibration_objective import Objective, ParameterSpace, inside_bounds, same_fixed_parameters
+from calibration_reports import read_calibration_report, report_parameters
+from run_executor import RunExecutor
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def report_results(executor: RunExecutor, reports: list, replay: bool = False, **options):
+    """
+    Runs of the iterations of calibration reports.
+
+    :param reports: Manual calibration reports (see calibration_reports.find_calibration_reports())
+    :param replay:  Run the parameter sets of the reports without a run in the archive (one batch)
+    :return: results of the runs (see run_executor.execute_run()), and the number of iterations not used
+    """
+    parameter_sets = {}
+    for path in reports:
+        try:
+            table = read_calibration_report(path)
+        except (pd.errors.EmptyDataError, ValueError, SyntaxError) as error:
+            print("%s not used: %s" % (path, error))
+            continue
+        for _, iteration in table.iterrows():
+            parameters = report_parameters(iteration)
+            parameter_sets.setdefault(executor.key(parameters, **options), parameters)
+
+    results, missing = [], []
+    for parameters in parameter_sets.values():
+        result = executor.cached_result(executor.specification(parameters, **options))
+        if result is None:
+            missing.append(parameters)
+        else:
+            results.append(result)
+    if replay and missing:
+        print("Warm start: %s parameter sets of the reports run again" % len(missing))
+        results.extend(result for result in executor.run_batch(missing, **options) if result["status"] == "done")
+        missing = []
+    return results, len(missing)
+
+
+def warm_start_data(executor: RunExecutor, space: ParameterSpace, objective: Objective, reports: list = None,
+                    replay: bool = False, **options):
+    """
+    Points known before a calibration: the runs of the archive and of the calibration reports still valid for the
+    space (see the description of the module).
+
+    :param reports: Manual calibration reports whose iterations are used (default: none)
+    :param replay:  Run the parameter sets of the reports without a run in the archive
+    :param options: Options of the runs of the calibration (ex: enable_sediment=1)
+    :return: dictionary with the points (unit cube, n x d), the terms of the objective (n x terms, nan when a term
+             can not be calculated), the objective (n) and the key of the runs, sorted by objective
+    """
+    results = executor.archived_results(**options)
+    stale = 0
+    if reports:
+        report_runs, stale = report_results(executor, reports, replay, **options)
+        results = results + report_runs
+
+    known = set()
+    unit, terms, values, keys = [], [], [], []
+    for result in results:
+        if result["key"] in known or result["metrics"] is None:
+            continue
+        known.add(result["key"])
+        if not same_fixed_parameters(result["parameters"], space) or not inside_bounds(result["parameters"], space):
+            continue
+        unit.append(space.unit_of(result["parameters"]))
+        terms.append(objective.terms_values(result["metrics"]))
+        values.append(objective(result))
+        keys.append(result["key"])
+
+    order = np.argsort(values, kind="stable")
+    data = {"unit": np.array(unit, dtype=float).reshape(-1, space.dimension)[order],
+            "terms": np.array(terms, dtype=float).reshape(-1, len(objective.terms))[order],
+            "values": np.array(values, dtype=float)[order], "keys": [keys[index] for index in order]}
+    print("Warm start: %s runs known for %s%s%s" % (
+        len(keys), ", ".join(space.names), "" if not len(keys) else ", best objective %.4f" % data["values"][0],
+        "" if not stale else " (%s iterations of the reports without a valid run not used)" % stale))
+    return data
+
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Ensemble projections of the lake under perturbed climate forcings
+
+Probabilistic projections (ex: the lake after the Phoslock treatment) need the spread of the results caused by the
+weather. N forcing files are generated from the forcing file of the lake (IO/<lake>/input_<lake>.txt) and the filled
+climate data (obs/climate_data_filled_interpolate.csv, see create_inputs_model_from_obs.py):
+    - bootstrap: each year of the simulation takes the climate of a year drawn in the climate data (blocks of
+      consecutive years to keep the persistence between years);
+    - perturbation: the air temperature is shifted by a constant and an AR(1) daily noise, the wind speed and the
+      precipitation are multiplied by a log-normal factor of each member;
+    - both: perturbations of bootstrapped years.
+The columns of the forcings of all members are generated at once (members x days x variables) and written with the
+formats of mylakeinput(); the other columns (inflows) are those of the file of the lake. The forcing files are named
+after a hash of their content (Postproc_code/<lake>/climate_ensemble/forcings), so the runs stay in the cache of
+RunExecutor when the ensemble is generated again with the same seed.
+
+The members are run in parallel and their profiles are written as they finish in memory-mapped arrays
+(Postproc_code/<lake>/climate_ensemble/members_<variable>.npy, members x days x layers, float32): 1000 members of
+5 years at dz = 0.5 m use 100 MB by variable on the disk, not in memory. The percentile bands are calculated over
+the members in one vectorised pass by block of days.
+
+    $ python climate_ensemble.py Bromont --members 200 --method bootstrap --workers 8
+    $ python climate_ensemble.py Bromont --members 1000 --method both --percentiles 5,25,50,75,95 --seed 1
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import concurrent.futures
+import hashlib
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+from run_executor import RunExecutor, forcing_columns, forcing_file, load_results, read_forcing_file, \
+    read_parameter_file, root_directory, simulated_variable
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+climate_file = os.path.join(root_directory, "obs", "climate_data_filled_interpolate.csv")
+# Formats of the climate columns in the forcing file (see mylakeinput())
+forcing_formats = {"Global radiation": "%.4g", "Cloud cover": "%.2f", "Air temperature": "%.2f",
+                   "Relative humidity": "%.2f", "Air pressure": "%.2f", "Wind speed": "%.2f", "Precipitation": "%.3f"}
+# Standard deviation of the perturbations: shift of the air temperature (deg C), AR(1) daily noise of the air
+# temperature (deg C) and its correlation from a day to the next, log of the factors of the wind and precipitation
+perturbation_scales = {"Air temperature": 1.0, "daily noise": 0.5, "daily correlation": 0.8, "Wind speed": 0.15,
+                       "Precipitation": 0.25}
+ensemble_methods = ["bootstrap", "perturbation", "both"]
+ensemble_variables = ["T", "O2", "Chl"]
+default_percentiles = [5, 25, 50, 75, 95]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def read_climate(path: str = climate_file):
+    """ Climate data by day (columns of forcing_columns), the days of the same date being averaged """
+    climate = pd.read_csv(path)
+    climate["Date"] = pd.to_datetime(climate["Date"]).dt.floor("D")
+    return climate.groupby("Date")[list(forcing_columns)].mean()
+
+
+def forcing_dates(forcing):
+    """ Days of the lines of a forcing file (see run_executor.read_forcing_file()) """
+    days = pd.DataFrame(forcing[:, :3].astype(int), columns=["year", "month", "day"])
+    return pd.DatetimeIndex(pd.to_datetime(days))
+
+
+def climate_years(climate: pd.DataFrame):
+    """
+    Climate of the complete years of the climate data, by day of the year (February 29 of the other years taken
+    from February 28).
+
+    :return: years and array (years x 366 days x variables), the days being in the order of a leap year
+    """
+    calendar = pd.date_range("2000-01-01", "2000-12-31")
+    years, tables = [], []
+    for year, data in climate.groupby(climate.index.year):
+        if len(data.dropna(how="all")) < 365:
+            continue
+        by_day = data.set_axis(data.index.strftime("%m-%d")).reindex(calendar.strftime("%m-%d"))
+        tables.append(by_day.ffill().bfill().values)
+        years.append(year)
+    if not years:
+        raise ValueError("The climate data have no complete year")
+    return np.array(years), np.array(tables, dtype=float)
+
+
+def bootstrap_forcing(climate: pd.DataFrame, dates, members: int, random, block_years: int = 1):
+    """
+    Forcings of the members made of years of the climate data drawn by blocks of consecutive years.
+
+    :param dates:       Days of the forcing (DatetimeIndex)
+    :param random:      numpy.random.Generator
+    :param block_years: Number of consecutive years drawn together
+    :return: array (members x days x variables of forcing_columns)
+    """
+    years, tables = climate_years(climate)
+    block_years = min(block_years, len(years))
+    simulated = dates.year.values - dates.year.values.min()
+    blocks = simulated.max() // block_years + 1
+    # first year of the block of each member, then year of each day
+    starts = random.integers(0, len(years) - block_years + 1, size=(members, blocks))
+    source = starts[:, simulated // block_years] + (simulated % block_years)[None, :]
+    day_of_year = np.asarray(pd.DatetimeIndex(dates.strftime("2000-%m-%d")).dayofyear) - 1
+    return tables[source, day_of_year[None, :], :]
+
+
+def perturb_forcing(forcing, random, scales: dict = None):
+    """
+    Perturbations of the air temperature, wind speed and precipitation of the forcings of the members (see the
+    description of the module).
+
+    :param forcing: array (members x days x variables of forcing_columns)
+    :param scales:  Standard deviations replacing those of perturbation_scales
+    :return: perturbed array
+    """
+    scales = dict(perturbation_scales, **(scales or {}))
+    forcing = np.array(forcing, dtype=float)
+    members, days, _ = forcing.shape
+    names = list(forcing_columns)
+    correlation = scales["daily correlation"]
+    noise = random.standard_normal((members, days)) * scales["daily noise"] * np.sqrt(1 - correlation ** 2)
+    temperature = names.index("Air temperature")
+    forcing[:, :, temperature] += random.normal(0, scales["Air temperature"], (members, 1)) \
+        + lfilter([1.0], [1.0, -correlation], noise, axis=1)
+    for name in ["Wind speed", "Precipitation"]:
+        # factors of mean 1
+        factor = np.exp(random.normal(0, scales[name], (members, 1)) - scales[name] ** 2 / 2)
+        forcing[:, :, names.index(name)] = np.clip(forcing[:, :, names.index(name)] * factor, 0, None)
+    return forcing
+
+
+def format_columns(values, fmt: str):
+    """ Text of an array of values with a format of mylakeinput() (nan written as in np.savetxt) """
+    finite = np.isfinite(values)
+    return np.where(finite, np.char.mod(fmt, np.where(finite, values, 0)), "nan")
+
+
+def write_forcing_files(base_path: str, folder: str, forcing):
+    """
+    Write forcing files made of the climate columns of the members and of the other columns of a forcing file, each
+    named after a hash of its content (an existing file is not written again).
+
+    :param base_path:   Forcing file giving the header and the other columns
+    :param folder:      Folder of the files
+    :param forcing:     Climate columns of the members (members x days x variables of forcing_columns)
+    :return: paths of the files, in the order of the members
+    """
+    with open(base_path) as f:
+        lines = f.read().rstrip("\n").split("\n")
+    header = [line for line in lines if line.startswith("#")]
+    cells = np.array([line.split("\t") for line in lines if not line.startswith("#")], dtype=object)
+    texts = {column: format_columns(forcing[:, :, index], forcing_formats[name])
+             for index, (name, column) in enumerate(forcing_columns.items())}
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for member in range(len(forcing)):
+        for column, text in texts.items():
+            cells[:, column] = text[member]
+        content = "\n".join(header + ["\t".join(row) for row in cells]) + "\n"
+        path = os.path.join(folder, "%s.txt" % hashlib.sha1(content.encode()).hexdigest()[:16])
+        if not os.path.exists(path):
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+def percentile_bands(stack, percentiles: list = None, block: int = 100):
+    """
+    Percentiles over the members of stacked results, by block of days to limit the memory used.
+
+    :param stack:       Array or memory-mapped array (members x days x layers), nan for the failed members
+    :param percentiles: Percentiles (default: default_percentiles)
+    :param block:       Number of days calculated together
+    :return: array (percentiles x days x layers)
+    """
+    percentiles = default_percentiles if percentiles is None else percentiles
+    bands = np.empty((len(percentiles),) + stack.shape[1:], dtype=float)
+    for start in range(0, stack.shape[1], block):
+        values = np.asarray(stack[:, start:start + block], dtype=float)
+        bands[:, start:start + block] = np.nanpercentile(values, percentiles, axis=0)
+    return bands
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ClimateEnsemble:
+    """
+    Ensemble of runs of a lake under perturbed forcings, the results being stacked in memory-mapped arrays.
+
+    Example:
+        with RunExecutor("Bromont", max_workers=8) as executor:
+            ensemble = ClimateEnsemble(executor, members=200, method="bootstrap", seed=1)
+            ensemble.run()
+            bands = ensemble.bands("T")
+    """
+
+    def __init__(self, executor: RunExecutor, members: int = 100, method: str = "bootstrap", parameters: dict = None,
+                 scales: dict = None, block_years: int = 1, seed: int = None, climate_path: str = climate_file,
+                 variables: list = None, **options):
+        """
+        :param members:         Number of members
+        :param method:          bootstrap, perturbation or both (see the description of the module)
+        :param parameters:      Values of the parameters of the runs (default: the parameter file of the lake)
+        :param scales:          Standard deviations of the perturbations replacing those of perturbation_scales
+        :param block_years:     Number of consecutive years drawn together by the bootstrap
+        :param climate_path:    Climate data of the bootstrap
+        :param variables:       Variables stacked (default: ensemble_variables)
+        :param options:         Options of the runs replacing those of the executor (ex: enable_sediment=1)
+        """
+        if method not in ensemble_methods:
+            raise ValueError("Method '%s' is not an option, choose between %s" % (method, ", ".join(ensemble_methods)))
+        self.executor = executor
+        self.members = members
+        self.method = method
+        self.parameters = dict(parameters or read_parameter_file(executor.name, executor.root))
+        self.scales = scales
+        self.block_years = block_years
+        self.random = np.random.default_rng(seed)
+        self.climate_path = climate_path
+        self.variables = variables or list(ensemble_variables)
+        self.options = options
+        self.folder = os.path.join(executor.output_folder, "climate_ensemble")
+        self.base_path = os.path.join(executor.root, "IO", executor.name, forcing_file % executor.name)
+        self.stacks = {}
+        self.dates = None
+        self.depths = None
+
+    def forcings(self):
+        """ Climate columns of the forcings of the members (members x days x variables of forcing_columns) """
+        base = read_forcing_file(self.base_path)
+        dates = forcing_dates(base)
+        if self.method == "perturbation":
+            forcing = np.repeat(base[None, :, list(forcing_columns.values())], self.members, axis=0)
+        else:
+            forcing = bootstrap_forcing(read_climate(self.climate_path), dates, self.members, self.random,
+                                        self.block_years)
+        if self.method != "bootstrap":
+            forcing = perturb_forcing(forcing, self.random, self.scales)
+        return forcing
+
+    def write_forcings(self, forcing):
+        """ Write the forcing files of the members (see write_forcing_files()) """
+        return write_forcing_files(self.base_path, os.path.join(self.folder, "forcings"), forcing)
+
+    def store(self, member: int, result: dict):
+        """ Write the profiles of a member in the stacks (created with the shape of the first result) """
+        water = load_results(result["result_file"])
+        profiles = {variable: simulated_variable(water, variable) for variable in self.variables}
+        if not self.stacks:
+            layers, days = profiles[self.variables[0]].shape
+            start = pd.Timestamp(result["options"].get("start_date") or "%s-01-01" % result["options"]["start_year"])
+            self.dates = pd.date_range(start, periods=days)
+            self.depths = np.arange(layers) * result["options"].get("dz", 0.5)
+            os.makedirs(self.folder, exist_ok=True)
+            for variable in self.variables:
+                self.stacks[variable] = np.lib.format.open_memmap(
+                    os.path.join(self.folder, "members_%s.npy" % variable), mode="w+", dtype=np.float32,
+                    shape=(self.members, days, layers))
+                self.stacks[variable][:] = np.nan
+        for variable, profile in profiles.items():
+            self.stacks[variable][member] = profile.T
+
+    def run(self):
+        """
+        Generate the forcings, run the members in parallel and stack their profiles as they finish.
+
+        :return: number of members whose run failed (their profiles are nan)
+        """
+        print("Climate ensemble of %s: %s members (%s)" % (self.executor.name, self.members, self.method))
+        paths = self.write_forcings(self.forcings())
+        # the outputs of the members are kept by the retention until their profiles are stacked
+        keys = [self.executor.specification(self.parameters, forcing=path, **self.options)["key"] for path in paths]
+        self.executor.protect(keys)
+        try:
+            futures = {self.executor.submit(self.parameters, forcing=path, **self.options): member
+                       for member, path in enumerate(paths)}
+            failed = 0
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                if result["status"] == "done" and result["result_file"] is not None and \
+                        os.path.exists(result["result_file"]):
+                    self.store(futures[future], result)
+                else:
+                    failed += 1
+                    print("Member %s failed: %s" % (futures[future], result.get("error")))
+                if done % max(1, self.members // 10) == 0:
+                    print("%s of %s members done" % (done, self.members))
+        finally:
+            self.executor.unprotect(keys)
+        for stack in self.stacks.values():
+            stack.flush()
+        return failed
+
+    def bands(self, variable: str, percentiles: list = None):
+        """
+        Percentile bands of a variable over the members.
+
+        :return: DataFrame with the columns Date, Depth and one column by percentile (P5, P50, ...)
+        """
+        percentiles = default_percentiles if percentiles is None else percentiles
+        values = percentile_bands(self.stacks[variable], percentiles)
+        table = pd.DataFrame({"Date": np.repeat(self.dates.values, len(self.depths)),
+                              "Depth": np.tile(self.depths, len(self.dates))})
+        for index, percentile in enumerate(percentiles):
+            table["P%g" % percentile] = values[index].ravel()
+        return table
+
+
+if __name__ == "__main__":
+    from run_retention import RetentionManager
+
+    parser = argparse.ArgumentParser(description="Ensemble of runs of a lake under perturbed climate forcings.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--members", type=int, default=100, help="Number of members")
+    parser.add_argument("--method", default="bootstrap", choices=ensemble_methods,
+                        help="Bootstrap of years, perturbations of the forcing of the lake, or both")
+    parser.add_argument("--block-years", type=int, default=1, help="Consecutive years drawn together (bootstrap)")
+    parser.add_argument("--temperature-shift", type=float, default=perturbation_scales["Air temperature"],
+                        help="Standard deviation of the shift of the air temperature (deg C)")
+    parser.add_argument("--wind-factor", type=float, default=perturbation_scales["Wind speed"],
+                        help="Standard deviation of the log of the factor of the wind speed")
+    parser.add_argument("--precipitation-factor", type=float, default=perturbation_scales["Precipitation"],
+                        help="Standard deviation of the log of the factor of the precipitation")
+    parser.add_argument("--percentiles", default=",".join("%g" % value for value in default_percentiles),
+                        help="Percentiles of the bands, separated by commas")
+    parser.add_argument("--variables", default=",".join(ensemble_variables), help="Variables, separated by commas")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the forcings")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    percentiles = [float(value) for value in args.percentiles.split(",")]
+    scales = {"Air temperature": args.temperature_shift, "Wind speed": args.wind_factor,
+              "Precipitation": args.precipitation_factor}
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        ensemble = ClimateEnsemble(executor, args.members, args.method, scales=scales, block_years=args.block_years,
+                                   seed=args.seed, variables=args.variables.split(","))
+        failed = ensemble.run()
+    if len(ensemble.stacks) == 0:
+        raise SystemExit("All the members failed")
+
+    date = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for variable in ensemble.variables:
+        path = os.path.join(ensemble.folder, "bands_%s_%s_%s.csv" % (args.lake, variable, date))
+        ensemble.bands(variable, percentiles).to_csv(path, index=False)
+        print("Percentiles of %s saved: %s" % (variable, path))
+    print("%s members failed" % failed if failed else "All the members done")
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Ensemble Kalman filter of the temperature and oxygen profiles
+
+MyLake can start from any state written in mylake_initial_concentrations.txt (see
+MyLake_Bromont_save_result_for_init_conc.m). The simulation is cut in windows ending at observation dates: the N
+members of the ensemble (perturbed initial states, and perturbed parameters if some are assimilated) are run over a
+window in parallel, each from its own initial state file. At the end of the window, the profiles of the members are
+updated with the observations of the day by the stochastic ensemble Kalman filter (perturbed observations):
+    X_a = X_f + K (y + e - H X_f),    K = A (HA)' / (N - 1) [HA (HA)' / (N - 1) + R]^-1
+A being the anomalies of the ensemble and H the linear interpolation of the profiles at the depths of the
+observations. The analysed profiles are written as new initial state files and the next window starts the next day.
+The calibrated parameters given are added to the state (unit cube of the ParameterSpace) and are updated with the
+profiles. After each analysis, the members receive additive perturbations (the errors of the model over the next
+window, and a random walk of the parameters), otherwise the spread of the ensemble collapses after a few analyses
+and the observations are no longer taken into account.
+
+The runs are runs of RunExecutor with the options start_date, stop_date and initial_state. The state files are named
+after a hash of their content (Postproc_code/<lake>/data_assimilation/states), so a filter run again with the same
+seed finds its runs in the cache. The other columns of the state file (nutrients, DOC, ...) are taken from the end of
+the runs when the results have them, their values are not updated by the analysis.
+
+    $ python data_assimilation.py Bromont --members 30 --start 2020-01-01 --stop 2021-06-23 --workers 8
+    $ python data_assimilation.py Bromont --members 50 --parameters swa_b0,k_BOD --inflation 1.05 --seed 1
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import hashlib
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calibration_objective import ParameterSpace, calibrated_parameters
+from run_executor import RunExecutor, initial_state_columns, initial_state_file, load_results, read_initial_state, \
+    read_observations, read_parameter_file, write_initial_state
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+assimilated_variables = ["T", "O2"]
+# Standard deviation of the errors of the observations and of the initial states (unit of the observations)
+observation_errors = {"T": 0.5, "O2": 0.5}
+state_errors = {"T": 0.5, "O2": 0.5}
+# Standard deviation of the errors of the model over a window, added to the members after each analysis
+model_errors = {"T": 0.2, "O2": 0.3}
+# Values of the state file by unit of the observations (O2 in mg/m3 in the file, in mg/L in the observations)
+state_units = {"T": 1.0, "O2": 1000.0}
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def variable_values(text: str):
+    """ Values by variable given as "T:0.3,O2:0.8" """
+    values = {}
+    for item in (text.split(",") if text else []):
+        variable, value = item.split(":")
+        values[variable.strip()] = float(value)
+    return values
+
+
+def assimilation_dates(observations: dict, start_date: str, stop_date: str, min_window: int = 7):
+    """
+    Ends of the assimilation windows: the days with observations after start_date and until stop_date, at least
+    min_window days apart.
+
+    :param observations:    Observations by variable (see run_executor.read_observations())
+    """
+    days = pd.DatetimeIndex([])
+    for observed in observations.values():
+        days = days.union(observed.dropna(how="all").index)
+    days = days[(days > pd.Timestamp(start_date)) & (days <= pd.Timestamp(stop_date))]
+    dates = []
+    for day in days:
+        if not dates or (day - dates[-1]).days >= min_window:
+            dates.append(day)
+    return dates
+
+
+def interpolation_matrix(state_depths, depths):
+    """ Matrix (depths x state depths) of the linear interpolation of a profile at depths (constant outside) """
+    state_depths = np.asarray(state_depths, dtype=float)
+    identity = np.eye(len(state_depths))
+    return np.array([[np.interp(depth, state_depths, column) for column in identity]
+                     for depth in np.atleast_1d(depths)])
+
+
+def ensemble_analysis(ensemble, predicted, observed, errors, random, inflation: float = 1.0):
+    """
+    Stochastic ensemble Kalman filter analysis (perturbed observations).
+
+    :param ensemble:    States of the members (n x N)
+    :param predicted:   Observations predicted by the members (m x N)
+    :param observed:    Observations (m)
+    :param errors:      Standard deviation of the errors of the observations (m)
+    :param random:      numpy.random.Generator of the perturbations
+    :param inflation:   Multiplicative inflation of the anomalies of the forecast (> 1 against the collapse of the
+                        spread of the ensemble)
+    :return: analysed states (n x N)
+    """
+    ensemble = np.asarray(ensemble, dtype=float)
+    predicted = np.asarray(predicted, dtype=float)
+    members = ensemble.shape[1]
+    anomalies = inflation * (ensemble - ensemble.mean(axis=1, keepdims=True))
+    predicted_anomalies = inflation * (predicted - predicted.mean(axis=1, keepdims=True))
+    ensemble = ensemble.mean(axis=1, keepdims=True) + anomalies
+    predicted = predicted.mean(axis=1, keepdims=True) + predicted_anomalies
+
+    errors = np.asarray(errors, dtype=float)
+    perturbed = np.asarray(observed, dtype=float)[:, None] + errors[:, None] * random.standard_normal(predicted.shape)
+    innovation_covariance = predicted_anomalies @ predicted_anomalies.T / (members - 1) + np.diag(errors ** 2)
+    cross_covariance = anomalies @ predicted_anomalies.T / (members - 1)
+    return ensemble + cross_covariance @ np.linalg.solve(innovation_covariance, perturbed - predicted)
+
+
+def forecast_state(result: dict, previous):
+    """
+    State at the end of a run, at the depths of the previous state file: profiles of the fields of
+    run_executor.initial_state_columns found in the results (the other columns keep their values).
+
+    :param result:      Result of the run (see run_executor.execute_run())
+    :param previous:    State at the start of the run (depths x columns, see run_executor.read_initial_state())
+    :return: state (depths x columns)
+    """
+    water = load_results(result["result_file"])
+    concentrations = water["concentrations"][0, 0]
+    fields = {"T": np.asarray(water["T"][0, 0], dtype=float)}
+    fields.update({name: np.asarray(concentrations[name][0, 0], dtype=float)
+                   for name in concentrations.dtype.names or []})
+    state = np.array(previous, dtype=float)
+    dz = result["options"].get("dz", 0.5)
+    for name, column in initial_state_columns.items():
+        if name in fields and fields[name].size:
+            profile = fields[name][:, -1]
+            state[:, column] = np.interp(state[:, 0], np.arange(len(profile)) * dz, profile)
+    if all(name in fields and fields[name].size for name in ["P", "PP", "DOP", "Chl", "C"]):
+        profile = sum(fields[name][:, -1] for name in ["P", "PP", "DOP", "Chl", "C"])
+        state[:, 5] = np.interp(state[:, 0], np.arange(len(profile)) * dz, profile)
+    return state
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class EnsembleKalmanFilter:
+    """
+    Ensemble Kalman filter of the profiles of the assimilated variables (and of the calibrated parameters of a
+    space), the members of each window being run in parallel by a RunExecutor.
+
+    Example:
+        with RunExecutor("Bromont", max_workers=8) as executor:
+            table = EnsembleKalmanFilter(executor, members=30, seed=1).run("2020-01-01", "2021-06-23")
+    """
+
+    def __init__(self, executor: RunExecutor, parameters: dict = None, space: ParameterSpace = None,
+                 members: int = 20, variables: list = None, errors: dict = None, inflation: float = 1.0,
+                 parameter_spread: float = 0.1, seed: int = None, model_error: dict = None,
+                 parameter_noise: float = 0.02, **options):
+        """
+        :param parameters:          Values of the parameters (default: the parameter file of the lake)
+        :param space:               Parameters updated by the filter (default: none)
+        :param members:             Number of members of the ensemble
+        :param variables:           Assimilated variables (default: assimilated_variables)
+        :param errors:              Standard deviation of the errors of the observations by variable (default:
+                                    observation_errors)
+        :param inflation:           Multiplicative inflation of the anomalies of the forecast
+        :param parameter_spread:    Standard deviation of the initial parameters (unit cube)
+        :param model_error:         Standard deviation of the additive errors of the model over a window by variable
+                                    (default: model_errors)
+        :param parameter_noise:     Standard deviation of the random walk of the parameters between two analyses
+                                    (unit cube)
+        :param options:             Options of the runs replacing those of the executor (ex: enable_sediment=1)
+        """
+        self.executor = executor
+        self.parameters = dict(parameters or read_parameter_file(executor.name, executor.root))
+        self.space = space
+        self.members = members
+        self.variables = variables or list(assimilated_variables)
+        self.errors = dict(observation_errors, **(errors or {}))
+        self.inflation = inflation
+        self.parameter_spread = parameter_spread
+        self.model_error = dict(model_errors, **(model_error or {}))
+        self.parameter_noise = parameter_noise
+        self.random = np.random.default_rng(seed)
+        self.options = options
+        self.folder = os.path.join(executor.output_folder, "data_assimilation")
+        self.observations = {variable: read_observations(executor.observation_folder, variable)
+                             for variable in self.variables}
+        self.header, self.state = read_initial_state(os.path.join(executor.root, "IO", executor.name,
+                                                                  initial_state_file))
+
+    def state_path(self, state):
+        """ Write a state in a file named after the hash of its content (see the description of the module) """
+        lines = ["\t".join("%.6g" % value for value in row) for row in np.asarray(state, dtype=float)]
+        name = hashlib.sha1("\n".join(self.header + lines).encode()).hexdigest()[:16]
+        path = os.path.join(self.folder, "states", "%s.txt" % name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_initial_state(path + ".tmp", self.header, state)
+            os.replace(path + ".tmp", path)
+        return path
+
+    def perturb(self, states, units, errors: dict, parameter_spread: float):
+        """
+        Additive perturbations of the members: a shift of the profile of each assimilated variable (standard
+        deviation by variable, unit of the observations) and of the parameters (unit cube).
+
+        :return: perturbed states (N x depths x columns) and parameters (N x d)
+        """
+        states = np.array(states, dtype=float)
+        for variable in self.variables:
+            column = initial_state_columns[variable]
+            shift = self.random.normal(0, errors.get(variable, 0.0), (self.members, 1))
+            states[:, :, column] = np.clip(states[:, :, column] + shift * state_units[variable], 0, None)
+        units = np.asarray(units, dtype=float)
+        return states, np.clip(units + parameter_spread * self.random.standard_normal(units.shape), 0, 1)
+
+    def initial_ensemble(self):
+        """ Initial states (N x depths x columns) and parameters (N x d, unit cube) of the members """
+        states = np.repeat(self.state[None, :, :], self.members, axis=0)
+        if self.space is None:
+            units = np.empty((self.members, 0))
+        else:
+            units = np.repeat(self.space.unit_of(self.parameters)[None, :], self.members, axis=0)
+        return self.perturb(states, units, state_errors, self.parameter_spread)
+
+    def member_parameters(self, unit):
+        """ Values of the parameters of a member """
+        if self.space is None:
+            return self.parameters
+        return dict(self.parameters, **self.space.parameters(unit))
+
+    def forecast(self, states, units, start_date: str, stop_date: str):
+        """
+        Run the members from their states over a window (in parallel).
+
+        :return: states at the end of the window (N x depths x columns), the failed members restarting from the
+                 mean of the others
+        """
+        runs = [(self.member_parameters(unit), dict(self.options, start_date=start_date, stop_date=stop_date,
+                                                    initial_state=self.state_path(state)))
+                for state, unit in zip(states, units)]
+        # the outputs of the members are kept by the retention until their final states are read
+        keys = [self.executor.specification(parameters, **options)["key"] for parameters, options in runs]
+        self.executor.protect(keys)
+        try:
+            futures = [self.executor.submit(parameters, **options) for parameters, options in runs]
+            results = [future.result() for future in futures]
+            done = [result["status"] == "done" and result["result_file"] is not None and
+                    os.path.exists(result["result_file"]) for result in results]
+            if not any(done):
+                raise RuntimeError("All the members failed from %s to %s: %s" % (start_date, stop_date,
+                                                                                 results[0].get("error")))
+            forecast = np.array(states, dtype=float)
+            for index, result in enumerate(results):
+                if done[index]:
+                    forecast[index] = forecast_state(result, states[index])
+        finally:
+            self.executor.unprotect(keys)
+        if not all(done):
+            print("%s members failed from %s to %s, they restart from the mean of the others" % (
+                len(done) - sum(done), start_date, stop_date))
+            forecast[~np.array(done)] = forecast[np.array(done)].mean(axis=0)
+        return forecast
+
+    def observed(self, date):
+        """ Observations of a day: list of (variable, depths, values) """
+        observed = []
+        for variable in self.variables:
+            if date not in self.observations[variable].index:
+                continue
+            values = self.observations[variable].loc[date]
+            values = values[values.notna()]
+            if len(values):
+                observed.append((variable, np.asarray(values.index, dtype=float), values.values.astype(float)))
+        return observed
+
+    def analysis(self, states, units, date):
+        """
+        Update the members with the observations of a day.
+
+        :return: analysed states and parameters, and the lines of the table of the day (see run())
+        """
+        depths = states[0, :, 0]
+        blocks = [(states[:, :, initial_state_columns[variable]] / state_units[variable]).T
+                  for variable in self.variables]
+        ensemble = np.vstack(blocks + [units.T])
+        observed = self.observed(date)
+        operator, values, errors, labels = [], [], [], []
+        for variable, observation_depths, observation_values in observed:
+            block = self.variables.index(variable)
+            rows = np.zeros((len(observation_depths), ensemble.shape[0]))
+            rows[:, block * len(depths):(block + 1) * len(depths)] = interpolation_matrix(depths, observation_depths)
+            operator.append(rows)
+            values.append(observation_values)
+            errors.append(np.full(len(observation_depths), self.errors[variable]))
+            labels.extend((variable, depth) for depth in observation_depths)
+        operator, values, errors = np.vstack(operator), np.concatenate(values), np.concatenate(errors)
+
+        predicted = operator @ ensemble
+        analysed = ensemble_analysis(ensemble, predicted, values, errors, self.random, self.inflation)
+        updated = operator @ analysed
+        lines = [{"Date": date, "Variable": variable, "Depth": depth, "Observation": value,
+                  "Forecast_mean": forecast.mean(), "Forecast_std": forecast.std(ddof=1),
+                  "Analysis_mean": analysis.mean(), "Analysis_std": analysis.std(ddof=1)}
+                 for (variable, depth), value, forecast, analysis in zip(labels, values, predicted, updated)]
+
+        states = np.array(states, dtype=float)
+        for block, variable in enumerate(self.variables):
+            profiles = analysed[block * len(depths):(block + 1) * len(depths)].T
+            states[:, :, initial_state_columns[variable]] = np.clip(profiles, 0, None) * state_units[variable]
+        units = np.clip(analysed[len(self.variables) * len(depths):].T, 0, 1)
+        if self.space is not None:
+            forecast = self.space.from_unit(ensemble[len(ensemble) - units.shape[1]:].T)
+            analysis = self.space.from_unit(units)
+            for index, name in enumerate(self.space.names):
+                lines.append({"Date": date, "Variable": name, "Depth": np.nan, "Observation": np.nan,
+                              "Forecast_mean": forecast[:, index].mean(),
+                              "Forecast_std": forecast[:, index].std(ddof=1),
+                              "Analysis_mean": analysis[:, index].mean(),
+                              "Analysis_std": analysis[:, index].std(ddof=1)})
+        return states, units, lines
+
+    def run(self, start_date: str, stop_date: str, min_window: int = 7):
+        """
+        Filter from start_date (state of the initial state file of the lake) to stop_date.
+
+        :param min_window:  Minimum number of days between two analyses
+        :return: DataFrame with, for each observation assimilated, the mean and the standard deviation of the
+                 ensemble before (Forecast) and after (Analysis) the update (the parameters have no depth), and the
+                 mean analysed state at stop_date (depths x columns)
+        """
+        dates = assimilation_dates(self.observations, start_date, stop_date, min_window)
+        print("Ensemble Kalman filter of %s: %s members, %s analyses from %s to %s" % (
+            ", ".join(self.variables), self.members, len(dates), start_date, stop_date))
+        states, units = self.initial_ensemble()
+        lines = []
+        start = pd.Timestamp(start_date)
+        for date in dates + [pd.Timestamp(stop_date)]:
+            if date < start:
+                break
+            if start > pd.Timestamp(start_date):
+                # errors of the model over the window after an analysis, against the collapse of the spread
+                states, units = self.perturb(states, units, self.model_error, self.parameter_noise)
+            states = self.forecast(states, units, start.strftime("%Y-%m-%d"), date.strftime("%Y-%m-%d"))
+            if date in dates:
+                states, units, day = self.analysis(states, units, date)
+                lines.extend(day)
+                day = pd.DataFrame(day).dropna(subset=["Observation"])
+                rmse = {variable: [np.sqrt(np.mean((group[column] - group["Observation"]) ** 2))
+                                   for column in ["Forecast_mean", "Analysis_mean"]]
+                        for variable, group in day.groupby("Variable", sort=False)}
+                print("%s: RMSE %s" % (date.strftime("%Y-%m-%d"), ", ".join(
+                    "%s %.3f -> %.3f" % (variable, *values) for variable, values in rmse.items())))
+            start = date + pd.Timedelta(days=1)
+        table = pd.DataFrame(lines, columns=["Date", "Variable", "Depth", "Observation", "Forecast_mean",
+                                             "Forecast_std", "Analysis_mean", "Analysis_std"])
+        return table, states.mean(axis=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ensemble Kalman filter of the temperature and oxygen of a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--members", type=int, default=20, help="Number of members of the ensemble")
+    parser.add_argument("--start", default=None, help="First day (default: January 1 of the first year)")
+    parser.add_argument("--stop", default=None, help="Last day (default: the last observation)")
+    parser.add_argument("--variables", default=",".join(assimilated_variables),
+                        help="Assimilated variables, separated by commas")
+    parser.add_argument("--obs-error", default=None,
+                        help="Standard deviation of the errors of the observations (ex: T:0.3,O2:0.8)")
+    parser.add_argument("--parameters", default=None, help="Parameters updated by the filter, separated by commas")
+    parser.add_argument("--parameter-spread", type=float, default=0.1,
+                        help="Standard deviation of the initial parameters (fraction of the bounds)")
+    parser.add_argument("--inflation", type=float, default=1.0, help="Inflation of the spread of the forecasts")
+    parser.add_argument("--model-error", default=None,
+                        help="Standard deviation of the errors of the model over a window (ex: T:0.2,O2:0.3)")
+    parser.add_argument("--parameter-noise", type=float, default=0.02,
+                        help="Standard deviation of the random walk of the parameters between two analyses "
+                             "(fraction of the bounds)")
+    parser.add_argument("--min-window", type=int, default=7, help="Minimum number of days between two analyses")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the perturbations")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    parameters = read_parameter_file(args.lake)
+    space = None
+    if args.parameters:
+        space = ParameterSpace(calibrated_parameters(args.parameters, None), fixed=parameters)
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        start = args.start or "%s-01-01" % executor.options["start_year"]
+        stop = args.stop
+        if stop is None:
+            stop = max(read_observations(executor.observation_folder, variable).dropna(how="all").index.max()
+                       for variable in args.variables.split(",")).strftime("%Y-%m-%d")
+        enkf = EnsembleKalmanFilter(executor, parameters, space, args.members, args.variables.split(","),
+                                    variable_values(args.obs_error), args.inflation, args.parameter_spread, args.seed,
+                                    model_error=variable_values(args.model_error),
+                                    parameter_noise=args.parameter_noise)
+        table, state = enkf.run(start, stop, args.min_window)
+        output_folder = enkf.folder
+
+    date = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs(output_folder, exist_ok=True)
+    table_path = os.path.join(output_folder, "enkf_%s_%s.csv" % (args.lake, date))
+    table.to_csv(table_path, index=False)
+    state_path = os.path.join(output_folder, "mylake_initial_concentrations_%s.txt" % stop.replace("-", ""))
+    write_initial_state(state_path, enkf.header, state)
+    print("Analyses saved: %s" % table_path)
+    print("Mean state of %s saved: %s" % (stop, state_path))
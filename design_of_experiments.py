@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Space-filling designs of parameter sets
+
+Designs of experiments in the unit cube of the parameters (between the bounds of run_executor.parameters_registry, on
+a logarithmic scale for the rate constants), used instead of the full factorial combinations of the values of each
+parameter (10 values of 7 parameters are 10^7 runs):
+    - lhs: latin hypercube;
+    - maximin: latin hypercube maximising the smallest distance between two points (best of several hypercubes,
+      improved by exchanges of coordinates);
+    - sobol: scrambled Sobol sequence.
+
+The points are submitted in a stratified order: each beginning of the design is itself a space-filling sample (the
+order of the Sobol sequence, the farthest point first for the hypercubes), so a design stopped before its end can
+still be used. The results are saved after each batch in Postproc_code/<lake>/design_<lake>_<method>_<date>.csv.
+
+    $ python design_of_experiments.py Bromont --group T --method maximin --runs 200 --batch-size 16 --workers 8
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import pdist, squareform
+from scipy.stats import qmc
+
+from calibration_emulator import screen_points
+from calibration_objective import Objective, ParameterSpace, calibrated_parameters, default_objective, latin_hypercube
+from run_executor import RunExecutor, read_parameter_file
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+design_methods = ["lhs", "maximin", "sobol"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def maximin_latin_hypercube(number: int, dimension: int, random, candidates: int = 20, exchanges: int = 1000):
+    """
+    Latin hypercube maximising the smallest distance between two points: the best of several hypercubes, then
+    exchanges of two coordinates of a parameter (which keep the latin hypercube) accepted when the smallest distance
+    increases.
+
+    :param candidates:  Number of hypercubes generated
+    :param exchanges:   Number of exchanges tried
+    """
+    if number < 2:
+        return latin_hypercube(number, dimension, random)
+    best = max((latin_hypercube(number, dimension, random) for _ in range(candidates)),
+               key=lambda design: pdist(design).min())
+    distances = squareform(pdist(best))
+    np.fill_diagonal(distances, np.inf)
+    for _ in range(exchanges):
+        # one of the two closest points exchanges a coordinate with another point
+        closest = np.unravel_index(np.argmin(distances), distances.shape)
+        first = closest[random.integers(2)]
+        second = random.integers(number)
+        if second == first:
+            continue
+        parameter = random.integers(dimension)
+        design = best.copy()
+        design[[first, second], parameter] = design[[second, first], parameter]
+        updated = distances.copy()
+        for point in (first, second):
+            row = np.sqrt(np.sum((design - design[point]) ** 2, axis=1))
+            row[point] = np.inf
+            updated[point], updated[:, point] = row, row
+        if updated.min() > distances.min():
+            best, distances = design, updated
+    return best
+
+
+def scrambled_sobol(number: int, dimension: int, seed: int = None):
+    """ Scrambled Sobol sequence (the balance of the sequence is kept for a power of 2) """
+    sampler = qmc.Sobol(dimension, scramble=True, seed=seed)
+    if number & (number - 1) == 0:
+        return sampler.random_base2(int(np.log2(number)))
+    return sampler.random(number)
+
+
+def stratified_order(points):
+    """
+    Order of the points in which each beginning of the design fills the space: the point nearest to the centre of the
+    cube, then the point farthest from the points already taken.
+
+    :return: indices of the points
+    """
+    points = np.asarray(points, dtype=float)
+    order = [int(np.argmin(np.sum((points - 0.5) ** 2, axis=1)))]
+    nearest = np.sum((points - points[order[0]]) ** 2, axis=1)
+    nearest[order[0]] = -1
+    for _ in range(len(points) - 1):
+        index = int(np.argmax(nearest))
+        order.append(index)
+        nearest = np.minimum(nearest, np.sum((points - points[index]) ** 2, axis=1))
+        nearest[order] = -1
+    return np.array(order)
+
+
+def design(dimension: int, number: int, method: str = "maximin", seed: int = None):
+    """
+    Space-filling design of the unit cube, in stratified order.
+
+    :param method:  lhs, maximin or sobol
+    :return: points (number x dimension)
+    """
+    if method not in design_methods:
+        raise ValueError("Design '%s' is not an option, choose between %s" % (method, ", ".join(design_methods)))
+    if method == "sobol":
+        # the order of the Sobol sequence is already stratified
+        return scrambled_sobol(number, dimension, seed)
+    random = np.random.default_rng(seed)
+    points = latin_hypercube(number, dimension, random) if method == "lhs" else \
+        maximin_latin_hypercube(number, dimension, random)
+    return points[stratified_order(points)]
+
+
+def design_values(points, names: list, bounds: dict = None):
+    """
+    Values of the parameters of the points of a design, between the bounds of the registry (or the bounds given), on
+    the scale of calibration_objective.ParameterSpace.
+
+    :return: list of dictionaries {parameter: value}
+    """
+    values = ParameterSpace(names, bounds=bounds).from_unit(points)
+    return [{name: float(value) for name, value in zip(names, point)} for point in values]
+
+
+def run_design(executor: RunExecutor, parameter_sets: list, batch_size: int = None, outpath: str = None,
+               **run_options):
+    """
+    Run the parameter sets of a design by batches, in their order, saving the results after each batch (a design
+    interrupted keeps the results of its first batches).
+
+    :param parameter_sets:  Value of the parameters of each point (see design_values()), the others take their value
+                            in the executor (default value of the registry)
+    :param batch_size:      Number of runs submitted at once (default: all)
+    :param outpath:         CSV file of the results
+    :return: DataFrame with the parameters, the key, the status and the performances of each run
+    """
+    batch_size = batch_size or len(parameter_sets)
+    lines = []
+    for start in range(0, len(parameter_sets), batch_size):
+        batch = parameter_sets[start:start + batch_size]
+        for number, (values, result) in enumerate(zip(batch, executor.run_batch(batch, **run_options))):
+            line = {"Order": start + number}
+            line.update({name: result["parameters"][name] for name in values})
+            line.update({"Run_key": result["key"], "Status": result["status"]})
+            if result["metrics"] is not None:
+                line.update(result["metrics"])
+            lines.append(line)
+        if outpath is not None:
+            pd.DataFrame(lines).to_csv(outpath, index=False)
+        print("Design: %s runs done out of %s" % (len(lines), len(parameter_sets)))
+    return pd.DataFrame(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a space-filling design of parameter sets for a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Parameters of the design, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--method", default="maximin", choices=design_methods, help="Design of experiments")
+    parser.add_argument("--runs", type=int, default=64, help="Number of parameter sets")
+    parser.add_argument("--batch-size", type=int, default=None, help="Number of runs submitted at once")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the design")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--screen", type=int, default=None,
+                        help="Run only this number of points, the most promising according to an emulator trained "
+                             "on the run archive (see calibration_emulator.py)")
+    parser.add_argument("--objective", default=None, help="Objective of the screening (default: the default objective)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    fixed = read_parameter_file(args.lake)
+    points = design(len(names), args.runs, args.method, args.seed)
+    print("Design %s of %s runs for %s: %s" % (args.method, args.runs, args.lake, ", ".join(names)))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        if args.screen is not None:
+            kept = screen_points(executor, ParameterSpace(names, fixed=fixed),
+                                 Objective.from_text(args.objective or default_objective), points, args.screen)[0]
+            # the points kept stay in the stratified order of the design
+            points = points[np.sort(kept)]
+        parameter_sets = [dict(fixed, **values) for values in design_values(points, names)]
+        outpath = os.path.join(executor.output_folder, "design_%s_%s_%s.csv" % (
+            args.lake, args.method, datetime.now().strftime('%Y%m%d_%H%M%S')))
+        run_design(executor, parameter_sets, args.batch_size, outpath)
+    print("Results saved: %s" % outpath)
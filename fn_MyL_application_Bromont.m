@@ -1,18 +1,19 @@
-function [MyLake_results, Sediment_results] = fn_MyL_application_Bromont(m_start,m_stop, K_sediments, K_lake, name_of_scenario, is_save_results,~,initfile, param_file,sediment_file,  enable_sediment,enable_river_inflow)
+function [MyLake_results, Sediment_results] = fn_MyL_application_Bromont(m_start,m_stop, K_sediments, K_lake, name_of_scenario, is_save_results,output_folder,initfile, param_file,sediment_file,  enable_sediment,enable_river_inflow)
 global sed_par_file lake_par_file Eevapor
 % This is the main MyLake application configuration file. INCA is a switch
 % It is made to run a after the parameter are set by Set_Prior
 
 Eevapor=0;
 % disp('init ...');
+[~, lake_name] = fileparts(output_folder);
 if is_save_results
-    load('./Postproc_code/Bromont/Bromont_result_run.mat')
+    load(sprintf('%s/%s_result_run.mat', output_folder, lake_name))
     if enable_sediment == 1
         if isempty( Sediment_results ) == 0
             initfile = MyLake_Bromont_sediment_save_init_conc(Sediment_results, 2);
         end
     end
-    initfile = MyLake_Bromont_save_result_for_init_conc(MyLake_results, 2);
+    initfile = MyLake_Bromont_save_result_for_init_conc(MyLake_results, 2, lake_name);
 else
     disp('Skipping saving the results and initial concentrations');
 end
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Monte Carlo propagation of the uncertainty of the climate forcing
+
+The forcing file of the lake is made of weather observations converted and completed by
+extract_information_from_raw_data.extract_climate() and create_inputs_model_from_obs.mylakeinput(): wind speed
+converted from km/h at the station, air pressure in kPa, a constant cloud cover of 0.65, global radiation estimated
+by the model (empty column), and the days without observation filled by the mean of the same day of the other years.
+Each climate variable is given an error model (forcing_errors):
+    - an error of the member (bias of the conversion or of the station), constant over the simulation;
+    - a daily error, AR(1) correlated from a day to the next, whose standard deviation is larger on the days filled
+      (no value in obs/climate_data.csv);
+the errors being added to the values (additive) or applied as a log-normal factor of mean 1 (multiplicative), and
+clipped to the bounds of the variable. A column without values (ex: global radiation estimated by the model) is not
+sampled.
+
+The output variance is attributed to the forcing variables by the Sobol indices of groups (the errors of a variable
+are one group, see sensitivity_indices.py): the error realisations of the matrices A and B, and of A with the errors
+of one variable of B (A_B^i) or B with the errors of one variable of A (B_A^i), N (2k + 2) runs for k variables. The
+forcing files of all runs are generated at once (runs x days x variables) and executed in parallel by RunExecutor
+(option forcing of the runs). The indices are calculated for the performances of the report and for daily series;
+for each series, the share of each variable is also given over the whole period (indices weighted by the variance of
+the days).
+
+    $ python forcing_uncertainty.py Bromont --samples 32 --workers 8
+    $ python forcing_uncertainty.py Bromont --variables "Air temperature,Wind speed,Cloud cover" --series T:surface
+
+The indices are saved in Postproc_code/<lake>/forcing_uncertainty_<lake>_<date>.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+from climate_ensemble import forcing_dates, write_forcing_files
+from run_executor import RunExecutor, forcing_columns, forcing_file, read_forcing_file, read_parameter_file, \
+    root_directory, simulation_start
+from sensitivity_indices import bootstrap_indices, figure_series_indices, output_label, output_names, output_values, \
+    parse_series, selected_series, split_outputs
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+raw_climate_file = os.path.join(root_directory, "obs", "climate_data.csv")
+# Error model of each climate variable: additive (unit of the forcing) or multiplicative (log of the factor), standard
+# deviation of the error of the member (bias), of the daily error on the days observed and on the days filled,
+# correlation of the daily error from a day to the next, and bounds of the values
+forcing_errors = {
+    "Air temperature": {"model": "additive", "bias": 0.3, "daily": 0.5, "filled": 3.0, "correlation": 0.7,
+                        "bounds": (None, None)},
+    # conversion from km/h and height of the anemometer
+    "Wind speed": {"model": "multiplicative", "bias": 0.2, "daily": 0.2, "filled": 0.5, "correlation": 0.5,
+                   "bounds": (0, None)},
+    "Air pressure": {"model": "additive", "bias": 1.0, "daily": 0.3, "filled": 1.0, "correlation": 0.9,
+                     "bounds": (None, None)},
+    "Relative humidity": {"model": "additive", "bias": 3.0, "daily": 5.0, "filled": 12.0, "correlation": 0.6,
+                          "bounds": (0, 100)},
+    "Precipitation": {"model": "multiplicative", "bias": 0.2, "daily": 0.5, "filled": 1.0, "correlation": 0.2,
+                      "bounds": (0, None)},
+    # constant value of 0.65 instead of observations
+    "Cloud cover": {"model": "additive", "bias": 0.15, "daily": 0.15, "filled": 0.15, "correlation": 0.8,
+                    "bounds": (0, 1)},
+    "Global radiation": {"model": "multiplicative", "bias": 0.1, "daily": 0.2, "filled": 0.4, "correlation": 0.5,
+                         "bounds": (0, None)}}
+default_series = "T:surface,T:deepwater,O2:deepwater"
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def filled_days(dates, raw_path: str = raw_climate_file):
+    """
+    Days of the forcing filled by mylakeinput() for each climate variable (no value in the raw climate data).
+
+    :param dates:   Days of the forcing (DatetimeIndex)
+    :return: array of booleans (days x variables of forcing_columns)
+    """
+    raw = pd.read_csv(raw_path)
+    raw["Date"] = pd.to_datetime(raw["Date"]).dt.floor("D")
+    observed = raw.groupby("Date")[[name for name in forcing_columns if name in raw.columns]].count() > 0
+    observed = observed.reindex(index=dates, columns=list(forcing_columns), fill_value=False)
+    return ~observed.values.astype(bool)
+
+
+def daily_errors(innovations, deviation, correlation: float, bias: float):
+    """
+    Errors of the members from standard normal innovations: error of the member and AR(1) daily error of unit
+    variance scaled by the standard deviation of each day.
+
+    :param innovations: Standard normal values (members x (1 + days)), the first column giving the error of the member
+    :param deviation:   Standard deviation of the daily error of each day (days)
+    :return: errors (members x days)
+    """
+    daily = innovations[:, 1:] * np.sqrt(1 - correlation ** 2)
+    # first day drawn in the stationary distribution
+    daily[:, 0] = innovations[:, 1]
+    daily = lfilter([1.0], [1.0, -correlation], daily, axis=1)
+    return bias * innovations[:, :1] + daily * np.asarray(deviation)[None, :]
+
+
+def perturbed_forcing(base, filled, innovations: dict, errors: dict = None):
+    """
+    Climate columns of the forcing of runs with the errors of the variables given.
+
+    :param base:        Climate columns of the forcing of the lake (days x variables of forcing_columns)
+    :param filled:      Days filled of each variable (see filled_days())
+    :param innovations: Standard normal innovations by variable (runs x (1 + days)), the variables without
+                        innovations keeping their values
+    :param errors:      Error models replacing those of forcing_errors
+    :return: array (runs x days x variables of forcing_columns)
+    """
+    errors = dict(forcing_errors, **(errors or {}))
+    runs = len(next(iter(innovations.values())))
+    forcing = np.repeat(np.asarray(base, dtype=float)[None, :, :], runs, axis=0)
+    for index, name in enumerate(forcing_columns):
+        if name not in innovations:
+            continue
+        model = errors[name]
+        deviation = np.where(filled[:, index], model["filled"], model["daily"])
+        error = daily_errors(innovations[name], deviation, model["correlation"], model["bias"])
+        if model["model"] == "additive":
+            values = forcing[:, :, index] + error
+        else:
+            values = forcing[:, :, index] * np.exp(error - (model["bias"] ** 2 + deviation[None, :] ** 2) / 2)
+        forcing[:, :, index] = np.clip(values, *model["bounds"]) if model["bounds"] != (None, None) else values
+    return forcing
+
+
+def group_innovations(names: list, samples: int, days: int, random):
+    """
+    Innovations of the Saltelli matrices of groups: A, B, A_B^1..A_B^k and B_A^1..B_A^k
+    (see sensitivity_indices.saltelli_sample()), the errors of a variable being one group.
+
+    :return: innovations by variable (N (2k + 2) x (1 + days))
+    """
+    count = len(names)
+    # rows of the matrices taking the innovations of B
+    from_b = np.zeros((2 * count + 2, count), dtype=bool)
+    from_b[1] = True
+    from_b[2:count + 2] = np.eye(count, dtype=bool)
+    from_b[count + 2:] = ~np.eye(count, dtype=bool)
+    innovations = {}
+    for index, name in enumerate(names):
+        a, b = random.standard_normal((2, samples, 1 + days))
+        innovations[name] = np.where(from_b[:, index, None, None], b[None], a[None]).reshape(-1, 1 + days)
+    return innovations
+
+
+def uncertainty_analysis(executor: RunExecutor, samples: int = 32, names: list = None, series: list = None,
+                         errors: dict = None, batch_size: int = None, resamples: int = 100, seed: int = None,
+                         **run_options):
+    """
+    Generate the forcings of the Saltelli matrices, run them by batches and attribute the variance of the outputs to
+    the forcing variables.
+
+    :param samples:     Number of realisations N of the matrices A and B
+    :param names:       Forcing variables sampled (default: all the variables of forcing_errors with values)
+    :param series:      Daily series analysed, list of (variable, level)
+    :param errors:      Error models replacing those of forcing_errors
+    :param batch_size:  Number of runs submitted at once (default: all)
+    :return: dictionary with the indices of the performances (DataFrame), the share of each variable in the variance
+             of the series (DataFrame), the daily indices of the series (dictionary of arrays k x series x days), the
+             dates and the variables
+    """
+    series = series or []
+    base_path = os.path.join(executor.root, "IO", executor.name, forcing_file % executor.name)
+    forcing = read_forcing_file(base_path)
+    base = forcing[:, list(forcing_columns.values())]
+    filled = filled_days(forcing_dates(forcing))
+    available = [name for index, name in enumerate(forcing_columns) if np.isfinite(base[:, index]).any()]
+    names = [name for name in (names or list(forcing_errors)) if name in available]
+    skipped = [name for name in forcing_columns if name not in available]
+    if skipped:
+        print("Not sampled (no values in the forcing file): %s" % ", ".join(skipped))
+    print("Forcing uncertainty of %s: %s (%s runs), %.0f%% of the days filled" % (
+        executor.name, ", ".join(names), samples * (2 * len(names) + 2),
+        100 * filled[:, [list(forcing_columns).index(name) for name in names]].mean()))
+
+    random = np.random.default_rng(seed)
+    innovations = group_innovations(names, samples, len(base), random)
+    paths = write_forcing_files(base_path, os.path.join(executor.output_folder, "forcing_uncertainty", "forcings"),
+                                perturbed_forcing(base, filled, innovations, errors))
+    parameters = read_parameter_file(executor.name, executor.root)
+    batch_size = batch_size or len(paths)
+    results, daily = [], None
+    for start in range(0, len(paths), batch_size):
+        # the outputs of the batch are kept by the retention until their series are read
+        keys = [executor.specification(parameters, forcing=path, **run_options)["key"]
+                for path in paths[start:start + batch_size]]
+        executor.protect(keys)
+        try:
+            futures = [executor.submit(parameters, forcing=path, **run_options)
+                       for path in paths[start:start + batch_size]]
+            batch = [future.result() for future in futures]
+            results += batch
+            if series:
+                for index, result in enumerate(batch):
+                    values = selected_series(result, series)
+                    if values is not None and daily is None:
+                        daily = np.full((len(paths),) + values.shape, np.nan, dtype=np.float32)
+                    if values is not None:
+                        daily[start + index] = values
+        finally:
+            executor.unprotect(keys)
+        print("Forcing uncertainty: %s runs done out of %s" % (len(results), len(paths)))
+    failed = sum(result["status"] != "done" for result in results)
+    if failed:
+        print("%s runs failed, their realisations are not used" % failed)
+
+    values = output_values(results)
+    indices = bootstrap_indices(*split_outputs(values, len(names)), resamples=resamples, seed=seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        deviation = np.nanstd(values[:2 * samples], axis=0)
+        variance = None if daily is None else np.nanvar(daily[:2 * samples], axis=0)
+    table = pd.DataFrame({"Output": np.tile([output_label(output) for output in output_names], len(names)),
+                          "Forcing": np.repeat(names, len(output_names)), "Std": np.tile(deviation, len(names))})
+    for name, index_values in indices.items():
+        table[name] = index_values.ravel()
+    analysis = {"table": table, "series": series, "names": names}
+    if daily is not None:
+        analysis["series_indices"] = bootstrap_indices(*split_outputs(daily, len(names)), resamples=resamples,
+                                                       seed=seed)
+        analysis["dates"] = pd.date_range(simulation_start(dict(executor.options, **run_options)),
+                                          periods=daily.shape[-1])
+        # share of the variance of the whole period: indices of the days weighted by their variance
+        lines = []
+        for position, (variable, level) in enumerate(series):
+            weights = np.where(np.isfinite(variance[position]), variance[position], 0)
+            for number, name in enumerate(names):
+                line = {"Series": "%s:%s" % (variable, level), "Forcing": name,
+                        "Std": float(np.sqrt(np.nanmean(variance[position])))}
+                for index in ["S1", "ST"]:
+                    daily_index = analysis["series_indices"][index][number, position]
+                    valid = np.isfinite(daily_index) & (weights > 0)
+                    line[index] = float(np.sum(daily_index[valid] * weights[valid]) / max(weights[valid].sum(),
+                                                                                          1e-300))
+                lines.append(line)
+        analysis["series_table"] = pd.DataFrame(lines, columns=["Series", "Forcing", "Std", "S1", "ST"])
+    return analysis
+
+
+if __name__ == "__main__":
+    from run_retention import RetentionManager
+
+    parser = argparse.ArgumentParser(description="Attribute the uncertainty of the outputs to the climate forcing.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--variables", default=None,
+                        help="Forcing variables sampled, separated by commas (default: all with values)")
+    parser.add_argument("--samples", type=int, default=32,
+                        help="Number of realisations N of the matrices A and B (N (2k + 2) runs)")
+    parser.add_argument("--series", default=default_series,
+                        help="Daily series analysed, variable:level separated by commas (default: %s)" % default_series)
+    parser.add_argument("--batch-size", type=int, default=None, help="Number of runs submitted at once")
+    parser.add_argument("--resamples", type=int, default=100, help="Number of bootstrap resamples")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the errors and of the bootstrap")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.variables.split(",")] if args.variables else None
+    unknown = [name for name in names or [] if name not in forcing_errors]
+    if unknown:
+        raise SystemExit("Unknown forcing variables: %s (choose between %s)" % (", ".join(unknown),
+                                                                               ", ".join(forcing_errors)))
+    series = parse_series(args.series)
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        analysis = uncertainty_analysis(executor, args.samples, names, series, batch_size=args.batch_size,
+                                        resamples=args.resamples, seed=args.seed)
+        folder = os.path.join(executor.output_folder, "forcing_uncertainty_%s_%s" % (
+            args.lake, datetime.now().strftime('%Y%m%d_%H%M%S')))
+    os.makedirs(folder, exist_ok=True)
+    analysis["table"].to_csv(os.path.join(folder, "indices.csv"), index=False)
+    if "series_indices" in analysis:
+        analysis["series_table"].to_csv(os.path.join(folder, "series_shares.csv"), index=False)
+        np.savez_compressed(os.path.join(folder, "series_indices.npz"), forcings=np.array(analysis["names"]),
+                            series=np.array(["%s:%s" % element for element in series]),
+                            dates=analysis["dates"].strftime("%Y%m%d").astype(int), **analysis["series_indices"])
+        figure_series_indices(analysis, analysis["names"], os.path.join(folder, "series_indices.png"),
+                              "Sobol indices of the forcing variables %s" % args.lake)
+        pd.set_option("display.width", 200)
+        print("\nShare of the variance of the series:\n%s" % analysis["series_table"].round(3).to_string(index=False))
+    print("Indices saved: %s" % folder)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Content-addressed archive of the run files
+
+The files to keep (.mat results, comparison files, input files of the runs) are stored once in an archive folder
+(Postproc_code/<lake>/archive/<2 first characters of the hash>/<hash><extension>). The archived file is a hardlink of
+the original file, and the copies asked by the scripts are then hardlinks to the archived file too. A reflink
+(copy-on-write clone) or a real copy is only done when the file is on another file system. Since the original file
+and the archived file are the same file, the scripts never modify an archived file in place: a file written again
+(ex: <lake>_result_run.mat at the next iteration) is deleted or replaced first (see remove_entry()).
+
+    archive = Archive(os.path.join("Postproc_code", "Bromont", "archive"))
+    archive.archive("Postproc_code/Bromont/Bromont_result_run.mat",
+                    "Postproc_code/Bromont/save_output_all/raw_output/Bromont_20230101_1200_ite1_result_run.mat")
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import time
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Ways to create the archive entries, tried in this order (the copy is only used across file systems)
+link_modes = ["hardlink", "reflink", "copy"]
+
+# ioctl request cloning a file on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+read_only = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+# Archived files created less than this time (s) ago are not deleted (they may be about to be linked)
+garbage_delay = 60
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def content_hash(path: str):
+    """ sha256 of the content of a file """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def reflink(source: str, destination: str):
+    """
+    Create destination as a copy-on-write clone of source (Linux only). Raise OSError if the file system does not
+    support it.
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only available on Linux")
+    import fcntl
+
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            destination_file.close()
+            os.remove(destination)
+            raise
+
+
+def link_file(source: str, destination: str, modes: list = None):
+    """
+    Create destination from source with the first possible mode of modes (hardlink, reflink or copy). The copy is
+    only done if the link modes failed because the files are on different file systems (or not supported).
+
+    :return: mode used
+    """
+    for mode in modes or link_modes:
+        try:
+            if mode == "hardlink":
+                os.link(source, destination)
+            elif mode == "reflink":
+                reflink(source, destination)
+            else:
+                shutil.copy2(source, destination)
+            return mode
+        except OSError as error:
+            if mode == "copy" or error.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP,
+                                                     errno.EINVAL, errno.ENOTTY, errno.EMLINK):
+                raise
+    raise OSError(errno.EXDEV, "No mode to link %s to %s" % (source, destination))
+
+
+def remove_entry(path: str):
+    """
+    Delete an archive entry, or a file linked to the archive before it is written again. On Windows, a read-only file
+    can not be deleted: it is made writable first.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+        os.remove(path)
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class Archive:
+    """
+    Store of read-only files identified by their content, and creation of the archive entries as links to them.
+    """
+
+    def __init__(self, folder: str):
+        """
+        :param folder:  Folder of the archived files (created if needed)
+        """
+        self.folder = folder
+
+    def object_path(self, digest: str, extension: str = ""):
+        return os.path.join(self.folder, digest[:2], digest + extension)
+
+    def store(self, path: str, modes: tuple = tuple(link_modes)):
+        """
+        Add a file to the archive. The archived file is a hardlink of the file when they are on the same file system (a
+        clone or a copy otherwise), so the file must not be modified in place afterwards. A file already in the archive
+        (same content) is not written again.
+
+        :return: path of the archived (read-only) file
+        """
+        digest = content_hash(path)
+        object_path = self.object_path(digest, os.path.splitext(path)[1])
+        if os.path.exists(object_path):
+            return object_path
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temporary = "%s.%s.temp" % (object_path, os.getpid())
+        mode = link_file(path, temporary, list(modes))
+        if mode != "hardlink":
+            os.chmod(temporary, read_only)
+        os.replace(temporary, object_path)
+        return object_path
+
+    def link(self, object_path: str, destination: str):
+        """
+        Create (or replace) destination as a link to an archived file.
+
+        :return: mode used (hardlink, reflink or copy)
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        temporary = "%s.%s.temp" % (destination, os.getpid())
+        mode = link_file(object_path, temporary)
+        os.replace(temporary, destination)
+        return mode
+
+    def archive(self, path: str, destination: str, modes: tuple = tuple(link_modes)):
+        """
+        Archive a file and create destination as a link to the archived file (replacing
+        shutil.copy2(path, destination)).
+
+        :param modes:   Modes used to add the file to the archive (see store())
+        :return: path of the archived file
+        """
+        object_path = self.store(path, modes)
+        self.link(object_path, destination)
+        return object_path
+
+    def collect_garbage(self):
+        """
+        Delete the archived files which are no longer linked by an archive entry (the entries created by a reflink or
+        a copy do not need the archived file).
+
+        :return: number of bytes freed
+        """
+        freed = 0
+        for directory, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(directory, name)
+                status = os.stat(path)
+                if status.st_nlink == 1 and not name.endswith(".temp") and \
+                        status.st_ctime < time.time() - garbage_delay:
+                    remove_entry(path)
+                    freed += status.st_size
+        return freed
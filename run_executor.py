@@ -0,0 +1,937 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Parallel execution of MyLake runs for the calibration scripts
+
+Each run is identified by a key computed from the lake name, the value of the calibrated parameters, the run options
+and the hash of the input files. A run is executed in its own workspace (Postproc_code/<lake>/runs/<key>), a copy of
+the IO/<lake> folder, so that several runs can be launched at the same time without overwriting <lake>_para.txt or
+<lake>_result_run.mat. The performances of the run are kept in the workspace (metrics.json) and reused by later
+batches; they are recalculated from the .mat file when only the observations have changed.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+
+from run_archive import Archive
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+lakes_dict = {"Bromont": "Bromont"}
+# Switch enable_river_inflow given to MyLake_Bromont_run.m for each lake (1 if not given)
+river_inflow_by_lake = {"Bromont": 1}
+
+variables_list = ['T', 'O2', 'Chl']
+depth_levels = {'surface': 1, 'deepwater': 6}
+performance_indices_names = ["RMSE", "NSE", "RSR", "Pbias", "R2", "SOS", "nrmse"]
+# Column of each variable in obs/<lake>/<lake>_observation_data.csv (see variables_by_depth)
+variable_pos = {'T': 5, 'O2': 6}  # , 'Chl': 13}
+
+# Parameters given to MyLake_Bromont_run, in the order of the calibration report. "group" is the variable (or the
+# sediment module) that the parameter is calibrated for, as in Lake.ask_parameters_value.
+parameters_registry = {
+    "kz_N0": {"default": 0.00007, "bounds": [1e-7, 1e-3], "scale": "log", "group": "T"},
+    "c_shelter": {"default": "NaN", "bounds": [0.0, 1.0], "scale": "linear", "group": "T"},
+    "i_scv": {"default": 1, "bounds": [0.5, 2.0], "scale": "linear", "group": "T"},
+    "i_sct": {"default": 0, "bounds": [-2.0, 3.0], "scale": "linear", "group": "T"},
+    "swa_b0": {"default": 2.5, "bounds": [0.5, 5.0], "scale": "linear", "group": "T"},
+    "swa_b1": {"default": 1, "bounds": [0.5, 3.0], "scale": "linear", "group": "T"},
+    "I_scDOC": {"default": 1, "bounds": [0.1, 10.0], "scale": "log", "group": "O2"},
+    "I_scO": {"default": 1, "bounds": [0.1, 5.0], "scale": "log", "group": "O2"},
+    "k_BOD": {"default": 0.1, "bounds": [0.01, 1.0], "scale": "log", "group": "O2"},
+    "I_scChl": {"default": 1, "bounds": [0.1, 5.0], "scale": "log", "group": "Chl"},
+    "k_Chl": {"default": 0.4, "bounds": [0.01, 2.0], "scale": "log", "group": "Chl"},
+    "k_POP": {"default": 0.04, "bounds": [0.001, 1.0], "scale": "log", "group": "sediment"},
+    "k_POC": {"default": 0.02, "bounds": [0.001, 1.0], "scale": "log", "group": "sediment"},
+    "k_DOP": {"default": 0.04, "bounds": [0.001, 1.0], "scale": "log", "group": "sediment"},
+    "k_DOC": {"default": 0.02, "bounds": [0.001, 1.0], "scale": "log", "group": "sediment"},
+    "k_pdesorb_a": {"default": 100, "bounds": [1.0, 1000.0], "scale": "log", "group": "sediment"},
+    "k_pdesorb_b": {"default": 100, "bounds": [1.0, 1000.0], "scale": "log", "group": "sediment"},
+}
+
+# Name of the report column when it differs from the name of the parameter
+report_columns = {"k_BOD": "K_BOD"}
+
+# Order of the parameters in the call of MyLake_Bromont_run.m
+matlab_arguments_order = ["kz_N0", "c_shelter", "i_scv", "i_sct", "swa_b0", "swa_b1", "I_scDOC", "I_scO", "I_scChl",
+                          "k_Chl", "k_BOD", "k_POP", "k_POC", "k_DOP", "k_DOC", "k_pdesorb_a", "k_pdesorb_b"]
+
+# Files of IO/<lake> needed by MyLake_Bromont_run.m ("%s" is replaced by the lake name)
+input_files = ["input_%s.txt", "mylake_initial_concentrations.txt", "%s_sediment_para.txt"]
+parameter_file = "%s_para.txt"
+forcing_file = "input_%s.txt"
+initial_state_file = "mylake_initial_concentrations.txt"
+# Columns of the forcing file (see create_inputs_model_from_obs.Simulation_informations.mylakeinput) by column of the
+# climate file (obs/climate_data_filled_interpolate.csv)
+forcing_columns = {"Global radiation": 3, "Cloud cover": 4, "Air temperature": 5, "Relative humidity": 6,
+                   "Air pressure": 7, "Wind speed": 8, "Precipitation": 9}
+# Columns of the initial state file taken from the end of a run (see MyLake_Bromont_save_result_for_init_conc.m):
+# column of the file by field of MyLake_results (T) or of MyLake_results.concentrations, in the units of MyLake
+initial_state_columns = {"T": 2, "C": 3, "POC": 4, "DOP": 6, "Chl": 7, "DOC": 8, "O2": 14, "DIC": 15, "NO3": 16,
+                         "NH4": 17, "SO4": 18, "HS": 19, "H2S": 20, "Fe2": 21, "Ca2": 22, "pH": 23, "CH4aq": 24,
+                         "Fe3": 25, "Al3": 26, "FeS": 27, "CaCO3": 28, "CH4g": 29, "POP": 30}
+
+root_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def complete_parameters(parameters: dict):
+    """
+    Give the value of all parameters of the registry, using the default value for the parameters not given.
+
+    :param parameters:  Value of some (or all) parameters, by parameter name
+    :type parameters:   dict
+
+    :return: dictionary with the value of all parameters of the registry, in the order of the registry
+    """
+    unknown = [name for name in parameters if name not in parameters_registry]
+    if unknown:
+        raise KeyError("Unknown parameter(s): %s" % ", ".join(unknown))
+    completed = {}
+    for name, information in parameters_registry.items():
+        value = parameters.get(name, information["default"])
+        if isinstance(value, str):
+            completed[name] = value
+        else:
+            completed[name] = float(value)
+    return completed
+
+
+def lake_parameters(lake):
+    """
+    Get the value of the parameters of the registry from a script_manual_calibration.Lake object.
+
+    :param lake:    Lake object with the parameters as attributes
+    :return: dictionary with the value of all parameters of the registry
+    """
+    return complete_parameters({name: getattr(lake, name) for name in parameters_registry})
+
+
+def read_parameter_file(lake_name: str, root: str = root_directory):
+    """
+    Get the value of the parameters of the registry from the parameter file of the lake (IO/<lake>/<lake>_para.txt,
+    the values of the last manual calibration). The parameters absent from the file take their default value.
+    """
+    path = os.path.join(root, "IO", lake_name, parameter_file % lake_name)
+    parameters = {}
+    if os.path.exists(path):
+        registry_names = {name.lower(): name for name in parameters_registry}
+        with open(path) as f:
+            for line in f.readlines()[2:]:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) > 1 and fields[0].lower() in registry_names:
+                    value = fields[1].strip()
+                    parameters[registry_names[fields[0].lower()]] = value if value.lower() == "nan" else float(value)
+    return complete_parameters(parameters)
+
+
+def parse_parameter_value(value):
+    """
+    Convert the value given in input for a parameter. The value can be a number, a range "start:stop:number"
+    (ex: "1.5:3.5:5" gives 1.5, 2.0, 2.5, 3.0 and 3.5) or a list "[v1,v2,...]" (ex: "[0.5,1,2]").
+    :param value: String given in input
+    :return: the value as float, or the list of values (float) for a range or a list
+    """
+    value = value.strip()
+    if value.startswith("[") and value.endswith("]"):
+        values = [float(item) for item in value[1:-1].split(",") if item.strip() != ""]
+    elif ":" in value:
+        items = value.split(":")
+        if len(items) != 3 or int(items[2]) < 1:
+            raise ValueError("Range should be given as start:stop:number, not '%s'" % value)
+        values = [float(item) for item in np.linspace(float(items[0]), float(items[1]), int(items[2]))]
+    else:
+        return float(value)
+    if len(values) == 0:
+        raise ValueError("No value given in '%s'" % value)
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def hash_files(paths: list, normalise_parameter_file: bool = False):
+    """
+    Calculate a hash of the content of the given files (missing files are included as missing).
+
+    :param paths:                       List of the files to include in the hash
+    :param normalise_parameter_file:    If True, the value of the parameters of the registry in a *_para.txt file
+                                        is removed before the hash, since it is replaced by the value of the run.
+    :return: hexadecimal hash of the files
+    """
+    digest = hashlib.sha1()
+    registry_names = [name.lower() for name in parameters_registry]
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        if not os.path.exists(path):
+            digest.update(b"missing")
+            continue
+        if normalise_parameter_file and path.endswith("_para.txt"):
+            with open(path) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if fields[0].lower() in registry_names:
+                        fields[1] = ""
+                    digest.update("\t".join(fields).encode())
+        else:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def inputs_hash(lake_name: str, root: str = root_directory):
+    """
+    Hash of the files of IO/<lake> used by the model (the parameter file without the value of the calibrated
+    parameters).
+    """
+    folder = os.path.join(root, "IO", lake_name)
+    paths = [os.path.join(folder, name % lake_name if "%s" in name else name)
+             for name in input_files + [parameter_file]]
+    return hash_files(paths, normalise_parameter_file=True)
+
+
+def observations_hash(lake_name: str, root: str = root_directory):
+    """
+    Hash of the observation files (obs/<lake>/Observed_<variable>.csv) used to calculate the performances.
+    """
+    folder = os.path.join(root, "obs", lake_name)
+    return hash_files([os.path.join(folder, "Observed_%s.csv" % variable) for variable in variables_list])
+
+
+def run_key(lake_name: str, parameters: dict, options: dict, input_hash: str):
+    """
+    Key identifying a run: two runs with the same key give the same result.
+
+    :param lake_name:   Name of the lake
+    :param parameters:  Value of the parameters (completed with the default values)
+    :param options:     Options of the run (period, sediment, inflow, solver, ...)
+    :param input_hash:  Hash of the input files (see inputs_hash())
+    :return: key of 16 hexadecimal characters
+    """
+    description = json.dumps({"lake": lake_name, "parameters": complete_parameters(parameters), "options": options,
+                              "inputs": input_hash}, sort_keys=True, default=str)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def write_parameter_file(template_path: str, parameters: dict, outpath: str):
+    """
+    Write the MyLake parameter file of a run, using the file of the lake as template and replacing the value of the
+    parameters of the registry (the name of the parameters is not case sensitive).
+    """
+    values = {name.lower(): value for name, value in parameters.items()}
+    lines = []
+    with open(template_path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 1 and fields[0].lower() in values:
+                fields[1] = "%s" % values[fields[0].lower()]
+            lines.append("\t".join(fields))
+    with open(outpath, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return outpath
+
+
+def prepare_workspace(workspace: str, lake_name: str, parameters: dict, root: str = root_directory):
+    """
+    Create the folders of a run (IO/<lake> and Postproc_code/<lake>) in the workspace, link the input files of the
+    lake (archived in Postproc_code/<lake>/archive, see run_archive.py) and write the parameter file of the run.
+    """
+    input_folder = os.path.join(workspace, "IO", lake_name)
+    output_folder = os.path.join(workspace, "Postproc_code", lake_name)
+    os.makedirs(input_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+
+    source_folder = os.path.join(root, "IO", lake_name)
+    archive = Archive(os.path.join(root, "Postproc_code", lake_name, "archive"))
+    for name in input_files:
+        filename = name % lake_name if "%s" in name else name
+        if os.path.exists(os.path.join(source_folder, filename)):
+            archive.archive(os.path.join(source_folder, filename), os.path.join(input_folder, filename))
+
+    template = os.path.join(source_folder, parameter_file % lake_name)
+    if os.path.exists(template):
+        write_parameter_file(template, parameters, os.path.join(input_folder, parameter_file % lake_name))
+    return input_folder, output_folder
+
+
+def simulation_start(options: dict):
+    """ First day of the simulation of a run (start_date if the run is a window, see data_assimilation.py) """
+    return options.get("start_date") or "%s-01-01" % options["start_year"]
+
+
+def numeric_row(line: str):
+    """ Values of a line of numbers separated by tabs, None if the line is empty or is not only numbers """
+    try:
+        return [float(value) for value in line.strip().split("\t")] if line.strip() else None
+    except ValueError:
+        return None
+
+
+def read_initial_state(path: str):
+    """
+    Read an initial state file of MyLake (mylake_initial_concentrations.txt): lines of header (3 in the input files,
+    2 in the files written by MyLake_Bromont_save_result_for_init_conc.m), then one line by depth (depth, area,
+    temperature, concentrations, ...). The header ends at the first line of numbers.
+
+    :return: lines of the header and array (depths x columns)
+    """
+    with open(path) as f:
+        lines = f.read().split("\n")
+    start = next((number for number, line in enumerate(lines) if numeric_row(line) is not None), len(lines))
+    rows = [numeric_row(line) for line in lines[start:] if line.strip()]
+    if any(row is None for row in rows):
+        raise ValueError("Initial state %s: a line after the header is not only numbers" % path)
+    return lines[:start], np.array(rows, dtype=float)
+
+
+def write_initial_state(path: str, header: list, state):
+    """ Write an initial state file of MyLake (see read_initial_state()) """
+    with open(path, "w") as f:
+        f.write("\n".join(header) + "\n")
+        for row in np.asarray(state, dtype=float):
+            f.write("\t".join("%.6g" % value for value in row) + "\n")
+
+
+def read_forcing_file(path: str):
+    """
+    Read a forcing file of MyLake (IO/<lake>/input_<lake>.txt): 2 lines of header, then one line by day (year, month,
+    day, climate, inflows, ...).
+
+    :return: array (days x columns)
+    """
+    return np.loadtxt(path, comments="#", delimiter="\t", ndmin=2)
+
+
+def install_input_file(workspace: str, lake_name: str, filename: str, source: str):
+    """ Replace an input file of the workspace of a run (a link to the archive) by a copy of source """
+    destination = os.path.join(workspace, "IO", lake_name, filename)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    with open(source) as f, open(destination, "w") as g:
+        g.write(f.read())
+
+
+def matlab_date(date: str, year: int):
+    """ MATLAB argument of the start or the stop of a run: the year, or [year,month,day] for a date """
+    if not date:
+        return "%d" % year
+    day = pd.Timestamp(date)
+    return "[%d,%d,%d]" % (day.year, day.month, day.day)
+
+
+def matlab_value(value):
+    """ Format a parameter value as a MATLAB argument (the strings, as 'NaN' for c_shelter, are quoted) """
+    if isinstance(value, str):
+        return "'%s'" % value
+    return "%.10g" % value
+
+
+def matlab_solver(workspace: str, lake_name: str, parameters: dict, start_year: int = 2018, stop_year: int = 2021,
+                  enable_sediment: int = 0, enable_river_inflow: int = 1, save_initial_conditions: int = 0,
+                  dz: float = 0.5, matlab: str = "matlab", root: str = root_directory, start_date: str = None,
+                  stop_date: str = None, initial_state: str = None, forcing: str = None):
+    """
+    Run MyLake_Bromont_run.m with MATLAB in the workspace of the run (without the interactive window).
+
+    :param dz:              Depth resolution of the layers (m), ex: 1 or 2 for cheap runs (see
+                            calibration_multifidelity.py)
+    :param start_date:      First day of the run (yyyy-mm-dd) instead of January 1 of start_year
+    :param stop_date:       Last day of the run instead of December 31 of stop_year
+    :param initial_state:   Initial state file replacing mylake_initial_concentrations.txt (see data_assimilation.py)
+    :param forcing:         Forcing file replacing input_<lake>.txt (see climate_ensemble.py)
+
+    :return: path to the .mat file with the results of the run
+    """
+    paths = ["addpath('%s')" % root.replace("\\", "/")]
+    for submodule in ["MyLake-v2.0", "Sediment-v2.0"]:
+        if os.path.exists(os.path.join(root, submodule)):
+            paths.append("addpath(genpath('%s'))" % os.path.join(root, submodule).replace("\\", "/"))
+    if initial_state is not None:
+        install_input_file(workspace, lake_name, initial_state_file, initial_state)
+    if forcing is not None:
+        install_input_file(workspace, lake_name, forcing_file % lake_name, forcing)
+    arguments = ",".join([matlab_value(parameters[name]) for name in matlab_arguments_order])
+    command = "%s; MyLake_Bromont_run(%s,%s,'%s',%s,%d,%d,%d,%s)" % (
+        "; ".join(paths), matlab_date(start_date, start_year), matlab_date(stop_date, stop_year), lake_name,
+        arguments, enable_sediment, enable_river_inflow, save_initial_conditions, matlab_value(dz))
+
+    with open(os.path.join(workspace, "matlab.log"), "w") as log:
+        subprocess.run([matlab, "-batch", command], cwd=workspace, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return os.path.join(workspace, "Postproc_code", lake_name, "%s_result_run.mat" % lake_name)
+
+
+def stand_in_solver(workspace: str, lake_name: str, parameters: dict, start_year: int = 2018, stop_year: int = 2021,
+                    enable_sediment: int = 0, enable_river_inflow: int = 1, save_initial_conditions: int = 0,
+                    dz: float = 0.5, root: str = root_directory, start_date: str = None, stop_date: str = None,
+                    initial_state: str = None, forcing: str = None, **kwargs):
+    """
+    Cheap analytical replacement of MyLake used to test the calibration tools without MATLAB.
+
+    It writes a .mat file with the same structure as MyLake_Bromont_run.m (MyLake_results.T and
+    MyLake_results.concentrations.O2/Chl, layers x days, O2 in mg/m3). The profiles are seasonal and react smoothly
+    to the parameters (light attenuation and mixing for the temperature, DOC and BOD for the oxygen, ...); they are
+    not a simulation of the lake. With an initial state, the difference between the initial profiles and the
+    seasonal profiles of the first day decreases with a time scale of 15 days. With a forcing file, the profiles
+    follow the difference between its air temperature and the air temperature of the file of the lake (30-day mean).
+
+    :return: path to the .mat file with the results of the run
+    """
+    with open(os.path.join(root, "obs", lake_name, "%s_bathymetry.csv" % lake_name)) as bathymetry:
+        max_depth = float(bathymetry.read().strip().split("\n")[-1].split(",")[1])
+    depth = np.arange(0, max_depth, dz)
+    days = pd.date_range(start_date or "%s-01-01" % start_year, stop_date or "%s-12-31" % stop_year)
+    season = np.sin(2 * np.pi * (days.dayofyear.values - 105) / 365.25)
+
+    def value(name):
+        parameter = parameters[name]
+        return parameters_registry[name]["default"] if isinstance(parameter, str) else parameter
+
+    shelter = 0.5 if isinstance(parameters["c_shelter"], str) else parameters["c_shelter"]
+    mixing_depth = 1.0 + 2.0 / (value("swa_b0") + 0.5 * value("swa_b1")) + 0.5 * (1 - shelter) \
+        + 0.2 * np.log10(value("kz_N0") / 7e-5 + 1e-12)
+    surface = np.clip(12 + 14 * season + value("i_sct") * 0.3 * value("i_scv"), 0, None)
+    bottom = 4 + 4 * np.clip(season, 0, None) / (1 + value("swa_b0"))
+    stratification = 1 / (1 + np.exp((depth[:, None] - mixing_depth * (1 + np.clip(-season, 0, None) * 4)) / 0.6))
+    temperature = bottom + (surface - bottom) * stratification
+
+    if forcing is not None:
+        air = []
+        for path in [forcing, os.path.join(root, "IO", lake_name, forcing_file % lake_name)]:
+            table = read_forcing_file(path)
+            index = pd.to_datetime(pd.DataFrame(table[:, :3].astype(int), columns=["year", "month", "day"]))
+            air.append(pd.Series(table[:, forcing_columns["Air temperature"]], index=index).reindex(days))
+        anomaly = (air[0] - air[1]).rolling(30, min_periods=1).mean().fillna(0).values
+        temperature = np.clip(temperature + anomaly[None, :] * (0.3 + 0.7 * stratification), 0, None)
+
+    demand = value("k_BOD") * value("I_scDOC") * (1 - stratification) * np.clip(season + 0.3, 0, None)
+    oxygen = np.clip(14.6 - 0.39 * temperature + np.log(value("I_scO")) - 20 * demand, 0, None) * 1000
+
+    chlorophyll = value("I_scChl") * (3 + 8 * np.clip(season, 0, None)) * np.exp(-depth[:, None] * value("k_Chl")) \
+        * np.exp(-value("swa_b1") * 0.2 * depth[:, None])
+
+    if initial_state is not None:
+        state = read_initial_state(initial_state)[1]
+        memory = np.exp(-np.arange(len(days)) / 15.0)
+        for profiles, column in [(temperature, initial_state_columns["T"]), (oxygen, initial_state_columns["O2"])]:
+            initial = np.interp(depth, state[:, 0], state[:, column])
+            profiles += (initial - profiles[:, 0])[:, None] * memory[None, :]
+        oxygen = np.clip(oxygen, 0, None)
+
+    output_folder = os.path.join(workspace, "Postproc_code", lake_name)
+    os.makedirs(output_folder, exist_ok=True)
+    outpath = os.path.join(output_folder, "%s_result_run.mat" % lake_name)
+    sio.savemat(outpath, {"MyLake_results": {"T": temperature, "concentrations": {"O2": oxygen, "Chl": chlorophyll}},
+                          "Sediment_results": np.zeros((0, 0))})
+    return outpath
+
+
+solvers = {"matlab": matlab_solver, "stand-in": stand_in_solver}
+
+
+def load_results(path: str):
+    """ Read the MyLake results of a .mat file (see script_manual_calibration.load_data) """
+    try:
+        mat_contents = sio.loadmat(path)
+    except NotImplementedError:
+        import hdf5storage
+        mat_contents = hdf5storage.loadmat(path)
+    return mat_contents['MyLake_results']
+
+
+def simulated_variable(water, variable: str):
+    """
+    Get the simulated variable (layers x days) from the MyLake results, in the unit of the observations
+    (O2 from mg/m3 to mg/L).
+    """
+    if variable == "T":
+        data = np.asarray(water['T'][0, 0], dtype=float)
+    else:
+        data = np.asarray(water['concentrations'][0, 0][variable][0, 0], dtype=float)
+    if variable == "O2":
+        data = data * 0.001
+    return data
+
+
+def variables_by_depth(observation_folder, lakeName, output_folder, variable='T'):
+    """
+    Creates a new csv file with the observed temperatures separated in columns by depths.
+    :param observation_folder: String
+    :param lakeName: String
+    :param output_folder: String
+    :return: None
+    """
+    test = "{}/{}_bathymetry.csv".format(observation_folder, lakeName)
+
+    with open("{}/{}_bathymetry.csv".format(observation_folder, lakeName)) as bathymetric_file:
+        maxDepth = int(float(list(csv.reader(bathymetric_file))[-1][1]))
+        depthLevels = list(range(maxDepth + 1))
+
+    with open("{}/{}_observation_data.csv".format(observation_folder, lakeName)) as obs_file:
+        reader = list(csv.reader(obs_file))[1:]
+        depthlist = []
+        loop = 0
+        for depth in reader:
+            depth[3] = maxDepth + float(depth[3])
+            if float(depth[3]) not in depthlist:
+                depthlist.append(float(depth[3]))
+            elif float(depth[3]) == depthlist[0]:
+                loop += 1
+            if loop == 1000:
+                break
+        outputdir2 = list(output_folder.split("/"))
+        outputdir3 = 'Postproc_code'
+        if not os.path.exists(outputdir3):
+            os.mkdir(outputdir3)
+        outputdir3 = os.path.join(outputdir3, lakeName)
+        if not os.path.exists(outputdir3):
+            os.mkdir(outputdir3)
+
+        depthlist.sort()
+
+        with open("{}/Observed_{}.csv".format(observation_folder, variable), "w", newline='') as csvfile:
+            print("{}/Observed_{}.csv".format(observation_folder, variable))
+            header = "{}, {}\n".format(np.nan, depthlist)
+            csvfile.write(header.translate({ord(i): None for i in '[]'}))
+
+            out = csv.writer(csvfile)
+            rows = {}
+            dates = []
+            for i in depthlist:
+                rows[i] = []
+
+            for observation in reader:
+                obs_date = observation[2]  # "%s%s%s"%(observation[2][0:3],observation[2][4:5],observation[2][5:])
+                if obs_date not in dates:
+                    dates.append(obs_date)
+                    # print(obs_date)
+
+            temp_list = []
+            number = 0
+            for date in dates:
+                for observation in reader:
+                    # print(int(observation[2]), date)
+                    if str(observation[2]) == str(date):
+                        temp_list.append(observation)
+
+                for depth in depthlist:
+
+                    missing_temp = True
+
+                    for t in temp_list:
+
+                        if float(t[3]) == depth:
+
+                            if len(rows[depth]) <= number:
+                                if t[variable_pos[variable]] == "":
+                                    rows[depth].append("None")
+                                else:
+                                    rows[depth].append(float(t[variable_pos[variable]]))
+
+                                missing_temp = False
+
+                    if missing_temp:
+                        rows[depth].append("None")
+                number += 1
+                temp_list.clear()
+            temp_list.clear()
+            for date in dates:
+                temp_list.append(date)
+                for x in depthlist:
+                    temp_list.append(rows[x][dates.index(date)])
+                out.writerow(temp_list)
+                temp_list.clear()
+
+    print("observation done ... ... ... ... ")
+
+
+def read_observations(observation_folder: str, variable: str):
+    """
+    Read the observations by depth (obs/<lake>/Observed_<variable>.csv, see variables_by_depth)
+
+    :return: DataFrame with the dates as index and the depths (float) as columns
+    """
+    observed = pd.read_csv(os.path.join(observation_folder, "Observed_%s.csv" % variable), index_col=0,
+                           na_values=["None"], skipinitialspace=True)
+    observed.index = pd.to_datetime(observed.index)
+    observed.columns = [float(column) for column in observed.columns]
+    return observed.astype(float)
+
+
+def compare_with_observations(simulated, observed: pd.DataFrame, start_date: str = "2018-01-01", dz: float = 0.5):
+    """
+    Match the simulated profiles with the observations, as the *_comparisonall.csv files of
+    Lake.make_comparison_file_allobs. The simulated values at the depth of the observations are interpolated
+    linearly between the two nearest layers.
+
+    :param simulated:   Simulated variable, layers x days, the first day being start_date
+    :param observed:    Observations by depth (see read_observations())
+    :param start_date:  First day of the simulation
+    :param dz:          Depth resolution of the simulation (m)
+
+    :return: DataFrame with the columns Date (yyyymmdd), Depth, Observations, Simulations and Datetime
+    """
+    simulated = np.asarray(simulated, dtype=float)
+    days = pd.date_range(start_date, periods=simulated.shape[1])
+    observed = observed[observed.index.isin(days)]
+    depths = np.asarray(observed.columns, dtype=float)
+
+    position = depths / dz
+    lower = np.clip(np.floor(position).astype(int), 0, simulated.shape[0] - 1)
+    upper = np.clip(lower + 1, 0, simulated.shape[0] - 1)
+    weight = (position - lower)[:, None]
+    profiles = simulated[:, days.get_indexer(observed.index)]
+    values = profiles[lower, :] * (1 - weight) + profiles[upper, :] * weight
+    values[(depths < 0) | (depths > (simulated.shape[0] - 1) * dz), :] = np.nan
+
+    comparison = pd.DataFrame({
+        "Datetime": np.tile(observed.index.values, len(depths)),
+        "Depth": np.repeat(depths, len(observed.index)),
+        "Observations": observed.values.T.ravel(),
+        "Simulations": values.ravel()})
+    comparison = comparison.dropna().sort_values(["Datetime", "Depth"], kind="stable").reset_index(drop=True)
+    comparison.insert(0, "Date", comparison["Datetime"].dt.strftime("%Y%m%d").astype(int))
+    return comparison[["Date", "Depth", "Observations", "Simulations", "Datetime"]]
+
+
+def performance_indices(observations, simulations):
+    """
+    Calculate the performance indices of Lake.stats_lake (RMSE, NSE, RSR, Pbias, R2, SOS and nrmse) along the last
+    axis. The simulations can have more dimensions than the observations (ex: runs x observations) to score several
+    runs at once; the missing values (nan) are ignored.
+
+    :return: array (..., 7) with the indices in the order of performance_indices_names
+    """
+    observations = np.asarray(observations, dtype=float)
+    simulations = np.asarray(simulations, dtype=float)
+    observations = np.broadcast_to(observations, np.broadcast_shapes(observations.shape, simulations.shape))
+    valid = np.isfinite(observations) & np.isfinite(simulations)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        number = valid.sum(axis=-1)
+        obs = np.where(valid, observations, 0.0)
+        sim = np.where(valid, simulations, 0.0)
+        residuals = np.where(valid, observations - simulations, 0.0)
+        sos = (residuals ** 2).sum(axis=-1)
+        rmse = np.sqrt(sos / number)
+        obs_anomaly = np.where(valid, obs - (obs.sum(axis=-1) / number)[..., None], 0.0)
+        sim_anomaly = np.where(valid, sim - (sim.sum(axis=-1) / number)[..., None], 0.0)
+        obs_variance = (obs_anomaly ** 2).sum(axis=-1)
+        nse = 1 - sos / obs_variance
+        rsr = rmse / np.sqrt(obs_variance / (number - 1))
+        obs_sum = obs.sum(axis=-1)
+        pbias = np.where(obs_sum != 0, residuals.sum(axis=-1) * 100 / obs_sum, 0.0)
+        r2 = ((obs_anomaly * sim_anomaly).sum(axis=-1) / np.sqrt(obs_variance * (sim_anomaly ** 2).sum(axis=-1))) ** 2
+        obs_range = np.where(valid, observations, -np.inf).max(axis=-1, initial=-np.inf) - \
+            np.where(valid, observations, np.inf).min(axis=-1, initial=np.inf)
+        nrmse = rmse / obs_range
+
+    indices = np.stack([rmse, nse, rsr, pbias, r2, sos, nrmse], axis=-1)
+    indices[number < 2] = np.nan
+    return indices
+
+
+def comparisons_with_observations(water, observation_folder: str, start_date: str = "2018-01-01", dz: float = 0.5,
+                                  observations: dict = None):
+    """
+    Match the simulations of a run with the observations of each variable (see compare_with_observations()).
+
+    :param water:               MyLake results (see load_results())
+    :param observation_folder:  Folder with the Observed_<variable>.csv files
+    :param observations:        Observations already read, by variable (optional, read from the folder otherwise)
+
+    :return: dictionary with the comparison table of each variable of variables_list
+    """
+    comparisons = {}
+    for variable in variables_list:
+        if observations is not None:
+            observed = observations[variable]
+        else:
+            observed = read_observations(observation_folder, variable)
+        comparisons[variable] = compare_with_observations(simulated_variable(water, variable), observed, start_date, dz)
+    return comparisons
+
+
+def metrics_from_comparisons(comparisons: dict):
+    """
+    Calculate the performances of a run as in the calibration report: RMSE and R (linear regression) for all depths,
+    and the performance indices at the surface and deepwater levels, for each variable.
+
+    :param comparisons: Comparison table of each variable (see comparisons_with_observations())
+    :return: dictionary with the columns of the report (RMSE_all, R2_all, RMSE, NSE, RSR, Pbias, R2, SOS and nrmse)
+    """
+    metrics = {"RMSE_all": [], "R2_all": []}
+    for name in performance_indices_names:
+        metrics[name] = []
+
+    for variable in variables_list:
+        comparison = comparisons[variable]
+        indices = performance_indices(comparison["Observations"].values, comparison["Simulations"].values)
+        if len(comparison) > 1:
+            r_value = np.corrcoef(comparison["Observations"].values, comparison["Simulations"].values)[0, 1]
+        else:
+            r_value = np.nan
+        metrics["RMSE_all"].append(round(float(indices[0]), 3))
+        metrics["R2_all"].append(round(float(r_value), 3))
+
+        by_level = []
+        for level in ["surface", "deepwater"]:
+            at_level = comparison[comparison["Depth"] == depth_levels[level]]
+            by_level.append(performance_indices(at_level["Observations"].values, at_level["Simulations"].values))
+        for position, name in enumerate(performance_indices_names):
+            metrics[name].append([round(float(indices[position]), 3) for indices in by_level])
+    return metrics
+
+
+def score_results(water, observation_folder: str, start_date: str = "2018-01-01", dz: float = 0.5,
+                  observations: dict = None):
+    """
+    Calculate the performances of a run (see comparisons_with_observations() and metrics_from_comparisons()).
+
+    :return: dictionary with the columns of the report (RMSE_all, R2_all, RMSE, NSE, RSR, Pbias, R2, SOS and nrmse)
+    """
+    return metrics_from_comparisons(comparisons_with_observations(water, observation_folder, start_date, dz,
+                                                                  observations))
+
+
+def execute_run(specification: dict):
+    """
+    Execute one run (in a worker process): prepare the workspace, launch the solver and calculate the performances.
+    The result is also written in the workspace (metrics.json).
+
+    :param specification:   Dictionary given by RunExecutor.specification()
+    :return: dictionary with the key, parameters, metrics, path of the result file, duration and status of the run
+    """
+    start = time.time()
+    workspace = specification["workspace"]
+    lake_name = specification["lake"]
+    parameters = specification["parameters"]
+    options = specification["options"]
+    result = {"key": specification["key"], "lake": lake_name, "parameters": parameters, "options": options,
+              "inputs_hash": specification["inputs_hash"], "observations_hash": specification["observations_hash"],
+              "workspace": workspace, "result_file": None, "metrics": None, "status": "failed", "error": None,
+              "date": datetime.now().strftime('%Y%m%d_%H%M%S')}
+    try:
+        prepare_workspace(workspace, lake_name, parameters, specification["root"])
+        solver_options = {name: value for name, value in options.items() if name != "solver"}
+        result["result_file"] = solvers[options["solver"]](workspace, lake_name, parameters,
+                                                           root=specification["root"], **solver_options)
+        result["metrics"] = score_results(load_results(result["result_file"]),
+                                          os.path.join(specification["root"], "obs", lake_name),
+                                          simulation_start(options), options.get("dz", 0.5))
+        result["status"] = "done"
+    except Exception as error:
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+    result["duration"] = round(time.time() - start, 3)
+
+    with open(os.path.join(workspace, "metrics.json"), "w") as f:
+        json.dump(result, f, indent=1, default=str)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class RunExecutor:
+    """
+    Pool of workers running MyLake for a lake. The runs already done (same key) are not launched again: their
+    result is read in their workspace, and their performances are recalculated if the observations have changed.
+    Identical runs submitted at the same time are executed only once.
+
+    Example:
+        with RunExecutor("Bromont", max_workers=4) as executor:
+            results = executor.run_batch([{"swa_b0": 1.5}, {"swa_b0": 2.5}])
+    """
+
+    def __init__(self, lake_name: str, max_workers: int = None, solver: str = "matlab", start_year: int = 2018,
+                 stop_year: int = 2021, enable_sediment: int = 0, enable_river_inflow: int = None,
+                 matlab: str = "matlab", root: str = root_directory, use_cache: bool = True, pool=None,
+                 retention=None):
+        """
+        :param lake_name:           Name of the lake (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)
+        :param max_workers:         Number of runs executed at the same time (default: number of processors)
+        :param solver:              "matlab" to run MyLake, "stand-in" to use the analytical replacement
+        :param use_cache:           If False, runs are always launched again
+        :param enable_river_inflow: 1 to use the inflows of the input file (default: river_inflow_by_lake)
+        :param pool:                concurrent.futures executor shared with other lakes (see script_multi_lake.py);
+                                    it is not shut down by close()
+        :param retention:           RetentionManager of the lake (see run_retention.py), applied after each run to
+                                    keep the outputs under its quota
+        """
+        if solver not in solvers:
+            raise ValueError("Solver '%s' is not an option, choose between %s" % (solver, ", ".join(solvers)))
+        self.name = lake_name
+        self.root = root
+        self.output_folder = os.path.join(root, "Postproc_code", lake_name)
+        self.observation_folder = os.path.join(root, "obs", lake_name)
+        self.runs_folder = os.path.join(self.output_folder, "runs")
+        self.use_cache = use_cache
+        if enable_river_inflow is None:
+            enable_river_inflow = river_inflow_by_lake.get(lake_name, 1)
+        self.options = {"solver": solver, "start_year": start_year, "stop_year": stop_year,
+                        "enable_sediment": enable_sediment, "enable_river_inflow": enable_river_inflow}
+        if solver == "matlab":
+            self.options["matlab"] = matlab
+
+        self.inputs_hash = inputs_hash(lake_name, root)
+        self.observations_hash = observations_hash(lake_name, root)
+        self.shared_pool = pool is not None
+        self.pool = pool if self.shared_pool else concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        self.in_flight = {}
+        # keys of the runs of the batches in progress (number of batches using each), kept by the retention
+        self.protected = {}
+        self.lock = threading.Lock()
+        self.retention = retention
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self.shared_pool:
+            self.pool.shutdown(wait=True)
+
+    def key(self, parameters: dict, **options):
+        """ Key of the run with these parameters (and the options of the executor, updated by options) """
+        key_options = {name: value for name, value in dict(self.options, **options).items() if name != "matlab"}
+        return run_key(self.name, parameters, key_options, self.inputs_hash)
+
+    def specification(self, parameters: dict, **options):
+        """ Description of a run given to execute_run() """
+        parameters = complete_parameters(parameters)
+        key = self.key(parameters, **options)
+        return {"key": key, "lake": self.name, "parameters": parameters, "options": dict(self.options, **options),
+                "inputs_hash": self.inputs_hash, "observations_hash": self.observations_hash,
+                "workspace": os.path.join(self.runs_folder, key), "root": self.root}
+
+    def cached_result(self, specification: dict, require_output: bool = False):
+        """
+        Result of a run already done, or None. The performances are recalculated (without running the model again)
+        if the observations have changed since the run.
+
+        :param require_output: If True, None is also returned when the output file of the run no longer exists (ex:
+                               deleted by the retention), so that the run is done again
+        """
+        path = os.path.join(specification["workspace"], "metrics.json")
+        if not self.use_cache or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            result = json.load(f)
+        if result["status"] != "done":
+            return None
+        if require_output and (result["result_file"] is None or not os.path.exists(result["result_file"])):
+            return None
+        # last use of the run, for the retention of the outputs (see run_retention.py)
+        os.utime(path)
+        if result["observations_hash"] != self.observations_hash:
+            if result["result_file"] is None or not os.path.exists(result["result_file"]):
+                return None
+            result["metrics"] = score_results(load_results(result["result_file"]), self.observation_folder,
+                                              simulation_start(result["options"]),
+                                              result["options"].get("dz", 0.5))
+            result["observations_hash"] = self.observations_hash
+            with open(path, "w") as f:
+                json.dump(result, f, indent=1, default=str)
+        return result
+
+    def submit(self, parameters: dict, **options):
+        """
+        Submit a run to the pool.
+
+        :param parameters:  Value of the parameters (the others take their default value)
+        :param options:     Options of the run replacing those of the executor (ex: enable_sediment=1)
+        :return: concurrent.futures.Future giving the result of the run (see execute_run())
+        """
+        specification = self.specification(parameters, **options)
+        with self.lock:
+            if specification["key"] in self.in_flight:
+                return self.in_flight[specification["key"]]
+            cached = self.cached_result(specification, require_output=True)
+            if cached is not None:
+                future = concurrent.futures.Future()
+                future.set_result(cached)
+                return future
+            os.makedirs(specification["workspace"], exist_ok=True)
+            future = self.pool.submit(execute_run, specification)
+            self.in_flight[specification["key"]] = future
+        future.add_done_callback(lambda _: self.release(specification["key"]))
+        return future
+
+    def release(self, key: str):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            exclude = set(self.in_flight) | set(self.protected)
+        if self.retention is not None:
+            self.retention.enforce(exclude=exclude)
+
+    def protect(self, keys):
+        """ Keep the outputs of these runs from the retention until unprotect(keys) """
+        with self.lock:
+            for key in keys:
+                self.protected[key] = self.protected.get(key, 0) + 1
+
+    def unprotect(self, keys):
+        with self.lock:
+            for key in keys:
+                self.protected[key] -= 1
+                if self.protected[key] == 0:
+                    del self.protected[key]
+
+    def run_batch(self, parameters_list: list, **options):
+        """
+        Run a batch of parameter sets in parallel and wait for all results. The outputs of the runs of the batch are
+        kept by the retention until the batch returns.
+
+        :return: list of results, in the order of parameters_list
+        """
+        keys = [self.specification(parameters, **options)["key"] for parameters in parameters_list]
+        self.protect(keys)
+        try:
+            futures = [self.submit(parameters, **options) for parameters in parameters_list]
+            return [future.result() for future in futures]
+        finally:
+            self.unprotect(keys)
+
+    def archived_results(self, **options):
+        """
+        Results of the runs of the runs folder done with the current input files and the options of the executor
+        (updated by options), ex: the runs of earlier sweeps or calibrations.
+
+        :return: list of results (see execute_run()), performances recalculated if the observations have changed
+        """
+        key_options = {name: value for name, value in dict(self.options, **options).items() if name != "matlab"}
+        results = []
+        for path in sorted(glob.glob(os.path.join(self.runs_folder, "*", "metrics.json"))):
+            try:
+                with open(path) as f:
+                    archived = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if archived.get("status") != "done" or archived.get("inputs_hash") != self.inputs_hash:
+                continue
+            if {name: value for name, value in archived["options"].items() if name != "matlab"} != key_options:
+                continue
+            result = self.cached_result(self.specification(archived["parameters"], **options))
+            if result is not None:
+                results.append(result)
+        return results
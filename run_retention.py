@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Retention of the outputs of the runs
+
+The runs of RunExecutor (Postproc_code/<lake>/runs/<key>) and the outputs saved by the manual calibration
+(Postproc_code/<lake>/save_output_all/raw_output and comparison_output) are kept until their total size reaches the
+quota of the lake. The files of the archive (see run_archive.py) are counted once, whatever their number of links. The
+bulk files (.mat, comparison files, copies of the inputs) of the runs used the least recently are then deleted, except
+for the best runs of each variable (lowest RMSE for all depths). The compact performances are always kept:
+metrics.json in the folder of the runs, and save_output_all/saved_metrics.jsonl for the outputs of the manual
+calibration.
+
+    $ python run_retention.py Bromont --quota 20G --keep 5
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from run_archive import Archive, remove_entry
+from run_executor import root_directory, variables_list
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Number of runs never deleted for each variable, and the performance used to rank them (lower is better)
+keep_top_runs = 5
+score_metric = "RMSE_all"
+
+size_units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def parse_size(size):
+    """ Convert a size given as a number of bytes or a text like "500M" or "20G" into a number of bytes """
+    if size is None or isinstance(size, (int, float)):
+        return size
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)B?\s*", size.upper())
+    if match is None:
+        raise ValueError("Size '%s' is not an option, use a number of bytes or a number followed by K, M, G or T"
+                         % size)
+    return int(float(match.group(1)) * size_units[match.group(2)])
+
+
+def archive_objects(folder: str):
+    """
+    Files of the archive of a lake (see run_archive.py).
+
+    :return: dictionary with the status (os.stat) of each archived file, by (device, inode)
+    """
+    objects = {}
+    for directory, _, names in os.walk(folder):
+        for name in names:
+            if not name.endswith(".temp"):
+                status = os.stat(os.path.join(directory, name))
+                objects[(status.st_dev, status.st_ino)] = status
+    return objects
+
+
+def files_links(paths: list, objects: dict):
+    """
+    Size of the files which are not linked to the archive (a file with several links is counted once), and number of
+    links to each archived file among the files. The missing files are ignored.
+
+    :param objects: Archived files (see archive_objects())
+    :return: size (bytes), dictionary with the number of links by archived file (device, inode)
+    """
+    size = 0
+    seen = set()
+    links = {}
+    for path in paths:
+        if os.path.isfile(path):
+            status = os.stat(path)
+            inode = (status.st_dev, status.st_ino)
+            if inode in objects:
+                links[inode] = links.get(inode, 0) + 1
+            elif inode not in seen:
+                seen.add(inode)
+                size += status.st_size
+    return size, links
+
+
+def freed_size(item: dict, objects: dict, removed: dict = None):
+    """
+    Size freed by deleting the files of an item: its files which are not linked to the archive, and the archived files
+    whose last links (besides the archived file itself) are deleted, since Archive.collect_garbage() then deletes them.
+
+    :param removed: Number of links to each archived file already deleted (updated with the links of the item)
+    """
+    removed = {} if removed is None else removed
+    size = item["unlinked_size"]
+    for inode, count in item["links"].items():
+        before = removed.get(inode, 0)
+        removed[inode] = before + count
+        if before < objects[inode].st_nlink - 1 <= removed[inode]:
+            size += objects[inode].st_size
+    return size
+
+
+def folder_files(folder: str, excluded: tuple = ()):
+    """ List all files of a folder and its sub-folders, except the files named in excluded """
+    paths = []
+    for directory, _, names in os.walk(folder):
+        paths.extend(os.path.join(directory, name) for name in names if name not in excluded)
+    return paths
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class RetentionManager:
+    """
+    Keep the outputs of the runs of a lake under a quota.
+
+    Example:
+        retention = RetentionManager("Bromont", quota="20G")
+        with RunExecutor("Bromont", retention=retention) as executor:
+            executor.run_batch(parameter_sets)
+    """
+
+    def __init__(self, lake_name: str, quota=None, keep_top: int = keep_top_runs, root: str = root_directory):
+        """
+        :param lake_name:   Name of the lake (folder Postproc_code/<lake>)
+        :param quota:       Maximum size of the outputs, in bytes or as a text like "20G" (None: no limit)
+        :param keep_top:    Number of the best runs of each variable that are never deleted
+        """
+        self.name = lake_name
+        self.quota = parse_size(quota)
+        self.keep_top = keep_top
+        self.output_folder = os.path.join(root, "Postproc_code", lake_name)
+        self.runs_folder = os.path.join(self.output_folder, "runs")
+        self.saved_output_folder = os.path.join(self.output_folder, "save_output_all")
+        self.saved_metrics_file = os.path.join(self.saved_output_folder, "saved_metrics.jsonl")
+        self.archive = Archive(os.path.join(self.output_folder, "archive"))
+        self.lock = threading.Lock()
+
+    def record_saved_output(self, name: str, parameters: dict, metrics: dict):
+        """
+        Keep the performances of an iteration of the manual calibration whose outputs are saved in save_output_all.
+
+        :param name:        Beginning of the name of the saved files (<lake>_<date>_ite<iteration>)
+        :param parameters:  Value of the parameters of the iteration
+        :param metrics:     Performances of the iteration (columns of the report, see run_executor.score_results())
+        """
+        os.makedirs(self.saved_output_folder, exist_ok=True)
+        with self.lock, open(self.saved_metrics_file, "a") as f:
+            f.write(json.dumps({"name": name, "parameters": parameters, "metrics": metrics,
+                                "date": datetime.now().strftime('%Y%m%d_%H%M%S')}, default=str) + "\n")
+
+    def saved_metrics(self):
+        """ Performances of the iterations of the manual calibration saved with record_saved_output(), by name """
+        metrics = {}
+        if os.path.exists(self.saved_metrics_file):
+            with open(self.saved_metrics_file) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        metrics[record["name"]] = record["metrics"]
+        return metrics
+
+    def run_items(self, objects: dict):
+        """
+        Outputs of the runs of RunExecutor: one item by workspace, with all its files except metrics.json.
+
+        :param objects: Archived files (see archive_objects())
+        :return: list of dictionaries with the name, files, sizes, last use (time) and scores of each item
+        """
+        items = []
+        for metrics_path in glob.glob(os.path.join(self.runs_folder, "*", "metrics.json")):
+            try:
+                with open(metrics_path) as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                continue
+            files = folder_files(os.path.dirname(metrics_path), excluded=("metrics.json",))
+            scores = result["metrics"][score_metric] if result.get("metrics") else None
+            unlinked_size, links = files_links(files, objects)
+            items.append({"name": os.path.basename(os.path.dirname(metrics_path)), "kind": "run", "files": files,
+                          "unlinked_size": unlinked_size, "links": links,
+                          "last_used": os.path.getmtime(metrics_path), "scores": scores, "metrics_path": metrics_path})
+        return items
+
+    def saved_output_items(self, objects: dict):
+        """
+        Outputs saved by the manual calibration: one item by iteration (.mat file and comparison files).
+
+        :param objects: Archived files (see archive_objects())
+        :return: list of dictionaries with the name, files, sizes, last use (time) and scores of each item
+        """
+        metrics = self.saved_metrics()
+        groups = {}
+        pattern = re.compile(r"^(%s_\d{8}_\d{4}_ite\d+)_" % re.escape(self.name))
+        for path in glob.glob(os.path.join(self.saved_output_folder, "raw_output", "*")) + \
+                glob.glob(os.path.join(self.saved_output_folder, "comparison_output", "*")):
+            match = pattern.match(os.path.basename(path))
+            if match is not None:
+                groups.setdefault(match.group(1), []).append(path)
+        items = []
+        for name, files in groups.items():
+            scores = metrics[name][score_metric] if name in metrics else None
+            unlinked_size, links = files_links(files, objects)
+            items.append({"name": name, "kind": "saved_output", "files": files, "unlinked_size": unlinked_size,
+                          "links": links, "last_used": max(os.path.getmtime(path) for path in files),
+                          "scores": scores, "metrics_path": None})
+        return items
+
+    def protected(self, items: list):
+        """ Names of the items with one of the keep_top best scores of a variable """
+        names = set()
+        for position in range(len(variables_list)):
+            scored = [(item["scores"][position], item["name"]) for item in items
+                      if item["scores"] is not None and position < len(item["scores"])
+                      and item["scores"][position] is not None and np.isfinite(item["scores"][position])]
+            names.update(name for _, name in sorted(scored)[:self.keep_top])
+        return names
+
+    def evict(self, item: dict):
+        """ Delete the bulk files of an item (its performances are kept) """
+        for path in item["files"]:
+            remove_entry(path)
+        if item["metrics_path"] is not None:
+            with open(item["metrics_path"]) as f:
+                result = json.load(f)
+            result["evicted"] = datetime.now().strftime('%Y%m%d_%H%M%S')
+            with open(item["metrics_path"], "w") as f:
+                json.dump(result, f, indent=1, default=str)
+
+    def enforce(self, exclude=(), dry_run: bool = False):
+        """
+        Delete the bulk files of the least recently used runs until the total size is under the quota. The best runs
+        of each variable, and the runs in exclude (ex: the runs in progress), are never deleted.
+
+        :param exclude: Names (run keys) of the items not to delete
+        :param dry_run: If True, only list the items that would be deleted
+        :return: list of the names of the deleted items
+        """
+        if self.quota is None:
+            return []
+        with self.lock:
+            objects = archive_objects(self.archive.folder)
+            items = self.run_items(objects) + self.saved_output_items(objects)
+            # each archived file is counted once, whatever the number of its links
+            total = sum(status.st_size for status in objects.values()) + \
+                sum(item["unlinked_size"] for item in items)
+            if total <= self.quota:
+                return []
+            protected = self.protected(items)
+            candidates = sorted([item for item in items if (item["unlinked_size"] > 0 or item["links"])
+                                 and item["name"] not in protected and item["name"] not in exclude],
+                                key=lambda item: item["last_used"])
+            evicted = []
+            freed = 0
+            removed = {}
+            for item in candidates:
+                if total - freed <= self.quota:
+                    break
+                if not dry_run:
+                    self.evict(item)
+                evicted.append(item["name"])
+                freed += freed_size(item, objects, removed)
+            if evicted and not dry_run:
+                self.archive.collect_garbage()
+        if evicted:
+            print("Retention %s: %s output(s) %s, %.1f MB freed" % (self.name, len(evicted),
+                                                                     "to delete" if dry_run else "deleted",
+                                                                     freed / size_units["M"]))
+        if total - freed > self.quota:
+            print("Retention %s: the outputs kept (%.1f MB) are over the quota (%.1f MB), the best runs are never "
+                  "deleted" % (self.name, (total - freed) / size_units["M"], self.quota / size_units["M"]))
+        return evicted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete the outputs of the runs of a lake over a quota.")
+    parser.add_argument("lake", help="Lake name (folder Postproc_code/<lake>)")
+    parser.add_argument("--quota", required=True, help="Maximum size of the outputs (ex: 500M, 20G)")
+    parser.add_argument("--keep", type=int, default=keep_top_runs,
+                        help="Number of the best runs of each variable never deleted")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the outputs that would be deleted")
+    args = parser.parse_args()
+
+    deleted = RetentionManager(args.lake, quota=args.quota, keep_top=args.keep).enforce(dry_run=args.dry_run)
+    for name in deleted:
+        print(name)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Automatic calibration (Part 3)
+
+Script calibrating the parameters of a lake with an optimisation algorithm instead of the manual calibration. The
+objective is a weighted sum of the performances of Lake.stats_lake (RMSE, NSE, RSR, Pbias, R2, SOS, nrmse) of the
+variables (T, O2, Chl) at the surface and deepwater levels (see calibration_objective.py), and the runs asked by the
+algorithm are executed in parallel by RunExecutor. The calibration starts from the values of IO/<lake>/<lake>_para.txt;
+all evaluations are saved in Postproc_code/<lake>/final_calibration_<lake>_<method>_<date>.csv.
+
+    $ python script_final_calibration.py Bromont --method nelder-mead --group T --workers 8
+    $ python script_final_calibration.py Bromont --method powell --parameters kz_N0,swa_b0,swa_b1 \
+        --objective nrmse:T:surface:1,nrmse:T:deepwater:2 --max-evaluations 300 --save-parameters
+    $ python script_final_calibration.py Bromont --method cmaes --group T,O2 --population 16 --max-evaluations 5000
+    $ python script_final_calibration.py Bromont --method bayesian --group T --batch-size 8 --max-evaluations 100
+    $ python script_final_calibration.py Bromont --method levenberg-marquardt --group T --warm-start --fd-step 0.01
+    $ python script_final_calibration.py Bromont --method dream --group T --chains 8 --max-evaluations 20000
+    $ python script_final_calibration.py Bromont --method nsga2 --group T,O2 --population 16 --max-evaluations 2000 \
+        --objective RMSE:T:all,RMSE:O2:all,RMSE:Chl:all
+
+The state of CMA-ES and DREAM(ZS) is saved after each generation in
+Postproc_code/<lake>/final_calibration_<lake>_<method>.json; calling the script again with the same parameters
+continues the calibration from the last generation (--restart to start again). The chains of DREAM(ZS) are saved in
+final_calibration_<lake>_dream_chains.csv. NSGA-II treats each term of the objective as a separate objective, and keeps
+the non-dominated runs in final_calibration_<lake>_nsga2_pareto.csv (see script_pareto.py). With --previous-results,
+the Bayesian optimisation also uses the iterations of the manual calibration reports and the evaluations of the
+previous Bayesian optimisations of the lake whose run is still valid (see calibration_bayesian.py). With --emulator,
+the points predicted not competitive by an emulator of the objective trained on the run archive are not run (see
+calibration_emulator.py). With --coarse-dz, the points are run first at a coarse depth resolution and only the best
+ones are run at 0.5 m (see calibration_multifidelity.py); both options are refused with dream and nsga2, which need
+every point. With --warm-start, the algorithm starts from the runs already done that are still valid for the input
+files and the observations (run archive and manual calibration reports, see calibration_warm_start.py) instead of
+starting from the parameter file; the Bayesian optimisation adds these runs to the data of its surrogate.
+
+    $ python script_final_calibration.py Bromont --method cmaes --group T --warm-start --max-evaluations 500
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+
+from calibration_bayesian import BayesianOptimisation, previous_results_files
+from calibration_cmaes import CMAES
+from calibration_emulator import EmulatedEvaluator, emulator_models
+from calibration_gradient import LevenbergMarquardt
+from calibration_local import NelderMead, Powell, QuadraticTrustRegion
+from calibration_mcmc import DreamZS, likelihoods, posterior_summary
+from calibration_multifidelity import MultiFidelityEvaluator
+from calibration_nsga2 import NSGA2
+from calibration_objective import CalibrationEvaluator, Objective, ParameterSpace, calibrated_parameters, \
+    default_objective
+from calibration_reports import find_calibration_reports
+from calibration_warm_start import warm_start_data
+from run_executor import RunExecutor, parameter_file, read_parameter_file, root_directory, write_parameter_file
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+optimizers = {"nelder-mead": NelderMead, "powell": Powell, "bobyqa": QuadraticTrustRegion, "cmaes": CMAES,
+              "bayesian": BayesianOptimisation, "dream": DreamZS,
+              "nsga2": NSGA2, "levenberg-marquardt": LevenbergMarquardt}
+# Algorithms able to start from the runs already done (see calibration_warm_start.py)
+warm_start_methods = ["nelder-mead", "powell", "bobyqa", "cmaes", "bayesian", "nsga2", "levenberg-marquardt"]
+# Algorithms needing every point run at full resolution (posterior of DREAM(ZS), all objectives of NSGA-II): no emulator
+# nor multi-fidelity evaluations
+unscreened_methods = ["dream", "nsga2"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def save_calibrated_parameters(lake_name: str, parameters: dict, root: str = root_directory):
+    """ Write the calibrated values in the parameter file of the lake (IO/<lake>/<lake>_para.txt) """
+    path = os.path.join(root, "IO", lake_name, parameter_file % lake_name)
+    return write_parameter_file(path, parameters, path)
+
+
+def checkpoint_path(lake_name: str, method: str, root: str = root_directory):
+    """
+    Checkpoint file of the algorithms saving their state
+    (Postproc_code/<lake>/final_calibration_<lake>_<method>.json)
+    """
+    return os.path.join(root, "Postproc_code", lake_name, "final_calibration_%s_%s.json" % (lake_name, method))
+
+
+def pareto_archive_path(lake_name: str, root: str = root_directory):
+    """ Pareto archive of NSGA-II (Postproc_code/<lake>/final_calibration_<lake>_nsga2_pareto.csv) """
+    return os.path.join(root, "Postproc_code", lake_name, "final_calibration_%s_nsga2_pareto.csv" % lake_name)
+
+
+def calibrate(executor, names: list, objective: Objective, method: str = "nelder-mead",
+              max_evaluations: int = 200, method_options: dict = None, emulator: dict = None,
+              multifidelity: dict = None, initial: dict = None, warm_start: dict = None, **run_options):
+    """
+    Calibrate the parameters of a lake.
+
+    :param executor:        RunExecutor of the lake
+    :param names:           Names of the calibrated parameters
+    :param objective:       Objective to minimise
+    :param method:          Name of the algorithm (see optimizers)
+    :param method_options:  Options of the algorithm (ex: {"initial_step": 0.2})
+    :param emulator:        Options of the emulator screening the points before the runs (ex: {"model": "gp"}, see
+                            calibration_emulator.EmulatedEvaluator), None to run all the points
+    :param multifidelity:   Options of the runs at a coarse depth resolution (ex: {"coarse_dz": 2}, see
+                            calibration_multifidelity.MultiFidelityEvaluator), None to run all the points at dz = 0.5 m
+    :param initial:         Starting values of the calibrated parameters and values of the other parameters (default:
+                            the parameter file of the lake)
+    :param warm_start:      Options of the warm start from the runs already done (ex: {"reports": [...]}, see
+                            calibration_warm_start.warm_start_data()), None to start from the initial values
+    :param run_options:     Options of the runs replacing those of the executor (ex: enable_sediment=1)
+    :return: best point found (see calibration_local.calibration_result())
+    """
+    if method not in optimizers:
+        raise ValueError("Method '%s' is not an option, choose between %s" % (method, ", ".join(optimizers)))
+    initial = initial or read_parameter_file(executor.name, executor.root)
+    space = ParameterSpace(names, fixed=initial)
+    if emulator is not None and multifidelity is not None:
+        raise ValueError("The emulator and the multi-fidelity evaluations can not be used together")
+    if method in unscreened_methods and (emulator is not None or multifidelity is not None):
+        raise ValueError("The emulator and the multi-fidelity evaluations can not be used with %s" % method)
+    if multifidelity is not None:
+        evaluator = MultiFidelityEvaluator(executor, space, objective, method, max_evaluations, **multifidelity,
+                                           **run_options)
+    elif emulator is not None:
+        evaluator = EmulatedEvaluator(executor, space, objective, method, max_evaluations, **emulator, **run_options)
+    else:
+        evaluator = CalibrationEvaluator(executor, space, objective, method, max_evaluations, **run_options)
+    method_options = dict(method_options or {})
+    if warm_start is not None:
+        if method not in warm_start_methods:
+            raise ValueError("Method '%s' can not start from the runs already done, choose between %s" % (
+                method, ", ".join(warm_start_methods)))
+        method_options["warm_start"] = warm_start_data(executor, space, objective, **warm_start, **run_options)
+    return optimizers[method](evaluator, **method_options).minimise(space.unit_of(initial))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the parameters of a lake with an optimisation algorithm.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--method", default="nelder-mead", choices=list(optimizers), help="Optimisation algorithm")
+    parser.add_argument("--parameters", default=None, help="Calibrated parameters, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the calibrated parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--objective", default=default_objective,
+                        help="Objective as metric:variable:level:weight separated by commas (default: %s)"
+                             % default_objective)
+    parser.add_argument("--max-evaluations", type=int, default=200, help="Maximum number of runs")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    parser.add_argument("--population", type=int, default=None,
+                        help="CMA-ES and NSGA-II: number of runs of each generation (default: 4 + 3 ln(number of "
+                             "parameters) for CMA-ES, number of processors for NSGA-II)")
+    parser.add_argument("--sigma", type=float, default=0.3, help="CMA-ES: initial step size (fraction of the bounds)")
+    parser.add_argument("--restart", action="store_true",
+                        help="CMA-ES, DREAM(ZS) and NSGA-II: do not continue from the last checkpoint (Pareto "
+                             "archive for NSGA-II)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Bayesian optimisation: number of runs of each round (default: number of processors)")
+    parser.add_argument("--chains", type=int, default=None,
+                        help="DREAM(ZS): number of chains, runs of each generation (default: number of processors)")
+    parser.add_argument("--likelihood", default="gaussian", choices=likelihoods,
+                        help="DREAM(ZS): error model of the residuals at the observations")
+    parser.add_argument("--fd-step", type=float, default=0.01,
+                        help="Levenberg-Marquardt: step of the finite differences (fraction of the bounds)")
+    parser.add_argument("--emulator", default=None, choices=emulator_models,
+                        help="Run only the points that an emulator trained on the run archive predicts competitive "
+                             "(not used by DREAM(ZS) and NSGA-II)")
+    parser.add_argument("--kappa", type=float, default=2.0,
+                        help="Emulator: a point is run if its objective minus kappa standard deviations is better "
+                             "than the best quarter of the objectives known")
+    parser.add_argument("--coarse-dz", type=float, default=None,
+                        help="Run the points first at this depth resolution (m, ex: 2) and promote only the best ones "
+                             "to dz = 0.5 m (not used by DREAM(ZS) and NSGA-II)")
+    parser.add_argument("--promote", type=float, default=0.25,
+                        help="Multi-fidelity: fraction of the points of each batch promoted to dz = 0.5 m")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="Start from the runs already done with the current input files and observations (run "
+                             "archive and manual calibration reports; not available for DREAM(ZS))")
+    parser.add_argument("--replay-reports", action="store_true",
+                        help="Warm start: run the iterations of the reports without a valid run in the archive")
+    parser.add_argument("--previous-results", action="store_true",
+                        help="Bayesian: also use the reports and the previous Bayesian optimisations whose run is "
+                             "still valid for the current input files and observations")
+    parser.add_argument("--save-parameters", action="store_true",
+                        help="Write the calibrated values in IO/<lake>/<lake>_para.txt")
+    args = parser.parse_args()
+    if args.method in unscreened_methods and (args.emulator is not None or args.coarse_dz is not None):
+        parser.error("--emulator and --coarse-dz can not be used with --method %s (every point is run)" % args.method)
+    if args.previous_results and args.method != "bayesian":
+        parser.error("--previous-results is only used by --method bayesian")
+
+    names = calibrated_parameters(args.parameters, args.group)
+    method_options = {}
+    if args.method in ["cmaes", "dream"]:
+        checkpoint = checkpoint_path(args.lake, args.method)
+        if args.restart and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        method_options = {"checkpoint": checkpoint}
+    if args.method == "cmaes":
+        method_options.update({"population_size": args.population, "sigma": args.sigma})
+    elif args.method == "dream":
+        method_options.update({"chains": args.chains, "likelihood": args.likelihood})
+    elif args.method == "nsga2":
+        archive = pareto_archive_path(args.lake)
+        if args.restart and os.path.exists(archive):
+            os.remove(archive)
+        method_options = {"population_size": args.population, "archive": archive}
+    elif args.method == "levenberg-marquardt":
+        method_options = {"step": args.fd_step}
+    elif args.method == "bayesian":
+        method_options = {"batch_size": args.batch_size,
+                          "previous": previous_results_files(args.lake, root_directory) if args.previous_results
+                          else None}
+    objective = Objective.from_text(args.objective)
+    if args.method == "nsga2" and len(objective.terms) < 2:
+        parser.error("--method nsga2 needs at least two terms in --objective (one objective by term)")
+    print("Calibration of %s for %s with %s, objective %s" % (", ".join(names), args.lake, args.method, objective))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        result = calibrate(executor, names, objective, args.method, args.max_evaluations, method_options,
+                           None if args.emulator is None else {"model": args.emulator, "kappa": args.kappa},
+                           None if args.coarse_dz is None else {"coarse_dz": args.coarse_dz, "promote": args.promote},
+                           warm_start=None if not args.warm_start else {
+                               "reports": find_calibration_reports(args.lake), "replay": args.replay_reports})
+
+    print("Best objective %.4f after %s runs (run %s):" % (result["objective"], result["evaluations"],
+                                                          result["run_key"]))
+    for name in names:
+        print("    %s = %s" % (name, result["parameters"][name]))
+    print("History saved: %s" % result["history"])
+    if result.get("chains") is not None:
+        print("Posterior distribution (second half of the chains, saved in %s):" % result["chains"])
+        print(posterior_summary(result["chains"], names).to_string())
+    if result.get("pareto") is not None:
+        print("Pareto archive (%s runs): %s" % (result["front_size"], result["pareto"]))
+    if args.save_parameters:
+        print("Parameters saved: %s" % save_calibrated_parameters(args.lake, result["parameters"]))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" GLUE uncertainty analysis
+
+Generalised likelihood uncertainty estimation (Beven and Binley, 1992): parameter sets are sampled between the bounds
+of the parameters registry (uniform or latin hypercube, on a logarithmic scale for the rate constants) and run in
+parallel with RunExecutor. The runs meeting all the criteria (NSE above or RMSE below a threshold, for a variable and
+a depth level) are behavioural; their daily simulated series at the surface and deepwater levels are kept, and the
+prediction bands are the quantiles of the series weighted by the likelihood of the runs. The runs already done with
+the same inputs and fixed parameters, inside the sampled bounds (sweeps, calibrations), can be added to the samples
+(--reuse-runs).
+
+The likelihood of a behavioural run is the product of the scaled performances of the criteria, to the power --shape:
+(NSE - threshold) / (1 - threshold) and 1 - RMSE / threshold.
+
+    $ python script_glue.py Bromont --group T --samples 2000 --workers 8
+    $ python script_glue.py Bromont --parameters kz_N0,swa_b0 --criteria NSE:T:surface:0.7,RMSE:O2:deepwater:2 \
+        --sampling uniform --reuse-runs
+
+The samples, the behavioural series (.npz) and the bands (.csv and .png) are saved in
+Postproc_code/<lake>/glue_<lake>_<date>.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+from datetime import datetime
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from calibration_objective import ParameterSpace, calibrated_parameters, inside_bounds, latin_hypercube, levels_list, \
+    metric_value, same_fixed_parameters
+from run_executor import RunExecutor, depth_levels, read_observations, read_parameter_file, variables_list
+from run_retention import RetentionManager
+from sensitivity_indices import run_series
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+sampling_methods = ["lhs", "uniform"]
+criteria_metrics = ["NSE", "RMSE"]
+default_criteria = "NSE:T:surface:0.5,NSE:T:deepwater:0.5,RMSE:O2:surface:2,RMSE:O2:deepwater:3"
+band_quantiles = [0.05, 0.5, 0.95]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def parse_criteria(text: str = default_criteria):
+    """
+    Behavioural criteria given as "metric:variable:level:threshold" separated by commas.
+
+    :return: list of (metric, variable, level, threshold)
+    """
+    criteria = []
+    for criterion in text.split(","):
+        metric, variable, level, threshold = criterion.strip().split(":")
+        if metric not in criteria_metrics or variable not in variables_list or level not in levels_list + ["all"] \
+                or (level == "all" and metric != "RMSE"):
+            raise ValueError("Criterion %s is not an option (metrics: %s, variables: %s, levels: %s; all only for "
+                             "RMSE)" % (criterion, ", ".join(criteria_metrics), ", ".join(variables_list),
+                                        ", ".join(levels_list + ["all"])))
+        criteria.append((metric, variable, level, float(threshold)))
+    return criteria
+
+
+def behavioural_likelihood(metrics: dict, criteria: list, shape: float = 1.0):
+    """
+    Likelihood of a run: product of the scaled performances of the criteria, 0 if one criterion is not met.
+
+    :param metrics:     Performances of the run (see run_executor.score_results())
+    :param criteria:    List of (metric, variable, level, threshold) (see parse_criteria())
+    :param shape:       Power of the likelihood (higher values give more weight to the best runs)
+    """
+    if metrics is None:
+        return 0.0
+    likelihood = 1.0
+    for metric, variable, level, threshold in criteria:
+        value = metric_value(metrics, metric, variable, level)
+        if value is None or not np.isfinite(value):
+            return 0.0
+        scaled = (value - threshold) / (1 - threshold) if metric == "NSE" else 1 - value / threshold
+        if scaled <= 0:
+            return 0.0
+        likelihood *= scaled
+    return float(likelihood ** shape)
+
+
+def weighted_quantiles(values, weights, quantiles: list):
+    """
+    Quantiles of values (runs x ...) weighted by the runs (weights of length runs), calculated for all the other
+    dimensions at once. The weighted distribution is interpolated between the mid-points of the runs.
+
+    :return: array (quantiles x ...)
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float).reshape((-1,) + (1,) * (values.ndim - 1))
+    order = np.argsort(values, axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    sorted_weights = np.take_along_axis(np.broadcast_to(weights, values.shape), order, axis=0)
+    total = sorted_weights.sum(axis=0)
+    cumulative = (np.cumsum(sorted_weights, axis=0) - 0.5 * sorted_weights) / np.where(total > 0, total, 1)
+    if values.shape[0] == 1:
+        return np.repeat(sorted_values, len(quantiles), axis=0)
+    bands = []
+    for quantile in quantiles:
+        upper = np.clip((cumulative < quantile).sum(axis=0, keepdims=True), 1, values.shape[0] - 1)
+        lower = upper - 1
+        low_cumulative = np.take_along_axis(cumulative, lower, axis=0)
+        high_cumulative = np.take_along_axis(cumulative, upper, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.clip((quantile - low_cumulative) / (high_cumulative - low_cumulative), 0, 1)
+        fraction = np.where(np.isfinite(fraction), fraction, 0)
+        low_value = np.take_along_axis(sorted_values, lower, axis=0)
+        high_value = np.take_along_axis(sorted_values, upper, axis=0)
+        bands.append((low_value + fraction * (high_value - low_value))[0])
+    return np.array(bands)
+
+
+def sample_points(dimension: int, number: int, method: str = "lhs", seed: int = None):
+    """ Points of the unit cube sampled uniformly or by latin hypercube """
+    if method not in sampling_methods:
+        raise ValueError("Sampling '%s' is not an option, choose between %s" % (method, ", ".join(sampling_methods)))
+    random = np.random.default_rng(seed)
+    if method == "lhs":
+        return latin_hypercube(number, dimension, random)
+    return random.random((number, dimension))
+
+
+def glue_analysis(executor: RunExecutor, space: ParameterSpace, criteria: list, samples: int = 1000,
+                  sampling: str = "lhs", reuse_runs: bool = False, shape: float = 1.0, quantiles: list = None,
+                  seed: int = None, **run_options):
+    """
+    Run the samples and calculate the likelihood-weighted prediction bands of the behavioural runs.
+
+    :param executor:    RunExecutor of the lake
+    :param space:       ParameterSpace of the sampled parameters (the others keep their value of space.fixed)
+    :param criteria:    Behavioural criteria (see parse_criteria())
+    :param samples:     Number of parameter sets sampled
+    :param reuse_runs:  Add the runs already done with the same inputs, options and fixed parameters, inside the
+                        bounds of the space (see RunExecutor.archived_results)
+    :param run_options: Options of the runs replacing those of the executor (ex: enable_sediment=1)
+    :return: dictionary with the table of the samples, the dates, the series of the behavioural runs (runs x
+             variables x levels x days), their weights and the bands (quantiles x variables x levels x days)
+    """
+    quantiles = quantiles or band_quantiles
+    points = sample_points(space.dimension, samples, sampling, seed)
+    results = executor.run_batch([space.parameters(point) for point in points], **run_options)
+    if reuse_runs:
+        # only the runs that could have been sampled: same fixed parameters, sampled parameters inside the bounds
+        known = {result["key"] for result in results}
+        archived = [result for result in executor.archived_results(**run_options) if result["key"] not in known
+                    and same_fixed_parameters(result["parameters"], space)
+                    and inside_bounds(result["parameters"], space)]
+        print("%s runs already done added to the samples" % len(archived))
+        results += archived
+
+    table = pd.DataFrame([{name: result["parameters"][name] for name in space.names} for result in results])
+    table["Run_key"] = [result["key"] for result in results]
+    table["Status"] = [result["status"] for result in results]
+    for metric, variable, level, _ in criteria:
+        table["%s_%s_%s" % (metric, variable, level)] = [
+            None if result["metrics"] is None else metric_value(result["metrics"], metric, variable, level)
+            for result in results]
+    table["Likelihood"] = [behavioural_likelihood(result["metrics"], criteria, shape) for result in results]
+    table["Behavioural"] = table["Likelihood"] > 0
+
+    behavioural = [result for result, selected in zip(results, table["Behavioural"]) if selected]
+    kept = [result for result in behavioural if result["result_file"] and os.path.exists(result["result_file"])]
+    if len(kept) < len(behavioural):
+        print("%s behavioural runs without result file (removed by the retention) are not used" %
+              (len(behavioural) - len(kept)))
+    print("%s behavioural runs out of %s" % (len(kept), len(results)))
+    analysis = {"table": table, "quantiles": quantiles, "keys": [result["key"] for result in kept]}
+    if not kept:
+        return analysis
+
+    series = np.array([run_series(result) for result in kept])
+    weights = table.set_index("Run_key").loc[analysis["keys"], "Likelihood"].values
+    weights = weights / weights.sum()
+    start_year = kept[0]["options"]["start_year"]
+    analysis.update({"dates": pd.date_range("%s-01-01" % start_year, periods=series.shape[-1]), "series": series,
+                     "weights": weights, "bands": weighted_quantiles(series, weights, quantiles)})
+    return analysis
+
+
+def save_analysis(analysis: dict, folder: str):
+    """ Write the samples (samples.csv), the behavioural series (behavioural_series.npz) and the bands (bands.csv) """
+    os.makedirs(folder, exist_ok=True)
+    analysis["table"].to_csv(os.path.join(folder, "samples.csv"), index=False)
+    if "series" not in analysis:
+        return folder
+    np.savez_compressed(os.path.join(folder, "behavioural_series.npz"), series=analysis["series"],
+                        weights=analysis["weights"], keys=np.array(analysis["keys"]),
+                        dates=analysis["dates"].strftime("%Y%m%d").astype(int), variables=np.array(variables_list),
+                        levels=np.array(levels_list))
+    bands = []
+    for position, variable in enumerate(variables_list):
+        for index, level in enumerate(levels_list):
+            band = pd.DataFrame({"Date": analysis["dates"], "Variable": variable, "Level": level})
+            for number, quantile in enumerate(analysis["quantiles"]):
+                band["q%g" % (100 * quantile)] = analysis["bands"][number, position, index]
+            bands.append(band)
+    pd.concat(bands, ignore_index=True).to_csv(os.path.join(folder, "bands.csv"), index=False)
+    return folder
+
+
+def figure_bands(analysis: dict, observation_folder: str, outpath: str, title: str = ""):
+    """
+    Figure of the prediction bands (outer quantiles) and the median at the surface and deepwater levels, with the
+    observations at these depths, one subplot by variable.
+    """
+    fig, axes = plt.subplots(len(variables_list), 1, figsize=(12, 3.5 * len(variables_list)), squeeze=False)
+    for position, (axis, variable) in enumerate(zip(axes[:, 0], variables_list)):
+        observed = read_observations(observation_folder, variable)
+        for index, (level, color) in enumerate(zip(levels_list, ["black", "blue"])):
+            bands = analysis["bands"][:, position, index]
+            axis.fill_between(analysis["dates"], bands[0], bands[-1], color=color, alpha=0.2,
+                              label="%s %g-%g %%" % (level, 100 * analysis["quantiles"][0],
+                                                     100 * analysis["quantiles"][-1]))
+            axis.plot(analysis["dates"], bands[len(bands) // 2], "-", color=color, label="%s median" % level)
+            if depth_levels[level] in observed.columns:
+                at_level = observed[depth_levels[level]].dropna()
+                at_level = at_level[(at_level.index >= analysis["dates"][0]) &
+                                    (at_level.index <= analysis["dates"][-1])]
+                axis.plot(at_level.index, at_level.values, "s", color=color, label="%s observed" % level)
+        axis.set_ylabel(variable)
+        axis.legend(loc="upper right", fontsize="small")
+    axes[0, 0].set_title(title)
+    fig.tight_layout()
+    fig.savefig(outpath)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GLUE uncertainty analysis of the parameters of a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Sampled parameters, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the sampled parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--criteria", default=default_criteria,
+                        help="Behavioural criteria as metric:variable:level:threshold separated by commas, metric "
+                             "being NSE (minimum) or RMSE (maximum) (default: %s)" % default_criteria)
+    parser.add_argument("--samples", type=int, default=1000, help="Number of parameter sets sampled")
+    parser.add_argument("--sampling", default="lhs", choices=sampling_methods, help="Sampling of the parameters")
+    parser.add_argument("--shape", type=float, default=1.0, help="Power of the likelihood")
+    parser.add_argument("--reuse-runs", action="store_true",
+                        help="Add the runs already done with the same inputs and fixed parameters, inside the bounds "
+                             "(sweeps, calibrations)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the sampling")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    criteria = parse_criteria(args.criteria)
+    print("GLUE of %s for %s: %s samples (%s)" % (", ".join(names), args.lake, args.samples, args.sampling))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        space = ParameterSpace(names, fixed=read_parameter_file(args.lake))
+        analysis = glue_analysis(executor, space, criteria, args.samples, args.sampling, args.reuse_runs, args.shape,
+                                 seed=args.seed)
+        folder = save_analysis(analysis, os.path.join(executor.output_folder, "glue_%s_%s" % (
+            args.lake, datetime.now().strftime('%Y%m%d_%H%M%S'))))
+        if "bands" in analysis:
+            figure_bands(analysis, executor.observation_folder, os.path.join(folder, "bands.png"),
+                         "GLUE %s (%s behavioural runs)" % (args.lake, len(analysis["keys"])))
+    print("Results saved: %s" % folder)
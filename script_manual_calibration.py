@@ -43,7 +43,6 @@ import statistics
 import csv
 import os
 import pkg_resources
-import shutil
 from datetime import datetime, timedelta, date
 import pandas as pd
 import seaborn as sns
@@ -53,6 +52,13 @@ if not pkg_resources.get_distribution("seaborn").version == '0.11.0':
 from numpy import arange, nan, reshape, sqrt
 import scipy.io as sio
 import subprocess
+import itertools
+from design_of_experiments import design, design_values
+from run_executor import RunExecutor, depth_levels, lake_parameters, load_results, matlab_value, \
+    parse_parameter_value, read_observations, simulated_variable, variables_by_depth, variables_list, lakes_dict, \
+    river_inflow_by_lake
+from run_archive import Archive, remove_entry
+from run_retention import RetentionManager
 cwd = os.getcwd()
 
 
@@ -61,18 +67,14 @@ num2month = {1: "Jan", 2: "Feb", 3: "Mar", 4: "Apr", 5: "May", 6: "June", 7: "Ju
              11: "Nov", 12: "Dec"}
 variables_dict = {'T': "Temperature", 'O2': "DO concentration", 'Chl': 'Chlorophyll a'}
 matlab_folder = r"C:\Program Files\MATLAB\R2019b\bin\matlab"  # Value by default. need to be ajust to where matlab is install and the matlab version
+# Maximum size of the saved outputs and of the runs of a lake (ex: "20G"), None for no limit (see run_retention.py)
+output_quota = None
 
-test_cases = 10
-parameters = {"Swa_b0": [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5],
-              "Swa_b1": [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5],
-              "C_shelter": [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9],
-              "I_ScV": [0, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4, 1.6, 1.8],
-              "I_ScT": [0, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4, 1.6, 1.8],
-              "Alb_melt_ice": [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9],
-              "Alb_melt_snow": [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]}
-
-
-variable_pos = {'T': 5, 'O2': 6}#, 'Chl': 13}
+# Parameter sweeps with more combinations than max_factorial_runs are replaced by a space-filling design of
+# design_runs parameter sets between the smallest and largest values of each parameter (see design_of_experiments.py)
+max_factorial_runs = 100
+design_runs = 20
+design_method = "maximin"
 
 
 ### Matlab files reading function ###
@@ -281,20 +283,23 @@ def ask_for_matlab_directory():
 
 def aks_for_which_lake_wanted_to_calibrated():
     """
-    function to get in input the lake that will be calibrated. For now, options are "Bromont" .
+    function to get in input the lake that will be calibrated. Options are the lakes of lakes_dict (ex: "Bromont").
     function is not case sensible.
-    :return: the lake name ("Bromont" )
+    :return: the lake name (ex: "Bromont")
     """
+    lakes = {lake.upper(): lake for lake in lakes_dict}
     while True:
-        lake_name = input("Enter which lake will be calibrated 'Bromont' (not case sensitive): ")
-        if lake_name.upper() not in ("BROMONT"):
-            print("Lake name giving is not an option, choose between 'Bromont'.\n")
+        lake_name = input("Enter which lake will be calibrated %s (not case sensitive): " % (
+            ", ".join(["'%s'" % lake for lake in lakes_dict])))
+        if lake_name.upper() not in lakes:
+            print("Lake name giving is not an option, choose between %s.\n" % (
+                ", ".join(["'%s'" % lake for lake in lakes_dict])))
             continue
         else:
             # user enter correct lake name
             break
 
-    return "%s%s" % (lake_name[0].upper(), lake_name[1:].lower())
+    return lakes[lake_name.upper()]
 
 
 def aks_for_what_is_modeled():
@@ -417,98 +422,6 @@ def ask_what_to_save():
 
 
 ### General Function needed by method of Lake CLass ###
-def variables_by_depth(observation_folder, lakeName, output_folder, variable='T'):
-    """
-    Creates a new csv file with the observed temperatures separated in columns by depths.
-    :param observation_folder: String
-    :param lakeName: String
-    :param output_folder: String
-    :return: None
-    """
-    test = "{}/{}_bathymetry.csv".format(observation_folder, lakeName)
-
-    with open("{}/{}_bathymetry.csv".format(observation_folder, lakeName)) as bathymetric_file:
-        maxDepth = int(float(list(csv.reader(bathymetric_file))[-1][1]))
-        depthLevels = list(range(maxDepth + 1))
-
-    with open("{}/{}_observation_data.csv".format(observation_folder, lakeName)) as obs_file:
-        reader = list(csv.reader(obs_file))[1:]
-        depthlist = []
-        loop = 0
-        for depth in reader:
-            depth[3] = 7+ float(depth[3])
-            if float(depth[3]) not in depthlist:
-                depthlist.append(float(depth[3]))
-            elif float(depth[3]) == depthlist[0]:
-                loop += 1
-            if loop == 1000:
-                break
-        outputdir2 = list(output_folder.split("/"))
-        outputdir3 = 'Postproc_code'
-        if not os.path.exists(outputdir3):
-            os.mkdir(outputdir3)
-        outputdir3 = os.path.join(outputdir3, lakeName)
-        if not os.path.exists(outputdir3):
-            os.mkdir(outputdir3)
-
-        depthlist.sort()
-
-        with open("{}/Observed_{}.csv".format(observation_folder, variable), "w", newline='') as csvfile:
-            print("{}/Observed_{}.csv".format(observation_folder, variable))
-            header = "{}, {}\n".format(np.nan, depthlist)
-            csvfile.write(header.translate({ord(i): None for i in '[]'}))
-
-            out = csv.writer(csvfile)
-            rows = {}
-            dates = []
-            for i in depthlist:
-                rows[i] = []
-
-            for observation in reader:
-                obs_date = observation[2]  # "%s%s%s"%(observation[2][0:3],observation[2][4:5],observation[2][5:])
-                if obs_date not in dates:
-                    dates.append(obs_date)
-                    # print(obs_date)
-
-            temp_list = []
-            number = 0
-            for date in dates:
-                for observation in reader:
-                    # print(int(observation[2]), date)
-                    if str(observation[2]) == str(date):
-                        temp_list.append(observation)
-
-                for depth in depthlist:
-
-                    missing_temp = True
-
-                    for t in temp_list:
-
-                        if float(t[3]) == depth:
-
-                            if len(rows[depth]) <= number:
-                                if t[variable_pos[variable]] == "":
-                                    rows[depth].append("None")
-                                else:
-                                    rows[depth].append(float(t[variable_pos[variable]]))
-
-                                missing_temp = False
-
-                    if missing_temp:
-                        rows[depth].append("None")
-                number += 1
-                temp_list.clear()
-            temp_list.clear()
-            for date in dates:
-                temp_list.append(date)
-                for x in depthlist:
-                    temp_list.append(rows[x][dates.index(date)])
-                out.writerow(temp_list)
-                temp_list.clear()
-
-    print("observation done ... ... ... ... ")
-
-
 def get_dates_of_simulation(start_year, stop_year):
     """
     Finds the dates for each day of simulation. The dates are found by beginning at the first of January of the given
@@ -845,8 +758,11 @@ class Lake:
         self.name = lake_name
         self.observation_folder = r"obs/%s" % lake_name
         self.save_date = datetime.now().strftime('%Y%m%d')
+        # depth resolution of the layers of the runs (m)
+        self.dz = 0.5
 
-        if not os.path.exists("IO/Bromont/Bromont_para.txt"):
+        parameter_file = "IO/%s/%s_para.txt" % (lake_name, lake_name)
+        if not os.path.exists(parameter_file):
             # Default value for parameters related to Temperature
             self.kz_N0 = 0.00007
             self.c_shelter = "NaN"
@@ -874,8 +790,9 @@ class Lake:
             self.k_pdesorb_b = 100
 
         else:
-            print("Since the script found the file '%s_Para', the value from the last calibration will be used")
-            par_file = pd.read_csv("IO/Bromont/Bromont_para.txt", sep='\t',skiprows=1)
+            print("Since the script found the file '%s', the value from the last calibration will be used" %
+                  parameter_file)
+            par_file = pd.read_csv(parameter_file, sep='\t',skiprows=1)
 
             par_file['Parameter'] = par_file['Parameter'].str.lower()
             par_file = par_file.set_index('Parameter')
@@ -908,6 +825,9 @@ class Lake:
             self.k_pdesorb_a = 100
             self.k_pdesorb_b = 100
 
+        # Parameters given as a range or a list in ask_parameters_value (name: list of values)
+        self.sweep_values = {}
+
         self.input_folder = r"IO/%s" % lake_name
         self.output_folder = r"Postproc_code/%s" % lake_name
         self.figures_folder = r"Postproc_code/%s/figures" % lake_name
@@ -917,7 +837,7 @@ class Lake:
             variables_by_depth(self.observation_folder, self.name, self.output_folder, variable)
 
     def manual_calibration_loop(self, report=True, save_figures=False, save_output_data=False,
-                                save_comparison_data=False, matlab=matlab_folder):
+                                save_comparison_data=False, matlab=matlab_folder, quota=None):
         """ Main function, loop through iteration of simulation of the temperature, oxygen, and chl_a for the selected lake.
 
         This function calls the function asking for parameters' values, launches the simulation with those values and
@@ -943,6 +863,10 @@ class Lake:
         outputdir = os.path.join(self.output_folder, "save_output_all")
         if not os.path.exists(outputdir):
             os.mkdir(outputdir)
+        # outputs saved and runs of the sweeps kept under the quota (None: no limit, see run_retention.py)
+        retention = RetentionManager(self.name, quota)
+        # outputs saved as links to their archived (read-only) version, see run_archive.py
+        archive = Archive(os.path.join(self.output_folder, "archive"))
 
         what_is_calibrated, what_variable_is_calibrated = aks_for_what_is_modeled()
         if what_is_calibrated in [2, 3]:
@@ -1016,35 +940,55 @@ class Lake:
                                 return 0
                         break
 
-                if self.name == "Bromont":
-                    enable_river_inflow = 1
-                else:
-                    enable_river_inflow = 1
+                enable_river_inflow = river_inflow_by_lake.get(self.name, 1)
+                if self.sweep_values:
+                    # values given as range or list: all combinations are run in parallel
+                    results, table = self.parameter_sweep(dict_variable[what_variable_is_calibrated],
+                                                          enable_sediment, enable_river_inflow,
+                                                          iteration=iteration_number, save_figures=save_figures,
+                                                          matlab=matlab, retention=retention,
+                                                          save_initial_conditions=save_initial_conditions)
+                    if report:
+                        for number, result in enumerate(results):
+                            if result["status"] != "done":
+                                continue
+                            metrics = result["metrics"]
+                            table_report.append(
+                                [iteration_number, self.name, what_variable_is_calibrated] +
+                                list(result["parameters"].values()) +
+                                [metrics["RMSE_all"], metrics["R2_all"], metrics["RMSE"], metrics["NSE"],
+                                 metrics["RSR"], metrics["Pbias"], metrics["R2"], metrics["SOS"], metrics["nrmse"],
+                                 np.nan, "sweep run %s of %s" % (number, len(results)),
+                                 str(datetime.now() - start_iteration)])
+                    continue
+
                 # Run MyLake
                 if self.c_shelter == str(self.c_shelter):
                     myBat = open(r'%s/commandline_run_matlab.bat' % cwd, 'w+')
                     myBat.write('''@echo off
                                     cd %s
-                                    %s -nosplash -nodesktop -r "MyLake_Bromont_run(%d,%d,%s,%f,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%d,%d,%d), exit"
+                                    %s -nosplash -nodesktop -r "MyLake_Bromont_run(%d,%d,%s,%f,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%d,%d,%d,%s), exit"
                                                         ''' % (cwd,'"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
                                                             self.kz_N0, "'%s'" % self.c_shelter, self.i_scv,
                                                             self.i_sct, self.swa_b0, self.swa_b1, self.I_scDOC,self.I_scO,
                                                             self.I_scChl, self.k_Chl,self.k_BOD, self.k_POP, self.k_POC, self.k_DOP,
                                                             self.k_DOC, self.k_pdesorb_a, self.k_pdesorb_b,
-                                                            enable_sediment,enable_river_inflow, save_initial_conditions))
+                                                            enable_sediment,enable_river_inflow,
+                                                            save_initial_conditions, matlab_value(self.dz)))
                     myBat.close()
                     cmd = r'%s -wait -r -nosplash -nodesktop MyLake_Bromont_run(%d,%d,%s,%f,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,' \
-                          r'%f,%f,%f,%f,%f,%f,%d,%d,%d);quit' % ( '"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
+                          r'%f,%f,%f,%f,%f,%f,%d,%d,%d,%s);quit' % ( '"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
                                                             self.kz_N0, "'%s'" % self.c_shelter, self.i_scv,
                                                             self.i_sct, self.swa_b0, self.swa_b1, self.I_scDOC,self.I_scO,
                                                             self.I_scChl, self.k_Chl,self.k_BOD, self.k_POP, self.k_POC, self.k_DOP,
                                                             self.k_DOC, self.k_pdesorb_a, self.k_pdesorb_b,
-                                                            enable_sediment,enable_river_inflow,save_initial_conditions)
+                                                            enable_sediment,enable_river_inflow,save_initial_conditions,
+                                                            matlab_value(self.dz))
                 else:
                     myBat = open(r'%s/commandline_run_matlab.bat' % cwd, 'w+')
                     myBat.write('''@echo off
                                                         cd %s
-                                                        %s -nosplash -nodesktop -r "MyLake_Bromont_run(%d,%d,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%d,%d,%d), exit"
+                                                        %s -nosplash -nodesktop -r "MyLake_Bromont_run(%d,%d,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%d,%d,%d,%s), exit"
                                                         ''' % (cwd,
                                                                '"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
                                                                self.kz_N0, self.c_shelter, self.i_scv, self.i_sct,
@@ -1053,14 +997,18 @@ class Lake:
                                                                self.k_BOD, self.k_POP, self.k_POC, self.k_DOP,
                                                                self.k_DOC,
                                                                self.k_pdesorb_a, self.k_pdesorb_b, enable_sediment,
-                                                               enable_river_inflow, save_initial_conditions))
+                                                               enable_river_inflow, save_initial_conditions,
+                                                               matlab_value(self.dz)))
                     myBat.close()
                     cmd = r'%s -wait -r -nosplash -nodesktop MyLake_Bromont_run(%d,%d,%s,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,%f,' \
-                          r'%f,%f,%f,%f,%f,%f,%d,%d,%d);quit' % ('"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
+                          r'%f,%f,%f,%f,%f,%f,%d,%d,%d,%s);quit' % ('"%s"' % matlab, 2018, 2021, "'%s'" % self.name,
                                                            self.kz_N0, self.c_shelter, self.i_scv, self.i_sct,
                                                            self.swa_b0, self.swa_b1, self.I_scDOC,self.I_scO,self.I_scChl, self.k_Chl,
                                                            self.k_BOD,self.k_POP, self.k_POC, self.k_DOP, self.k_DOC,
-                                                           self.k_pdesorb_a, self.k_pdesorb_b, enable_sediment,enable_river_inflow,save_initial_conditions)
+                                                           self.k_pdesorb_a, self.k_pdesorb_b, enable_sediment,enable_river_inflow,save_initial_conditions,
+                                                           matlab_value(self.dz))
+                # the result of the last iteration can be linked to the archive (see run_archive.py): deleted first
+                remove_entry(os.path.join(self.output_folder, "%s_result_run.mat" % self.name))
                 print("Run MyLake model with parameter\n" + cmd)
                 self.save_parameter_value()
                 try:
@@ -1076,21 +1024,22 @@ class Lake:
                     outputdir2 = os.path.join(outputdir, "raw_output")
                     if not os.path.exists(outputdir2):
                         os.mkdir(outputdir2)
-                    shutil.copy2(os.path.join(self.output_folder, "%s_result_run.mat" % self.name),
-                                 os.path.join(outputdir2, "%s_%s_ite%s_result_run.mat" % (
-                                 self.name, self.save_date, iteration_number)))
+                    archive.archive(os.path.join(self.output_folder, "%s_result_run.mat" % self.name),
+                                    os.path.join(outputdir2, "%s_%s_ite%s_result_run.mat" % (
+                                    self.name, self.save_date, iteration_number)))
 
                 print("Performance calcul")
-                mat_data = load_data('%s/%s_result_run.mat' % (self.output_folder, lake_name), enable_sediment)
+                mat_data = load_data('%s/%s_result_run.mat' % (self.output_folder, self.name), enable_sediment)
                 for comp_variable in list(dict_variable.keys())[0:3]:
-                    self.make_comparison_file_allobs(dict_variable[comp_variable], enable_sediment, mat_data=mat_data)
+                    self.make_comparison_file_allobs(dict_variable[comp_variable], enable_sediment, mat_data=mat_data,
+                                                     dz=self.dz)
 
                 if save_comparison_data:
                     outputdir2 = os.path.join(outputdir, "comparison_output")
                     if not os.path.exists(outputdir2):
                         os.mkdir(outputdir2)
                     for comp_variable in list(dict_variable.keys())[0:3]:
-                        shutil.copy2(
+                        archive.archive(
                             os.path.join(self.output_folder, "%s_comparisonall.csv" % dict_variable[comp_variable]),
                             os.path.join(outputdir2, "%s_%s_ite%s_%s_comparisonall.csv" % (
                             self.name, self.save_date, iteration_number, dict_variable[comp_variable])))
@@ -1103,31 +1052,39 @@ class Lake:
                                                                               what_variable_is_calibrated],
                                                                           mat_data=mat_data)
 
-                if report:
-                    RMSE_all = [round(float(x), 3) for x in final_performance['rmse']]
-                    R2_all = [round(float(x), 3) for x in final_performance['r2']]
-                    RMSE = [[performances[0][0][0], performances[0][1][0]],
-                            [performances[1][0][0], performances[1][1][0]],
-                            [performances[2][0][0], performances[2][1][0]]]
-                    NSE = [[performances[0][0][1], performances[0][1][1]],
-                           [performances[1][0][1], performances[1][1][1]],
-                           [performances[2][0][1], performances[2][1][1]]]
-                    RSR = [[performances[0][0][2], performances[0][1][2]],
-                           [performances[1][0][2], performances[1][1][2]],
-                           [performances[2][0][2], performances[2][1][2]]]
-                    Pbias = [[performances[0][0][3], performances[0][1][3]],
-                             [performances[1][0][3], performances[1][1][3]],
-                             [performances[2][0][3], performances[2][1][3]]]
-                    R2 = [[performances[0][0][3], performances[0][1][4]],
-                          [performances[1][0][4], performances[1][1][4]],
-                          [performances[2][0][4], performances[2][1][4]]]
-                    SOS = [[performances[0][0][5], performances[0][1][5]],
-                           [performances[1][0][5], performances[1][1][5]],
-                           [performances[2][0][5], performances[2][1][5]]]
-                    nrmse = [[performances[0][0][6], performances[0][1][6]],
-                             [performances[1][0][6], performances[1][1][6]],
-                             [performances[2][0][6], performances[2][1][6]]]
+                RMSE_all = [round(float(x), 3) for x in final_performance['rmse']]
+                R2_all = [round(float(x), 3) for x in final_performance['r2']]
+                RMSE = [[performances[0][0][0], performances[0][1][0]],
+                        [performances[1][0][0], performances[1][1][0]],
+                        [performances[2][0][0], performances[2][1][0]]]
+                NSE = [[performances[0][0][1], performances[0][1][1]],
+                       [performances[1][0][1], performances[1][1][1]],
+                       [performances[2][0][1], performances[2][1][1]]]
+                RSR = [[performances[0][0][2], performances[0][1][2]],
+                       [performances[1][0][2], performances[1][1][2]],
+                       [performances[2][0][2], performances[2][1][2]]]
+                Pbias = [[performances[0][0][3], performances[0][1][3]],
+                         [performances[1][0][3], performances[1][1][3]],
+                         [performances[2][0][3], performances[2][1][3]]]
+                R2 = [[performances[0][0][3], performances[0][1][4]],
+                      [performances[1][0][4], performances[1][1][4]],
+                      [performances[2][0][4], performances[2][1][4]]]
+                SOS = [[performances[0][0][5], performances[0][1][5]],
+                       [performances[1][0][5], performances[1][1][5]],
+                       [performances[2][0][5], performances[2][1][5]]]
+                nrmse = [[performances[0][0][6], performances[0][1][6]],
+                         [performances[1][0][6], performances[1][1][6]],
+                         [performances[2][0][6], performances[2][1][6]]]
+
+                if save_output_data or save_comparison_data:
+                    # performances kept even after the saved outputs are deleted by the retention
+                    retention.record_saved_output("%s_%s_ite%s" % (self.name, self.save_date, iteration_number),
+                                                  lake_parameters(self),
+                                                  {"RMSE_all": RMSE_all, "R2_all": R2_all, "RMSE": RMSE, "NSE": NSE,
+                                                   "RSR": RSR, "Pbias": Pbias, "R2": R2, "SOS": SOS, "nrmse": nrmse})
+                    retention.enforce()
 
+                if report:
                     report_iteration_line = [iteration_number, self.name, what_variable_is_calibrated, self.kz_N0, self.c_shelter, self.i_scv, self.i_sct,
                                                            self.swa_b0, self.swa_b1, self.I_scDOC,self.I_scO,self.k_BOD,self.I_scChl, self.k_Chl,
                                                            self.k_POP, self.k_POC, self.k_DOP, self.k_DOC,
@@ -1145,11 +1102,116 @@ class Lake:
             df.to_csv(os.path.join(self.output_folder, report_core_title),index=False)
         return 1
 
+    def set_parameter_value(self, name, value):
+        """
+        Set the value given in input for a parameter. If the value is a range or a list (see parse_parameter_value),
+        the parameter takes the first value and the values are kept in sweep_values to be run in parallel.
+        :param name: Name of the parameter (attribute of the class)
+        :param value: String given in input
+        :return: None
+        """
+        parsed = parse_parameter_value(value)
+        if isinstance(parsed, list):
+            self.sweep_values[name] = parsed
+            setattr(self, name, parsed[0])
+        else:
+            self.sweep_values.pop(name, None)
+            setattr(self, name, parsed)
+
+    def sweep_parameter_sets(self):
+        """
+        Give all combinations of the values in sweep_values, the other parameters keeping their current value. When
+        there are more than max_factorial_runs combinations, a space-filling design of design_runs parameter sets
+        between the smallest and largest values of each parameter is given instead, in stratified order. The
+        parameters with values that are not numbers (ex: c_shelter "NaN") are not in the design: their combinations
+        are taken in turn by the parameter sets.
+        :return: list of dictionaries with the value of all parameters (see run_executor.parameters_registry)
+        """
+        base = lake_parameters(self)
+        names = list(self.sweep_values.keys())
+        parameter_sets = []
+        combinations = int(np.prod([len(self.sweep_values[name]) for name in names]))
+        if combinations > max_factorial_runs:
+            numeric = [name for name in names if all(isinstance(value, (int, float)) and np.isfinite(value)
+                                                     for value in self.sweep_values[name])]
+            others = [name for name in names if name not in numeric]
+            bounds = {name: (min(self.sweep_values[name]), max(self.sweep_values[name])) for name in numeric}
+            print("%s combinations of values, a %s design of %s parameter sets is run instead" % (
+                combinations, design_method, design_runs))
+            choices = itertools.cycle(itertools.product(*[self.sweep_values[name] for name in others]))
+            for values in design_values(design(len(numeric), design_runs, design_method), numeric, bounds):
+                parameter_set = dict(base)
+                parameter_set.update(values)
+                parameter_set.update(dict(zip(others, next(choices))))
+                parameter_sets.append(parameter_set)
+            return parameter_sets
+        for combination in itertools.product(*[self.sweep_values[name] for name in names]):
+            parameter_set = dict(base)
+            parameter_set.update(dict(zip(names, combination)))
+            parameter_sets.append(parameter_set)
+        return parameter_sets
+
+    def parameter_sweep(self, variable_calibrated='T', enable_sediment=0, enable_river_inflow=1, iteration=0,
+                        save_figures=False, matlab=matlab_folder, retention=None, save_initial_conditions=0):
+        """
+        Run in parallel all combinations of the values given as range or list in ask_parameters_value, print a
+        comparison table and show the simulations of the calibrated variable in one figure. The user then selects
+        the parameter set to keep for the next iterations. The runs use the depth resolution (dz) of the lake and
+        the same options as the single runs of the calibration.
+        :param retention: RetentionManager keeping the outputs of the runs under its quota (see run_retention.py)
+        :return: the list of results (see run_executor.execute_run) and the comparison table
+        """
+        parameter_sets = self.sweep_parameter_sets()
+        names = list(self.sweep_values.keys())
+        print("\nStart %s MyLake runs in parallel for %s" % (len(parameter_sets), ", ".join(names)))
+        with RunExecutor(self.name, matlab=matlab, enable_sediment=enable_sediment,
+                         enable_river_inflow=enable_river_inflow, retention=retention) as executor:
+            results = executor.run_batch(parameter_sets, dz=self.dz, save_initial_conditions=save_initial_conditions)
+
+        variable_index = variables_list.index(variable_calibrated)
+        lines = []
+        for number, result in enumerate(results):
+            line = {"Run": number}
+            line.update({name: result["parameters"][name] for name in names})
+            if result["status"] == "done":
+                metrics = result["metrics"]
+                line.update({"RMSE_all": metrics["RMSE_all"][variable_index],
+                             "RMSE_surface": metrics["RMSE"][variable_index][0],
+                             "RMSE_deepwater": metrics["RMSE"][variable_index][1],
+                             "NSE_surface": metrics["NSE"][variable_index][0],
+                             "NSE_deepwater": metrics["NSE"][variable_index][1]})
+            else:
+                line["Error"] = result["error"]
+            lines.append(line)
+        table = pd.DataFrame(lines).set_index("Run")
+        print("\nComparison of the runs for %s:\n%s\n" % (variables_dict[variable_calibrated], table.to_string()))
+
+        Graphics(Lake=self).figures_parameter_sweep(results, names, variable_calibrated=variable_calibrated,
+                                                    save_figures=save_figures, iteration=iteration)
+
+        while True:
+            selected = input("Number of the run to keep for the next iteration (press Enter to keep run 0): ")
+            if selected == "":
+                selected = 0
+                break
+            try:
+                selected = int(selected)
+                if 0 <= selected < len(results):
+                    break
+            except ValueError:
+                pass
+            print("answer giving is not an option, choose between 0 and %s.\n" % (len(results) - 1))
+        for name in names:
+            setattr(self, name, results[selected]["parameters"][name])
+        self.sweep_values = {}
+        return results, table
+
     def ask_parameters_value(self, what_is_calibrated, what_variable_is_calibrated):
         """
 
         :return:
         """
+        self.sweep_values = {}
         if what_is_calibrated == 1:
             if what_variable_is_calibrated == 1:
                 print("The parameters value are set to:"
@@ -1256,13 +1318,15 @@ class Lake:
                 continue
             else:
                 if change_parameters.upper() == "N":
+                    print("A value can also be given as a range (start:stop:number of values, ex: 1.5:3.5:5) or a list "
+                          "(ex: [0.5,1,2]); all combinations are then run in parallel.")
                     if what_is_calibrated == 1:
                         if what_variable_is_calibrated == 1:
                             while True:
                                 change_parameters = input("\nChange kz_N0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.kz_N0 = float(change_parameters)
+                                        self.set_parameter_value("kz_N0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1272,7 +1336,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new kz_N0: ")
                                             try:
-                                                self.kz_N0 = float(parameter_value)
+                                                self.set_parameter_value("kz_N0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1281,7 +1345,7 @@ class Lake:
                                 change_parameters = input("\nChange c_shelter (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.c_shelter = float(change_parameters)
+                                        self.set_parameter_value("c_shelter", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1291,7 +1355,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new c_shelter: ")
                                             try:
-                                                self.c_shelter = float(parameter_value)
+                                                self.set_parameter_value("c_shelter", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1300,7 +1364,7 @@ class Lake:
                                 change_parameters = input("\nChange i_scv (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_scv = float(change_parameters)
+                                        self.set_parameter_value("i_scv", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1310,7 +1374,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_scv: ")
                                             try:
-                                                self.i_scv = float(parameter_value)
+                                                self.set_parameter_value("i_scv", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1319,7 +1383,7 @@ class Lake:
                                 change_parameters = input("\nChange i_sct (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_sct = float(change_parameters)
+                                        self.set_parameter_value("i_sct", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1329,7 +1393,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_sct: ")
                                             try:
-                                                self.i_sct = float(parameter_value)
+                                                self.set_parameter_value("i_sct", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1338,7 +1402,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b0 = float(change_parameters)
+                                        self.set_parameter_value("swa_b0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1348,7 +1412,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b0: ")
                                             try:
-                                                self.swa_b0 = float(parameter_value)
+                                                self.set_parameter_value("swa_b0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1357,7 +1421,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b1 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b1 = float(change_parameters)
+                                        self.set_parameter_value("swa_b1", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1367,7 +1431,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b1: ")
                                             try:
-                                                self.swa_b1 = float(parameter_value)
+                                                self.set_parameter_value("swa_b1", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1378,7 +1442,7 @@ class Lake:
                                 change_parameters = input("\nChange kz_N0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.kz_N0 = float(change_parameters)
+                                        self.set_parameter_value("kz_N0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1388,7 +1452,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new kz_N0: ")
                                             try:
-                                                self.kz_N0 = float(parameter_value)
+                                                self.set_parameter_value("kz_N0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1397,7 +1461,7 @@ class Lake:
                                 change_parameters = input("\nChange c_shelter (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.c_shelter = float(change_parameters)
+                                        self.set_parameter_value("c_shelter", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1407,7 +1471,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new c_shelter: ")
                                             try:
-                                                self.c_shelter = float(parameter_value)
+                                                self.set_parameter_value("c_shelter", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1416,7 +1480,7 @@ class Lake:
                                 change_parameters = input("\nChange i_scv (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_scv = float(change_parameters)
+                                        self.set_parameter_value("i_scv", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1426,7 +1490,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_scv: ")
                                             try:
-                                                self.i_scv = float(parameter_value)
+                                                self.set_parameter_value("i_scv", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1435,7 +1499,7 @@ class Lake:
                                 change_parameters = input("\nChange i_sct (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_sct = float(change_parameters)
+                                        self.set_parameter_value("i_sct", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1445,7 +1509,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_sct: ")
                                             try:
-                                                self.i_sct = float(parameter_value)
+                                                self.set_parameter_value("i_sct", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1454,7 +1518,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b0 = float(change_parameters)
+                                        self.set_parameter_value("swa_b0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1464,7 +1528,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b0: ")
                                             try:
-                                                self.swa_b0 = float(parameter_value)
+                                                self.set_parameter_value("swa_b0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1473,7 +1537,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b1 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b1 = float(change_parameters)
+                                        self.set_parameter_value("swa_b1", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1483,7 +1547,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b1: ")
                                             try:
-                                                self.swa_b1 = float(parameter_value)
+                                                self.set_parameter_value("swa_b1", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1492,7 +1556,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scDOC (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scDOC = float(change_parameters)
+                                        self.set_parameter_value("I_scDOC", change_parameters)
                                         break
                                     except:
                                         print(
@@ -1503,7 +1567,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scDOC: ")
                                             try:
-                                                self.I_scDOC = float(parameter_value)
+                                                self.set_parameter_value("I_scDOC", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1512,7 +1576,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scO (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scO = float(change_parameters)
+                                        self.set_parameter_value("I_scO", change_parameters)
                                         break
                                     except:
                                         print(
@@ -1523,7 +1587,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scDOC: ")
                                             try:
-                                                self.I_scO = float(parameter_value)
+                                                self.set_parameter_value("I_scO", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1532,7 +1596,7 @@ class Lake:
                                 change_parameters = input("\nChange k_BOD (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.k_BOD = float(change_parameters)
+                                        self.set_parameter_value("k_BOD", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1542,7 +1606,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new k_BOD: ")
                                             try:
-                                                self.k_BOD = float(parameter_value)
+                                                self.set_parameter_value("k_BOD", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1551,7 +1615,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scChl (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scChl = float(change_parameters)
+                                        self.set_parameter_value("I_scChl", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1561,7 +1625,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scChl: ")
                                             try:
-                                                self.I_scChl = float(parameter_value)
+                                                self.set_parameter_value("I_scChl", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1573,7 +1637,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scChl (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scChl = float(change_parameters)
+                                        self.set_parameter_value("I_scChl", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1583,7 +1647,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scChl: ")
                                             try:
-                                                self.I_scChl = float(parameter_value)
+                                                self.set_parameter_value("I_scChl", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1592,7 +1656,7 @@ class Lake:
                                 change_parameters = input("\nChange k_Chl (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.k_Chl = float(change_parameters)
+                                        self.set_parameter_value("k_Chl", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1602,7 +1666,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new k_Chl: ")
                                             try:
-                                                self.k_Chl = float(parameter_value)
+                                                self.set_parameter_value("k_Chl", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1614,7 +1678,7 @@ class Lake:
                                 change_parameters = input("\nChange kz_N0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.kz_N0 = float(change_parameters)
+                                        self.set_parameter_value("kz_N0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1624,7 +1688,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new kz_N0: ")
                                             try:
-                                                self.kz_N0 = float(parameter_value)
+                                                self.set_parameter_value("kz_N0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1633,7 +1697,7 @@ class Lake:
                                 change_parameters = input("\nChange c_shelter (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.c_shelter = float(change_parameters)
+                                        self.set_parameter_value("c_shelter", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1643,7 +1707,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new c_shelter: ")
                                             try:
-                                                self.c_shelter = float(parameter_value)
+                                                self.set_parameter_value("c_shelter", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1652,7 +1716,7 @@ class Lake:
                                 change_parameters = input("\nChange i_scv (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_scv = float(change_parameters)
+                                        self.set_parameter_value("i_scv", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1662,7 +1726,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_scv: ")
                                             try:
-                                                self.i_scv = float(parameter_value)
+                                                self.set_parameter_value("i_scv", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1671,7 +1735,7 @@ class Lake:
                                 change_parameters = input("\nChange i_sct (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.i_sct = float(change_parameters)
+                                        self.set_parameter_value("i_sct", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1681,7 +1745,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new i_sct: ")
                                             try:
-                                                self.i_sct = float(parameter_value)
+                                                self.set_parameter_value("i_sct", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1690,7 +1754,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b0 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b0 = float(change_parameters)
+                                        self.set_parameter_value("swa_b0", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1700,7 +1764,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b0: ")
                                             try:
-                                                self.swa_b0 = float(parameter_value)
+                                                self.set_parameter_value("swa_b0", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1709,7 +1773,7 @@ class Lake:
                                 change_parameters = input("\nChange swa_b1 (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.swa_b1 = float(change_parameters)
+                                        self.set_parameter_value("swa_b1", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1719,7 +1783,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new swa_b1: ")
                                             try:
-                                                self.swa_b1 = float(parameter_value)
+                                                self.set_parameter_value("swa_b1", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1728,7 +1792,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scDOC (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scDOC = float(change_parameters)
+                                        self.set_parameter_value("I_scDOC", change_parameters)
                                         break
                                     except:
                                         print(
@@ -1739,7 +1803,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scDOC: ")
                                             try:
-                                                self.I_scDOC = float(parameter_value)
+                                                self.set_parameter_value("I_scDOC", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1748,7 +1812,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scO (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scO = float(change_parameters)
+                                        self.set_parameter_value("I_scO", change_parameters)
                                         break
                                     except:
                                         print(
@@ -1759,7 +1823,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scDOC: ")
                                             try:
-                                                self.I_scO = float(parameter_value)
+                                                self.set_parameter_value("I_scO", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1768,7 +1832,7 @@ class Lake:
                                 change_parameters = input("\nChange k_BOD (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.k_BOD = float(change_parameters)
+                                        self.set_parameter_value("k_BOD", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1778,7 +1842,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new k_BOD: ")
                                             try:
-                                                self.k_BOD = float(parameter_value)
+                                                self.set_parameter_value("k_BOD", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1787,7 +1851,7 @@ class Lake:
                                 change_parameters = input("\nChange I_scChl (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.I_scChl = float(change_parameters)
+                                        self.set_parameter_value("I_scChl", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1797,7 +1861,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new I_scChl: ")
                                             try:
-                                                self.I_scChl = float(parameter_value)
+                                                self.set_parameter_value("I_scChl", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1806,7 +1870,7 @@ class Lake:
                                 change_parameters = input("\nChange k_Chl (y or n or value)? ")
                                 if change_parameters.upper() not in ("N", "Y"):
                                     try:
-                                        self.k_Chl = float(change_parameters)
+                                        self.set_parameter_value("k_Chl", change_parameters)
                                         break
                                     except:
                                         print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1816,7 +1880,7 @@ class Lake:
                                         while True:
                                             parameter_value = input("Enter new k_Chl: ")
                                             try:
-                                                self.k_Chl = float(parameter_value)
+                                                self.set_parameter_value("k_Chl", parameter_value)
                                                 break
                                             except:
                                                 continue
@@ -1829,7 +1893,7 @@ class Lake:
                             change_parameters = input("\nChange  k_POP (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_POP = float(change_parameters)
+                                    self.set_parameter_value("k_POP", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1839,7 +1903,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_POP: ")
                                         try:
-                                            self.k_POP = float(parameter_value)
+                                            self.set_parameter_value("k_POP", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1848,7 +1912,7 @@ class Lake:
                             change_parameters = input("\nChange  k_POC (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_POC = float(change_parameters)
+                                    self.set_parameter_value("k_POC", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1858,7 +1922,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_POC: ")
                                         try:
-                                            self.k_POC = float(parameter_value)
+                                            self.set_parameter_value("k_POC", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1867,7 +1931,7 @@ class Lake:
                             change_parameters = input("\nChange  k_DOP (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_DOP = float(change_parameters)
+                                    self.set_parameter_value("k_DOP", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1877,7 +1941,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_DOP: ")
                                         try:
-                                            self.k_DOP = float(parameter_value)
+                                            self.set_parameter_value("k_DOP", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1886,7 +1950,7 @@ class Lake:
                             change_parameters = input("\nChange  k_DOC (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_DOC = float(change_parameters)
+                                    self.set_parameter_value("k_DOC", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1896,7 +1960,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_DOC: ")
                                         try:
-                                            self.k_DOC = float(parameter_value)
+                                            self.set_parameter_value("k_DOC", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1905,7 +1969,7 @@ class Lake:
                             change_parameters = input("\nChange k_pdesorb_a (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_pdesorb_a = float(change_parameters)
+                                    self.set_parameter_value("k_pdesorb_a", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1915,7 +1979,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_pdesorb_a: ")
                                         try:
-                                            self.k_pdesorb_a = float(parameter_value)
+                                            self.set_parameter_value("k_pdesorb_a", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1924,7 +1988,7 @@ class Lake:
                             change_parameters = input("\nChange k_pdesorb_b (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_pdesorb_b = float(change_parameters)
+                                    self.set_parameter_value("k_pdesorb_b", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1934,7 +1998,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_pdesorb_b: ")
                                         try:
-                                            self.k_pdesorb_b = float(parameter_value)
+                                            self.set_parameter_value("k_pdesorb_b", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1944,7 +2008,7 @@ class Lake:
                             change_parameters = input("\nChange kz_N0 (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.kz_N0 = float(change_parameters)
+                                    self.set_parameter_value("kz_N0", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1954,7 +2018,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new kz_N0: ")
                                         try:
-                                            self.kz_N0 = float(parameter_value)
+                                            self.set_parameter_value("kz_N0", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1963,7 +2027,7 @@ class Lake:
                             change_parameters = input("\nChange c_shelter (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.c_shelter = float(change_parameters)
+                                    self.set_parameter_value("c_shelter", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1973,7 +2037,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new c_shelter: ")
                                         try:
-                                            self.c_shelter = float(parameter_value)
+                                            self.set_parameter_value("c_shelter", parameter_value)
                                             break
                                         except:
                                             continue
@@ -1982,7 +2046,7 @@ class Lake:
                             change_parameters = input("\nChange i_scv (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.i_scv = float(change_parameters)
+                                    self.set_parameter_value("i_scv", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -1992,7 +2056,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new i_scv: ")
                                         try:
-                                            self.i_scv = float(parameter_value)
+                                            self.set_parameter_value("i_scv", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2001,7 +2065,7 @@ class Lake:
                             change_parameters = input("\nChange i_sct (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.i_sct = float(change_parameters)
+                                    self.set_parameter_value("i_sct", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2011,7 +2075,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new i_sct: ")
                                         try:
-                                            self.i_sct = float(parameter_value)
+                                            self.set_parameter_value("i_sct", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2020,7 +2084,7 @@ class Lake:
                             change_parameters = input("\nChange swa_b0 (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.swa_b0 = float(change_parameters)
+                                    self.set_parameter_value("swa_b0", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2030,7 +2094,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new swa_b0: ")
                                         try:
-                                            self.swa_b0 = float(parameter_value)
+                                            self.set_parameter_value("swa_b0", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2039,7 +2103,7 @@ class Lake:
                             change_parameters = input("\nChange swa_b1 (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.swa_b1 = float(change_parameters)
+                                    self.set_parameter_value("swa_b1", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2049,7 +2113,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new swa_b1: ")
                                         try:
-                                            self.swa_b1 = float(parameter_value)
+                                            self.set_parameter_value("swa_b1", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2058,7 +2122,7 @@ class Lake:
                             change_parameters = input("\nChange I_scDOC (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.I_scDOC = float(change_parameters)
+                                    self.set_parameter_value("I_scDOC", change_parameters)
                                     break
                                 except:
                                     print(
@@ -2069,7 +2133,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new I_scDOC: ")
                                         try:
-                                            self.I_scDOC = float(parameter_value)
+                                            self.set_parameter_value("I_scDOC", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2078,7 +2142,7 @@ class Lake:
                             change_parameters = input("\nChange I_scO (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.I_scO = float(change_parameters)
+                                    self.set_parameter_value("I_scO", change_parameters)
                                     break
                                 except:
                                     print(
@@ -2089,7 +2153,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new I_scDOC: ")
                                         try:
-                                            self.I_scO = float(parameter_value)
+                                            self.set_parameter_value("I_scO", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2098,7 +2162,7 @@ class Lake:
                             change_parameters = input("\nChange I_scO (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.I_scO = float(change_parameters)
+                                    self.set_parameter_value("I_scO", change_parameters)
                                     break
                                 except:
                                     print(
@@ -2109,7 +2173,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new I_scDOC: ")
                                         try:
-                                            self.I_scO = float(parameter_value)
+                                            self.set_parameter_value("I_scO", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2118,7 +2182,7 @@ class Lake:
                             change_parameters = input("\nChange I_scChl (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.I_scChl = float(change_parameters)
+                                    self.set_parameter_value("I_scChl", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2128,7 +2192,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new I_scChl: ")
                                         try:
-                                            self.I_scChl = float(parameter_value)
+                                            self.set_parameter_value("I_scChl", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2137,7 +2201,7 @@ class Lake:
                             change_parameters = input("\nChange k_Chl (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_Chl = float(change_parameters)
+                                    self.set_parameter_value("k_Chl", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2147,7 +2211,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_Chl: ")
                                         try:
-                                            self.k_Chl = float(parameter_value)
+                                            self.set_parameter_value("k_Chl", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2156,7 +2220,7 @@ class Lake:
                             change_parameters = input("\nChange k_BOD (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_BOD = float(change_parameters)
+                                    self.set_parameter_value("k_BOD", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2166,7 +2230,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_BOD: ")
                                         try:
-                                            self.k_BOD = float(parameter_value)
+                                            self.set_parameter_value("k_BOD", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2175,7 +2239,7 @@ class Lake:
                             change_parameters = input("\nChange  k_POP (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_POP = float(change_parameters)
+                                    self.set_parameter_value("k_POP", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2185,7 +2249,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_POP: ")
                                         try:
-                                            self.k_POP = float(parameter_value)
+                                            self.set_parameter_value("k_POP", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2194,7 +2258,7 @@ class Lake:
                             change_parameters = input("\nChange  k_POC (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_POC = float(change_parameters)
+                                    self.set_parameter_value("k_POC", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2204,7 +2268,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_POC: ")
                                         try:
-                                            self.k_POC = float(parameter_value)
+                                            self.set_parameter_value("k_POC", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2213,7 +2277,7 @@ class Lake:
                             change_parameters = input("\nChange  k_DOP (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_DOP = float(change_parameters)
+                                    self.set_parameter_value("k_DOP", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2223,7 +2287,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_DOP: ")
                                         try:
-                                            self.k_DOP = float(parameter_value)
+                                            self.set_parameter_value("k_DOP", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2232,7 +2296,7 @@ class Lake:
                             change_parameters = input("\nChange  k_DOC (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_DOC = float(change_parameters)
+                                    self.set_parameter_value("k_DOC", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2242,7 +2306,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new  k_DOC: ")
                                         try:
-                                            self.k_DOC = float(parameter_value)
+                                            self.set_parameter_value("k_DOC", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2251,7 +2315,7 @@ class Lake:
                             change_parameters = input("\nChange k_pdesorb_a (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_pdesorb_a = float(change_parameters)
+                                    self.set_parameter_value("k_pdesorb_a", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2261,7 +2325,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_pdesorb_a: ")
                                         try:
-                                            self.k_pdesorb_a = float(parameter_value)
+                                            self.set_parameter_value("k_pdesorb_a", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2270,7 +2334,7 @@ class Lake:
                             change_parameters = input("\nChange k_pdesorb_b (y or n or value)? ")
                             if change_parameters.upper() not in ("N", "Y"):
                                 try:
-                                    self.k_pdesorb_b = float(change_parameters)
+                                    self.set_parameter_value("k_pdesorb_b", change_parameters)
                                     break
                                 except:
                                     print("Answer giving is not an option, choose between 'y', 'n' or a value.\n")
@@ -2280,7 +2344,7 @@ class Lake:
                                     while True:
                                         parameter_value = input("Enter new k_pdesorb_b: ")
                                         try:
-                                            self.k_pdesorb_b = float(parameter_value)
+                                            self.set_parameter_value("k_pdesorb_b", parameter_value)
                                             break
                                         except:
                                             continue
@@ -2290,16 +2354,18 @@ class Lake:
 
         return 1
 
-    def make_comparison_file_allobs(self, variable='T', enable_sediment=0, start_year_comparison=2019, mat_data=[]):
+    def make_comparison_file_allobs(self, variable='T', enable_sediment=0, start_year_comparison=2019, mat_data=[],
+                                    dz=0.5):
         """
         Search a given output folder for an observation file, containing measured temperatures for a lake on a finite period,
         and a simulated temperatures file. Then writes corresponding observed and simulated temperatures to a CSV file,
         where each column is a list of temperatures for a given depth.
         :param output_folder: A string containing the folder to search and write to.
         :param mat_data     tuple or list of tuple
+        :param dz:          Depth resolution of the simulation (m)
         :return: None
         """
-        dt = 0.5
+        dt = dz
         if len(mat_data) == 2:
             water, sediment = mat_data[0], mat_data[1]
         else:
@@ -2308,6 +2374,8 @@ class Lake:
         # temp = water['T'][0, 0]
         # df = pd.DataFrame(temp).transpose()
 
+        # the comparison file of the last iteration can be linked to the archive (see run_archive.py): deleted first
+        remove_entry("{}/{}_comparisonall.csv".format(self.output_folder, variable))
         if variable in ['T', "O2","Chl"]:  # Mean water column comparison
             with open("{}/{}_comparisonall.csv".format(self.output_folder, variable), "w", newline="\n") as file:
                 observation_dict = {}
@@ -2347,21 +2415,17 @@ class Lake:
                     if 1 == 1:  # try:
                         for i in range(0, len(depth_levels)):
 
-                            if float(depth_levels[i]) < 0 or float(depth_levels[i]) > (len(sim) * dt - 0.5):
+                            if float(depth_levels[i]) < 0 or float(depth_levels[i]) > ((len(sim) - 1) * dt):
                                 temp_at_date.append(np.nan)
 
-                            elif (float(depth_levels[i])) != int(float(depth_levels[i])) and (
-                                    float(depth_levels[i])) != (int(float(depth_levels[i])) + 0.5):
-                                if (float(depth_levels[i]) - int(float(depth_levels[i]))) < 0.5:
-                                    xa = int(float(depth_levels[i]))
-                                    xb = xa + dt
-                                else:
-                                    xa = int(float(depth_levels[i])) + 0.5
-                                    xb = xa + dt
+                            elif not np.isclose(float(depth_levels[i]) / dt, round(float(depth_levels[i]) / dt)):
+                                # between two layers (layer k at the depth k x dt)
+                                layer = int(np.floor(float(depth_levels[i]) / dt))
+                                xa = layer * dt
+                                xb = xa + dt
 
-                                if sim[int(xa * (1 / dt))] != "None" and sim[int(xb * (1 / dt))] != "None":
-                                    valueyc = findYPoint(xa, xb, sim[int(xa * (1 / dt))], sim[int(xb * (1 / dt))],
-                                                         float(depth_levels[i]))
+                                if sim[layer] != "None" and sim[layer + 1] != "None":
+                                    valueyc = findYPoint(xa, xb, sim[layer], sim[layer + 1], float(depth_levels[i]))
                                     # if valueyc < 0:
                                     #     print("here")
 
@@ -2371,7 +2435,7 @@ class Lake:
                                     temp_at_date.append(np.nan)
 
                             else:
-                                depth1 = int(float(depth_levels[i]) * (1 / dt))
+                                depth1 = int(round(float(depth_levels[i]) / dt))
                                 if sim[depth1] == "None":
                                     temp_at_date.append("None")
                                 else:
@@ -2457,21 +2521,17 @@ class Lake:
                         if 1 == 1:  # try:
                             for i in range(0, len(depth_levels)):
 
-                                if float(depth_levels[i]) < 0 or float(depth_levels[i]) > (len(sim) * dt - 0.5):
+                                if float(depth_levels[i]) < 0 or float(depth_levels[i]) > ((len(sim) - 1) * dt):
                                     temp_at_date.append(np.nan)
 
-                                elif (float(depth_levels[i])) != int(float(depth_levels[i])) and (
-                                        float(depth_levels[i])) != (int(float(depth_levels[i])) + 0.5):
-                                    if (float(depth_levels[i]) - int(float(depth_levels[i]))) < 0.5:
-                                        xa = int(float(depth_levels[i]))
-                                        xb = xa + dt
-                                    else:
-                                        xa = int(float(depth_levels[i])) + 0.5
-                                        xb = xa + dt
+                                elif not np.isclose(float(depth_levels[i]) / dt, round(float(depth_levels[i]) / dt)):
+                                    # between two layers (layer k at the depth k x dt)
+                                    layer = int(np.floor(float(depth_levels[i]) / dt))
+                                    xa = layer * dt
+                                    xb = xa + dt
 
-                                    if sim[int(xa * (1 / dt))] != "None" and sim[int(xb * (1 / dt))] != "None":
-                                        valueyc = findYPoint(xa, xb, sim[int(xa * (1 / dt))], sim[int(xb * (1 / dt))],
-                                                             float(depth_levels[i]))
+                                    if sim[layer] != "None" and sim[layer + 1] != "None":
+                                        valueyc = findYPoint(xa, xb, sim[layer], sim[layer + 1], float(depth_levels[i]))
                                         # if valueyc < 0:
                                         #     print("here")
                                         temp_at_date.append(valueyc)
@@ -2480,7 +2540,7 @@ class Lake:
                                         temp_at_date.append(np.nan)
 
                                 else:
-                                    depth1 = int(float(depth_levels[i]) * (1 / dt))
+                                    depth1 = int(round(float(depth_levels[i]) / dt))
                                     if sim[depth1] == "None":
                                         temp_at_date.append("None")
                                     else:
@@ -2549,7 +2609,7 @@ class Lake:
 
         out = '''-999	"Mylake parameters"			
 Parameter	Value	Min	Max	Unit	
-dz	0.5	0.5	2	m	
+dz	%s	0.5	2	m	
 Kz_ak	0.04424	NaN	NaN	(-)	
 Kz_ak_ice	0.000898	NaN	NaN	(-)	
 Kz_N0	%s	NaN	NaN	s-2	
@@ -2621,7 +2681,8 @@ pH	7.5	NaN	NaN	(-)
 Q10	2	NaN	NaN	(-)	
 wc_factor	1	NaN	NaN	(-)	
 T_ref	4.8497	NaN	NaN	(-)	
-        ''' % (self.kz_N0,self.c_shelter,self.i_scv,self.i_sct,self.I_scChl,self.I_scDOC,self.I_scO,self.swa_b0,self.swa_b1,self.k_BOD)
+        ''' % (self.dz,
+               self.kz_N0,self.c_shelter,self.i_scv,self.i_sct,self.I_scChl,self.I_scDOC,self.I_scO,self.swa_b0,self.swa_b1,self.k_BOD)
 
         outpath = os.path.join(self.input_folder,"%s_para.txt"%self.name)
 
@@ -2885,6 +2946,47 @@ class Graphics:
         return all_performances, final_performance, M_score, Note
 
 
+    def figures_parameter_sweep(self, results, names, variable_calibrated='T', save_figures=False, iteration=0):
+        """
+        Overlay the simulations of the calibrated variable (surface and deepwater) of all runs of a parameter sweep
+        with the observations.
+
+        :param results: list of results of the runs (see run_executor.execute_run)
+        :param names: names of the parameters given as range or list
+        :param variable_calibrated: variable shown in the figure
+        :return: None
+        """
+        observed = read_observations(self.observation_folder, variable_calibrated)
+        fig, axs = plt.subplots(2, 1, sharex=True, frameon=False)
+        colors = plt.cm.viridis(np.linspace(0, 1, max(len(results), 2)))
+
+        for number, result in enumerate(results):
+            if result["status"] != "done":
+                continue
+            simulated = simulated_variable(load_results(result["result_file"]), variable_calibrated)
+            dates = pd.date_range(start='1/1/%s' % result["options"]["start_year"], periods=simulated.shape[1])
+            label = "%s: %s" % (number, ", ".join(["%s = %s" % (name, result["parameters"][name]) for name in names]))
+            # layer of the depth of the observations (layers of dz m from the surface)
+            dz = result["options"].get("dz", self.dz)
+            for ax, depth_level in zip(axs, ["surface", "deepwater"]):
+                layer = min(int(round(depth_levels[depth_level] / dz)), simulated.shape[0] - 1)
+                ax.plot(dates, simulated[layer], color=colors[number], linewidth=1, label=label)
+
+        for ax, depth_level in zip(axs, ["surface", "deepwater"]):
+            depth = float(depth_levels[depth_level])
+            if depth in observed.columns:
+                ax.scatter(observed.index, observed[depth], s=12, color='k', zorder=10, label="Observations")
+            ax.set_ylabel("%s\n%s" % (variables_dict[variable_calibrated], depth_level))
+        axs[0].legend(fontsize=self.SMALL_SIZE, ncol=2)
+        axs[1].set_xlabel("Dates")
+        plt.show()
+        if save_figures:
+            if not os.path.exists(self.figures_folder):
+                os.mkdir(self.figures_folder)
+            fig.savefig(os.path.join(self.figures_folder, "%s_%s_ite_%s_sweep.png" % (
+                variable_calibrated, self.save_date, iteration)))
+        plt.close('all')
+
     def Sediment_figures_comparison_timeseries_and_profiles(self, save_figures=False, iteration=0, overall=True, byvariable=True,
                                                    variable_calibrated='PT', mat_data=[]):
         """
@@ -3523,13 +3625,15 @@ if __name__ == "__main__":
             continue_calibration = input("Try the calibration with another variable ? \n"
                                          "Anything other than 'Y' or 'y'(not case sensitive) will terminate the calibration ")
             if continue_calibration.upper() in ["Y"]:
-                lake = Lake(lake_name).manual_calibration_loop(save_option[0], save_option[1], save_option[2], save_option[3],matlab=matlab_directory)
+                lake = Lake(lake_name).manual_calibration_loop(save_option[0], save_option[1], save_option[2],
+                                                               save_option[3], matlab=matlab_directory,
+                                                               quota=output_quota)
 
                 continue
             else:
                 break
         else:
             lake = Lake(lake_name).manual_calibration_loop(save_option[0], save_option[1], save_option[2],
-                                                           save_option[3], matlab=matlab_directory)
+                                                           save_option[3], matlab=matlab_directory, quota=output_quota)
             start += 1
 
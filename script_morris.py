@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Morris screening of the parameters
+
+Elementary effects method (Morris, 1991, with the sampling of Campolongo et al., 2007): r trajectories of d + 1 points
+are built on a grid of the unit cube of the parameters (between the bounds of the registry, on a logarithmic scale
+for the rate constants), each step of a trajectory changing one parameter by delta. All the points are run in one
+batch by RunExecutor (in parallel). The mean of the absolute elementary effects (mu*), their mean (mu) and standard
+deviation (sigma) are given for each parameter and each performance of the report (RMSE, NSE, RSR, Pbias, R2, SOS,
+nrmse at the surface and deepwater levels, RMSE and R of all depths) of T, O2 and Chl.
+
+The parameters whose mu* is lower than --threshold times the largest mu* of every performance of the variables
+chosen are given as parameters that can be fixed in the calibration.
+
+    $ python script_morris.py Bromont --trajectories 20 --workers 8
+    $ python script_morris.py Bromont --group T,O2 --trajectories 30 --variables T,O2 --threshold 0.05
+
+The indices are saved in Postproc_code/<lake>/morris_<lake>_<date>.csv, with a figure of mu* and sigma.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+import warnings
+from datetime import datetime
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from calibration_objective import ParameterSpace, calibrated_parameters, levels_list
+from run_executor import RunExecutor, parameters_registry, performance_indices_names, read_parameter_file, \
+    variables_list
+from run_retention import RetentionManager
+from sensitivity_indices import output_label, output_names, output_values
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def morris_trajectories(dimension: int, trajectories: int, levels: int = 4, candidates: int = None,
+                        seed: int = None):
+    """
+    Trajectories of the Morris method on a grid of levels in the unit cube. The trajectories are chosen among the
+    candidates to be as far as possible from each other (Campolongo et al., 2007).
+
+    :param levels:      Number of levels of the grid (even number)
+    :param candidates:  Number of trajectories generated before the choice (default: 4 x trajectories)
+    :return: points (trajectories x (d + 1) x d), steps (trajectories x d: signed change of each parameter) and
+             order (trajectories x d: parameter changed by each step)
+    """
+    random = np.random.default_rng(seed)
+    candidates = max(candidates or 4 * trajectories, trajectories)
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels) / (levels - 1)
+    start = grid[random.integers(levels, size=(candidates, dimension))]
+    steps = np.where(start + delta <= 1 + 1e-12, delta, -delta)
+    order = np.argsort(random.random((candidates, dimension)), axis=1)
+    points = np.repeat(start[:, None, :], dimension + 1, axis=1)
+    for step in range(dimension):
+        changed = order[:, step]
+        points[:, step + 1:, :] += (np.eye(dimension)[changed] * steps)[:, None, :]
+
+    # greedy choice of the trajectories with the largest distances to the others
+    distances = np.zeros((candidates, candidates))
+    for index in range(candidates):
+        distances[index] = np.sqrt(np.sum((points[index][None, :, None, :] - points[:, None, :, :]) ** 2,
+                                          axis=-1)).sum(axis=(1, 2))
+    chosen = list(range(candidates))
+    while len(chosen) > trajectories:
+        spread = distances[np.ix_(chosen, chosen)].sum(axis=1)
+        chosen.pop(int(np.argmin(spread)))
+    return np.clip(points[chosen], 0, 1), steps[chosen], order[chosen]
+
+
+def elementary_effects(values, steps, order):
+    """
+    Elementary effects of each parameter (change of the output divided by the change of the parameter in the unit
+    cube) for all trajectories and outputs at once.
+
+    :param values:  Outputs of the points (trajectories x (d + 1) x outputs)
+    :return: array (trajectories x d x outputs), ordered by parameter
+    """
+    trajectories, dimension = order.shape
+    changed = np.take_along_axis(steps, order, axis=1)
+    effects = np.diff(values, axis=1) / changed[:, :, None]
+    by_parameter = np.empty_like(effects)
+    by_parameter[np.arange(trajectories)[:, None], order] = effects
+    return by_parameter
+
+
+def morris_indices(effects, names: list, outputs: list = None):
+    """
+    mu*, mu and sigma of the elementary effects of each parameter and output (the failed runs are ignored).
+
+    :return: DataFrame with the columns Output, Parameter, mu_star, mu, sigma and mu_star_normalised (mu* divided by
+             the largest mu* of the output)
+    """
+    outputs = outputs or output_names
+    # the outputs without observations (ex: Chl at deepwater) are nan for all runs
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mu_star = np.nanmean(np.abs(effects), axis=0)
+        mu = np.nanmean(effects, axis=0)
+        sigma = np.nanstd(effects, axis=0, ddof=1)
+        normalised = mu_star / np.nanmax(mu_star, axis=0, keepdims=True)
+    return pd.DataFrame({"Output": np.tile([output_label(output) for output in outputs], len(names)),
+                         "Parameter": np.repeat(names, len(outputs)), "mu_star": mu_star.ravel(), "mu": mu.ravel(),
+                         "sigma": sigma.ravel(), "mu_star_normalised": normalised.ravel()})
+
+
+def insensitive_parameters(indices: pd.DataFrame, variables: list, threshold: float = 0.1):
+    """ Parameters whose normalised mu* is lower than threshold for all the outputs of the variables """
+    outputs = indices["Output"].str.split(":").str[1].isin(variables)
+    largest = indices[outputs].groupby("Parameter", sort=False)["mu_star_normalised"].max()
+    return list(largest[~(largest >= threshold)].index)
+
+
+def figure_morris(indices: pd.DataFrame, metric: str, outpath: str, title: str = ""):
+    """ Figure of sigma against mu* of each parameter for one metric, one subplot by variable and level """
+    panels = [(variable, level) for variable in variables_list for level in levels_list]
+    fig, axes = plt.subplots(len(variables_list), len(levels_list), figsize=(6 * len(levels_list),
+                                                                             4.5 * len(variables_list)), squeeze=False)
+    for axis, (variable, level) in zip(axes.ravel(), panels):
+        selected = indices[indices["Output"] == "%s:%s:%s" % (metric, variable, level)]
+        axis.scatter(selected["mu_star"], selected["sigma"], s=15)
+        for _, line in selected.iterrows():
+            if np.isfinite(line["mu_star"]) and np.isfinite(line["sigma"]):
+                axis.annotate(line["Parameter"], (line["mu_star"], line["sigma"]), fontsize="x-small")
+        axis.set_title("%s %s %s" % (metric, variable, level))
+        axis.set_xlabel("mu*")
+        axis.set_ylabel("sigma")
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(outpath)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Morris screening of the parameters of a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Screened parameters, separated by commas")
+    parser.add_argument("--group", default=",".join(sorted({description["group"] for description in
+                                                             parameters_registry.values()})),
+                        help="Groups of the screened parameters if --parameters is not given (default: all)")
+    parser.add_argument("--trajectories", type=int, default=20, help="Number of trajectories (r)")
+    parser.add_argument("--levels", type=int, default=4, help="Number of levels of the grid")
+    parser.add_argument("--variables", default="T,O2", help="Variables used to find the insensitive parameters")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Parameters whose mu* is lower than threshold x the largest mu* are insensitive")
+    parser.add_argument("--metric", default="RMSE", choices=performance_indices_names, help="Metric of the figure")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the trajectories")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    space = ParameterSpace(names, fixed=read_parameter_file(args.lake))
+    points, steps, order = morris_trajectories(space.dimension, args.trajectories, args.levels, seed=args.seed)
+    print("Morris screening of %s parameters for %s: %s trajectories, %s runs" % (
+        len(names), args.lake, args.trajectories, points.shape[0] * points.shape[1]))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        results = executor.run_batch([space.parameters(point) for point in points.reshape(-1, space.dimension)])
+        output_folder = executor.output_folder
+    failed = sum(result["status"] != "done" for result in results)
+    if failed:
+        print("%s runs failed, their elementary effects are not used" % failed)
+
+    values = output_values(results).reshape(points.shape[0], points.shape[1], -1)
+    indices = morris_indices(elementary_effects(values, steps, order), names)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    outpath = os.path.join(output_folder, "morris_%s_%s.csv" % (args.lake, stamp))
+    indices.to_csv(outpath, index=False)
+    figure_morris(indices, args.metric, os.path.splitext(outpath)[0] + ".png", "Morris screening %s" % args.lake)
+
+    for variable in args.variables.split(","):
+        for level in levels_list:
+            ranking = indices[indices["Output"] == "%s:%s:%s" % (args.metric, variable, level)]
+            ranking = ranking.sort_values("mu_star", ascending=False)
+            print("%s %s %s: %s" % (args.metric, variable, level, ", ".join(
+                "%s %.3g" % (name, value) for name, value in zip(ranking["Parameter"], ranking["mu_star"]))))
+    fixed = insensitive_parameters(indices, args.variables.split(","), args.threshold)
+    print("Parameters that can be fixed (mu* < %s x the largest for %s): %s" % (
+        args.threshold, args.variables, ", ".join(fixed) if fixed else "none"))
+    print("Indices saved: %s" % outpath)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Processing of several lakes at the same time
+
+Script running the whole chain (extraction of the raw data, creation of the inputs, MyLake runs and performances) for
+the lakes of lakes_dict, or the lakes given in argument. The lakes are processed concurrently: each lake extracts its
+data and creates its inputs in its own thread, and the runs of all lakes share the same pool of workers. Each lake keeps
+its own folders (obs/<lake>, IO/<lake> and Postproc_code/<lake>); the summary of the runs of a lake is saved in
+Postproc_code/<lake>/multi_lake_<lake>_<date>.csv.
+
+    $ python script_multi_lake.py Bromont --inputs --workers 8
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import concurrent.futures
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from run_executor import RunExecutor, lakes_dict, read_parameter_file, river_inflow_by_lake, root_directory, \
+    variables_by_depth
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+io_directory = os.path.join(root_directory, "IO")
+
+
+# ---------------------------------------------------------------------------
+# Functions (executed by the workers)
+# ---------------------------------------------------------------------------
+
+def extract_lake(lake_name: str, root: str = root_directory):
+    """
+    Extract the bathymetry and the observations of a lake from the raw data
+    (see IO/extract_information_from_raw_data.py)
+    """
+    sys.path.insert(0, os.path.join(root, "IO"))
+    import extract_information_from_raw_data as extraction
+
+    raw_obs_directory = extraction.raw_obs_directories.get(lake_name)
+    if raw_obs_directory is None:
+        raise ValueError("No folder of raw observations for %s in raw_obs_directories of "
+                         "IO/extract_information_from_raw_data.py (lakes: %s)" % (
+                             lake_name, ", ".join(extraction.raw_obs_directories) or "none"))
+    lakes = {lake_name: lakes_dict.get(lake_name, lake_name)}
+    extraction.extract_bathymetry(lakes, rawdata_path=os.path.join(root, "Raw_data", "geo_data"),
+                                  observation_path=os.path.join(root, "obs"))
+    extraction.extract_observations(lakes, rawdata_path=os.path.normpath(os.path.join(
+        root, "IO", raw_obs_directory)), observation_path=os.path.join(root, "obs"))
+    return lake_name
+
+
+def extract_climate(root: str = root_directory):
+    """ Extract the climate data shared by the lakes (see IO/extract_information_from_raw_data.py) """
+    sys.path.insert(0, os.path.join(root, "IO"))
+    import extract_information_from_raw_data as extraction
+
+    return extraction.extract_climate(os.path.join(root, "Raw_data", "meteo"), os.path.join(root, "obs"))
+
+
+def create_lake_inputs(lake_name: str, root: str = root_directory, enable_river_inflow=None):
+    """
+    Create the input and initial concentration files of a lake (see IO/create_inputs_model_from_obs.py)
+
+    :param enable_river_inflow: 1 to use the inflows of the lake in the input file (default: river_inflow_by_lake)
+    """
+    sys.path.insert(0, os.path.join(root, "IO"))
+    import create_inputs_model_from_obs as inputs
+
+    if enable_river_inflow is None:
+        enable_river_inflow = river_inflow_by_lake.get(lake_name, 1)
+
+    simulation_information = inputs.Simulation_informations(input_folder=os.path.join(root, "IO"),
+                                                            observation_folder=os.path.join(root, "obs"),
+                                                            output_folder=os.path.join(root, "Postproc_code"))
+    inputs.Lake(lake_name, simulation_information, enable_river_inflow).create_files()
+    return lake_name
+
+
+def observations_by_depth(lake_name: str, root: str = root_directory):
+    """ Create the files of the observations by depth (obs/<lake>/Observed_<variable>.csv) used for the performances """
+    for variable in ["T", "O2"]:
+        variables_by_depth(os.path.join(root, "obs", lake_name), lake_name,
+                           os.path.join(root, "Postproc_code", lake_name), variable)
+    return lake_name
+
+
+def summary_of_runs(results: list):
+    """ Table with the parameters and the performances (by variable) of the runs of a lake """
+    lines = []
+    for result in results:
+        line = {"Run_key": result["key"], "Status": result["status"]}
+        line.update(result["parameters"])
+        if result["status"] == "done":
+            for position, variable in enumerate(["T", "O2", "Chl"]):
+                metrics = result["metrics"]
+                line["RMSE_all_%s" % variable] = metrics["RMSE_all"][position]
+                line["RMSE_surface_%s" % variable] = metrics["RMSE"][position][0]
+                line["RMSE_deepwater_%s" % variable] = metrics["RMSE"][position][1]
+                line["NSE_surface_%s" % variable] = metrics["NSE"][position][0]
+                line["NSE_deepwater_%s" % variable] = metrics["NSE"][position][1]
+        else:
+            line["Error"] = result["error"]
+        lines.append(line)
+    return pd.DataFrame(lines)
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class MultiLakeOrchestrator:
+    """
+    Process several lakes concurrently with one pool of workers shared by all lakes.
+
+    Example:
+        with MultiLakeOrchestrator(["Bromont", "Other"], max_workers=8) as orchestrator:
+            summaries = orchestrator.run(create_inputs=True)
+    """
+
+    def __init__(self, lakes: list, max_workers: int = None, solver: str = "matlab", matlab: str = "matlab",
+                 enable_sediment: int = 0, root: str = root_directory, quota=None):
+        """
+        :param quota:   Maximum size of the outputs of the runs of each lake (see run_retention.py)
+        """
+        self.lakes = lakes
+        self.quota = quota
+        self.root = root
+        self.solver = solver
+        self.matlab = matlab
+        self.enable_sediment = enable_sediment
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def process_lake(self, lake_name: str, parameter_sets: list = None, extract: bool = False,
+                     create_inputs: bool = False):
+        """
+        Process one lake (in its own thread): the extraction and the creation of the inputs are done by the thread,
+        and the runs are submitted to the shared pool, so the steps of the different lakes are executed at the same
+        time.
+
+        :param parameter_sets:  Parameter sets to run (default: the values of the parameter file of the lake)
+        :return: table with the performances of the runs (see summary_of_runs())
+        """
+        if extract:
+            extract_lake(lake_name, self.root)
+            observations_by_depth(lake_name, self.root)
+        if create_inputs:
+            create_lake_inputs(lake_name, self.root, river_inflow_by_lake.get(lake_name, 1))
+        if parameter_sets is None:
+            parameter_sets = [read_parameter_file(lake_name, self.root)]
+
+        executor = RunExecutor(lake_name, solver=self.solver, matlab=self.matlab, enable_sediment=self.enable_sediment,
+                               root=self.root, pool=self.pool,
+                               retention=RetentionManager(lake_name, self.quota, root=self.root))
+        summary = summary_of_runs(executor.run_batch(parameter_sets))
+        outpath = os.path.join(executor.output_folder, "multi_lake_%s_%s.csv" % (
+            lake_name, datetime.now().strftime('%Y%m%d_%H%M')))
+        summary.to_csv(outpath, index=False)
+        print("Lake %s done, summary saved: %s" % (lake_name, outpath))
+        return summary
+
+    def run(self, parameter_sets: list = None, extract: bool = False, create_inputs: bool = False):
+        """
+        Process all lakes concurrently.
+
+        :return: dictionary with the table of the performances of the runs for each lake
+        """
+        if extract:
+            extract_climate(self.root)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.lakes)) as lakes_threads:
+            futures = {lake: lakes_threads.submit(self.process_lake, lake, parameter_sets, extract, create_inputs)
+                       for lake in self.lakes}
+        return {lake: future.result() for lake, future in futures.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process several lakes at the same time.")
+    parser.add_argument("lakes", nargs="*", help="Lake names (default: all lakes of lakes_dict)")
+    parser.add_argument("--extract", action="store_true",
+                        help="Extract the raw data (climate, bathymetry, observations)")
+    parser.add_argument("--inputs", action="store_true", help="Create the input files of the lakes")
+    parser.add_argument("--parameters", default=None,
+                        help="CSV file with one parameter set by line (columns: parameter names) run for each lake")
+    parser.add_argument("--workers", type=int, default=None, help="Number of workers shared by all lakes")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs of each lake (ex: 20G)")
+    args = parser.parse_args()
+
+    lakes = args.lakes or list(lakes_dict.keys())
+    parameter_sets = None
+    if args.parameters is not None:
+        parameter_sets = pd.read_csv(args.parameters).to_dict(orient="records")
+
+    with MultiLakeOrchestrator(lakes, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                               enable_sediment=args.sediment, quota=args.quota) as orchestrator:
+        orchestrator.run(parameter_sets, extract=args.extract, create_inputs=args.inputs)
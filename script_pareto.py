@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Query and figure of the Pareto archive of NSGA-II
+
+Script reading the Pareto archive of the multi-objective calibration of a lake
+(Postproc_code/<lake>/final_calibration_<lake>_nsga2_pareto.csv, see calibration_nsga2.py), printing the runs meeting
+conditions on the objectives and drawing the trade-offs between each pair of objectives.
+
+    $ python script_pareto.py Bromont
+    $ python script_pareto.py Bromont --query "RMSE:T:all<1.5,RMSE:O2:all<2" --sort RMSE:O2:all --figure
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+
+import pandas as pd
+
+from calibration_nsga2 import archive_columns, figure_pareto, query_pareto, read_pareto_archive
+from run_executor import parameters_registry
+from script_final_calibration import pareto_archive_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the Pareto archive of the multi-objective calibration.")
+    parser.add_argument("lake", help="Lake name (folder Postproc_code/<lake>)")
+    parser.add_argument("--archive", default=None, help="Path to the archive (default: the archive of the lake)")
+    parser.add_argument("--query", default=None,
+                        help="Conditions objective<value or objective>value separated by commas")
+    parser.add_argument("--sort", default=None, help="Objective used to sort the runs (default: the first one)")
+    parser.add_argument("--figure", action="store_true",
+                        help="Draw the archive in final_calibration_<lake>_nsga2_pareto.png")
+    args = parser.parse_args()
+
+    path = args.archive or pareto_archive_path(args.lake)
+    archive = read_pareto_archive(path)
+    if archive is None:
+        raise SystemExit("No Pareto archive %s, run script_final_calibration.py with --method nsga2" % path)
+    labels = [column for column in archive.columns if column not in archive_columns and
+              column not in parameters_registry]
+    selected = query_pareto(archive, args.query) if args.query else archive
+    selected = selected.sort_values(args.sort or labels[0])
+    print("%s runs of %s in the Pareto archive %s" % (len(selected), len(archive), path))
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(selected.to_string(index=False))
+    if args.figure:
+        outpath = os.path.splitext(path)[0] + ".png"
+        figure_pareto(archive, labels, outpath, "Pareto archive %s (%s runs)" % (args.lake, len(archive)))
+        print("Figure saved: %s" % outpath)
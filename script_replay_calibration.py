@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Replay of the manual calibration reports
+
+Script reading the reports of the manual calibration (Postproc_code/<lake>/manual_calibration_<lake>_<var>_<stamp>.csv),
+running again every parameter set tested (once for each distinct set, in parallel) and writing a new report with the
+updated performances for each original iteration. Used when the inputs or the observations have changed.
+
+    $ python script_replay_calibration.py Bromont --workers 4
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from calibration_reports import find_calibration_reports, list_columns, read_calibration_report, report_parameters
+from run_executor import RunExecutor
+from run_retention import RetentionManager
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def replay_calibration_reports(executor: RunExecutor, reports: list):
+    """
+    Run again the parameter sets of the reports and update their performances.
+
+    :param executor:    RunExecutor of the lake
+    :param reports:     List of path to the reports
+    :return: DataFrame with the iterations of all reports and the updated performances
+    """
+    table = pd.concat([read_calibration_report(path) for path in reports], ignore_index=True)
+    parameters = [report_parameters(iteration) for _, iteration in table.iterrows()]
+
+    keys = [executor.key(parameter_set) for parameter_set in parameters]
+    distinct = {}
+    for key, parameter_set in zip(keys, parameters):
+        distinct.setdefault(key, parameter_set)
+    print("%s iterations in %s report(s), %s distinct parameter sets" % (len(table), len(reports), len(distinct)))
+
+    results = dict(zip(distinct.keys(), executor.run_batch(list(distinct.values()))))
+
+    for column in list_columns:
+        if column not in table.columns:
+            table[column] = None
+        table[column] = table[column].astype(object)
+    table["Run_key"] = keys
+    table["Status"] = ""
+    for index, key in enumerate(keys):
+        result = results[key]
+        table.at[index, "Status"] = result["status"]
+        if result["status"] == "done":
+            for column in list_columns:
+                table.at[index, column] = result["metrics"][column]
+        else:
+            print("Iteration %s of %s failed: %s" % (table.at[index, "Iteration"], table.at[index, "Report"],
+                                                    result["error"]))
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run again the parameter sets of the manual calibration reports.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("reports", nargs="*", help="Reports to replay (default: all reports of the lake)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    reports = args.reports or find_calibration_reports(args.lake)
+    if not reports:
+        raise SystemExit("No manual calibration report found for lake %s" % args.lake)
+
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        replay = replay_calibration_reports(executor, reports)
+
+    outpath = os.path.join(executor.output_folder,
+                           "replay_calibration_%s_%s.csv" % (args.lake, datetime.now().strftime('%Y%m%d_%H%M')))
+    replay.to_csv(outpath, index=False)
+    print("Report saved: %s" % outpath)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Local run service
+
+Small HTTP/JSON server sharing one pool of workers between several users of the same computer. The runs and the
+sweeps are submitted to the server, which executes them with RunExecutor (identical runs, already done or in
+progress, are executed only once) and gives back their status, performances and result file.
+
+    $ python script_run_service.py --port 8765 --workers 8
+
+    POST /runs      {"lake": "Bromont", "parameters": {"swa_b0": 1.5}, "options": {"enable_sediment": 0}}
+    POST /sweeps    {"lake": "Bromont", "parameters": {"swa_b0": "1:3:5", "kz_N0": [1e-5, 1e-4]}}
+    GET  /runs, /runs/<key>, /sweeps, /sweeps/<id>, /lakes
+
+The server only listens on localhost (127.0.0.1).
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import concurrent.futures
+import itertools
+import json
+import threading
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from run_executor import RunExecutor, inputs_hash, lakes_dict, observations_hash, parameters_registry, \
+    parse_parameter_value, read_parameter_file, root_directory
+from run_retention import RetentionManager
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+default_port = 8765
+# Options of the runs that can be given in a submission (see RunExecutor)
+run_options = ["start_year", "stop_year", "enable_sediment", "enable_river_inflow"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def parameter_value(name: str, value):
+    """
+    Check the value of a parameter of a run: a number (or a text read as a number), or "NaN" for c_shelter (no
+    shelter, as in the parameter file).
+
+    :return: the value as float, or "NaN"
+    """
+    if name == "c_shelter" and isinstance(value, str) and value.strip().lower() == "nan":
+        return "NaN"
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("Value of %s should be a number, not %s" % (name, json.dumps(value)))
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError("Value of %s should be a number, not '%s'" % (name, value))
+    if not np.isfinite(number):
+        raise ValueError("Value of %s should be a finite number, not '%s'" % (name, value))
+    return number
+
+
+def sweep_values(name: str, value):
+    """
+    Values of a parameter in a sweep: a list of values, a single value, or a text read as in
+    Lake.ask_parameters_value (see run_executor.parse_parameter_value: number, range "start:stop:number" or list
+    "[v1,v2,...]").
+
+    :return: list of the values (see parameter_value())
+    """
+    if isinstance(value, list):
+        values = value
+    elif isinstance(value, str) and not (name == "c_shelter" and value.strip().lower() == "nan"):
+        parsed = parse_parameter_value(value)
+        values = parsed if isinstance(parsed, list) else [parsed]
+    else:
+        values = [value]
+    if len(values) == 0:
+        raise ValueError("No value given for %s" % name)
+    return [parameter_value(name, element) for element in values]
+
+
+def request_service(url: str, path: str, payload: dict = None, timeout: float = 60):
+    """
+    Send a request to the run service (GET, or POST if a payload is given).
+
+    :param url:     Address of the service (ex: http://127.0.0.1:8765)
+    :param path:    Path of the request (ex: /runs)
+    :return: answer of the service (dictionary)
+    """
+    data = None if payload is None else json.dumps(payload).encode()
+    request = urllib.request.Request(url.rstrip("/") + path, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as answer:
+        return json.loads(answer.read().decode())
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class RunService:
+    """
+    Runs and sweeps submitted to the service, executed by one RunExecutor by lake sharing the same pool.
+    """
+
+    def __init__(self, max_workers: int = None, solver: str = "matlab", matlab: str = "matlab", quota=None,
+                 root: str = root_directory):
+        self.solver = solver
+        self.matlab = matlab
+        self.quota = quota
+        self.root = root
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        self.executors = {}
+        # runs by key: {"lake", "parameters", "options", "submitted", "future"}, and sweeps by number
+        self.runs = {}
+        self.sweeps = {}
+        self.lock = threading.Lock()
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.close()
+        self.pool.shutdown(wait=True)
+
+    def executor(self, lake_name: str):
+        """
+        RunExecutor of a lake, created at the first submission. The hashes of the input and observation files are
+        updated at each submission, so the runs submitted after a modification of the files are not read in the cache.
+        """
+        with self.lock:
+            if lake_name not in self.executors:
+                if lake_name not in lakes_dict:
+                    raise ValueError("Lake '%s' is not an option, choose between %s" % (lake_name,
+                                                                                       ", ".join(lakes_dict)))
+                self.executors[lake_name] = RunExecutor(lake_name, solver=self.solver, matlab=self.matlab,
+                                                        root=self.root, pool=self.pool,
+                                                        retention=RetentionManager(lake_name, self.quota,
+                                                                                   root=self.root))
+            else:
+                self.executors[lake_name].inputs_hash = inputs_hash(lake_name, self.root)
+                self.executors[lake_name].observations_hash = observations_hash(lake_name, self.root)
+            return self.executors[lake_name]
+
+    @staticmethod
+    def check_submission(submission: dict):
+        """ Raise ValueError if the parameters or the options of a submission are not known """
+        if not isinstance(submission, dict) or not all(isinstance(submission.get(name, {}), dict)
+                                                       for name in ["parameters", "options"]):
+            raise ValueError("The submission should be an object with the parameters and options as objects")
+        unknown = [name for name in submission.get("parameters", {}) if name not in parameters_registry]
+        unknown += [name for name in submission.get("options", {}) if name not in run_options]
+        if unknown:
+            raise ValueError("Unknown parameters or options: %s" % ", ".join(unknown))
+
+    def submit_run(self, lake_name: str, parameters: dict, options: dict = None):
+        """
+        Submit a run. The parameters not given take the value of the parameter file of the lake.
+
+        :return: key of the run
+        """
+        executor = self.executor(lake_name)
+        options = options or {}
+        parameters = dict(read_parameter_file(lake_name, self.root),
+                          **{name: parameter_value(name, value) for name, value in parameters.items()})
+        key = executor.key(parameters, **options)
+        with self.lock:
+            known = self.runs.get(key)
+            # a run in progress or done is not submitted again, a failed run is
+            if known is not None and not (known["future"].done() and (known["future"].exception() is not None or
+                                                                      known["future"].result()["status"] != "done")):
+                return key
+        future = executor.submit(parameters, **options)
+        with self.lock:
+            self.runs[key] = {"lake": lake_name, "parameters": parameters, "options": options,
+                              "submitted": datetime.now().strftime('%Y%m%d_%H%M%S'), "future": future}
+        return key
+
+    def submit_sweep(self, lake_name: str, parameters: dict, options: dict = None):
+        """
+        Submit all combinations of the values of the parameters (see sweep_values()).
+
+        :return: number of the sweep
+        """
+        names = list(parameters.keys())
+        values = [sweep_values(name, parameters[name]) for name in names]
+        keys = [self.submit_run(lake_name, dict(zip(names, combination)), options)
+                for combination in itertools.product(*values)]
+        with self.lock:
+            number = len(self.sweeps) + 1
+            self.sweeps[number] = {"lake": lake_name, "parameters": names, "keys": keys,
+                                   "submitted": datetime.now().strftime('%Y%m%d_%H%M%S')}
+        return number
+
+    def run_status(self, key: str, details: bool = True):
+        """ Status of a run (queued, running, done or failed) with its performances once done """
+        run = self.runs[key]
+        future = run["future"]
+        status = {"key": key, "lake": run["lake"], "submitted": run["submitted"]}
+        if not future.done():
+            status["status"] = "running" if future.running() else "queued"
+        elif future.exception() is not None:
+            status.update({"status": "failed", "error": "%s: %s" % (type(future.exception()).__name__,
+                                                                    future.exception())})
+        else:
+            result = future.result()
+            status["status"] = result["status"]
+            if details:
+                status.update({name: result.get(name) for name in ["parameters", "options", "metrics",
+                                                                   "result_file", "error", "duration"]})
+        return status
+
+    def sweep_status(self, number: int):
+        sweep = self.sweeps[number]
+        runs = [self.run_status(key) for key in sweep["keys"]]
+        counts = {}
+        for run in runs:
+            counts[run["status"]] = counts.get(run["status"], 0) + 1
+        return {"sweep": number, "lake": sweep["lake"], "parameters": sweep["parameters"],
+                "submitted": sweep["submitted"], "counts": counts, "runs": runs}
+
+
+class RunServiceHandler(BaseHTTPRequestHandler):
+    """ HTTP interface of the RunService given to the server (server.service) """
+
+    def send_json(self, answer, code: int = 200):
+        data = json.dumps(answer, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length).decode() or "{}")
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        try:
+            if parts == ["lakes"]:
+                self.send_json({"lakes": list(lakes_dict), "parameters": list(parameters_registry)})
+            elif parts == ["runs"]:
+                self.send_json({"runs": [service.run_status(key, details=False) for key in list(service.runs)]})
+            elif len(parts) == 2 and parts[0] == "runs" and parts[1] in service.runs:
+                self.send_json(service.run_status(parts[1]))
+            elif parts == ["sweeps"]:
+                self.send_json({"sweeps": [{name: value for name, value in service.sweep_status(number).items()
+                                            if name != "runs"} for number in list(service.sweeps)]})
+            elif len(parts) == 2 and parts[0] == "sweeps" and parts[1].isdigit() and int(parts[1]) in service.sweeps:
+                self.send_json(service.sweep_status(int(parts[1])))
+            else:
+                self.send_json({"error": "Not found: %s" % self.path}, 404)
+        except Exception as error:
+            self.send_json({"error": "%s: %s" % (type(error).__name__, error)}, 500)
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            submission = self.read_json()
+            service.check_submission(submission)
+            lake_name = submission.get("lake", list(lakes_dict)[0])
+            if self.path.rstrip("/") == "/runs":
+                key = service.submit_run(lake_name, submission.get("parameters", {}), submission.get("options"))
+                self.send_json(service.run_status(key, details=False), 202)
+            elif self.path.rstrip("/") == "/sweeps":
+                number = service.submit_sweep(lake_name, submission.get("parameters", {}), submission.get("options"))
+                self.send_json(service.sweep_status(number), 202)
+            else:
+                self.send_json({"error": "Not found: %s" % self.path}, 404)
+        except (ValueError, KeyError) as error:
+            self.send_json({"error": "%s: %s" % (type(error).__name__, error)}, 400)
+        except Exception as error:
+            self.send_json({"error": "%s: %s" % (type(error).__name__, error)}, 500)
+
+    def log_message(self, format, *args):
+        print("%s - %s" % (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), format % args))
+
+
+def start_service(port: int = default_port, **service_options):
+    """
+    Start the service on localhost in a thread.
+
+    :param service_options: options of RunService (max_workers, solver, matlab, quota, root)
+    :return: the server (server.shutdown() and server.service.close() to stop it)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), RunServiceHandler)
+    server.service = RunService(**service_options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local service running MyLake for several users.")
+    parser.add_argument("--port", type=int, default=default_port, help="Port of the service on localhost")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs of each lake (ex: 20G)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), RunServiceHandler)
+    server.service = RunService(max_workers=args.workers, solver=args.solver, matlab=args.matlab, quota=args.quota)
+    print("Run service on http://127.0.0.1:%s (Ctrl+C to stop)" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Run service stopped")
+    finally:
+        server.server_close()
+        server.service.close()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Sobol sensitivity analysis of the parameters
+
+Variance-based sensitivity analysis with the sampling of Saltelli: two matrices A and B of N points (scrambled Sobol
+sequence in the unit cube of the parameters, between the bounds of the registry), and for each parameter i the
+matrices A_B^i (A with the column i of B) and B_A^i (B with the column i of A), N (2d + 2) runs in total. The runs are
+submitted to RunExecutor by batches of --batch-size points (the runs already done are read in the cache).
+
+The first-order (S1, Saltelli et al., 2010) and total (ST, Jansen, 1999) indices are the mean of the estimators of
+(A, A_B^i) and (B, B_A^i), with bootstrap confidence intervals. They are calculated for the performances of the report
+(see sensitivity_indices.output_names) and for daily series of the runs (ex: O2 at the deepwater level,
+--series O2:deepwater), all outputs and all days at once.
+
+    $ python script_sobol.py Bromont --parameters kz_N0,swa_b0,swa_b1,I_scDOC,I_scO,k_BOD --samples 256 --workers 8
+    $ python script_sobol.py Bromont --group O2 --samples 128 --series O2:deepwater,T:surface
+
+The indices are saved in Postproc_code/<lake>/sobol_<lake>_<date>.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calibration_objective import ParameterSpace, calibrated_parameters, levels_list
+from run_executor import RunExecutor, read_parameter_file, variables_list
+from run_retention import RetentionManager
+from sensitivity_indices import bootstrap_indices, figure_series_indices, output_label, output_names, output_values, \
+    parse_series, saltelli_sample, selected_series, split_outputs
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+default_series = "O2:deepwater"
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def sobol_analysis(executor: RunExecutor, space: ParameterSpace, samples: int = 64, series: list = None,
+                   batch_size: int = None, resamples: int = 100, seed: int = None, **run_options):
+    """
+    Run the Saltelli sample by batches and calculate the indices of the performances and the daily series.
+
+    :param executor:    RunExecutor of the lake
+    :param space:       ParameterSpace of the analysed parameters (the others keep their value of space.fixed)
+    :param samples:     Number of points N of the matrices A and B
+    :param series:      Daily series analysed, list of (variable, level)
+    :param batch_size:  Number of runs submitted at once (default: all)
+    :return: dictionary with the indices of the performances (DataFrame), the indices of the series (dictionary of
+             arrays d x series x days) and the dates of the series
+    """
+    series = series or []
+    points = saltelli_sample(space.dimension, samples, seed)
+    batch_size = batch_size or len(points)
+    results, daily = [], None
+    for start in range(0, len(points), batch_size):
+        batch = executor.run_batch([space.parameters(point) for point in points[start:start + batch_size]],
+                                   **run_options)
+        results += batch
+        if series:
+            # the series are read after each batch, before the retention removes the result files
+            for index, result in enumerate(batch):
+                values = selected_series(result, series)
+                if values is not None and daily is None:
+                    daily = np.full((len(points),) + values.shape, np.nan, dtype=np.float32)
+                if values is not None:
+                    daily[start + index] = values
+        print("Sobol analysis: %s runs done out of %s" % (len(results), len(points)))
+    failed = sum(result["status"] != "done" for result in results)
+    if failed:
+        print("%s runs failed, their points are not used" % failed)
+
+    indices = bootstrap_indices(*split_outputs(output_values(results), space.dimension), resamples=resamples,
+                                seed=seed)
+    table = pd.DataFrame({"Output": np.tile([output_label(output) for output in output_names], space.dimension),
+                          "Parameter": np.repeat(space.names, len(output_names))})
+    for name, values in indices.items():
+        table[name] = values.ravel()
+    analysis = {"table": table, "series": series}
+    if daily is not None:
+        analysis["series_indices"] = bootstrap_indices(*split_outputs(daily, space.dimension), resamples=resamples,
+                                                       seed=seed)
+        start_year = dict(executor.options, **run_options)["start_year"]
+        analysis["dates"] = pd.date_range("%s-01-01" % start_year, periods=daily.shape[-1])
+    return analysis
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sobol sensitivity analysis of the parameters of a lake.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--parameters", default=None, help="Analysed parameters, separated by commas")
+    parser.add_argument("--group", default="T",
+                        help="Groups of the analysed parameters (T, O2, Chl, sediment) if --parameters is not given")
+    parser.add_argument("--samples", type=int, default=64,
+                        help="Number of points N of the matrices A and B (N (2d + 2) runs, power of 2)")
+    parser.add_argument("--series", default=default_series,
+                        help="Daily series analysed, variable:level separated by commas (default: %s)" % default_series)
+    parser.add_argument("--batch-size", type=int, default=None, help="Number of runs submitted at once")
+    parser.add_argument("--resamples", type=int, default=100, help="Number of bootstrap resamples")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the sampling and of the bootstrap")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    args = parser.parse_args()
+
+    names = calibrated_parameters(args.parameters, args.group)
+    series = parse_series(args.series)
+    print("Sobol analysis of %s for %s: %s runs" % (", ".join(names), args.lake, args.samples * (2 * len(names) + 2)))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     enable_sediment=args.sediment, retention=RetentionManager(args.lake, args.quota)) as executor:
+        space = ParameterSpace(names, fixed=read_parameter_file(args.lake))
+        analysis = sobol_analysis(executor, space, args.samples, series, args.batch_size, args.resamples, args.seed)
+        folder = os.path.join(executor.output_folder, "sobol_%s_%s" % (args.lake,
+                                                                      datetime.now().strftime('%Y%m%d_%H%M%S')))
+    os.makedirs(folder, exist_ok=True)
+    analysis["table"].to_csv(os.path.join(folder, "indices.csv"), index=False)
+    if "series_indices" in analysis:
+        np.savez_compressed(os.path.join(folder, "series_indices.npz"), parameters=np.array(names),
+                            series=np.array(["%s:%s" % element for element in series]),
+                            dates=analysis["dates"].strftime("%Y%m%d").astype(int), **analysis["series_indices"])
+        figure_series_indices(analysis, names, os.path.join(folder, "series_indices.png"),
+                              "Sobol indices %s" % args.lake)
+
+    for variable in variables_list:
+        for level in levels_list:
+            selected = analysis["table"][analysis["table"]["Output"] == "RMSE:%s:%s" % (variable, level)]
+            if selected["ST"].notna().any():
+                print("RMSE %s %s: %s" % (variable, level, ", ".join(
+                    "%s S1 %.2f [%.2f, %.2f] ST %.2f [%.2f, %.2f]" % tuple(line) for line in selected[
+                        ["Parameter", "S1", "S1_low", "S1_high", "ST", "ST_low", "ST_high"]].values)))
+    print("Indices saved: %s" % folder)
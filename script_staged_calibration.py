@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Staged automatic calibration (T -> O2 -> Chl -> sediment)
+
+The water column is calibrated before the sediment, and the temperature before the oxygen and the chlorophyll (the
+order of aks_for_what_is_modeled in script_manual_calibration.py). Each stage optimises only the parameters of its
+group of the registry against the performances of its own variable, the parameters of the previous stages being
+frozen at their calibrated values: a few low-dimensional searches instead of one search of all the parameters.
+
+The result of each stage is saved in Postproc_code/<lake>/staged_calibration_<lake>.json. When the script is called
+again, a stage whose frozen upstream values, settings, input files and observations are unchanged is not run again
+(the stages after a stage that changed are). The runs of the stages are also kept in the cache of RunExecutor, so
+the first point of a stage (the frozen result of the previous stages) is not run again. A stage whose variable has no
+observations is skipped, its parameters keeping their values.
+
+    $ python script_staged_calibration.py Bromont --method nelder-mead --max-evaluations 200 --workers 8
+    $ python script_staged_calibration.py Bromont --stages T,O2 --method cmaes --max-evaluations 1000 --save-parameters
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from calibration_objective import Objective, calibrated_parameters
+from run_executor import RunExecutor, read_observations, read_parameter_file, root_directory
+from run_retention import RetentionManager
+from script_final_calibration import calibrate, save_calibrated_parameters
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Stages in their order: group of the calibrated parameters, objective and sediment module of the runs
+calibration_stages = {
+    "T": {"group": "T", "objective": "nrmse:T:surface:1,nrmse:T:deepwater:1", "enable_sediment": 0},
+    "O2": {"group": "O2", "objective": "nrmse:O2:surface:1,nrmse:O2:deepwater:1", "enable_sediment": 0},
+    "Chl": {"group": "Chl", "objective": "nrmse:Chl:surface:1", "enable_sediment": 0},
+    "sediment": {"group": "sediment", "objective": "nrmse:O2:deepwater:1,nrmse:Chl:surface:1", "enable_sediment": 1}}
+stage_methods = ["nelder-mead", "powell", "bobyqa", "cmaes", "bayesian"]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def staged_state_path(lake_name: str, root: str = root_directory):
+    """ Results of the stages (Postproc_code/<lake>/staged_calibration_<lake>.json) """
+    return os.path.join(root, "Postproc_code", lake_name, "staged_calibration_%s.json" % lake_name)
+
+
+def stage_signature(executor: RunExecutor, stage: str, start: dict, method: str, max_evaluations: int):
+    """ Hash of everything the result of a stage depends on (values of the parameters at its start included) """
+    description = json.dumps({"stage": stage, "settings": calibration_stages[stage], "start": start,
+                              "method": method, "max_evaluations": max_evaluations,
+                              "options": {name: value for name, value in executor.options.items() if name != "matlab"},
+                              "inputs": executor.inputs_hash, "observations": executor.observations_hash},
+                             sort_keys=True, default=str)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def observed_terms(objective: Objective, observation_folder: str):
+    """ Terms of the objective whose variable has observations """
+    observed = {}
+    terms = []
+    for term in objective.terms:
+        variable = term[1]
+        if variable not in observed:
+            try:
+                observed[variable] = bool(read_observations(observation_folder, variable).notna().values.any())
+            except OSError:
+                observed[variable] = False
+        if observed[variable]:
+            terms.append(term)
+    return terms
+
+
+def staged_calibration(executor: RunExecutor, stages: list = None, method: str = "nelder-mead",
+                       max_evaluations: int = 200, initial: dict = None, state_path: str = None):
+    """
+    Calibrate the stages one after the other, each starting from the frozen values of the previous ones.
+
+    :param stages:          Names of the stages (see calibration_stages), in their order (default: all)
+    :param max_evaluations: Maximum number of runs of each stage
+    :param initial:         Values of the parameters at the start (default: the parameter file of the lake)
+    :param state_path:      JSON file of the results of the stages (default: staged_state_path())
+    :return: values of all parameters after the last stage, and the result of each stage
+    """
+    stages = stages or list(calibration_stages)
+    state_path = state_path or staged_state_path(executor.name, executor.root)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    parameters = dict(initial or read_parameter_file(executor.name, executor.root))
+
+    for stage in stages:
+        settings = calibration_stages[stage]
+        signature = stage_signature(executor, stage, parameters, method, max_evaluations)
+        if state.get(stage, {}).get("signature") == signature:
+            print("Stage %s: unchanged since %s, objective %s" % (stage, state[stage]["date"],
+                                                                 state[stage]["objective"]))
+            parameters = dict(state[stage]["parameters"])
+            continue
+
+        names = calibrated_parameters(None, settings["group"])
+        terms = observed_terms(Objective.from_text(settings["objective"]), executor.observation_folder)
+        result = {"signature": signature, "names": names, "date": datetime.now().strftime('%Y%m%d_%H%M%S')}
+        if not terms:
+            print("Stage %s: no observations for %s, %s keep their values" % (
+                stage, settings["objective"], ", ".join(names)))
+            result.update({"parameters": parameters, "objective": None, "evaluations": 0, "history": None})
+        else:
+            objective = Objective(terms)
+            print("Stage %s: calibration of %s, objective %s" % (stage, ", ".join(names), objective))
+            calibrated = calibrate(executor, names, objective, method, max_evaluations, initial=parameters,
+                                   enable_sediment=settings["enable_sediment"])
+            print("Stage %s: best objective %.4f after %s runs" % (stage, calibrated["objective"],
+                                                                  calibrated["evaluations"]))
+            result.update({"parameters": calibrated["parameters"], "objective": calibrated["objective"],
+                           "evaluations": calibrated["evaluations"], "run_key": calibrated["run_key"],
+                           "history": calibrated["history"]})
+        parameters = dict(result["parameters"])
+        state[stage] = result
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f, indent=1, default=str)
+        os.replace(state_path + ".tmp", state_path)
+    return parameters, {stage: state[stage] for stage in stages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the parameters of a lake stage by stage.")
+    parser.add_argument("lake", help="Lake name (folders IO/<lake>, obs/<lake> and Postproc_code/<lake>)")
+    parser.add_argument("--stages", default=",".join(calibration_stages),
+                        help="Stages in their order, separated by commas (default: %s)" % ",".join(calibration_stages))
+    parser.add_argument("--method", default="nelder-mead", choices=stage_methods, help="Optimiser of each stage")
+    parser.add_argument("--max-evaluations", type=int, default=200, help="Maximum number of runs of each stage")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at the same time")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--quota", default=None, help="Maximum size of the outputs of the runs (ex: 20G)")
+    parser.add_argument("--restart", action="store_true", help="Run all the stages again")
+    parser.add_argument("--save-parameters", action="store_true",
+                        help="Write the calibrated values in IO/<lake>/<lake>_para.txt")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",")]
+    unknown = [stage for stage in stages if stage not in calibration_stages]
+    if unknown:
+        raise SystemExit("Unknown stages: %s (choose between %s)" % (", ".join(unknown), ", ".join(calibration_stages)))
+    if args.restart and os.path.exists(staged_state_path(args.lake)):
+        os.remove(staged_state_path(args.lake))
+    with RunExecutor(args.lake, max_workers=args.workers, solver=args.solver, matlab=args.matlab,
+                     retention=RetentionManager(args.lake, args.quota)) as executor:
+        parameters, results = staged_calibration(executor, stages, args.method, args.max_evaluations)
+
+    for stage, result in results.items():
+        print("Stage %s (objective %s, %s runs):" % (stage, result["objective"], result["evaluations"]))
+        for name in result["names"]:
+            print("    %s = %s" % (name, parameters[name]))
+    print("Results of the stages saved: %s" % staged_state_path(args.lake))
+    if args.save_parameters:
+        print("Parameters saved: %s" % save_calibrated_parameters(args.lake, parameters))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Watch mode of the pipeline
+
+Script watching the files edited by hand (raw data, obs/<lake>/*.csv, the climate files and IO/<lake>/*_para.txt) and
+running again only the stages of the pipeline that depend on the modified files:
+
+    extract -> inputs -> run -> compare -> metrics -> figures
+
+The other stages reuse their last result: the runs are done by RunExecutor, so a run with the same parameters and the
+same input files is read from its workspace instead of being launched again, and an edit of the observations by depth
+(obs/<lake>/Observed_<variable>.csv) only compares the existing simulations with the new observations. The files of
+the last comparison, the performances and the figures are saved in Postproc_code/<lake>/watch.
+
+    $ python script_watch_pipeline.py Bromont --interval 5
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import argparse
+import concurrent.futures
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import matplotlib.pyplot as plt
+
+from run_executor import RunExecutor, comparisons_with_observations, depth_levels, lakes_dict, load_results, \
+    metrics_from_comparisons, read_parameter_file, river_inflow_by_lake, root_directory, variables_list
+from script_multi_lake import create_lake_inputs, extract_climate, extract_lake, observations_by_depth
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+pipeline_stages = ["extract", "inputs", "run", "compare", "metrics", "figures"]
+
+# Files read by each stage, relative to the root of the project ("%s" is replaced by the lake name). A modification
+# of one of these files runs again the stage and all the stages after it.
+stage_dependencies = {
+    "extract": [os.path.join("Raw_data", "**", "*")],
+    "inputs": [os.path.join("obs", "climate_data.csv"), os.path.join("obs", "%s", "climate_data.csv"),
+               os.path.join("obs", "%s", "%s_bathymetry.csv"), os.path.join("obs", "%s", "%s_observation_data.csv"),
+               os.path.join("obs", "%s", "%s_inflow_data.csv")],
+    "run": [os.path.join("IO", "%s", "*_para.txt"), os.path.join("IO", "%s", "input_%s.txt"),
+            os.path.join("IO", "%s", "mylake_initial_concentrations.txt")],
+    "compare": [os.path.join("obs", "%s", "Observed_*.csv")],
+}
+
+# Watched files written by the stages: they are not considered as modified by the user after the execution
+stage_outputs = {
+    "extract": [os.path.join("obs", "climate_data.csv"), os.path.join("obs", "%s", "%s_bathymetry.csv"),
+                os.path.join("obs", "%s", "%s_observation_data.csv")],
+    "inputs": [os.path.join("IO", "%s", "input_%s.txt"), os.path.join("IO", "%s", "mylake_initial_concentrations.txt"),
+               os.path.join("obs", "%s", "Observed_*.csv")],
+}
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def lake_patterns(patterns: list, lake_name: str, root: str = root_directory):
+    """ Absolute glob patterns of a lake ("%s" replaced by the lake name) """
+    return [os.path.join(root, pattern.replace("%s", lake_name)) for pattern in patterns]
+
+
+def file_hash(path: str):
+    """ Hash of the content of a file (None if the file does not exist) """
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def figure_comparisons(comparisons: dict, outpath: str, title: str = ""):
+    """
+    Figure of the observed (points) and simulated (lines) values at the surface and deepwater levels, one subplot by
+    variable with observations.
+
+    :param comparisons: Comparison table of each variable (see run_executor.comparisons_with_observations())
+    :param outpath:     Path of the figure
+    """
+    variables = [variable for variable in variables_list if len(comparisons[variable]) > 0]
+    fig, axes = plt.subplots(max(len(variables), 1), 1, figsize=(12, 3.5 * max(len(variables), 1)), squeeze=False)
+    for axis, variable in zip(axes[:, 0], variables):
+        comparison = comparisons[variable]
+        for level, color in [("surface", "black"), ("deepwater", "blue")]:
+            at_level = comparison[comparison["Depth"] == depth_levels[level]]
+            axis.plot(at_level["Datetime"], at_level["Simulations"], "-", color=color, label="%s simulated" % level)
+            axis.plot(at_level["Datetime"], at_level["Observations"], "s", color=color, label="%s observed" % level)
+        axis.set_ylabel(variable)
+        axis.legend(loc="upper right", fontsize="small")
+    axes[0, 0].set_title(title)
+    fig.tight_layout()
+    fig.savefig(outpath)
+    plt.close(fig)
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class PipelineWatcher:
+    """
+    Watch the files of the lakes and run again the stages depending on the modified files.
+
+    Example:
+        with PipelineWatcher(["Bromont"], solver="stand-in") as watcher:
+            watcher.watch()
+    """
+
+    def __init__(self, lakes: list, interval: float = 2.0, max_workers: int = None, solver: str = "matlab",
+                 matlab: str = "matlab", enable_sediment: int = 0, root: str = root_directory):
+        """
+        :param lakes:       Names of the lakes watched
+        :param interval:    Time between two checks of the files (s)
+        :param max_workers: Number of workers shared by the lakes
+        :param solver:      "matlab" to run MyLake, "stand-in" to use the analytical replacement
+        """
+        self.lakes = lakes
+        self.interval = interval
+        self.solver = solver
+        self.matlab = matlab
+        self.enable_sediment = enable_sediment
+        self.root = root
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        # (mtime, size, hash) of the watched files at the last check
+        self.state = {}
+        # results of the last execution of the stages of each lake
+        self.results = {lake: {} for lake in lakes}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def watched_files(self):
+        """
+        List the files watched and the first stage of each lake depending on them.
+
+        :return: dictionary {path: {lake: stage}}
+        """
+        files = {}
+        for lake in self.lakes:
+            for stage, patterns in stage_dependencies.items():
+                for pattern in lake_patterns(patterns, lake, self.root):
+                    for path in glob.glob(pattern, recursive=True):
+                        if os.path.isfile(path):
+                            depending = files.setdefault(os.path.normpath(path), {})
+                            if lake not in depending or pipeline_stages.index(stage) < pipeline_stages.index(
+                                    depending[lake]):
+                                depending[lake] = stage
+        return files
+
+    def check_files(self, paths: list = None):
+        """
+        Compare the watched files with their state at the last check. The content of a file is hashed only when its
+        modification time or its size changed, and a file saved without modification is not considered as modified.
+
+        :param paths:   Files to check (default: all watched files); the state of the other files is not updated
+        :return: list of the modified (or created, or deleted) files
+        """
+        if paths is None:
+            paths = set(self.watched_files()) | set(self.state)
+        modified = []
+        for path in paths:
+            if os.path.isfile(path):
+                status = os.stat(path)
+                signature = (status.st_mtime_ns, status.st_size)
+            else:
+                signature = None
+            previous = self.state.get(path)
+            if previous is not None and previous[:2] == signature:
+                continue
+            content = file_hash(path)
+            if previous is None or previous[2] != content:
+                modified.append(path)
+            if signature is None:
+                self.state.pop(path, None)
+            else:
+                self.state[path] = signature + (content,)
+        return modified
+
+    def first_stages(self, modified: list):
+        """
+        First stage to execute for each lake after the modification of files.
+
+        :return: dictionary {lake: stage}
+        """
+        files = self.watched_files()
+        stages = {}
+        for path in modified:
+            # a deleted file is no longer found by watched_files(): it is assigned with the patterns of the stages
+            depending = files.get(path) or {lake: stage for lake in self.lakes
+                                            for stage, patterns in stage_dependencies.items()
+                                            if any(fnmatch.fnmatch(path, pattern)
+                                                   for pattern in lake_patterns(patterns, lake, self.root))}
+            for lake, stage in depending.items():
+                if lake not in stages or pipeline_stages.index(stage) < pipeline_stages.index(stages[lake]):
+                    stages[lake] = stage
+        return stages
+
+    def watch_folder(self, lake_name: str):
+        folder = os.path.join(self.root, "Postproc_code", lake_name, "watch")
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    # Stages ------------------------------------------------------------------
+
+    def stage_extract(self, lake_name: str):
+        extract_lake(lake_name, self.root)
+
+    def stage_inputs(self, lake_name: str):
+        create_lake_inputs(lake_name, self.root, river_inflow_by_lake.get(lake_name, 1))
+        observations_by_depth(lake_name, self.root)
+
+    def stage_run(self, lake_name: str):
+        """ Run the parameters of IO/<lake>/<lake>_para.txt (read in the cache if the run was already done) """
+        executor = RunExecutor(lake_name, solver=self.solver, matlab=self.matlab,
+                               enable_sediment=self.enable_sediment, root=self.root, pool=self.pool)
+        result = executor.run_batch([read_parameter_file(lake_name, self.root)])[0]
+        if result["status"] == "done" and not os.path.exists(result["result_file"]):
+            # .mat file deleted by the retention of the outputs (see run_retention.py): the run is done again
+            executor.use_cache = False
+            result = executor.run_batch([read_parameter_file(lake_name, self.root)])[0]
+        if result["status"] != "done":
+            raise RuntimeError("Run %s failed: %s" % (result["key"], result["error"]))
+        self.results[lake_name]["run"] = result
+
+    def stage_compare(self, lake_name: str):
+        """ Compare the last run with the observations and save the comparison files of each variable """
+        result = self.results[lake_name]["run"]
+        comparisons = comparisons_with_observations(load_results(result["result_file"]),
+                                                    os.path.join(self.root, "obs", lake_name),
+                                                    "%s-01-01" % result["options"]["start_year"],
+                                                    result["options"].get("dz", 0.5))
+        folder = self.watch_folder(lake_name)
+        for variable, comparison in comparisons.items():
+            comparison.drop(columns=["Datetime"]).to_csv(os.path.join(folder, "%s_comparisonall.csv" % variable),
+                                                         index=False)
+        self.results[lake_name]["compare"] = comparisons
+
+    def stage_metrics(self, lake_name: str):
+        """ Calculate the performances of the last comparison (saved in Postproc_code/<lake>/watch/metrics.json) """
+        result = self.results[lake_name]["run"]
+        metrics = metrics_from_comparisons(self.results[lake_name]["compare"])
+        with open(os.path.join(self.watch_folder(lake_name), "metrics.json"), "w") as f:
+            json.dump({"key": result["key"], "parameters": result["parameters"], "metrics": metrics,
+                       "date": datetime.now().strftime('%Y%m%d_%H%M%S')}, f, indent=1, default=str)
+        for position, variable in enumerate(variables_list):
+            print("%s %s: RMSE all depths %s, RMSE surface/deepwater %s, NSE surface/deepwater %s" % (
+                lake_name, variable, metrics["RMSE_all"][position], metrics["RMSE"][position],
+                metrics["NSE"][position]))
+        self.results[lake_name]["metrics"] = metrics
+
+    def stage_figures(self, lake_name: str):
+        outpath = os.path.join(self.watch_folder(lake_name), "comparison_%s.png" % lake_name)
+        figure_comparisons(self.results[lake_name]["compare"], outpath,
+                           "%s, run %s" % (lake_name, self.results[lake_name]["run"]["key"]))
+
+    def execute(self, lake_name: str, first_stage: str):
+        """
+        Execute the stages of a lake from first_stage to the end of the pipeline. The stages after a stage that
+        failed are not executed.
+
+        :return: list of the stages executed
+        """
+        stages = pipeline_stages[pipeline_stages.index(first_stage):]
+        if "run" not in stages and "run" not in self.results[lake_name]:
+            stages = pipeline_stages[pipeline_stages.index("run"):]
+        executed = []
+        for stage in stages:
+            start = time.time()
+            try:
+                getattr(self, "stage_%s" % stage)(lake_name)
+            except Exception as error:
+                print("%s: stage %s failed (%s: %s)" % (lake_name, stage, type(error).__name__, error))
+                break
+            executed.append(stage)
+            print("%s: stage %s done (%.1f s)" % (lake_name, stage, time.time() - start))
+        return executed
+
+    def update(self, stages: dict):
+        """
+        Execute the stages of the lakes at the same time, then update the state of the files written by the stages.
+
+        :param stages:  First stage to execute for each lake (see first_stages())
+        """
+        if any(stage == "extract" for stage in stages.values()):
+            extract_climate(self.root)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(stages), 1)) as lakes_threads:
+            futures = {lake: lakes_threads.submit(self.execute, lake, stage) for lake, stage in stages.items()}
+        written = set()
+        for lake, future in futures.items():
+            for stage in future.result():
+                for pattern in lake_patterns(stage_outputs.get(stage, []), lake, self.root):
+                    written.update(os.path.normpath(path) for path in glob.glob(pattern))
+        self.check_files(list(written))
+
+    def watch(self, initial_stage: str = "run"):
+        """
+        Execute the pipeline of all lakes from initial_stage, then watch the files until Ctrl+C.
+        """
+        self.check_files()
+        self.update({lake: initial_stage for lake in self.lakes})
+        print("Watching the files of %s (Ctrl+C to stop)" % ", ".join(self.lakes))
+        try:
+            while True:
+                time.sleep(self.interval)
+                modified = self.check_files()
+                if not modified:
+                    continue
+                # wait until the files are no longer modified (files saved in several steps)
+                while True:
+                    time.sleep(self.interval)
+                    also_modified = self.check_files()
+                    if not also_modified:
+                        break
+                    modified.extend(also_modified)
+                for path in sorted(set(modified)):
+                    print("Modified: %s" % os.path.relpath(path, self.root))
+                self.update(self.first_stages(sorted(set(modified))))
+        except KeyboardInterrupt:
+            print("Watch stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run again the stages of the pipeline depending on modified files.")
+    parser.add_argument("lakes", nargs="*", help="Lake names (default: all lakes of lakes_dict)")
+    parser.add_argument("--interval", type=float, default=2.0, help="Time between two checks of the files (s)")
+    parser.add_argument("--start", default="run", choices=pipeline_stages,
+                        help="Stage from which the pipeline is executed when the watch starts")
+    parser.add_argument("--workers", type=int, default=None, help="Number of workers shared by all lakes")
+    parser.add_argument("--solver", default="matlab", help="'matlab' or 'stand-in'")
+    parser.add_argument("--matlab", default="matlab", help="Path to matlab.exe")
+    parser.add_argument("--sediment", type=int, default=0, help="Enable the sediment module (1) or not (0)")
+    args = parser.parse_args()
+
+    with PipelineWatcher(args.lakes or list(lakes_dict.keys()), interval=args.interval, max_workers=args.workers,
+                         solver=args.solver, matlab=args.matlab, enable_sediment=args.sediment) as watcher:
+        watcher.watch(args.start)
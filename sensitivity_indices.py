@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Outputs of the runs and variance-based indices shared by the sensitivity analyses
+
+Functions used by script_morris.py, script_sobol.py and forcing_uncertainty.py (and the daily series by
+script_glue.py and calibration_emulator.py), without the modules of the calibration:
+    - output_names, output_values: performances of the report of the runs (RMSE, NSE, RSR, Pbias, R2, SOS, nrmse at
+      the surface and deepwater levels, RMSE and R of all depths);
+    - run_series, selected_series: daily series of the runs at the surface and deepwater levels;
+    - saltelli_sample, sobol_indices, bootstrap_indices: sampling of Saltelli and first-order (S1, Saltelli et al.,
+      2010) and total (ST, Jansen, 1999) indices with bootstrap confidence intervals.
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import os
+import warnings
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.stats import qmc
+
+from calibration_objective import levels_list, metric_value
+from run_executor import depth_levels, load_results, performance_indices_names, simulated_variable, variables_list
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+# Performances of the runs analysed: (metric, variable, level)
+output_names = [("%s_all" % metric, variable, "all") for metric in ["RMSE", "R2"] for variable in variables_list] + \
+    [(metric, variable, level) for metric in performance_indices_names for variable in variables_list
+     for level in levels_list]
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def output_label(output: tuple):
+    metric, variable, level = output
+    return "%s:%s" % (metric, variable) if level == "all" else "%s:%s:%s" % output
+
+
+def output_values(results: list, outputs: list = None):
+    """
+    Performances of the runs (nan for a failed run or a performance that can not be calculated).
+
+    :param results: Results of the runs (see run_executor.execute_run())
+    :param outputs: List of (metric, variable, level) (default: output_names)
+    :return: array (runs x outputs)
+    """
+    outputs = outputs or output_names
+    values = np.full((len(results), len(outputs)), np.nan)
+    for index, result in enumerate(results):
+        if result["status"] != "done" or result["metrics"] is None:
+            continue
+        for position, (metric, variable, level) in enumerate(outputs):
+            if level == "all":
+                value = result["metrics"][metric][variables_list.index(variable)]
+            else:
+                value = metric_value(result["metrics"], metric, variable, level)
+            values[index, position] = np.nan if value is None else value
+    return values
+
+
+def level_series(simulated, depth: float, dz: float = 0.5):
+    """ Daily series of a simulated variable (layers x days) at a depth, interpolated between the two nearest layers """
+    simulated = np.asarray(simulated, dtype=float)
+    position = depth / dz
+    lower = int(np.clip(np.floor(position), 0, simulated.shape[0] - 1))
+    upper = min(lower + 1, simulated.shape[0] - 1)
+    weight = position - lower
+    return simulated[lower] * (1 - weight) + simulated[upper] * weight
+
+
+def run_series(result: dict):
+    """
+    Daily series of a run at the surface and deepwater levels.
+
+    :return: array (variables x levels x days), in the order of variables_list and levels_list
+    """
+    water = load_results(result["result_file"])
+    dz = result["options"].get("dz", 0.5)
+    return np.array([[level_series(simulated_variable(water, variable), depth_levels[level], dz)
+                      for level in levels_list] for variable in variables_list], dtype=np.float32)
+
+
+def parse_series(text: str):
+    """ Daily series analysed, given as variable:level separated by commas (ex: "O2:deepwater,T:surface") """
+    series = [tuple(element.strip().split(":")) for element in text.split(",") if element.strip()]
+    for variable, level in series:
+        if variable not in variables_list or level not in levels_list:
+            raise ValueError("Series %s:%s is not an option (variables: %s, levels: %s)" % (
+                variable, level, ", ".join(variables_list), ", ".join(levels_list)))
+    return series
+
+
+def selected_series(result: dict, series: list, days: int = None):
+    """ Daily series of a run for the (variable, level) given (nan for a failed run or a result file removed) """
+    if result["status"] != "done" or result["result_file"] is None or not os.path.exists(result["result_file"]):
+        return None
+    values = run_series(result)
+    return np.array([values[variables_list.index(variable), levels_list.index(level)] for variable, level in series])
+
+
+def saltelli_sample(dimension: int, samples: int, seed: int = None):
+    """
+    Matrices of the Saltelli sampling.
+
+    :param samples: Number of points N of A and B (a power of 2 keeps the balance of the Sobol sequence)
+    :return: points (N (2d + 2) x d) in the order A, B, A_B^1..A_B^d, B_A^1..B_A^d
+    """
+    base = qmc.Sobol(2 * dimension, scramble=True, seed=seed).random(samples)
+    a, b = base[:, :dimension], base[:, dimension:]
+    a_b = np.repeat(a[None, :, :], dimension, axis=0)
+    b_a = np.repeat(b[None, :, :], dimension, axis=0)
+    for parameter in range(dimension):
+        a_b[parameter, :, parameter] = b[:, parameter]
+        b_a[parameter, :, parameter] = a[:, parameter]
+    return np.vstack([a, b, a_b.reshape(-1, dimension), b_a.reshape(-1, dimension)])
+
+
+def split_outputs(values, dimension: int):
+    """ Outputs of the runs (N (2d + 2) x ...) split into f(A), f(B), f(A_B) and f(B_A) (d x N x ...) """
+    samples = len(values) // (2 * dimension + 2)
+    values = np.asarray(values, dtype=float).reshape((2 * dimension + 2, samples) + values.shape[1:])
+    return values[0], values[1], values[2:dimension + 2], values[dimension + 2:]
+
+
+def sobol_indices(f_a, f_b, f_ab, f_ba):
+    """
+    First-order and total indices of each parameter for all outputs at once. The points with a failed run in one of
+    the matrices are not used (for that output).
+
+    :param f_a:     Outputs of A (N x ...), f_b the outputs of B
+    :param f_ab:    Outputs of A_B^i (d x N x ...), f_ba the outputs of B_A^i
+    :return: S1 and ST (d x ...)
+    """
+    valid = np.isfinite(f_a) & np.isfinite(f_b) & np.all(np.isfinite(f_ab), axis=0) & np.all(np.isfinite(f_ba), axis=0)
+    f_a, f_b = np.where(valid, f_a, np.nan), np.where(valid, f_b, np.nan)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        variance = np.nanvar(np.concatenate([f_a, f_b]), axis=0)
+        first = (np.nanmean(f_b * (f_ab - f_a), axis=1) + np.nanmean(f_a * (f_ba - f_b), axis=1)) / (2 * variance)
+        total = (np.nanmean((f_a - f_ab) ** 2, axis=1) + np.nanmean((f_b - f_ba) ** 2, axis=1)) / (4 * variance)
+    return first, total
+
+
+def bootstrap_indices(f_a, f_b, f_ab, f_ba, resamples: int = 100, confidence: float = 0.95, seed: int = None):
+    """
+    Indices with the bounds of their bootstrap confidence interval (points of the N resampled with replacement).
+
+    :return: dictionary of arrays (d x ...): S1, S1_low, S1_high, ST, ST_low, ST_high
+    """
+    random = np.random.default_rng(seed)
+    first, total = sobol_indices(f_a, f_b, f_ab, f_ba)
+    firsts, totals = [], []
+    for _ in range(resamples):
+        rows = random.integers(len(f_a), size=len(f_a))
+        resampled = sobol_indices(f_a[rows], f_b[rows], f_ab[:, rows], f_ba[:, rows])
+        firsts.append(resampled[0])
+        totals.append(resampled[1])
+    tails = [50 * (1 - confidence), 50 * (1 + confidence)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        first_bounds = np.nanpercentile(np.array(firsts), tails, axis=0)
+        total_bounds = np.nanpercentile(np.array(totals), tails, axis=0)
+    return {"S1": first, "S1_low": first_bounds[0], "S1_high": first_bounds[1],
+            "ST": total, "ST_low": total_bounds[0], "ST_high": total_bounds[1]}
+
+
+def figure_series_indices(analysis: dict, names: list, outpath: str, title: str = ""):
+    """ Figure of the daily first-order and total indices of each series, one line by parameter """
+    series = analysis["series"]
+    fig, axes = plt.subplots(len(series), 2, figsize=(14, 3.5 * len(series)), squeeze=False, sharex=True)
+    for position, (variable, level) in enumerate(series):
+        for column, index in enumerate(["S1", "ST"]):
+            axis = axes[position, column]
+            for number, name in enumerate(names):
+                axis.plot(analysis["dates"], analysis["series_indices"][index][number, position], label=name)
+            axis.set_ylabel("%s %s %s" % (index, variable, level))
+            axis.set_ylim(-0.05, 1.05)
+    axes[0, 1].legend(loc="upper right", fontsize="x-small", ncol=2)
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(outpath)
+    plt.close(fig)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Tests of the calibration algorithms (with the stand-in solver) and of the sensitivity and assimilation tools
+
+    $ python -m pytest tests
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from calibration_nsga2 import objective_labels, read_pareto_archive
+from calibration_objective import CalibrationEvaluator, Objective, ParameterSpace, default_objective
+from data_assimilation import ensemble_analysis
+from run_executor import RunExecutor, read_parameter_file, root_directory
+from script_final_calibration import calibrate, optimizers
+from sensitivity_indices import saltelli_sample, sobol_indices, split_outputs
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+lake_name = "Bromont"
+calibrated_names = ["swa_b0", "swa_b1", "kz_N0"]
+max_evaluations = 24
+# Options keeping the generations of the population methods small enough for max_evaluations
+method_options = {"cmaes": {"population_size": 6, "seed": 1}, "bayesian": {"batch_size": 4, "seed": 1},
+                  "dream": {"chains": 4, "seed": 1}, "nsga2": {"population_size": 6, "seed": 1}}
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def ishigami(points):
+    """ Ishigami function (a = 7, b = 0.1) of points of [-pi, pi]^3 """
+    return np.sin(points[:, 0]) + 7 * np.sin(points[:, 1]) ** 2 + 0.1 * points[:, 2] ** 4 * np.sin(points[:, 0])
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class TestOptimisers(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the runs are done in a copy of the input and observation files of the lake
+        cls.root = tempfile.mkdtemp()
+        for folder in ["IO", "obs"]:
+            shutil.copytree(os.path.join(root_directory, folder, lake_name), os.path.join(cls.root, folder, lake_name))
+        os.makedirs(os.path.join(cls.root, "Postproc_code", lake_name))
+        cls.executor = RunExecutor(lake_name, max_workers=2, solver="stand-in", root=cls.root)
+        cls.initial = read_parameter_file(lake_name, cls.root)
+        cls.objective = Objective.from_text(default_objective)
+        cls.initial_value = cls.objective(cls.executor.run_batch([cls.initial])[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.close()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def test_optimisers(self):
+        for method in optimizers:
+            with self.subTest(method=method):
+                result = calibrate(self.executor, calibrated_names, self.objective, method, max_evaluations,
+                                   method_options.get(method), initial=self.initial)
+                self.assertLessEqual(result["evaluations"], max_evaluations)
+                self.assertLess(result["objective"], self.initial_value)
+
+    def test_nsga2_archive(self):
+        space = ParameterSpace(calibrated_names, fixed=self.initial)
+        evaluator = CalibrationEvaluator(self.executor, space, self.objective, "nsga2", max_evaluations, save=False)
+        archive = os.path.join(self.root, "pareto.csv")
+        result = optimizers["nsga2"](evaluator, archive=archive, **method_options["nsga2"]).minimise(
+            space.unit_of(self.initial))
+        values = read_pareto_archive(archive)[objective_labels(self.objective)].values
+        self.assertEqual(len(values), result["front_size"])
+        for first in values:
+            for second in values:
+                self.assertFalse(np.all(second <= first) and np.any(second < first),
+                                 "%s dominated by %s" % (first, second))
+
+
+class TestSobolIndices(unittest.TestCase):
+
+    def test_ishigami(self):
+        points = -np.pi + 2 * np.pi * saltelli_sample(3, 2 ** 12, seed=1)
+        first, total = sobol_indices(*split_outputs(ishigami(points), 3))
+        np.testing.assert_allclose(first, [0.314, 0.442, 0.0], atol=0.02)
+        np.testing.assert_allclose(total, [0.558, 0.442, 0.244], atol=0.02)
+
+
+class TestEnsembleAnalysis(unittest.TestCase):
+
+    def test_spread(self):
+        random = np.random.default_rng(1)
+        # 3 states (the first observed) of 100 members, the second correlated with the first
+        ensemble = random.normal(10, 1, size=(3, 100))
+        ensemble[1] = 0.8 * ensemble[0] + 0.2 * ensemble[1]
+        analysed = ensemble_analysis(ensemble, ensemble[:1], [11.0], [0.2], random)
+        self.assertEqual(analysed.shape, ensemble.shape)
+        self.assertLess(analysed[0].std(), 0.5 * ensemble[0].std())
+        self.assertLess(analysed[1].std(), ensemble[1].std())
+        self.assertAlmostEqual(analysed[0].mean(), 11.0, delta=0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+""" Tests of the HTTP interface of the local run service (script_run_service.py), with the stand-in solver
+
+    $ python -m pytest tests
+"""
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+import urllib.error
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_executor import root_directory
+from script_run_service import request_service, start_service
+
+# ---------------------------------------------------------------------------
+# Global Variables
+# ---------------------------------------------------------------------------
+lake_name = "Bromont"
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class TestRunService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the runs are done in a copy of the input and observation files of the lake
+        cls.root = tempfile.mkdtemp()
+        for folder in ["IO", "obs"]:
+            shutil.copytree(os.path.join(root_directory, folder, lake_name), os.path.join(cls.root, folder, lake_name))
+        os.makedirs(os.path.join(cls.root, "Postproc_code", lake_name))
+        port = free_port()
+        cls.server = start_service(port, max_workers=2, solver="stand-in", root=cls.root)
+        cls.url = "http://127.0.0.1:%s" % port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.server.service.close()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def post_error(self, path: str, payload: dict):
+        """ Code and answer of a request refused by the service """
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            request_service(self.url, path, payload)
+        return context.exception.code, context.exception.read().decode()
+
+    def wait_run(self, key: str, timeout: float = 120):
+        """ Status of a run once it is done or failed """
+        start = time.time()
+        while time.time() - start < timeout:
+            status = request_service(self.url, "/runs/%s" % key)
+            if status["status"] not in ("queued", "running"):
+                return status
+            time.sleep(0.2)
+        self.fail("Run %s not done after %s s" % (key, timeout))
+
+    def test_lakes(self):
+        answer = request_service(self.url, "/lakes")
+        self.assertIn(lake_name, answer["lakes"])
+        self.assertIn("swa_b0", answer["parameters"])
+
+    def test_run(self):
+        submitted = request_service(self.url, "/runs", {"lake": lake_name, "parameters": {"swa_b0": 1.5}})
+        status = self.wait_run(submitted["key"])
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["parameters"]["swa_b0"], 1.5)
+        self.assertIn("RMSE_all", status["metrics"])
+        keys = [run["key"] for run in request_service(self.url, "/runs")["runs"]]
+        self.assertIn(submitted["key"], keys)
+        # the same run is not submitted again
+        again = request_service(self.url, "/runs", {"lake": lake_name, "parameters": {"swa_b0": "1.5"}})
+        self.assertEqual(again["key"], submitted["key"])
+
+    def test_sweep_list(self):
+        sweep = request_service(self.url, "/sweeps", {"lake": lake_name, "parameters": {"swa_b0": "[1,2]"}})
+        self.assertEqual(len(sweep["runs"]), 2)
+        for run in sweep["runs"]:
+            status = self.wait_run(run["key"])
+            self.assertEqual(status["status"], "done")
+            self.assertIsInstance(status["parameters"]["swa_b0"], float)
+        values = sorted(self.wait_run(run["key"])["parameters"]["swa_b0"] for run in sweep["runs"])
+        self.assertEqual(values, [1.0, 2.0])
+        answer = request_service(self.url, "/sweeps/%s" % sweep["sweep"])
+        self.assertEqual(answer["parameters"], ["swa_b0"])
+
+    def test_sweep_range_and_shelter(self):
+        sweep = request_service(self.url, "/sweeps", {"lake": lake_name, "parameters": {
+            "swa_b1": "0.5:1.5:3", "c_shelter": ["NaN", 0.2]}})
+        self.assertEqual(len(sweep["runs"]), 6)
+        shelters = {str(self.wait_run(run["key"])["parameters"]["c_shelter"]) for run in sweep["runs"]}
+        self.assertEqual(shelters, {"NaN", "0.2"})
+
+    def test_rejected_values(self):
+        for path, parameters in [("/sweeps", {"swa_b0": "abc"}), ("/sweeps", {"swa_b0": ["1", "x"]}),
+                                 ("/sweeps", {"swa_b0": "NaN"}), ("/sweeps", {"swa_b0": "1:2"}),
+                                 ("/runs", {"swa_b0": "[1,2]"}), ("/runs", {"kz_N0": True}),
+                                 ("/runs", {"unknown": 1})]:
+            code, answer = self.post_error(path, {"lake": lake_name, "parameters": parameters})
+            self.assertEqual(code, 400, "%s %s: %s" % (path, parameters, answer))
+        code, _ = self.post_error("/runs", {"lake": "Unknown", "parameters": {}})
+        self.assertEqual(code, 400)
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            request_service(self.url, "/runs/unknown")
+        self.assertEqual(context.exception.code, 404)
+        code, _ = self.post_error("/unknown", {})
+        self.assertEqual(code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()